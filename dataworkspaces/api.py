@@ -2,7 +2,7 @@
 """
 This is an API for selected Data Workspaces management functions.
 """
-from typing import Optional, NamedTuple, List, Iterable, cast, Tuple
+from typing import Optional, NamedTuple, List, Iterable, cast, Tuple, Callable
 
 from dataworkspaces import __version__
 from dataworkspaces.workspace import (
@@ -14,7 +14,10 @@ from dataworkspaces.workspace import (
 )
 from dataworkspaces.commands.snapshot import snapshot_command
 from dataworkspaces.commands.restore import restore_command
-from dataworkspaces.commands.lineage import lineage_graph_command
+from dataworkspaces.commands.lineage import (
+    lineage_graph_command,
+    get_impacted_steps as _get_impacted_steps,
+)
 from dataworkspaces.commands.report import _get_results
 from dataworkspaces.errors import ConfigurationError
 import dataworkspaces.utils.lineage_utils as lu
@@ -97,6 +100,30 @@ class ResourceFileSystem:
     def isdir(self, rel_path) -> bool:
         return self.resource.does_subpath_exist(rel_path, must_be_directory=True)
 
+    def exists_many(self, rel_paths:List[str]) -> List[bool]:
+        """Batched version of exists(), returning a list of results in the
+        same order as rel_paths."""
+        return self.resource.does_subpaths_exist(rel_paths)
+
+    def upload_tree(self, local_dir:str, rel_dest:str,
+                    progress:Optional[Callable[[int, int], None]]=None) -> None:
+        """Copy the files under local_dir to rel_dest in the resource. If provided,
+        progress is called with the number of bytes copied so far and the
+        total number of bytes."""
+        self.resource.upload_tree(local_dir, rel_dest, progress)
+
+    def prefetch(self, rel_paths:List[str]) -> None:
+        """Fetch the specified files in bulk, so that subsequent open() calls
+        can be served locally. For resources whose files are already local,
+        this does nothing."""
+        self.resource.prefetch(rel_paths)
+
+    def download_tree(self, rel_prefix:str, local_dir:str) -> None:
+        """Copy the file or directory at rel_prefix (use empty string for
+        the whole resource) to local_dir. If a snapshot is active, the
+        files are copied as of that snapshot."""
+        self.resource.download_tree(rel_prefix, local_dir)
+
 
 def get_filesystem_for_resource(name: str,
         workspace_uri_or_path: Optional[str] = None,
@@ -237,6 +264,44 @@ def make_lineage_graph(
     )
 
 
+class ImpactedStep(NamedTuple):
+    """Named tuple representing a step to be re-run, as returned by
+    :func:`~get_impacted_steps`. stale_inputs are the input and code
+    references (as RESOURCE or RESOURCE:/SUBPATH) which have changed.
+    """
+
+    step_name: str
+    start_time: str
+    command_line: Optional[List[str]]
+    stale_inputs: List[str]
+
+
+def get_impacted_steps(
+    resource_ref: str,
+    current_hash: Optional[str] = None,
+    workspace_uri_or_path: Optional[str] = None,
+    verbose: bool = False,
+) -> List[ImpactedStep]:
+    """Return the steps which need to be re-run because the resource (or resource:subpath)
+    resource_ref has changed, in the order they should be run. If current_hash is not
+    specified, the resource's hash from the most recent snapshot is used.
+    """
+    workspace = find_and_load_workspace(True, verbose, workspace_uri_or_path)
+    (_, _, steps) = _get_impacted_steps(workspace, resource_ref, current_hash)
+    return [
+        ImpactedStep(
+            step.step_name,
+            step.start_time.isoformat(),
+            step.command_line,
+            [
+                c.ref.name if c.ref.subpath is None else c.ref.name + ":/" + c.ref.subpath
+                for c in stale_inputs
+            ],
+        )
+        for (step, stale_inputs) in steps
+    ]
+
+
 def get_results(
     workspace_uri_or_path: Optional[str] = None,
     tag_or_hash: Optional[str] = None,
@@ -20,7 +20,7 @@ import json
 import re
 import uuid
 from urllib.parse import ParseResult, urlparse
-from typing import Any, Iterable, Optional, List, Dict, Tuple, cast
+from typing import Any, Iterable, Optional, List, Dict, cast
 
 assert Dict  # make pyflakes happy
 
@@ -67,13 +67,18 @@ from dataworkspaces.utils.param_utils import (
     get_scratch_directory,
     SCRATCH_DIRECTORY,
     LOCAL_SCRATCH_DIRECTORY,
-    DWS_GIT_BRANCH
+    DWS_GIT_BRANCH,
+    LINEAGE_STORE,
+    LINEAGE_COMPACT_FORMAT,
+    LINEAGE_WRITE_BEHIND,
 )
 from dataworkspaces.utils.lineage_utils import (
     FileLineageStore,
     LineageStore,
-    ResourceRef,
-    ResourceLineage,
+)
+from dataworkspaces.utils.sqlite_lineage_store import (
+    SqliteLineageStore,
+    import_unmigrated_file_lineage,
 )
 
 
@@ -87,6 +92,8 @@ SNAPSHOT_DIR_PATH = ".dataworkspace/snapshots"
 SNAPSHOT_METADATA_DIR_PATH = ".dataworkspace/snapshot_metadata"
 CURRENT_LINEAGE_DIR_PATH = ".dataworkspace/current_lineage"
 SNAPSHOT_LINEAGE_DIR_PATH = ".dataworkspace/snapshot_lineage"
+LINEAGE_DB_FILENAME = "lineage.db"
+SNAPSHOT_LINEAGE_DB_FILENAME = "snapshot_lineage.db"
 
 
 class GitFileLineageStore(FileLineageStore):
@@ -99,46 +106,111 @@ class GitFileLineageStore(FileLineageStore):
             cast(Workspace, workspace).get_instance(),
             join(workspace.workspace_dir, CURRENT_LINEAGE_DIR_PATH),
             join(workspace.workspace_dir, SNAPSHOT_LINEAGE_DIR_PATH),
+            compact=workspace.get_global_param(LINEAGE_COMPACT_FORMAT),
+            write_behind=workspace.get_global_param(LINEAGE_WRITE_BEHIND),
         )
         self.workspace = workspace
 
-    def _add_to_git(self, path: str):
+    def _stage_snapshot_files(self, paths: List[str]) -> None:
+        # We add all the files in one call, rather than running git for each one
         ws_dir = cast(str, self.workspace.workspace_dir)
         git_add(
             ws_dir,
-            [get_subpath_from_absolute(ws_dir, path)],  # type: ignore
+            [get_subpath_from_absolute(ws_dir, path) for path in paths],  # type: ignore
             verbose=self.workspace.verbose,
         )
 
-    def _save_rfile_to_snapshot(
-        self,
-        resource_name: str,
-        lineage_map: Dict[ResourceRef, ResourceLineage],
-        snapshot_hash: str,
-    ) -> str:
-        rpath = super()._save_rfile_to_snapshot(resource_name, lineage_map, snapshot_hash)
-        self._add_to_git(rpath)
-        return rpath
-
-    def _copy_rfile_to_snapshot(self, resource_name: str, snapshot_hash: str) -> Tuple[str, str]:
-        (spath, dpath) = super()._copy_rfile_to_snapshot(resource_name, snapshot_hash)
-        self._add_to_git(dpath)
-        return (spath, dpath)
-
-    def _write_placeholder_to_snapshot(
-        self, snapshot_hash: str, filename: str, content: str
-    ) -> str:
-        spath = super()._write_placeholder_to_snapshot(snapshot_hash, filename, content)
-        self._add_to_git(spath)
-        return spath
+    def _remove_blobs(self, blob_paths: List[str]) -> None:
+        ws_dir = cast(str, self.workspace.workspace_dir)
+        for blob_path in blob_paths:
+            git_remove_file(
+                ws_dir,
+                get_subpath_from_absolute(ws_dir, blob_path),  # type: ignore
+                verbose=self.workspace.verbose,
+            )
 
     def delete_snapshot_lineage(self, instance: str, snapshot_hash: str) -> None:
         """Delete any lineage data associated with the specified snapshot.
         """
+        self._invalidate_lineage_graph(snapshot_hash)
         lineage_relative_path = join(SNAPSHOT_LINEAGE_DIR_PATH, snapshot_hash)
         git_remove_subtree(
             self.workspace.workspace_dir, lineage_relative_path, verbose=self.workspace.verbose
         )
+        self.manifest_cache.pop(snapshot_hash, None)
+        self._remove_unreferenced_blobs()
+
+
+class GitSqliteLineageStore(SqliteLineageStore):
+    """Subclass of the SQLite lineage store that adds the json export of
+    each snapshot's lineage to the git repo. Both databases are under
+    current_lineage/, which is not checked into git. Since each snapshot
+    has its own export file, snapshots taken independently in two clones
+    of the workspace merge cleanly, and the snapshots pulled from another
+    clone are loaded into the snapshot database when the store is next opened.
+
+    The lineage.store parameter is global, so a clone switches to this store
+    when it pulls the migration made in another clone. If import_file_lineage
+    is True and the databases do not exist yet, the lineage which this clone
+    recorded in json files is imported (see
+    :func:`~dataworkspaces.utils.sqlite_lineage_store.import_unmigrated_file_lineage`).
+    """
+
+    def __init__(self, workspace: "Workspace", import_file_lineage: bool = True):
+        snapshot_lineage_dir = join(workspace.workspace_dir, SNAPSHOT_LINEAGE_DIR_PATH)
+        if not exists(snapshot_lineage_dir):
+            os.makedirs(snapshot_lineage_dir)
+        current_db_path = join(
+            workspace.workspace_dir, CURRENT_LINEAGE_DIR_PATH, LINEAGE_DB_FILENAME
+        )
+        first_open = not exists(current_db_path)
+        super().__init__(
+            cast(Workspace, workspace).get_instance(),
+            current_db_path,
+            join(workspace.workspace_dir, CURRENT_LINEAGE_DIR_PATH, SNAPSHOT_LINEAGE_DB_FILENAME),
+            snapshot_export_dir=snapshot_lineage_dir,
+        )
+        self.workspace = workspace
+        if import_file_lineage and first_open:
+            self._import_file_lineage()
+
+    def _import_file_lineage(self) -> None:
+        (num_resources, snapshot_hashes) = import_unmigrated_file_lineage(
+            GitFileLineageStore(self.workspace), self, verbose=self.workspace.verbose
+        )
+        if len(snapshot_hashes) > 0:
+            self._add_exports_to_git(snapshot_hashes)
+        if num_resources > 0 or len(snapshot_hashes) > 0:
+            click.echo(
+                "Imported the json lineage of %d resources and %d snapshots into the sqlite store"
+                % (num_resources, len(snapshot_hashes))
+            )
+
+    def _add_exports_to_git(self, snapshot_hashes: List[str]) -> None:
+        ws_dir = cast(str, self.workspace.workspace_dir)
+        paths = [self._get_export_path(snapshot_hash) for snapshot_hash in snapshot_hashes]
+        git_add(
+            ws_dir,
+            [get_subpath_from_absolute(ws_dir, path) for path in paths],  # type: ignore
+            verbose=self.workspace.verbose,
+        )
+
+    def snapshot_lineage(
+        self, instance: str, snapshot_hash: str, resource_names: List[str]
+    ) -> None:
+        super().snapshot_lineage(instance, snapshot_hash, resource_names)
+        self._add_exports_to_git([snapshot_hash])
+
+    def delete_snapshot_lineage(self, instance: str, snapshot_hash: str) -> None:
+        ws_dir = cast(str, self.workspace.workspace_dir)
+        export_path = self._get_export_path(snapshot_hash)
+        if exists(export_path):
+            git_remove_file(
+                ws_dir,
+                get_subpath_from_absolute(ws_dir, export_path),  # type: ignore
+                verbose=self.workspace.verbose,
+            )
+        super().delete_snapshot_lineage(instance, snapshot_hash)
 
 
 class Workspace(ws.Workspace, ws.SyncedWorkspaceMixin, ws.SnapshotWorkspaceMixin):
@@ -160,7 +232,7 @@ class Workspace(ws.Workspace, ws.SyncedWorkspaceMixin, ws.SnapshotWorkspaceMixin
         self.resource_local_params_by_name = self._load_json_file(
             RESOURCE_LOCAL_PARAMS_PATH
         )  # type: Dict[str,JSONDict]
-        self.lineage_store = GitFileLineageStore(self)
+        self.lineage_store = self._make_lineage_store()  # type: LineageStore
         self.scratch_dir = get_scratch_directory(
             self.workspace_dir, self.global_params, self.local_params
         )
@@ -174,6 +246,12 @@ class Workspace(ws.Workspace, ws.SyncedWorkspaceMixin, ws.SnapshotWorkspaceMixin
     def get_lineage_store(self) -> LineageStore:
         return self.lineage_store
 
+    def _make_lineage_store(self) -> LineageStore:
+        if self.get_global_param(LINEAGE_STORE) == "sqlite":
+            return GitSqliteLineageStore(self)
+        else:
+            return GitFileLineageStore(self)
+
     def get_scratch_directory(self) -> str:
         if self.scratch_dir is not None:
             return self.scratch_dir
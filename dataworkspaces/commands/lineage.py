@@ -1,11 +1,22 @@
 """Lineage related commands
 """
 import click
-from typing import Optional
+from typing import Optional, List, Tuple, TextIO
 
 from dataworkspaces.workspace import Workspace, SnapshotWorkspaceMixin, ResourceRoles
+import dataworkspaces.backends.git as git_backend
 from dataworkspaces.errors import ConfigurationError
-from dataworkspaces.utils.lineage_utils import make_simplified_lineage_graph_for_resource
+from dataworkspaces.utils.lineage_utils import (
+    make_simplified_lineage_graph_for_resource,
+    FileLineageStore,
+    ResourceRef,
+    StepLineage,
+    Certificate,
+    HashCertificate,
+)
+from dataworkspaces.utils.sqlite_lineage_store import migrate_file_lineage_to_sqlite
+from dataworkspaces.utils.lineage_export import export_lineage
+from dataworkspaces.utils.param_utils import LINEAGE_STORE
 
 
 def lineage_graph_command(
@@ -56,3 +67,118 @@ def lineage_graph_command(
         click.echo(
             "Wrote lineage for %s as of snapshot %s to %s" % (resource_name, snapshot, output_file)
         )
+
+
+def lineage_migrate_command(workspace: Workspace) -> None:
+    """Migrate the workspace's lineage from json files to the SQLite lineage store.
+    The json files are left in place.
+    """
+    if not isinstance(workspace, git_backend.Workspace):
+        raise ConfigurationError(
+            "Migration of lineage data is only supported for git-backed workspaces"
+        )
+    if workspace.get_global_param(LINEAGE_STORE) == "sqlite":
+        raise ConfigurationError(
+            "Workspace %s is already using the sqlite lineage store" % workspace.name
+        )
+    file_store = workspace.get_lineage_store()
+    assert isinstance(file_store, FileLineageStore)
+    sqlite_store = git_backend.GitSqliteLineageStore(workspace, import_file_lineage=False)
+    (num_resources, num_snapshots) = migrate_file_lineage_to_sqlite(
+        file_store, sqlite_store, verbose=workspace.verbose
+    )
+    sqlite_store._add_exports_to_git(file_store.get_snapshot_hashes())
+    sqlite_store.close()
+    workspace.set_global_param(LINEAGE_STORE, "sqlite")
+    workspace.save("Migrated lineage data to the sqlite lineage store")
+    click.echo(
+        "Migrated lineage for %d resources and %d snapshots to %s"
+        % (num_resources, num_snapshots, sqlite_store.current_db_path)
+    )
+
+
+def parse_resource_ref(workspace: Workspace, resource_ref: str) -> ResourceRef:
+    """Parse a reference of the form RESOURCE or RESOURCE:SUBPATH (the subpath
+    may also be written as :/SUBPATH) and validate the resource name.
+    """
+    if ":" in resource_ref:
+        (resource_name, subpath) = resource_ref.split(":", 1)
+        subpath = subpath.strip("/")
+    else:
+        (resource_name, subpath) = (resource_ref, "")
+    workspace.validate_resource_name(resource_name)
+    return ResourceRef(resource_name, subpath if subpath != "" else None)
+
+
+def get_impacted_steps(
+    workspace: Workspace, resource_ref: str, current_hash: Optional[str] = None
+) -> Tuple[ResourceRef, Optional[str], List[Tuple[StepLineage, List[Certificate]]]]:
+    """Find the steps which need to be re-run because resource_ref has changed.
+    If current_hash is not specified, we use the resource's hash from the most recent
+    snapshot. Returns the parsed ref, the hash used, and the steps in the order they
+    should be run, along with their stale inputs.
+    """
+    if not isinstance(workspace, SnapshotWorkspaceMixin) or not workspace.supports_lineage():
+        raise ConfigurationError("Workspace %s does not support lineage" % workspace.name)
+    ref = parse_resource_ref(workspace, resource_ref)
+    if current_hash is None:
+        md = workspace.get_most_recent_snapshot()
+        if md is not None:
+            for entry in workspace.get_snapshot_manifest(md.hashval):
+                if entry["name"] == ref.name:
+                    current_hash = entry.get("hash")
+    graph = workspace.get_lineage_store().get_lineage_graph(workspace.get_instance())
+    return (ref, current_hash, graph.impacted_steps(ref, current_hash))
+
+
+def _ref_to_str(ref: ResourceRef) -> str:
+    return ref.name if ref.subpath is None else ref.name + ":/" + ref.subpath
+
+
+def lineage_impacted_command(
+    workspace: Workspace, resource_ref: str, current_hash: Optional[str] = None
+) -> None:
+    (ref, current_hash, steps) = get_impacted_steps(workspace, resource_ref, current_hash)
+    if len(steps) == 0:
+        click.echo("No steps are impacted by changes to %s" % _ref_to_str(ref))
+        return
+    if current_hash is None:
+        click.echo(
+            "No hash available for %s, assuming all of its uses are out of date" % ref.name
+        )
+    click.echo("%d steps need to be re-run, in this order:" % len(steps))
+    for (i, (step, stale_inputs)) in enumerate(steps):
+        click.echo("%3d. %s (last run at %s)" % (i + 1, step.step_name, step.start_time))
+        for cert in stale_inputs:
+            version = (
+                cert.hashval[0:8]
+                if isinstance(cert, HashCertificate)
+                else "unsnapshotted version"
+            )
+            click.echo("       stale input %s (%s)" % (_ref_to_str(cert.ref), version))
+        if step.command_line is not None:
+            click.echo("       command: %s" % " ".join(step.command_line))
+
+
+def lineage_export_command(
+    workspace: Workspace, output: TextIO, format: str = "jsonl", snapshot: Optional[str] = None
+) -> None:
+    if not isinstance(workspace, SnapshotWorkspaceMixin):
+        raise ConfigurationError(
+            "Workspace %s does not support snapshots and lineage" % workspace.name
+        )
+    if not workspace.supports_lineage():
+        raise ConfigurationError("Workspace %s does not support lineage" % workspace.name)
+    store = workspace.get_lineage_store()
+    store.flush()
+    snapshot_hash = None  # type: Optional[str]
+    if snapshot is not None:
+        snapshot_hash = workspace.get_snapshot_by_tag_or_hash(snapshot).hashval
+    count = export_lineage(workspace.get_instance(), store, output, format, snapshot_hash)
+    output.flush()
+    # When writing to stdout, the summary goes to stderr to keep the output parsable
+    click.echo(
+        "Exported %d lineage entries%s"
+        % (count, "" if snapshot is None else " as of snapshot %s" % snapshot),
+        err=True,
+    )
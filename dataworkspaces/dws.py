@@ -33,7 +33,12 @@ from dataworkspaces.commands.clone import clone_command
 
 # from dataworkspaces.commands.run import run_command
 from dataworkspaces.commands.diff import diff_command
-from dataworkspaces.commands.lineage import lineage_graph_command
+from dataworkspaces.commands.lineage import (
+    lineage_graph_command,
+    lineage_migrate_command,
+    lineage_impacted_command,
+    lineage_export_command,
+)
 from dataworkspaces.commands.deploy import deploy_build_command, deploy_run_command
 from dataworkspaces.commands.config import config_command
 from dataworkspaces.workspace import (
@@ -46,6 +51,8 @@ from dataworkspaces.errors import BatchModeError
 from dataworkspaces.utils.param_utils import DEFAULT_HOSTNAME
 from dataworkspaces.utils.regexp_utils import HOSTNAME_RE
 from dataworkspaces.utils.file_utils import LocalPathType
+from dataworkspaces.utils.lineage_export import EXPORT_FORMATS
+from dataworkspaces.resources.api_resource import FINGERPRINT_MODES, BATCH_ORDERS
 
 CURR_DIR = abspath(expanduser(curdir))
 CURR_DIRNAME = basename(CURR_DIR)
@@ -605,8 +612,22 @@ add.add_command(git)
 @click.command(name="api-resource")
 @click.option("--role", type=DATA_ROLE_PARAM)
 @click.option("--name", type=str, default=None, help="Short name for this resource")
+@click.option(
+    "--fingerprint",
+    type=click.Choice(FINGERPRINT_MODES),
+    default="exact",
+    help="How the data is hashed: 'exact' hashes all of it, 'sampled' hashes a fixed "
+    + "number of blocks of rows, which is faster for large data sets (default is exact)",
+)
+@click.option(
+    "--batch-order",
+    type=click.Choice(BATCH_ORDERS),
+    default="ordered",
+    help="If 'unordered', the hash does not depend on the order of the batches, so "
+    + "they can be shuffled or split across workers (default is ordered)",
+)
 @click.pass_context
-def api_resource(ctx, role, name):
+def api_resource(ctx, role, name, fingerprint, batch_order):
     """Resource to represent data obtained via an API. Use this when there is
     no file-based representation of your data that can be versioned and captured
     more directly. Subcommand of ``add``"""
@@ -620,7 +641,7 @@ def api_resource(ctx, role, name):
                 type=DATA_ROLE_PARAM,
             )
     workspace = find_and_load_workspace(ns.batch, ns.verbose, ns.workspace_dir)
-    add_command("api-resource", role, name, workspace)
+    add_command("api-resource", role, name, workspace, fingerprint, batch_order)
 
 
 add.add_command(api_resource)
@@ -1189,6 +1210,71 @@ def graph(
 lineage.add_command(graph)
 
 
+@click.command(name="migrate")
+@click.pass_context
+def migrate(ctx):
+    """Migrate the workspace's lineage data from json files to the SQLite
+    lineage store, which scales better to large numbers of steps and snapshots.
+    Subcommand of ``lineage``"""
+    ns = ctx.obj
+    workspace = find_and_load_workspace(ns.batch, ns.verbose, ns.workspace_dir)
+    lineage_migrate_command(workspace)
+
+
+lineage.add_command(migrate)
+
+
+@click.command(name="impacted")
+@click.option(
+    "--hash",
+    "current_hash",
+    type=str,
+    default=None,
+    help="Current hash of the resource. If not specified, use its hash from the most recent snapshot.",
+)
+@click.argument("resource_ref", type=str)
+@click.pass_context
+def impacted(ctx, current_hash, resource_ref):
+    """List the steps which need to be re-run because RESOURCE_REF has changed,
+    in the order they should be run. RESOURCE_REF is a resource name, optionally
+    followed by :SUBPATH. Steps whose inputs match the resource's current hash
+    are not included. Subcommand of ``lineage``"""
+    ns = ctx.obj
+    workspace = find_and_load_workspace(ns.batch, ns.verbose, ns.workspace_dir)
+    lineage_impacted_command(workspace, resource_ref, current_hash)
+
+
+lineage.add_command(impacted)
+
+
+@click.command(name="export")
+@click.option(
+    "--format",
+    default="jsonl",
+    type=click.Choice(EXPORT_FORMATS),
+    help="Format of the output: one json object per line, csv, or a graphviz dot graph "
+    + "(defaults to jsonl)",
+)
+@click.option(
+    "--snapshot",
+    type=SNAPSHOT_PARAM,
+    default=None,
+    help="Snapshot hash or tag to use for lineage. If not specified, use current lineage.",
+)
+@click.argument("output_file", type=click.File("w"), default="-")
+@click.pass_context
+def export(ctx, format: str, snapshot: Optional[str], output_file):
+    """Export all the lineage entries of the workspace to OUTPUT_FILE (defaults to
+    standard output). Entries are written as they are read, so this can be used
+    for workspaces with very large amounts of lineage. Subcommand of ``lineage``"""
+    ns = ctx.obj
+    workspace = find_and_load_workspace(ns.batch, ns.verbose, ns.workspace_dir)
+    lineage_export_command(workspace, output_file, format, snapshot)
+
+
+lineage.add_command(export)
+
+
 # The deploy command has subcommands for specific tasks related to deployment
 @click.group()
 @click.option("--workspace-dir", type=WORKSPACE_PARAM, default=DWS_PATHDIR)
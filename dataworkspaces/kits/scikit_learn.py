@@ -11,21 +11,24 @@ to a results file. Finally, there is
 runs a common sklearn classification workflow, including grid search.
 """
 
-from typing import Optional, Union, Dict, List, Any, cast
+from typing import Optional, Union, Dict, List, Any, Tuple, cast
 from abc import ABCMeta, abstractmethod
 from sklearn.base import ClassifierMixin # type: ignore
 from sklearn import metrics # type: ignore
-from sklearn.model_selection import GridSearchCV, train_test_split # type: ignore
+from sklearn.model_selection import ParameterGrid, check_cv, train_test_split # type: ignore
 from sklearn.utils import Bunch # type: ignore
 import sklearn.utils.metaestimators # type: ignore
 import sys
+import json
+import time
 import numpy as np # type: ignore
 import os
-from os.path import join, abspath, expanduser, exists, isabs
+from os.path import join, abspath, expanduser, exists, isabs, realpath
+import hashlib
 from tempfile import NamedTemporaryFile
 
 
-from dataworkspaces.errors import ConfigurationError
+from dataworkspaces.errors import ConfigurationError, InternalError
 from dataworkspaces.lineage import LineageBuilder
 from dataworkspaces.workspace import (
     find_and_load_workspace,
@@ -33,7 +36,9 @@ from dataworkspaces.workspace import (
     FileResourceMixin,
 )
 from dataworkspaces.utils.lineage_utils import ResourceRef
-from dataworkspaces.kits.wrapper_utils import _DwsModelState, _add_to_hash
+from dataworkspaces.utils.file_utils import write_file_atomically
+from dataworkspaces.utils.fingerprint_cache import register_file_origin, compute_digest
+from dataworkspaces.kits.wrapper_utils import _DwsModelState, _metric_obj_to_json
 
 from .jupyter import is_notebook, get_step_name_for_notebook, get_notebook_directory
 
@@ -42,30 +47,175 @@ try:
 except ImportError as e:
     raise ConfigurationError('Please install the joblib package (via "pip install joblib")') from e
 
+try:
+    import pyarrow # type: ignore
+except ImportError:
+    pyarrow = None # type: ignore
+
+
+# Name of the directory, within the workspace's scratch directory, where csv files
+# are cached in a binary format
+DATASET_CACHE_DIR = "dataset_cache"
+
+# Extensions for the files of a dataset's attributes, in order of preference (if
+# there is more than one file for an attribute)
+DATASET_FILE_EXTENSIONS = [
+    ".npy",
+    ".npz",
+    ".arrow",
+    ".feather",
+    ".parquet",
+    ".csv",
+    ".csv.gz",
+    ".csv.bz2",
+    ".txt",
+    ".rst",
+]
+# The data and target attributes must be arrays
+ARRAY_FILE_EXTENSIONS = DATASET_FILE_EXTENSIONS[:-2]
+
+# Supported values for the mmap_mode of load_dataset_from_resource(). We do not
+# support the writable modes, as they could change the cached copies of csv files.
+MMAP_MODES = ["r", "c"]
+
+
+def _get_cache_path(cache_dir: str, filepath: str, extn: str) -> str:
+    """The cached copy is keyed by the path, size, and modification time of
+    the original file, so a changed file gets a new cache entry.
+    """
+    stat = os.stat(filepath)
+    key = "%s|%d|%d" % (realpath(filepath), stat.st_size, stat.st_mtime_ns)
+    return join(cache_dir, hashlib.sha1(key.encode("utf-8")).hexdigest() + extn)
+
+
+def _write_cache_file(path: str, write_fn) -> None:
+    """Write to a temporary file and then rename it, so that other processes
+    never see a partial file.
+    """
+
+    def write(tmp_path: str) -> None:
+        with open(tmp_path, "wb") as f:
+            write_fn(f)
+
+    write_file_atomically(path, write)
 
-def _load_dataset_file(dataset_path, filename):
+
+def _dataframe_to_array(df):
+    if len(df.values.shape) == 2 and df.values.shape[1] == 1:  # this is just a list
+        return df.values.reshape(df.values.shape[0])
+    else:
+        return df.values
+
+
+def _arrow_table_to_array(table):
+    if table.num_columns == 1:
+        # zero copy for a single chunk of a numeric type without nulls
+        return table.column(0).to_numpy()
+    else:
+        return table.to_pandas().values
+
+
+def _load_csv_file(filepath: str, mmap_mode: Any, cache_dir: Optional[str]):
+    if cache_dir is not None:
+        npy_path = _get_cache_path(cache_dir, filepath, ".npy")
+        parquet_path = _get_cache_path(cache_dir, filepath, ".parquet")
+        if exists(npy_path):
+            array = np.load(npy_path, mmap_mode=mmap_mode)
+            register_file_origin(array, filepath, "numpy.loadtxt")
+            return array
+        elif pyarrow is not None and exists(parquet_path):
+            import pyarrow.parquet as pq  # type: ignore
+
+            array = _dataframe_to_array(pq.read_table(parquet_path).to_pandas())
+            register_file_origin(array, filepath, "pandas.read_csv")
+            return array
+    try:
+        array = np.loadtxt(filepath, delimiter=",")
+    except ValueError:
+        array = None
+    if array is not None:
+        if cache_dir is not None:
+            try:
+                _write_cache_file(npy_path, lambda f: np.save(f, array))
+                if mmap_mode is not None:
+                    array = np.load(npy_path, mmap_mode=mmap_mode)
+            except OSError:
+                pass  # e.g. the scratch directory is full or read-only, use the array we have
+        register_file_origin(array, filepath, "numpy.loadtxt")
+        return array
+    else:
+        # try with pandas
+        import pandas # type: ignore
+
+        df = pandas.read_csv(filepath)
+        if cache_dir is not None and pyarrow is not None:
+            # non-numeric data cannot be memory-mapped from a .npy file, so we use parquet
+            try:
+                _write_cache_file(parquet_path, lambda f: df.to_parquet(f))
+            except (ValueError, TypeError, OSError, pyarrow.ArrowException):
+                pass  # e.g. columns of mixed types, which we just don't cache
+        array = _dataframe_to_array(df)
+        register_file_origin(array, filepath, "pandas.read_csv")
+        return array
+
+
+def _load_dataset_file(
+    dataset_path: str, filename: str, mmap_mode: Any, cache_dir: Optional[str]
+):
     filepath = join(dataset_path, filename)
     if filename.endswith(".txt") or filename.endswith(".rst"):
         with open(filepath, "r") as f:
             return f.read()
     elif filename.endswith(".csv") or filename.endswith(".csv.gz") or filename.endswith(".csv.bz2"):
-        try:
-            return np.loadtxt(filepath, delimiter=",")
-        except ValueError:
-            # try with pandas
-            import pandas # type: ignore
-
-            df = pandas.read_csv(filepath)
-            if len(df.values.shape) == 2 and df.values.shape[1] == 1:  # this is just a list
-                return df.values.reshape(df.values.shape[0])
-            else:
-                return df.values
+        return _load_csv_file(filepath, mmap_mode, cache_dir)
     elif filename.endswith(".npy"):
-        return np.load(filepath)
+        array = np.load(filepath, mmap_mode=mmap_mode)
+        register_file_origin(array, filepath, "numpy.load")
+        return array
+    elif filename.endswith(".npz"):
+        # NumPy does not memory-map the arrays of an npz archive
+        with np.load(filepath) as npz:
+            if len(npz.files) == 1:
+                return npz[npz.files[0]]
+            else:
+                return {name: npz[name] for name in npz.files}
+    elif filename.endswith(".parquet") or filename.endswith(".arrow") or filename.endswith(
+        ".feather"
+    ):
+        if pyarrow is None:
+            raise ConfigurationError(
+                "Please install the pyarrow package to load '%s' (via \"pip install pyarrow\")"
+                % filepath
+            )
+        if filename.endswith(".parquet"):
+            import pyarrow.parquet as pq  # type: ignore
+
+            table = pq.read_table(filepath, memory_map=mmap_mode is not None)
+        else:
+            import pyarrow.feather as feather  # type: ignore
+
+            table = feather.read_table(filepath, memory_map=mmap_mode is not None)
+        return _arrow_table_to_array(table)
+    else:
+        raise InternalError("Unexpected dataset file %s" % filepath)
+
+
+def _split_dataset_filename(filename: str) -> Optional[Tuple[str, str]]:
+    """Returns the attribute name and extension of the file, or None if the
+    file does not have one of the extensions in DATASET_FILE_EXTENSIONS.
+    """
+    for extn in DATASET_FILE_EXTENSIONS:
+        if filename.endswith(extn) and len(filename) > len(extn):
+            return (filename[: -len(extn)], extn)
+    return None
 
 
 def load_dataset_from_resource(
-    resource_name: str, subpath: Optional[str] = None, workspace_dir: Optional[str] = None
+    resource_name: str,
+    subpath: Optional[str] = None,
+    workspace_dir: Optional[str] = None,
+    mmap_mode: Optional[str] = None,
+    cache_csv: bool = True,
 ) -> Bunch:
     """
     Load a datset (data and targets) from the specified resource, and returns an
@@ -100,6 +250,18 @@ def load_dataset_from_resource(
        this can be left unspecified and inferred by DWS, which will search up
        from the current working directory.
 
+    mmap_mode
+       If specified, ``.npy`` files (including cached copies of csv files) are memory-mapped
+       with this mode, which is either ``r`` (read-only) or ``c`` (copy-on-write, where
+       changes stay in memory), as in ``numpy.load()``. Arrow and Parquet files are also
+       read via a memory map. The data is then read from the
+       operating system's page cache as it is accessed, and this cache is shared by
+       all the processes which load the same files.
+
+    cache_csv
+       If True (the default), a csv file is converted to a binary format the first
+       time it is loaded, and later loads read the binary copy. See below.
+
     **Creating a Dataset**
 
     To create a dataset in your resource that is suitable for importing by this function,
@@ -117,8 +279,37 @@ def load_dataset_from_resource(
       the same was as csv files (numpy and pandas will automatically uncompress before parsing).
     * ``.npy`` - this a a file containing a serialized NumPy array saved via ``numpy.save()``.
       It is loaded using ``numpy.load()``.
+    * ``.npz`` - an archive of NumPy arrays saved via ``numpy.savez()``. If it contains a
+      single array, the attribute is that array, otherwise it is a dict of the arrays.
+      NumPy does not support memory-mapping these archives.
+    * ``.parquet``, ``.arrow`` or ``.feather`` - a Parquet file or Arrow IPC (Feather) file.
+      These require the pyarrow package. A table with one column is loaded as a 1-dimensional
+      array, without copying if the column is numeric and has no nulls. Other tables are
+      converted to a 2-dimensional array.
+
+    If there is more than one file for the same attribute, the first one in the above
+    list (starting with ``.npy``) is used.
+
+    **Caching csv files**
+
+    Parsing a large csv file is slow. If cache_csv is True and the workspace has a
+    scratch directory, the parsed array is saved as a ``.npy`` file (or a Parquet
+    file, for non-numeric data, if pyarrow is installed) under the
+    ``dataset_cache`` subdirectory of the scratch directory. The cached copy is
+    keyed by the csv file's path, size and modification time, so it is replaced if
+    the csv file changes. Files are written atomically, so several processes may
+    load a dataset at the same time. Old cache entries are not removed, but the
+    directory can be deleted at any time.
+
+    The file that each array was loaded from is recorded, so that, if the arrays are
+    passed to a model with an API resource as its input, their fingerprints can be
+    cached by file (see :mod:`~dataworkspaces.utils.fingerprint_cache`).
     """
 
+    if mmap_mode is not None and mmap_mode not in MMAP_MODES:
+        raise ConfigurationError(
+            "Invalid mmap_mode '%s', must be one of: %s" % (mmap_mode, ", ".join(MMAP_MODES))
+        )
     workspace = find_and_load_workspace(True, False, workspace_dir)
     workspace.validate_resource_name(resource_name, subpath)
     dataset_name = (
@@ -136,52 +327,46 @@ def load_dataset_from_resource(
     local_path = r.get_local_path_if_any()
     assert local_path is not None
     dataset_path = join(local_path, subpath) if subpath is not None else local_path
-    result = {}  # this will be the args to the result Bunch
-    # First load data and target files, which are required
-    data_file = join(dataset_path, "data.csv")
-    if exists(data_file):
-        pass
-    elif exists(data_file + ".gz"):
-        data_file += ".gz"
-    elif exists(data_file + ".bz2"):
-        data_file += ".bz2"
-    else:
-        raise ConfigurationError(
-            "Did not find data file for %s at '%s'" % (dataset_name, data_file)
-        )
-    result["data"] = np.loadtxt(data_file, delimiter=",")
-    target_file = join(dataset_path, "target.csv")
-    if exists(target_file):
-        pass
-    elif exists(target_file + ".gz"):
-        target_file += ".gz"
-    elif exists(target_file + ".bz2"):
-        target_file += ".bz2"
-    else:
-        raise ConfigurationError(
-            "Did not find target file for %s at '%s'" % (dataset_name, target_file)
-        )
-    result["target"] = np.loadtxt(target_file, delimiter=",")
+    cache_dir = None  # type: Optional[str]
+    if cache_csv:
+        try:
+            cache_dir = join(workspace.get_scratch_directory(), DATASET_CACHE_DIR)
+        except ConfigurationError:
+            pass  # no scratch directory, so we cannot cache
+    # find the file for each attribute
+    attribute_files = {}  # type: Dict[str, Tuple[int, str]]
+    for fname in os.listdir(dataset_path):
+        name_and_extn = _split_dataset_filename(fname)
+        if name_and_extn is None:
+            continue
+        (attribute, extn) = name_and_extn
+        rank = DATASET_FILE_EXTENSIONS.index(extn)
+        if (attribute not in attribute_files) or (rank < attribute_files[attribute][0]):
+            attribute_files[attribute] = (rank, fname)
+    # The data and target files are required
+    for attribute in ("data", "target"):
+        if (attribute not in attribute_files) or (
+            attribute_files[attribute][0] >= len(ARRAY_FILE_EXTENSIONS)
+        ):
+            raise ConfigurationError(
+                "Did not find %s file for %s at '%s'"
+                % (attribute, dataset_name, join(dataset_path, attribute + ".csv"))
+            )
+    result = {
+        attribute: _load_dataset_file(dataset_path, fname, mmap_mode, cache_dir)
+        for (attribute, (_, fname)) in attribute_files.items()
+    }  # this will be the args to the result Bunch
     if result["data"].shape[0] != result["target"].shape[0]:
         raise ConfigurationError(
             "Data matrix at '%s' has %d rows, but target at '%s' has %d rows"
-            % (data_file, result["data"].shape[0], target_file, result["target"].shape[0])
+            % (
+                join(dataset_path, attribute_files["data"][1]),
+                result["data"].shape[0],
+                join(dataset_path, attribute_files["target"][1]),
+                result["target"].shape[0],
+            )
         )
     result["resource"] = ResourceRef(resource_name, subpath)
-    # check for and load any other attributes
-    for fname in os.listdir(dataset_path):
-        if fname.endswith(".txt"):
-            result[fname[:-4]] = _load_dataset_file(dataset_path, fname)
-        elif fname.endswith(".rst"):
-            result[fname[:-4]] = _load_dataset_file(dataset_path, fname)
-        elif fname.endswith(".csv"):
-            result[fname[:-4]] = _load_dataset_file(dataset_path, fname)
-        elif fname.endswith(".csv.gz"):
-            result[fname[:-7]] = _load_dataset_file(dataset_path, fname)
-        elif fname.endswith(".csv.bz2"):
-            result[fname[:-8]] = _load_dataset_file(dataset_path, fname)
-        elif fname.endswith(".npy"):
-            result[fname[:-4]] = _load_dataset_file(dataset_path, fname)
     return Bunch(**result)
 
 
@@ -474,9 +659,8 @@ class LineagePredictor(sklearn.utils.metaestimators._BaseComposition):
         api_resource = self._dws_state.find_input_resources_and_return_if_api(X, y)
         if api_resource is not None:
             api_resource.init_hash_state()
-            hash_state = api_resource.get_hash_state()
-            _add_to_hash(X, hash_state)
-            _add_to_hash(y, hash_state)
+            api_resource.add_to_hash(X)
+            api_resource.add_to_hash(y)
             api_resource.save_current_hash()  # in case we evaluate in a separate process
         result = self.predictor.fit(X, y, *args, **kwargs)
         if self.model_save_file is not None:
@@ -502,10 +686,9 @@ class LineagePredictor(sklearn.utils.metaestimators._BaseComposition):
         api_resource = self._dws_state.find_input_resources_and_return_if_api(X, y)
         if api_resource is not None:
             api_resource.dup_hash_state()
-            hash_state = api_resource.get_hash_state()
-            _add_to_hash(X, hash_state)
+            api_resource.add_to_hash(X)
             if y is not None:
-                _add_to_hash(y, hash_state)
+                api_resource.add_to_hash(y)
             api_resource.save_current_hash()
             api_resource.pop_hash_state()
         predictions = self.predictor.predict(X)
@@ -523,6 +706,150 @@ class LineagePredictor(sklearn.utils.metaestimators._BaseComposition):
         return self.predictor.predict(X)
 
 
+# File in the results directory to which train_and_predict_with_cv() writes the
+# score of each fold of each hyperparameter combination, as it completes
+CV_RESULTS_FILE = "cv_results.jsonl"
+
+
+def _get_cv_run_key(
+    classifier_class, param_grid, dataset: Bunch, test_size, folds, cv_scoring, random_state
+) -> Optional[str]:
+    """Returns a key identifying the cross validation tasks, so that results from
+    an earlier run can be reused, or None if the data splits are random. The key
+    includes a fingerprint of the data and target, so that the results of a run
+    on different data are not reused.
+    """
+    if random_state is None:
+        return None
+    key = json.dumps(
+        _metric_obj_to_json(
+            [
+                classifier_class.__module__ + "." + classifier_class.__name__,
+                param_grid,
+                compute_digest(dataset.data),
+                compute_digest(dataset.target),
+                test_size,
+                folds,
+                cv_scoring,
+                random_state,
+            ]
+        ),
+        sort_keys=True,
+        default=repr,
+    )
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+
+def _read_cv_results(cv_results_path: str, run_key: Optional[str]) -> Dict[Tuple[int, int], float]:
+    """Read the scores of a previous run with the same run key, if any. A
+    truncated last line (e.g. if the run was killed) is ignored.
+    """
+    scores = {}  # type: Dict[Tuple[int, int], float]
+    if run_key is None or not exists(cv_results_path):
+        return scores
+    with open(cv_results_path, "r") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if record.get("run_key") == run_key:
+                scores[(record["candidate"], record["fold"])] = record["score"]
+    return scores
+
+
+def _fit_and_score_fold(
+    classifier_class,
+    params: Dict[str, Any],
+    candidate: int,
+    fold: int,
+    X,
+    y,
+    train,
+    test,
+    scorer,
+    cv_results_path: str,
+    run_key: Optional[str],
+) -> Tuple[int, int, float]:
+    """Train and score one fold for one combination of hyperparameters, and
+    append the score to the cv results file. This runs in a joblib worker.
+    """
+    start = time.time()
+    classifier = classifier_class(**params)
+    classifier.fit(X[train], y[train])
+    fit_time = time.time() - start
+    score = float(scorer(classifier, X[test], y[test]))
+    record = {
+        "run_key": run_key,
+        "candidate": candidate,
+        "fold": fold,
+        "params": _metric_obj_to_json(params),
+        "score": score,
+        "fit_time": fit_time,
+        "score_time": time.time() - start - fit_time,
+    }
+    # Each record is appended with a single write, so the records of concurrent
+    # workers are not interleaved.
+    with open(cv_results_path, "a") as f:
+        f.write(json.dumps(record, default=repr) + "\n")
+    return (candidate, fold, score)
+
+
+def _run_cv_search(
+    classifier_class,
+    param_grid,
+    X_train,
+    y_train,
+    folds: int,
+    cv_scoring: str,
+    n_jobs: Optional[int],
+    backend: Optional[str],
+    cv_results_path: str,
+    run_key: Optional[str],
+) -> Tuple[Dict[str, Any], float]:
+    """Our equivalent of GridSearchCV, which streams the score of each fold to
+    the cv results file. Returns the best parameters and their mean score.
+    """
+    candidates = list(ParameterGrid(param_grid))
+    splits = list(check_cv(folds, y_train, classifier=True).split(X_train, y_train))
+    scores = _read_cv_results(cv_results_path, run_key)
+    if len(scores) > 0:
+        print("Reusing %d fold scores from %s" % (len(scores), cv_results_path))
+        with open(cv_results_path, "rb+") as f:
+            f.seek(-1, os.SEEK_END)
+            if f.read(1) != b"\n":
+                f.write(b"\n")  # terminate a truncated last line
+    elif exists(cv_results_path):
+        os.remove(cv_results_path)  # from a different or random run
+    scorer = metrics.get_scorer(cv_scoring)
+    tasks = [
+        joblib.delayed(_fit_and_score_fold)(
+            classifier_class,
+            params,
+            candidate,
+            fold,
+            X_train,
+            y_train,
+            train,
+            test,
+            scorer,
+            cv_results_path,
+            run_key,
+        )
+        for (candidate, params) in enumerate(candidates)
+        for (fold, (train, test)) in enumerate(splits)
+        if (candidate, fold) not in scores
+    ]
+    for (candidate, fold, score) in joblib.Parallel(n_jobs=n_jobs, backend=backend)(tasks):
+        scores[(candidate, fold)] = score
+    mean_scores = [
+        np.mean([scores[(candidate, fold)] for fold in range(len(splits))])
+        for candidate in range(len(candidates))
+    ]
+    best = int(np.argmax(mean_scores))  # the first, if there are ties
+    return (candidates[best], float(mean_scores[best]))
+
+
 def train_and_predict_with_cv(
     classifier_class: ClassifierMixin,
     param_grid: Union[Dict[str, List[Any]], List[Dict[str, List[Any]]]],
@@ -534,6 +861,8 @@ def train_and_predict_with_cv(
     model_name: Optional[str] = None,
     random_state: Optional[int] = None,
     run_description: Optional[str] = None,
+    n_jobs: Optional[int] = None,
+    backend: Optional[str] = None,
 ) -> None:
     """NOTE: This function is under consideration for DEPRECATION and
     may be removed from a future version.
@@ -542,7 +871,8 @@ def train_and_predict_with_cv(
 
     1. Splits the data into training set and a final validation set.
     2. Runs a grid search cross validation to find the best combination
-       of hyperparameters for the classifier on the training data.
+       of hyperparameters for the classifier on the training data. The score
+       of each fold is appended to RESULTS_DIR/cv_results.jsonl as it completes.
     3. Trains the model on the training data using the best hyperparameter
        values.
     4. Predicts the classes of the validation test data set and computes
@@ -589,6 +919,25 @@ def train_and_predict_with_cv(
     run_description
         Optional text describing this particular run. This is saved in the results
         file and the lineage.
+    n_jobs
+        Number of jobs to run in parallel for the cross validation, as in
+        `joblib.Parallel <https://joblib.readthedocs.io/en/latest/generated/joblib.Parallel.html>`_.
+        Use -1 for all the cores. Defaults to None, which runs the folds one at a time,
+        unless changed by a ``joblib.parallel_backend()`` context.
+    backend
+        Optional joblib backend to use for the parallel jobs (e.g. "loky",
+        "threading", or "dask").
+
+    **Cross validation results**
+
+    The score of each fold for each combination of hyperparameters is written to
+    RESULTS_DIR/cv_results.jsonl, one json object per line, as soon as it is
+    computed. If the run is killed, the scores computed so far are kept. If
+    ``random_state`` is specified, the data splits are the same each time, so
+    a rerun with the same arguments reuses these scores and only runs the
+    remaining folds. The training data is only passed to the workers once per
+    task, and joblib memory-maps large arrays rather than copying them to each
+    worker process.
 
     **Example**
 
@@ -614,10 +963,23 @@ def train_and_predict_with_cv(
         dataset.data, dataset.target, test_size=test_size, random_state=random_state
     )
     # find the best combination of hyperparameters
-    search = GridSearchCV(classifier_class(), param_grid=param_grid, scoring=cv_scoring, cv=folds)
-    search.fit(X_train, y_train)
-    best_params = search.best_params_
-    print("Best params were: %s" % repr(best_params))
+    results_dir_path = abspath(expanduser(results_dir))
+    os.makedirs(results_dir_path, exist_ok=True)
+    (best_params, best_score) = _run_cv_search(
+        classifier_class,
+        param_grid,
+        X_train,
+        y_train,
+        folds,
+        cv_scoring,
+        n_jobs,
+        backend,
+        join(results_dir_path, CV_RESULTS_FILE),
+        _get_cv_run_key(
+            classifier_class, param_grid, dataset, test_size, folds, cv_scoring, random_state
+        ),
+    )
+    print("Best params were: %s (mean %s of %.4f)" % (repr(best_params), cv_scoring, best_score))
 
     lineage_params = {
         "classifier": classifier_class.__name__,
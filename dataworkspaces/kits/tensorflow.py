@@ -119,6 +119,13 @@ types are currently supported:
   due to the inability to access the underlying tensor representation when Tensorflow
   is running in graph mode in version 1.x
 
+If ``x`` is a generator, a Keras ``Sequence``, or a ``Dataset``, each batch is hashed
+on a background thread as it is read during the first epoch, and the hashes of the
+batches are combined in the order of the batches. This avoids a separate pass over
+the data before training. If the resource's ``batch_order`` parameter is set to
+``unordered``, the order of the batches does not affect the hash, so a shuffling
+generator gives the same hash in each run.
+
 If you are using another data representation, or running Tensorflow 1.x in graph
 mode, you can always use a resource type that stores the data in files
 (e.g. git or local-files) and pass in the input resource name to the
@@ -132,10 +139,11 @@ from typing import Optional, Union, List, Dict, cast, NamedTuple
 
 assert List
 import os
-from os.path import join, isdir, exists, basename
+from os.path import join, isdir, exists
 import re
 import glob
 from types import GeneratorType
+import itertools
 
 import tensorflow
 
@@ -145,7 +153,7 @@ else:
     USING_TENSORFLOW2 = False
 import tensorflow.keras.optimizers as optimizers
 import tensorflow.keras.utils as kerasutils
-from tensorflow.keras.callbacks import ModelCheckpoint
+from tensorflow.keras.callbacks import ModelCheckpoint, Callback
 
 if USING_TENSORFLOW2:
     import tensorflow.keras.losses as losses
@@ -159,9 +167,12 @@ from dataworkspaces.workspace import (
     FileResourceMixin,
 )
 from dataworkspaces.errors import ConfigurationError
+from dataworkspaces.lineage import MetricsStream
+from dataworkspaces.utils.fingerprint_utils import BackgroundFingerprinter
 from dataworkspaces.kits.wrapper_utils import (
     _DwsModelState,
-    _add_to_hash,
+    _CheckpointExporter,
+    _CheckpointRetention,
     NotSupportedError,
     _find_resource,
 )
@@ -184,60 +195,148 @@ def _verify_eager_if_dataset(x, y, api_resource):
         )
 
 
-def _wrap_generator(wrapped, hash_state):
-    """Return a generator such that it hashes
-    the values returned for each iterator
+def _wrap_generator(wrapped, fingerprinter):
+    """Return a generator which passes each
+    value it returns to the fingerprinter
     """
 
     def wrapper():
-        for v in wrapped:
-            if len(v) == 2:
-                (inputs, targets) = v
-                sample_weights = None
-            else:
-                (inputs, targets, sample_weights) = v
-            _add_to_hash(inputs, hash_state)
-            _add_to_hash(targets, hash_state)
-            if sample_weights is not None:
-                _add_to_hash(sample_weights, hash_state)
+        for (i, v) in enumerate(wrapped):
+            fingerprinter.add(i, v)
             yield v
 
     return wrapper()
 
 
 class _TfKerasSequenceWrapper(kerasutils.Sequence):
-    def __init__(self, wrapped, hash_state):
+    """Keras may call __getitem__() from several worker threads, and in a
+    shuffled order. The batches are keyed by their index, so the fingerprint
+    does not depend on the order of the calls. Only the first epoch is
+    fingerprinted: the fingerprinter keeps the first batch added for each index.
+    """
+
+    def __init__(self, wrapped, fingerprinter):
         self.wrapped = wrapped
-        self.hash_state = hash_state
+        self.fingerprinter = fingerprinter
+        self.epoch = 0
 
     def __getitem__(self, idx):
         v = self.wrapped.__getitem__(idx)
-        if len(v) == 2:
-            (inputs, targets) = v
-            sample_weights = None
-        else:
-            (inputs, targets, sample_weights) = v
-        _add_to_hash(inputs, self.hash_state)
-        _add_to_hash(targets, self.hash_state)
-        if sample_weights is not None:
-            _add_to_hash(sample_weights, self.hash_state)
+        if self.epoch == 0:
+            self.fingerprinter.add(idx, v)
         return v
 
     def __len__(self):
         return self.wrapped.__len__()
 
     def __iter__(self):
-        return _wrap_generator(self.wrapped, self.hash_state)
+        if self.epoch == 0:
+            return _wrap_generator(self.wrapped, self.fingerprinter)
+        else:
+            return iter(self.wrapped)
 
     def on_epoch_end(self):
+        self.epoch += 1
         return self.wrapped.on_epoch_end()
 
 
+def _wrap_dataset(dataset, fingerprinter):
+    """Add a stage to the dataset's pipeline which passes each element
+    to the fingerprinter, followed by a prefetch, so that the hashing
+    overlaps with the training. The map is not parallel, so the elements
+    are numbered in the order of the dataset. The numbering continues across
+    epochs, so the fingerprinter's num_batches limits it to the first epoch.
+    """
+    counter = itertools.count()
+
+    def add_element(*flat_tensors):
+        fingerprinter.add(next(counter), [t.numpy() for t in flat_tensors])
+        return 0
+
+    def tap(*element):
+        # the components of tuples are passed as separate arguments
+        structure = element[0] if len(element) == 1 else element
+        done = tensorflow.py_function(  # type: ignore
+            add_element, tensorflow.nest.flatten(structure), Tout=tensorflow.int32  # type: ignore
+        )
+        with tensorflow.control_dependencies([done]):  # type: ignore
+            return tensorflow.nest.map_structure(tensorflow.identity, structure)  # type: ignore
+
+    return dataset.map(tap).prefetch(tensorflow.data.experimental.AUTOTUNE)  # type: ignore
+
+
+class _StopFingerprintingCallback(Callback):
+    """Only the first epoch of a dataset is fingerprinted, as the
+    later epochs go through the same data. The batches are bounded by the
+    fingerprinter's num_batches where the number of steps is known. This
+    callback covers the other cases (e.g. a dataset of unknown cardinality).
+    """
+
+    def __init__(self, fingerprinter):
+        super().__init__()
+        self.fingerprinter = fingerprinter
+
+    def on_epoch_end(self, epoch, logs=None):
+        self.fingerprinter.stop_accepting()
+
+
+def _get_num_batches(x, steps: Optional[int]) -> Optional[int]:
+    """Return the number of batches in one epoch of x, where steps is the
+    steps_per_epoch (or steps) argument, or None if it is not known.
+    """
+    if isinstance(x, kerasutils.Sequence):
+        return len(x)  # batches are keyed by their index
+    elif steps is not None:
+        return steps
+    elif isinstance(x, tensorflow.data.Dataset):  # type: ignore
+        # negative if the dataset is infinite or its cardinality is unknown
+        cardinality = int(tensorflow.data.experimental.cardinality(x))  # type: ignore
+        return cardinality if cardinality >= 0 else None
+    else:
+        return None  # a generator without steps is read until it is exhausted
+
+
+def _wrap_input_for_fingerprint(method_name, x, y, steps: Optional[int]):
+    """If x is a generator, sequence, or dataset, wrap it so that its batches are
+    fingerprinted on background threads as they are read. Only the batches of
+    the first epoch are fingerprinted, where the epoch has steps batches, if
+    provided. Returns the (possibly wrapped) x and the fingerprinter, or None if
+    x was not wrapped. Arrays are not wrapped, as they can be hashed directly.
+    """
+    if isinstance(x, kerasutils.Sequence):
+        wrapper = _TfKerasSequenceWrapper
+    elif isinstance(x, GeneratorType):
+        wrapper = _wrap_generator
+    elif isinstance(x, tensorflow.data.Dataset):  # type: ignore
+        wrapper = _wrap_dataset
+    else:
+        return (x, None)
+    if y is not None:
+        raise NotSupportedError(
+            "%s() method does not suppport a generator for x AND a y value" % method_name
+        )
+    fingerprinter = BackgroundFingerprinter(num_batches=_get_num_batches(x, steps))
+    return (wrapper(x, fingerprinter), fingerprinter)
+
+
 class DwsModelCheckpoint(ModelCheckpoint):
     """
     Subclass of tf.keras.callbacks.ModelCheckpoint which will save checkpoints
-    to the workspace's stratch space and then move the most recent/best checkpoint
-    to the results directory at the end of the run.
+    to the workspace's stratch space and copy each one to the results directory
+    in the background. At the end of the run, the checkpoint metadata file, which
+    points to the most recent/best checkpoint, is copied as well, and the copies of
+    the other checkpoints are removed from the results directory. Since the checkpoint
+    has usually been copied by then, the end of training is not held up by the copies.
+
+    To bound the disk space used by the checkpoints in the scratch space, you
+    can specify a retention policy: ``keep_best`` keeps the checkpoints with the k best
+    values of the monitored metric, ``keep_last`` keeps the n most recent checkpoints,
+    and ``max_size_mb`` removes the oldest checkpoints when the total size exceeds
+    this limit. The other checkpoints are removed in the background. Files which are
+    identical to those of an earlier checkpoint are replaced by hard links. When used
+    with :func:`~add_lineage_to_keras_model_class`, the disk space used by the checkpoints
+    is recorded in the lineage parameters ``checkpoint.disk_bytes`` (at the end of
+    training) and ``checkpoint.peak_disk_bytes``.
 
     You can instantiate this class directly and pass it to the ``callbacks``
     parameter of the model's ``fit()`` method::
@@ -259,11 +358,17 @@ class DwsModelCheckpoint(ModelCheckpoint):
         results_resource: Optional[Union[str, ResourceRef]] = None,
         workspace_dir: Optional[str] = None,
         verbose: Union[int, bool] = 0,
+        keep_best: Optional[int] = None,
+        keep_last: Optional[int] = None,
+        max_size_mb: Optional[float] = None,
     ):
         """
         model_name is used to create the checkpoint filenames. The checkpoints
         will be saved as MODEL_NAME_{epoch}.
 
+        If keep_best, keep_last, and max_size_mb are all None, all checkpoints are
+        kept in the scratch space until the next run.
+
         Currently, only supports save_weights_only option.
 
         verbose can be either 0,1 in the style of tensorflow or a True,False
@@ -293,6 +398,16 @@ class DwsModelCheckpoint(ModelCheckpoint):
         if not isdir(self.dws_checkpoint_path):
             os.mkdir(self.dws_checkpoint_path)
         self.checkpoint_filepath_template = join(self.dws_checkpoint_path, model_name + "_{epoch}")
+        for (name, value) in [("keep_best", keep_best), ("keep_last", keep_last)]:
+            if value is not None and value < 1:
+                raise ConfigurationError("%s must be at least 1, got %s" % (name, value))
+        if max_size_mb is not None and max_size_mb <= 0:
+            raise ConfigurationError("max_size_mb must be positive, got %s" % max_size_mb)
+        self.keep_best = keep_best
+        self.keep_last = keep_last
+        self.max_size_mb = max_size_mb
+        self.dws_mode = mode
+        self.retention = None  # type: Optional[_CheckpointRetention]
         super().__init__(
             filepath=self.checkpoint_filepath_template,
             monitor=monitor,
@@ -324,45 +439,110 @@ class DwsModelCheckpoint(ModelCheckpoint):
             "dws> Removed %d old checkpoint files for model %s ahead of training"
             % (len(files_to_delete), self.dws_model_name)
         )
+        self.exported_checkpoint_base = None  # type: Optional[str]
+        self.exporter = _CheckpointExporter(
+            cast(FileResourceMixin, self.results_resource),
+            self.results_subdir,
+            join(self.dws_checkpoint_path, ".export-" + self.dws_model_name),
+        )
+        self.retention = _CheckpointRetention(
+            keep_best=self.keep_best,
+            keep_last=self.keep_last,
+            max_bytes=int(self.max_size_mb * 1024 * 1024) if self.max_size_mb is not None else None,
+            higher_is_better=self._is_higher_better(),
+        )
         return super().on_train_begin(logs)
 
-    def on_train_end(self, logs: Optional[Dict] = None):
+    def _is_higher_better(self) -> bool:
+        """Resolve the mode in the same way as ModelCheckpoint"""
+        if self.dws_mode == "max":
+            return True
+        elif self.dws_mode == "min":
+            return False
+        else:
+            return "acc" in self.monitor or self.monitor.startswith("fmeasure")
+
+    def get_disk_usage_params(self) -> Dict[str, int]:
+        """Return the disk space used by the checkpoints of the last run, as
+        lineage parameters.
+        """
+        if self.retention is None:
+            return {}
+        return {
+            "checkpoint.disk_bytes": self.retention.current_bytes,
+            "checkpoint.peak_disk_bytes": self.retention.peak_bytes,
+        }
+
+    def _get_checkpoint_base(self) -> Optional[str]:
+        """Return the base name of the most recent checkpoint, as recorded in
+        the checkpoint metadata file, or None if there is not yet a checkpoint.
+        """
         checkpoint_metadata_file = join(self.dws_checkpoint_path, "checkpoint")
-        assert exists(checkpoint_metadata_file), (
-            "Missing checkpoint metadata file %s" % checkpoint_metadata_file
+        if not exists(checkpoint_metadata_file):
+            return None
+        MODEL_CHECKPOINT_PATH = re.compile(
+            "^"
+            + re.escape("model_checkpoint_path:")
+            + r'\s+"('
+            + re.escape(self.dws_model_name + "_")
+            + r'\d+)"$'
         )
-        # find the checkpoint that we want to save
         with open(checkpoint_metadata_file, "r") as f:
-            MODEL_CHECKPOINT_PATH = re.compile(
-                "^"
-                + re.escape("model_checkpoint_path:")
-                + r'\s+"('
-                + re.escape(self.dws_model_name + "_")
-                + r'\d+)"$'
-            )
-            checkpoint_base = None
             for line in f:
                 mo = MODEL_CHECKPOINT_PATH.match(line.rstrip())
                 if mo is not None:
-                    checkpoint_base = mo.group(1)
-                    break
-            assert checkpoint_base is not None, (
-                "Did not find model checkpoint path in %s" % checkpoint_metadata_file
-            )
-        copy_files = []  # type: List[str]
-        copy_files.append(join(self.dws_checkpoint_path, checkpoint_base + ".index"))
-        copy_files.extend(
+                    return mo.group(1)
+        return None
+
+    def _get_checkpoint_files(self, checkpoint_base: str) -> List[str]:
+        files = [join(self.dws_checkpoint_path, checkpoint_base + ".index")]
+        files.extend(
             glob.glob(join(self.dws_checkpoint_path, checkpoint_base + ".data-*[0-9]-of-*[0-9]"))
         )
-        copy_files.append(
-            join(self.dws_checkpoint_path, "checkpoint")
-        )  # copy index file to make it easy to load checkpoint
-        for src_file in copy_files:
-            if self.results_subdir is not None:
-                dest_path = join(self.results_subdir, basename(src_file))
-            else:
-                dest_path = basename(src_file)
-            cast(FileResourceMixin, self.results_resource).upload_file(src_file, dest_path)
+        return files
+
+    def _save_model(self, *args, **kwargs):
+        """After each checkpoint is saved, start copying it to the results resource
+        in the background and apply the retention policy to the earlier checkpoints.
+        The arguments of this method differ between TensorFlow versions (the logs
+        are always last), so we just pass them through.
+        """
+        result = super()._save_model(*args, **kwargs)
+        checkpoint_base = self._get_checkpoint_base()
+        if checkpoint_base is not None and checkpoint_base != self.exported_checkpoint_base:
+            checkpoint_files = self._get_checkpoint_files(checkpoint_base)
+            self.exporter.export(checkpoint_files)
+            self.exported_checkpoint_base = checkpoint_base
+            logs = kwargs.get("logs", args[-1] if len(args) > 0 else None)
+            value = logs.get(self.monitor) if isinstance(logs, dict) else None
+            assert self.retention is not None
+            self.retention.add(
+                checkpoint_base,
+                checkpoint_files,
+                float(value) if value is not None else None,
+                checkpoint_base,
+            )
+        return result
+
+    def on_train_end(self, logs: Optional[Dict] = None):
+        checkpoint_metadata_file = join(self.dws_checkpoint_path, "checkpoint")
+        assert exists(checkpoint_metadata_file), (
+            "Missing checkpoint metadata file %s" % checkpoint_metadata_file
+        )
+        # find the checkpoint that we want to save
+        checkpoint_base = self._get_checkpoint_base()
+        assert checkpoint_base is not None, (
+            "Did not find model checkpoint path in %s" % checkpoint_metadata_file
+        )
+        checkpoint_files = self._get_checkpoint_files(checkpoint_base)
+        assert self.retention is not None
+        self.retention.finish()
+        if checkpoint_base != self.exported_checkpoint_base:
+            self.exporter.export(checkpoint_files)
+        # The checkpoint itself has usually already been copied. We wait for any
+        # copies in progress and then copy the metadata file, which points to the
+        # checkpoint, to make it easy to load.
+        self.exporter.finish(checkpoint_files, [checkpoint_metadata_file])
         if self.results_subdir is not None:
             print(
                 "dws> Copied checkpoint %s to resource %s:%s"
@@ -377,14 +557,51 @@ class DwsModelCheckpoint(ModelCheckpoint):
         return super().on_train_end(logs)
 
 
+class DwsMetricsStreamCallback(Callback):
+    """Keras callback which writes the metrics of each epoch to a
+    :class:`~dataworkspaces.lineage.MetricsStream`, so that long training runs
+    can be monitored from the ``metrics.jsonl`` file in the results directory.
+    If batch_frequency is specified, the metrics of every batch_frequency-th
+    training batch are written as well.
+
+    The easiest way to use this callback is to pass ``stream_metrics=True`` to
+    :func:`~add_lineage_to_keras_model_class`. If you create the lineage yourself
+    (e.g. via :class:`~dataworkspaces.lineage.LineageBuilder`), you can instantiate
+    the callback with the stream returned by the lineage's ``get_metrics_stream()``
+    method.
+    """
+
+    def __init__(self, stream: MetricsStream, batch_frequency: Optional[int] = None):
+        super().__init__()
+        if batch_frequency is not None and batch_frequency < 1:
+            raise ConfigurationError("batch_frequency must be at least 1, got %s" % batch_frequency)
+        self.stream = stream
+        self.batch_frequency = batch_frequency
+        self.epoch = 0
+
+    def on_epoch_begin(self, epoch, logs=None):
+        self.epoch = epoch
+
+    def on_train_batch_end(self, batch, logs=None):
+        if self.batch_frequency is not None and (batch + 1) % self.batch_frequency == 0:
+            self.stream.write("batch", dict(logs or {}), epoch=self.epoch, batch=batch)
+
+    def on_epoch_end(self, epoch, logs=None):
+        self.stream.write("epoch", dict(logs or {}), epoch=epoch)
+
+    def on_train_end(self, logs=None):
+        self.stream.flush()
+
+
 class CheckpointConfig(NamedTuple):
     """Configuration for checkpoints, to be passed as a parameter
     to :func:`~add_lineage_to_keras_model_class`, instead of
     directly instantiating :class:`~DwsModelChecpoint`.
 
     The checkpoints are initially written under the workspace's
-    scratch space. At the end of training, the best checkpoint is
-    copied to the results resource.
+    scratch space and copied to the results resource in the background.
+    At the end of training, only the best checkpoint is kept in the
+    results resource.
 
     The configuration fields are:
 
@@ -394,6 +611,10 @@ class CheckpointConfig(NamedTuple):
       previous are kept.
     * ``mode`` - how to determine whether a metric is the "best" - auto, min, or max
     * ``save_freq`` - 'epoch' or an interger
+    * ``keep_best`` - if specified, keep the k best checkpoints in the scratch space
+    * ``keep_last`` - if specified, keep the n most recent checkpoints in the scratch space
+    * ``max_size_mb`` - if specified, remove the oldest checkpoints from the scratch
+      space when they use more than this many megabytes
     """
 
     model_name: str
@@ -401,6 +622,17 @@ class CheckpointConfig(NamedTuple):
     save_best_only: bool = False
     mode: str = "auto"
     save_freq: Union[str, int] = "epoch"
+    keep_best: Optional[int] = None
+    keep_last: Optional[int] = None
+    max_size_mb: Optional[float] = None
+
+
+def _add_checkpoint_params(lineage, callbacks: Optional[List[Callback]]) -> None:
+    """Record the disk space used by any DwsModelCheckpoint callbacks"""
+    for callback in callbacks if callbacks is not None else []:
+        if isinstance(callback, DwsModelCheckpoint):
+            for (name, value) in callback.get_disk_usage_params().items():
+                lineage.add_param(name, value)
 
 
 def add_lineage_to_keras_model_class(
@@ -410,6 +642,8 @@ def add_lineage_to_keras_model_class(
     workspace_dir: Optional[str] = None,
     checkpoint_config: Optional[CheckpointConfig] = None,
     verbose: bool = False,
+    stream_metrics: bool = False,
+    stream_batch_frequency: Optional[int] = None,
 ) -> type:
     """This function wraps a Keras model class with a subclass that overwrites
     key methods to make calls to the data lineage API.
@@ -429,6 +663,11 @@ def add_lineage_to_keras_model_class(
     * ``checkpoint_config`` -- Optional instance of :class:`~CheckpointConfig`, which
       is used to enable checkpointing on fit and fit_generator()
     * ``verbose`` -- If True, print extra debugging information.
+    * ``stream_metrics`` -- If True, fit() and fit_generator() write the metrics of each
+      epoch to a ``metrics.jsonl`` file in the results resource as training progresses
+      (see :class:`~DwsMetricsStreamCallback`). A summary is added to ``results.json``.
+    * ``stream_batch_frequency`` -- If specified along with ``stream_metrics``, the metrics
+      of every n-th training batch are written as well.
 
     The following methods are wrapped:
 
@@ -468,10 +707,23 @@ def add_lineage_to_keras_model_class(
                     results_resource=results_resource,
                     workspace_dir=workspace_dir,
                     verbose=verbose,
+                    keep_best=checkpoint_config.keep_best,
+                    keep_last=checkpoint_config.keep_last,
+                    max_size_mb=checkpoint_config.max_size_mb,
                 )  # type: Optional[DwsModelCheckpoint]
             else:
                 self.checkpoint_cb = None
 
+        def _get_stream_callbacks(self) -> List[Callback]:
+            if stream_metrics:
+                return [
+                    DwsMetricsStreamCallback(
+                        self._dws_state.lineage.get_metrics_stream(), stream_batch_frequency
+                    )
+                ]
+            else:
+                return []
+
         def compile(
             self,
             optimizer,
@@ -527,26 +779,23 @@ def add_lineage_to_keras_model_class(
             else:
                 self._dws_state.lineage.add_param("fit.batch_size", None)
             api_resource = self._dws_state.find_input_resources_and_return_if_api(x, y)
+            fingerprinter = None
             if api_resource is not None:
                 _verify_eager_if_dataset(x, y, api_resource)
                 api_resource.init_hash_state()
-                hash_state = api_resource.get_hash_state()
-                if isinstance(x, kerasutils.Sequence):
-                    if y is not None:
-                        raise NotSupportedError(
-                            "fit() method does not suppport a generator for x AND a y value"
-                        )
-                    x = _TfKerasSequenceWrapper(x, hash_state)
-                elif isinstance(x, GeneratorType):
-                    if y is not None:
-                        raise NotSupportedError(
-                            "fit() method does not suppport a generator for x AND a y value"
-                        )
-                    x = _wrap_generator(x, hash_state)
+                (x, fingerprinter) = _wrap_input_for_fingerprint(
+                    "fit", x, y, kwargs.get("steps_per_epoch")
+                )
+                if fingerprinter is not None:
+                    # the later epochs read the same data
+                    if "callbacks" in kwargs:
+                        kwargs["callbacks"].append(_StopFingerprintingCallback(fingerprinter))
+                    else:
+                        kwargs["callbacks"] = [_StopFingerprintingCallback(fingerprinter)]
                 else:  # x and y are provided as full arrays
-                    _add_to_hash(x, hash_state)
+                    api_resource.add_to_hash(x)
                     if y is not None:
-                        _add_to_hash(y, hash_state)
+                        api_resource.add_to_hash(y)
                     api_resource.save_current_hash()  # in case we evaluate in a separate process
             if self.checkpoint_cb:
                 if "callbacks" in kwargs:
@@ -555,7 +804,18 @@ def add_lineage_to_keras_model_class(
                     kwargs["callbacks"] = [
                         self.checkpoint_cb,
                     ]
-            return super().fit(x, y, **kwargs)
+            if stream_metrics:
+                kwargs["callbacks"] = (kwargs.get("callbacks") or []) + self._get_stream_callbacks()
+            try:
+                results = super().fit(x, y, **kwargs)
+            finally:
+                if fingerprinter is not None:
+                    fingerprinter.close()
+            if fingerprinter is not None:
+                fingerprinter.finish(api_resource.get_hash_state())
+                api_resource.save_current_hash()
+            _add_checkpoint_params(self._dws_state.lineage, kwargs.get("callbacks"))
+            return results
 
         def fit_generator(
             self,
@@ -580,11 +840,17 @@ def add_lineage_to_keras_model_class(
             if api_resource is not None:
                 # wrap the generator to capture each entry as it is returned
                 api_resource.init_hash_state()
-                hash_state = api_resource.get_hash_state()
+                fingerprinter = BackgroundFingerprinter(
+                    num_batches=_get_num_batches(generator, steps_per_epoch)
+                )
                 if isinstance(generator, kerasutils.Sequence):
-                    generator = _TfKerasSequenceWrapper(generator, hash_state)
+                    generator = _TfKerasSequenceWrapper(generator, fingerprinter)
+                else:
+                    generator = _wrap_generator(generator, fingerprinter)
+                if callbacks is not None:
+                    callbacks.append(_StopFingerprintingCallback(fingerprinter))
                 else:
-                    generator = _wrap_generator(generator, hash_state)
+                    callbacks = [_StopFingerprintingCallback(fingerprinter)]
             if self.checkpoint_cb:
                 if callbacks is not None:
                     callbacks.append(self.checkpoint_cb)
@@ -592,24 +858,32 @@ def add_lineage_to_keras_model_class(
                     callbacks = [
                         self.checkpoint_cb,
                     ]
-            results = super().fit_generator(
-                generator,
-                steps_per_epoch,
-                epochs,
-                verbose,
-                callbacks,
-                validation_data,
-                validation_steps,
-                validation_freq,
-                class_weight,
-                max_queue_size,
-                workers,
-                use_multiprocessing,
-                shuffle,
-                initial_epoch,
-            )
+            if stream_metrics:
+                callbacks = (callbacks or []) + self._get_stream_callbacks()
+            try:
+                results = super().fit_generator(
+                    generator,
+                    steps_per_epoch,
+                    epochs,
+                    verbose,
+                    callbacks,
+                    validation_data,
+                    validation_steps,
+                    validation_freq,
+                    class_weight,
+                    max_queue_size,
+                    workers,
+                    use_multiprocessing,
+                    shuffle,
+                    initial_epoch,
+                )
+            finally:
+                if api_resource is not None:
+                    fingerprinter.close()
             if api_resource is not None:
+                fingerprinter.finish(api_resource.get_hash_state())
                 api_resource.save_current_hash()
+            _add_checkpoint_params(self._dws_state.lineage, callbacks)
             return results
 
         def evaluate(self, x, y=None, **kwargs):
@@ -618,29 +892,26 @@ def add_lineage_to_keras_model_class(
             else:
                 self._dws_state.lineage.add_param("evaluate.batch_size", None)
             api_resource = self._dws_state.find_input_resources_and_return_if_api(x, y)
+            fingerprinter = None
             if api_resource is not None:
                 _verify_eager_if_dataset(x, y, api_resource)
                 api_resource.dup_hash_state()
-                hash_state = api_resource.get_hash_state()
-                if isinstance(x, kerasutils.Sequence):
-                    if y is not None:
-                        raise NotSupportedError(
-                            "evaluate() method does not suppport a generator for x AND a y value"
-                        )
-                    x = _TfKerasSequenceWrapper(x, hash_state)
-                elif isinstance(x, GeneratorType):
-                    if y is not None:
-                        raise NotSupportedError(
-                            "evaluate() method does not suppport a generator for x AND a y value"
-                        )
-                    x = _wrap_generator(x, hash_state)
-                else:
-                    _add_to_hash(x, hash_state)
+                (x, fingerprinter) = _wrap_input_for_fingerprint(
+                    "evaluate", x, y, kwargs.get("steps")
+                )
+                if fingerprinter is None:
+                    api_resource.add_to_hash(x)
                     if y is not None:
-                        _add_to_hash(y, hash_state)
-            results = super().evaluate(x, y, **kwargs)
+                        api_resource.add_to_hash(y)
+            try:
+                results = super().evaluate(x, y, **kwargs)
+            finally:
+                if fingerprinter is not None:
+                    fingerprinter.close()
             assert len(results) == len(self.metrics_names)
             if api_resource is not None:
+                if fingerprinter is not None:
+                    fingerprinter.finish(api_resource.get_hash_state())
                 api_resource.save_current_hash()
                 api_resource.pop_hash_state()
             self._dws_state.write_metrics_and_complete(
@@ -663,15 +934,28 @@ def add_lineage_to_keras_model_class(
             if api_resource is not None:
                 # wrap the generator to capture each entry as it is returned
                 api_resource.dup_hash_state()
-                hash_state = api_resource.get_hash_state()
+                fingerprinter = BackgroundFingerprinter(
+                    num_batches=_get_num_batches(generator, steps)
+                )
                 if isinstance(generator, kerasutils.Sequence):
-                    generator = _TfKerasSequenceWrapper(generator, hash_state)
+                    generator = _TfKerasSequenceWrapper(generator, fingerprinter)
                 else:
-                    generator = _wrap_generator(generator, hash_state)
-            results = super().evaluate_generator(
-                generator, steps, callbacks, max_queue_size, workers, use_multiprocessing, verbose
-            )
+                    generator = _wrap_generator(generator, fingerprinter)
+            try:
+                results = super().evaluate_generator(
+                    generator,
+                    steps,
+                    callbacks,
+                    max_queue_size,
+                    workers,
+                    use_multiprocessing,
+                    verbose,
+                )
+            finally:
+                if api_resource is not None:
+                    fingerprinter.close()
             if api_resource is not None:
+                fingerprinter.finish(api_resource.get_hash_state())
                 api_resource.save_current_hash()
                 api_resource.pop_hash_state()
             assert len(results) == len(self.metrics_names)
@@ -2,28 +2,28 @@
 Common utils for wrapping objects with the Lineage API.
 """
 import datetime
-from typing import Optional, Union, cast, Dict
-from os.path import exists
+import os
+import queue
+import shutil
+import hashlib
+import threading
+from typing import Optional, Union, cast, Dict, List, NamedTuple
+from os.path import exists, join, basename
 
-from dataworkspaces.workspace import Workspace, ResourceRoles, ResourceRef
+from dataworkspaces.workspace import Workspace, ResourceRoles, ResourceRef, FileResourceMixin
 from dataworkspaces.utils.lineage_utils import LineageError, infer_step_name
 from dataworkspaces.kits.jupyter import get_step_name_for_notebook
 from dataworkspaces.lineage import ResultsLineage
-from dataworkspaces.resources.api_resource import API_RESOURCE_TYPE, ApiResource
+from dataworkspaces.resources.api_resource import (
+    API_RESOURCE_TYPE,
+    ApiResource,
+    SAMPLED_FINGERPRINT_NOTE,
+)
+from dataworkspaces.utils.fingerprint_utils import add_to_fingerprint
 from dataworkspaces.errors import ConfigurationError
 
 import numpy as np # type: ignore
 
-try:
-    import pandas # type: ignore
-except ImportError:
-    pandas = None
-
-try:
-    import tensorflow # type: ignore
-except ImportError:
-    tensorflow = None  # type: ignore
-
 
 class NotSupportedError(ConfigurationError):
     """Thrown when a wrapper encounters an unsupported configuration.
@@ -68,46 +68,10 @@ def _metric_obj_to_json(v):
 
 
 def _add_to_hash(array_data, hash_state):
-    if isinstance(array_data, np.ndarray):
-        hash_state.update(array_data.data)
-    elif (pandas is not None) and isinstance(array_data, pandas.DataFrame):
-        for c in array_data.columns:
-            hash_state.update(array_data[c].to_numpy(copy=False).data)
-    elif (pandas is not None) and isinstance(array_data, pandas.Series):
-        hash_state.update(array_data.to_numpy(copy=False).data)
-    elif isinstance(array_data, tuple) or isinstance(array_data, list):
-        # Tensorflow frequently puts the parts of a dataset in a tuple.
-        # For example: (features, labels)
-        for element in array_data:
-            _add_to_hash(element, hash_state)
-    elif isinstance(array_data, dict):
-        # Tensorflow uses a dict (specifically OrderedDict) to store
-        # the columns of a CSV.
-        for column in array_data.values():
-            _add_to_hash(column, hash_state)
-    elif (tensorflow is not None) and isinstance(array_data, tensorflow.data.Dataset):  # type: ignore
-        # We need to iterate through the dataset, to force an eager evaluation
-        for t in array_data:
-            _add_to_hash(t, hash_state)
-    elif (tensorflow is not None) and isinstance(array_data, tensorflow.Tensor):  # type: ignore
-        if hasattr(array_data, "numpy"):
-            _add_to_hash(array_data.numpy(), hash_state)
-        else:
-            raise Exception(
-                "Tensor type %s is not in eager mode, cannot convert to numpy, value was: %s"
-                % (type(array_data), repr(array_data))
-            )
-    elif (
-        isinstance(array_data, np.uint8)
-        or isinstance(array_data, np.int8)
-        or isinstance(array_data, np.int32)
-        or isinstance(array_data, np.int64)
-    ):
-        hash_state.update(bytes(int(array_data)))
-    else:
-        raise Exception(
-            "Unable to hash data type %s, data was: %s" % (type(array_data), array_data)
-        )
+    """Add the data to the hash state, using
+    :func:`~dataworkspaces.utils.fingerprint_utils.add_to_fingerprint`.
+    """
+    add_to_fingerprint(array_data, hash_state)
 
 
 def _find_resource(
@@ -179,6 +143,7 @@ class _DwsModelState:
         self.results_ref = _find_resource(workspace, ResourceRoles.RESULTS, results_resource)
         self.default_input_resource = input_resource
         self.api_resource_cache = {}  # type: Dict[str,ApiResource]
+        self.api_resource_refs = {}  # type: Dict[str,ResourceRef]
         self.lineage = ResultsLineage(
             _infer_step_name(), datetime.datetime.now(), {}, [], [], self.results_ref, workspace
         )
@@ -211,6 +176,7 @@ class _DwsModelState:
                 self.api_resource_cache[ref.name] = cast(
                     ApiResource, self.workspace.get_resource(ref.name)
                 )
+            self.api_resource_refs[ref.name] = ref
             return self.api_resource_cache[ref.name]
         else:
             return None
@@ -219,6 +185,11 @@ class _DwsModelState:
         metrics = _metric_obj_to_json(metrics)
         if self.workspace.verbose:
             print("dws>> Metrics: %s" % repr(metrics))
+        for (name, api_resource) in self.api_resource_cache.items():
+            if api_resource.hash_is_approximate():
+                self.lineage.step.annotate_input(
+                    self.api_resource_refs[name], SAMPLED_FINGERPRINT_NOTE
+                )
         self.lineage.write_results(metrics)
         self.lineage.complete()
 
@@ -229,3 +200,279 @@ class _DwsModelState:
         self.lineage.step.execution_time_seconds = None
         self.lineage.step.start_time = datetime.datetime.now()
         self.lineage.in_progress = True
+
+
+def _hash_file(path: str) -> str:
+    hash_state = hashlib.sha1()
+    with open(path, "rb") as f:
+        while True:
+            data = f.read(1024 * 1024)
+            if len(data) == 0:
+                return hash_state.hexdigest()
+            hash_state.update(data)
+
+
+class _CheckpointExporter:
+    """Copy checkpoints to a results resource on a background thread, so that
+    training does not wait for the copies. Each call to :meth:`export` stages
+    the files of one checkpoint, by hard linking them into a subdirectory of
+    staging_dir, so that later checkpoints do not change them. The worker
+    thread then uploads the staged files via the resource's ``upload_tree()``,
+    which remote resources implement with parallel uploads. A file whose
+    content was already uploaded (e.g. the weights of frozen layers, which
+    do not change between checkpoints) is skipped.
+
+    :meth:`finish` waits for the queued exports, uploads the kept files which
+    were skipped, uploads the final files (e.g. the checkpoint metadata file,
+    which points to the checkpoint to use), and deletes the exported files of
+    the earlier checkpoints.
+    """
+
+    def __init__(
+        self, resource: FileResourceMixin, results_subdir: Optional[str], staging_dir: str
+    ):
+        self.resource = resource
+        self.results_subdir = results_subdir
+        self.staging_dir = staging_dir
+        if exists(staging_dir):
+            shutil.rmtree(staging_dir)  # left over from a run which did not finish
+        os.makedirs(staging_dir)
+        self.uploaded = {}  # type: Dict[str, str]
+        self.names_by_hash = {}  # type: Dict[str, str]
+        # files which were not uploaded, as the same content was uploaded under another name
+        self.skipped = {}  # type: Dict[str, str]
+        self.num_exports = 0
+        self.queue = queue.Queue()  # type: queue.Queue
+        self.error = None  # type: Optional[BaseException]
+        self.thread = threading.Thread(target=self._run, name="dws-checkpoint-export", daemon=True)
+        self.thread.start()
+
+    def _get_dest_path(self, filename: str) -> str:
+        return join(self.results_subdir, filename) if self.results_subdir is not None else filename
+
+    def _record_upload(self, filename: str, file_hash: str) -> None:
+        old_hash = self.uploaded.get(filename)
+        if old_hash is not None and self.names_by_hash.get(old_hash) == filename:
+            del self.names_by_hash[old_hash]
+        self.uploaded[filename] = file_hash
+        self.names_by_hash[file_hash] = filename
+        self.skipped.pop(filename, None)
+
+    def _run(self) -> None:
+        while True:
+            stage_dir = self.queue.get()
+            if stage_dir is None:
+                return
+            try:
+                new_hashes = {}  # type: Dict[str, str]
+                for filename in sorted(os.listdir(stage_dir)):
+                    file_hash = _hash_file(join(stage_dir, filename))
+                    if file_hash in self.names_by_hash or file_hash in new_hashes.values():
+                        os.remove(join(stage_dir, filename))
+                        if self.uploaded.get(filename) != file_hash:
+                            self.skipped[filename] = file_hash
+                    else:
+                        new_hashes[filename] = file_hash
+                if len(new_hashes) > 0:
+                    self.resource.upload_tree(stage_dir, self.results_subdir or "")
+                    for (filename, file_hash) in new_hashes.items():
+                        self._record_upload(filename, file_hash)
+            except BaseException as e:
+                self.error = e  # reraised by export() or finish()
+            finally:
+                shutil.rmtree(stage_dir, ignore_errors=True)
+
+    def export(self, files: List[str]) -> None:
+        """Stage the files of a checkpoint and queue them to be uploaded."""
+        if self.error is not None:
+            raise self.error
+        self.num_exports += 1
+        stage_dir = join(self.staging_dir, str(self.num_exports))
+        os.mkdir(stage_dir)
+        for path in files:
+            try:
+                os.link(path, join(stage_dir, basename(path)))
+            except OSError:
+                shutil.copyfile(path, join(stage_dir, basename(path)))
+        self.queue.put(stage_dir)
+
+    def finish(self, keep_files: List[str], final_files: List[str]) -> None:
+        """Wait for the exports to complete and then upload final_files. Previously
+        exported files whose names are not in keep_files or final_files are deleted
+        from the resource.
+        """
+        self.queue.put(None)
+        self.thread.join()
+        shutil.rmtree(self.staging_dir, ignore_errors=True)
+        if self.error is not None:
+            raise self.error
+        for path in keep_files:
+            filename = basename(path)
+            if filename in self.skipped:
+                self.resource.upload_file(path, self._get_dest_path(filename))
+                self._record_upload(filename, self.skipped[filename])
+        for path in final_files:
+            self.resource.upload_file(path, self._get_dest_path(basename(path)))
+        keep_names = set(basename(path) for path in keep_files + final_files)
+        for filename in sorted(self.uploaded.keys()):
+            if filename not in keep_names:
+                self.resource.delete_file(self._get_dest_path(filename))
+
+
+class _RetainedCheckpoint(NamedTuple):
+    name: str
+    files: List[str]
+    value: Optional[float]  # the monitored metric, if available
+
+
+class _RetainedFile(NamedTuple):
+    path: str
+    size: int
+    mtime: int  # in nanoseconds
+
+
+class _CheckpointRetention:
+    """Retention policy for the checkpoints written to local scratch space.
+    Keeps the keep_best checkpoints with the best monitored values and the
+    keep_last most recent checkpoints; if both are None, all checkpoints are
+    kept. If the checkpoints then use more than max_bytes, the oldest are
+    removed until they fit. The current checkpoint (the one that the checkpoint
+    metadata file points to) is never removed.
+
+    Each file of a new checkpoint which is identical to a file of a retained
+    checkpoint (e.g. the weights of frozen layers) is replaced by a hard link to
+    that file. This is safe because TensorFlow writes checkpoints to temporary
+    files and renames them, rather than overwriting files in place.
+
+    The hashing, linking, and removal of checkpoints happen on a background
+    thread, so that training does not wait for them.
+    """
+
+    def __init__(
+        self,
+        keep_best: Optional[int] = None,
+        keep_last: Optional[int] = None,
+        max_bytes: Optional[int] = None,
+        higher_is_better: bool = False,
+    ):
+        self.keep_best = keep_best
+        self.keep_last = keep_last
+        self.max_bytes = max_bytes
+        self.higher_is_better = higher_is_better
+        self.checkpoints = []  # type: List[_RetainedCheckpoint]
+        # hash => the retained files with that content
+        self.files_by_hash = {}  # type: Dict[str, List[_RetainedFile]]
+        self.current_bytes = 0
+        self.peak_bytes = 0
+        self.num_linked = 0
+        self.num_removed = 0
+        self.queue = queue.Queue()  # type: queue.Queue
+        self.error = None  # type: Optional[BaseException]
+        self.thread = threading.Thread(
+            target=self._run, name="dws-checkpoint-retention", daemon=True
+        )
+        self.thread.start()
+
+    def _dedup(self, checkpoint: _RetainedCheckpoint) -> None:
+        for path in checkpoint.files:
+            file_hash = _hash_file(path)
+            others = self.files_by_hash.setdefault(file_hash, [])
+            for (other_path, size, mtime) in others:
+                try:
+                    stat = os.stat(other_path)
+                except FileNotFoundError:
+                    continue  # removed outside of the retention policy
+                if (stat.st_size, stat.st_mtime_ns) != (size, mtime):
+                    continue  # rewritten since we hashed it
+                if not os.path.samefile(other_path, path):
+                    tmp_path = path + ".tmp-link"
+                    try:
+                        os.link(other_path, tmp_path)
+                        os.replace(tmp_path, path)
+                        self.num_linked += 1
+                    except OSError:
+                        pass  # the file system may not support hard links
+                break
+            stat = os.stat(path)
+            others.append(_RetainedFile(path, stat.st_size, stat.st_mtime_ns))
+
+    def _get_disk_usage(self) -> int:
+        stats = []  # type: List[os.stat_result]
+        for checkpoint in self.checkpoints:
+            for path in checkpoint.files:
+                try:
+                    stats.append(os.stat(path))
+                except FileNotFoundError:
+                    pass
+        # hard linked files are only counted once
+        sizes = {(stat.st_dev, stat.st_ino): stat.st_size for stat in stats}
+        return sum(sizes.values())
+
+    def _remove(self, checkpoint: _RetainedCheckpoint) -> None:
+        self.checkpoints.remove(checkpoint)
+        for path in checkpoint.files:
+            if exists(path):
+                os.remove(path)
+        for others in self.files_by_hash.values():
+            others[:] = [entry for entry in others if entry.path not in checkpoint.files]
+        self.num_removed += 1
+
+    def _get_evictions(self, current: Optional[str]) -> List[_RetainedCheckpoint]:
+        if self.keep_best is None and self.keep_last is None:
+            return []
+        keep = set([current])
+        if self.keep_last is not None:
+            start = max(len(self.checkpoints) - self.keep_last, 0)
+            keep.update(checkpoint.name for checkpoint in self.checkpoints[start:])
+        if self.keep_best is not None:
+            scored = [checkpoint for checkpoint in self.checkpoints if checkpoint.value is not None]
+            scored.sort(
+                key=lambda checkpoint: cast(float, checkpoint.value),
+                reverse=self.higher_is_better,
+            )
+            keep.update(checkpoint.name for checkpoint in scored[: self.keep_best])
+        return [checkpoint for checkpoint in self.checkpoints if checkpoint.name not in keep]
+
+    def _run(self) -> None:
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            if self.error is not None:
+                continue
+            (checkpoint, current) = item
+            try:
+                for old in [old for old in self.checkpoints if old.name == checkpoint.name]:
+                    self._remove(old)  # saved again under the same name
+                self._dedup(checkpoint)
+                self.checkpoints.append(checkpoint)
+                self.current_bytes = self._get_disk_usage()
+                self.peak_bytes = max(self.peak_bytes, self.current_bytes)
+                for old in self._get_evictions(current):
+                    self._remove(old)
+                self.current_bytes = self._get_disk_usage()
+                if self.max_bytes is not None:
+                    for old in [old for old in self.checkpoints if old.name != current]:
+                        if self.current_bytes <= self.max_bytes:
+                            break
+                        self._remove(old)
+                        self.current_bytes = self._get_disk_usage()
+            except BaseException as e:
+                self.error = e  # reraised by add() or finish()
+
+    def add(
+        self, name: str, files: List[str], value: Optional[float], current: Optional[str]
+    ) -> None:
+        """Queue a newly saved checkpoint, whose monitored metric is value. Current
+        is the name of the current checkpoint, which is not removed.
+        """
+        if self.error is not None:
+            raise self.error
+        self.queue.put((_RetainedCheckpoint(name, files, value), current))
+
+    def finish(self) -> None:
+        """Wait for the queued checkpoints to be processed."""
+        self.queue.put(None)
+        self.thread.join()
+        if self.error is not None:
+            raise self.error
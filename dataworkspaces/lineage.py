@@ -108,12 +108,15 @@ Here is an example usage of the lineage API in a command line script::
 
 """
 import sys
+import os
 from abc import ABC, abstractmethod
 import contextlib
 from collections import OrderedDict
 import datetime
+import json
+import time
 from typing import List, Union, Any, Type, Iterable, Dict, Optional, cast
-from os.path import curdir, join, isabs, abspath, expanduser, exists, basename
+from os.path import curdir, join, isabs, abspath, expanduser, exists, basename, dirname
 from argparse import ArgumentParser, Namespace
 from copy import copy
 
@@ -122,6 +125,7 @@ from dataworkspaces.workspace import (
     Workspace,
     load_workspace,
     FileResourceMixin,
+    LocalStateResourceMixin,
     PathNotAResourceError,
     SnapshotWorkspaceMixin,
     ResourceRoles,
@@ -261,6 +265,7 @@ class Lineage(contextlib.AbstractContextManager):
             self.in_progress = False
         for output_cert in self.step.output_resources:
             self.store.clear_entry(self.instance, output_cert.ref)
+        self.store.flush()
 
     def _set_execution_time(self):
         """If the execution time has not already been set, and the start timestamp
@@ -291,6 +296,7 @@ class Lineage(contextlib.AbstractContextManager):
             self.in_progress = False
         self._set_execution_time()
         self.store.store_entry(self.instance, self.step)
+        self.store.flush()
 
     def __exit__(self, exc_type, exc_val, exc_tb):
         if exc_type is None:
@@ -300,12 +306,134 @@ class Lineage(contextlib.AbstractContextManager):
         return False  # don't suppress any exception
 
 
+METRICS_LOG_FILE = "metrics.jsonl"
+DEFAULT_FLUSH_SECONDS = 5.0
+DEFAULT_FLUSH_BYTES = 64 * 1024
+
+
+def _json_default(obj):
+    """Convert values that json does not know about (e.g. NumPy scalars)"""
+    if hasattr(obj, "tolist"):
+        return obj.tolist()
+    elif isinstance(obj, (datetime.datetime, datetime.date)):
+        return obj.isoformat()
+    else:
+        return repr(obj)
+
+
+class MetricsStream:
+    """An append-only log of metrics for a :class:`~ResultsLineage`, so that a
+    long run (e.g. training a model over many epochs) can be monitored while it is
+    in progress. Get an instance by calling :func:`~ResultsLineage.get_metrics_stream`.
+
+    Each call to :func:`~write` adds one line to the ``metrics.jsonl`` file,
+    which is written next to the ``results.json`` file. Each line is a JSON object
+    with the event name (e.g. "epoch"), any position keys (e.g. the epoch number),
+    a timestamp, and the metrics. The lines are buffered and written when the
+    buffer exceeds ``flush_bytes`` or when ``flush_seconds`` have passed since
+    the last write, so that we do not write to the results resource for each batch.
+
+    If the results resource has a local path, the lines are appended to the file
+    in place. Otherwise, the log is kept in the resource's scratch space and the
+    file is uploaded to the resource at each flush.
+
+    When :func:`~ResultsLineage.write_results` is called, the stream is closed and
+    a compacted summary (the number of records and the last, min, and max value of each
+    numeric metric, by event) is included in ``results.json`` under ``metrics_log``.
+    """
+
+    def __init__(
+        self,
+        local_path: str,
+        results_resource: Optional[FileResourceMixin],
+        rel_dest_path: str,
+        flush_seconds: float = DEFAULT_FLUSH_SECONDS,
+        flush_bytes: int = DEFAULT_FLUSH_BYTES,
+    ):
+        self.local_path = local_path
+        self.results_resource = results_resource  # if not None, upload on each flush
+        self.rel_dest_path = rel_dest_path
+        self.flush_seconds = flush_seconds
+        self.flush_bytes = flush_bytes
+        self.buffer = []  # type: List[str]
+        self.buffer_bytes = 0
+        self.last_flush = time.monotonic()
+        self.num_records = 0
+        self.summary = OrderedDict()  # type: Dict[str, Dict[str, Any]]
+        self.closed = False
+        parent_dir = dirname(local_path)
+        if not exists(parent_dir):
+            os.makedirs(parent_dir)
+        with open(local_path, "w"):
+            pass  # the log starts empty for each run
+
+    def _summarize(self, event: str, metrics: Dict[str, Any]) -> None:
+        summary = self.summary.setdefault(
+            event, OrderedDict([("count", 0), ("last", {}), ("min", {}), ("max", {})])
+        )
+        summary["count"] += 1
+        for (name, value) in metrics.items():
+            value = json.loads(json.dumps(value, default=_json_default))
+            summary["last"][name] = value
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                summary["min"][name] = min(value, summary["min"].get(name, value))
+                summary["max"][name] = max(value, summary["max"].get(name, value))
+
+    def write(self, event: str, metrics: Dict[str, Any], **position: Any) -> None:
+        """Add a record for the event (e.g. "epoch" or "batch"). Any keyword
+        arguments (e.g. ``epoch=3``) are included in the record to identify it.
+        """
+        if self.closed:
+            raise ConfigurationError("Cannot write to a metrics stream after it is closed")
+        record = OrderedDict([("event", event)])  # type: Dict[str, Any]
+        record.update(position)
+        record["timestamp"] = datetime.datetime.now().isoformat()
+        record["metrics"] = metrics
+        line = json.dumps(record, default=_json_default) + "\n"
+        self.buffer.append(line)
+        self.buffer_bytes += len(line)
+        self.num_records += 1
+        self._summarize(event, metrics)
+        if (
+            self.buffer_bytes >= self.flush_bytes
+            or (time.monotonic() - self.last_flush) >= self.flush_seconds
+        ):
+            self.flush()
+
+    def flush(self) -> None:
+        """Write any buffered records to the log."""
+        self.last_flush = time.monotonic()
+        if len(self.buffer) == 0:
+            return
+        with open(self.local_path, "a") as f:
+            f.write("".join(self.buffer))  # a single write, so readers see whole records
+        self.buffer = []
+        self.buffer_bytes = 0
+        if self.results_resource is not None:
+            self.results_resource.upload_file(self.local_path, self.rel_dest_path)
+
+    def close(self) -> None:
+        """Flush the log. Further writes are not allowed."""
+        if not self.closed:
+            self.flush()
+            self.closed = True
+
+    def get_summary(self) -> Dict[str, Any]:
+        """Return the compacted summary of the log for ``results.json``."""
+        return {
+            "file": self.rel_dest_path,
+            "records": self.num_records,
+            "events": self.summary,
+        }
+
+
 class ResultsLineage(Lineage):
     """Lineage for a results step. This subclass is returned by the
     :class:`~LineageBuilder` when :func:`~LineageBuilder.as_results_step` is called.
     This marks the :class:`~Lineage` object as generating results.
     It adds the :func:`~write_results`
-    method for writing a JSON summary of the final results.
+    method for writing a JSON summary of the final results, and the
+    :func:`~get_metrics_stream` method for logging metrics while the step runs.
 
     Results resources will also have a ``lineage.json`` file added
     when the next snapshot is taken. This file contains the full
@@ -342,19 +470,70 @@ class ResultsLineage(Lineage):
         self.results_resource = self.workspace.get_resource(self.results_ref.name)
         self.add_output_ref(self.results_ref)
         self.run_description = run_description
+        self.metrics_stream = None  # type: Optional[MetricsStream]
         if not isinstance(self.results_resource, FileResourceMixin):
             raise ConfigurationError(
                 "Resource '%s' does not support a file API and thus won't support writing results."
                 % self.results_ref.name
             )
 
+    def _get_results_relpath(self, filename: str) -> str:
+        if self.results_ref.subpath is not None:
+            return join(self.results_ref.subpath, filename)
+        else:
+            return filename
+
+    def get_metrics_stream(
+        self, flush_seconds: float = DEFAULT_FLUSH_SECONDS, flush_bytes: int = DEFAULT_FLUSH_BYTES
+    ) -> MetricsStream:
+        """Return the :class:`~MetricsStream` for logging metrics to a
+        ``metrics.jsonl`` file in the results directory while the step is running.
+        The stream is created (replacing the log of any previous run) on the first call.
+        The flush parameters are only used when the stream is created.
+        """
+        if self.metrics_stream is None or self.metrics_stream.closed:
+            rel_dest_path = self._get_results_relpath(METRICS_LOG_FILE)
+            local_root = (
+                self.results_resource.get_local_path_if_any()
+                if isinstance(self.results_resource, LocalStateResourceMixin)
+                else None
+            )
+            if local_root is not None:
+                self.metrics_stream = MetricsStream(
+                    join(local_root, rel_dest_path), None, rel_dest_path, flush_seconds, flush_bytes
+                )
+            else:
+                scratch_dir = self.workspace._get_local_scratch_space_for_resource(
+                    self.results_ref.name, create_if_not_present=True
+                )
+                self.metrics_stream = MetricsStream(
+                    join(scratch_dir, rel_dest_path),
+                    cast(FileResourceMixin, self.results_resource),
+                    rel_dest_path,
+                    flush_seconds,
+                    flush_bytes,
+                )
+        return self.metrics_stream
+
+    def complete(self):
+        if self.metrics_stream is not None:
+            self.metrics_stream.close()
+        super().complete()
+
+    def abort(self):
+        if self.metrics_stream is not None:
+            self.metrics_stream.close()
+        super().abort()
+
     def write_results(self, metrics: Dict[str, Any]):
         """Write a ``results.json`` file to the results directory
         specified when creating the lineage object (e.g. via
         :func:`~LineageBuilder.as_results_step`).
         This json file contains information
         about the step execution (e.g. start time), parameters,
-        and the provided metrics.
+        and the provided metrics. If metrics were logged via
+        :func:`~get_metrics_stream`, the stream is closed and its summary
+        is included as well.
         """
         self._set_execution_time()
         data = {
@@ -365,10 +544,10 @@ class ResultsLineage(Lineage):
             "run_description": self.run_description,
             "metrics": metrics,
         }
-        if self.results_ref.subpath is not None:
-            results_relpath = join(self.results_ref.subpath, "results.json")
-        else:
-            results_relpath = "results.json"
+        if self.metrics_stream is not None:
+            self.metrics_stream.close()
+            data["metrics_log"] = self.metrics_stream.get_summary()
+        results_relpath = self._get_results_relpath("results.json")
         cast(FileResourceMixin, self.results_resource).add_results_file(data, results_relpath)
         print("Wrote results to %s:%s" % (self.results_ref.name, results_relpath))
 
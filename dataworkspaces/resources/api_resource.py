@@ -9,6 +9,7 @@ import hashlib
 import click
 
 from dataworkspaces.errors import ConfigurationError, InternalError
+from dataworkspaces.utils.param_utils import EnumType, BoolType
 from dataworkspaces.workspace import (
     Workspace,
     Resource,
@@ -21,6 +22,12 @@ from dataworkspaces.workspace import (
 
 API_RESOURCE_TYPE = "api-resource"
 
+FINGERPRINT_MODES = ["exact", "sampled"]
+BATCH_ORDERS = ["ordered", "unordered"]
+# Added to the comment of a step's input certificate when the hash is
+# from a sampled fingerprint.
+SAMPLED_FINGERPRINT_NOTE = "approximate hash from a sampled fingerprint"
+
 
 class ApiResource(Resource, LocalStateResourceMixin, SnapshotResourceMixin):
     """This is a resource type for an API that has to be called to get data.
@@ -31,14 +38,75 @@ class ApiResource(Resource, LocalStateResourceMixin, SnapshotResourceMixin):
     API to get the data. The hash is stored in a local scratch directory which
     is read when the snapshot is taken.
 
+    By default, the hash covers all of the data. For large data sets, the
+    fingerprint parameter can be set to "sampled" to hash only a fixed
+    amount of the data (see
+    :func:`~dataworkspaces.utils.fingerprint_utils.add_sampled_fingerprint`).
+
+    By default, the hash depends on the order in which the data is passed in
+    (e.g. the order of the batches from a generator). If the batch_order
+    parameter is "unordered", each batch is hashed separately and the hashes
+    are combined via a
+    :class:`~dataworkspaces.utils.fingerprint_utils.MultisetDigest`, so that
+    shuffling the batches does not change the hash. In this mode, the workers
+    of a data-parallel job can each send the value of :meth:`get_partial_digest`
+    to one process, which combines them via :meth:`merge_partial_digest`.
+
+    The fingerprints of arrays are cached (see
+    :mod:`~dataworkspaces.utils.fingerprint_cache`), so that an array which is
+    passed to several models is only hashed once. If you modify arrays in place
+    between calls, set the cache_fingerprints parameter to False.
+
     This resource inherits from LocalStateResourceMixin so that we can get
     a clone call to initialze the scratch directory when the workspace or
     individual resource is cloned.
     """
 
-    def __init__(self, name: str, role: str, workspace: Workspace):
+    def __init__(
+        self,
+        name: str,
+        role: str,
+        workspace: Workspace,
+        fingerprint: str = "exact",
+        batch_order: str = "ordered",
+        cache_fingerprints: bool = True,
+    ):
         super().__init__(API_RESOURCE_TYPE, name, role, workspace)
+        self.param_defs.define(
+            "fingerprint",
+            default_value="exact",
+            optional=True,
+            help="How the data is hashed: 'exact' (all of the data) or 'sampled' "
+            + "(a fixed number of blocks of rows, for large data sets)",
+            is_global=True,
+            ptype=EnumType(*FINGERPRINT_MODES),
+        )
+        self.fingerprint = self.param_defs.get("fingerprint", fingerprint)  # type: str
+        self.param_defs.define(
+            "batch_order",
+            default_value="ordered",
+            optional=True,
+            help="Whether the hash depends on the order of the batches: 'ordered' or "
+            + "'unordered' (the batches may be shuffled or split across workers)",
+            is_global=True,
+            ptype=EnumType(*BATCH_ORDERS),
+        )
+        self.batch_order = self.param_defs.get("batch_order", batch_order)  # type: str
+        self.param_defs.define(
+            "cache_fingerprints",
+            default_value=True,
+            optional=True,
+            help="If True, cache the fingerprints of arrays, so that an array (or a file "
+            + "loaded via load_dataset_from_resource()) is only hashed once",
+            is_global=True,
+            ptype=BoolType(),
+        )
+        self.cache_fingerprints = self.param_defs.get(
+            "cache_fingerprints", cache_fingerprints
+        )  # type: bool
+        self.fingerprint_cache = None  # type: Any
         self.hash_states = []  # type: List[Any]
+        self.used_sampled_fingerprint = False
 
     def validate_subpath_exists(self, subpath: str) -> None:
         raise ConfigurationError(
@@ -90,7 +158,13 @@ class ApiResource(Resource, LocalStateResourceMixin, SnapshotResourceMixin):
         """Drop whatever was there before and init with a fresh hash object.
         Use this when starting training.
         """
-        self.hash_states = [hashlib.sha1()]
+        self.used_sampled_fingerprint = False
+        if self.is_unordered():
+            from dataworkspaces.utils.fingerprint_utils import MultisetDigest
+
+            self.hash_states = [MultisetDigest()]
+        else:
+            self.hash_states = [hashlib.sha1()]
 
     def dup_hash_state(self) -> None:
         """Push a copy of current TOS. Used when we want to start
@@ -108,12 +182,83 @@ class ApiResource(Resource, LocalStateResourceMixin, SnapshotResourceMixin):
         assert len(self.hash_states) > 0
         return self.hash_states[-1]
 
+    def is_sampled(self) -> bool:
+        return self.fingerprint == "sampled"
+
+    def is_unordered(self) -> bool:
+        return self.batch_order == "unordered"
+
+    def hash_is_approximate(self) -> bool:
+        """Return True if data was added to the hash via a sampled fingerprint
+        since the hash state was initialized. Data hashed elsewhere (e.g. by a
+        BackgroundFingerprinter) is always hashed exactly.
+        """
+        return self.used_sampled_fingerprint
+
+    def _get_digest(self, data) -> str:
+        # imported here, as it imports numpy and pandas, which would slow down
+        # the startup of the command line interface
+        from dataworkspaces.utils.fingerprint_cache import FingerprintCache, compute_digest
+
+        if not self.cache_fingerprints:
+            return compute_digest(data, self.fingerprint)
+        if self.fingerprint_cache is None:
+            scratch = self.workspace._get_local_scratch_space_for_resource(self.name)
+            self.fingerprint_cache = FingerprintCache(join(scratch, "fingerprint_cache"))
+        return self.fingerprint_cache.get_digest(data, self.fingerprint)
+
+    def add_to_hash(self, data) -> None:
+        """Add the in-memory data to the current hash state, using the resource's
+        fingerprint mode. The digest of the data's fingerprint is added,
+        so that it can be cached.
+        """
+        from dataworkspaces.utils.fingerprint_utils import add_digest_to_fingerprint
+
+        assert len(self.hash_states) > 0
+        digest = self._get_digest(data)
+        if self.is_sampled():
+            self.used_sampled_fingerprint = True
+        if self.is_unordered():
+            # the data is one element of the multiset
+            self.hash_states[-1].add_digest(digest)
+        else:
+            add_digest_to_fingerprint(digest, self.hash_states[-1])
+
+    def _check_unordered(self) -> None:
+        if not self.is_unordered():
+            raise ConfigurationError(
+                "Partial digests are only supported for resource %s if its batch_order "
+                % self.name
+                + "parameter is 'unordered'"
+            )
+
+    def get_partial_digest(self) -> str:
+        """Return the current hash state as a string, which can be passed to
+        :meth:`merge_partial_digest` in another process. Only supported if the
+        batch_order parameter is "unordered".
+        """
+        self._check_unordered()
+        assert len(self.hash_states) > 0
+        return self.hash_states[-1].to_string()
+
+    def merge_partial_digest(self, partial_digest: str) -> None:
+        """Add the data of another worker, as returned by its
+        :meth:`get_partial_digest`, to the current hash state.
+        """
+        from dataworkspaces.utils.fingerprint_utils import MultisetDigest
+
+        self._check_unordered()
+        assert len(self.hash_states) > 0
+        self.hash_states[-1].merge(MultisetDigest.from_string(partial_digest))
+
     def save_current_hash(self, comment: Optional[str] = None) -> None:
         """Save the current hash state to the scratch space. If a
         comment is provided, it is written to a separate file.
         """
         assert len(self.hash_states) > 0
         hashval = self.hash_states[-1].hexdigest()
+        if comment is None and self.hash_is_approximate():
+            comment = SAMPLED_FINGERPRINT_NOTE
         scratch = self.workspace._get_local_scratch_space_for_resource(self.name)
         hashfile = join(scratch, "hashval.txt")
         with open(hashfile, "w") as f:
@@ -131,7 +276,12 @@ class ApiResource(Resource, LocalStateResourceMixin, SnapshotResourceMixin):
 
 class ApiResourceFactory(ResourceFactory):
     def from_command_line(
-        self, role: str, name: str, workspace: Workspace, *args, **kwargs
+        self,
+        role: str,
+        name: str,
+        workspace: Workspace,
+        fingerprint: str = "exact",
+        batch_order: str = "ordered",
     ) -> Resource:
         """Instantiate a resource object from the add command's
         arguments"""
@@ -141,11 +291,18 @@ class ApiResourceFactory(ResourceFactory):
                 % (ResourceRoles.SOURCE_DATA_SET, ResourceRoles.INTERMEDIATE_DATA)
             )
         workspace._get_local_scratch_space_for_resource(name, create_if_not_present=True)
-        return ApiResource(name, role, workspace)
+        return ApiResource(name, role, workspace, fingerprint, batch_order)
 
     def from_json(self, params: JSONDict, local_params: JSONDict, workspace: Workspace) -> Resource:
         """Instantiate a resource object from saved params and local params"""
-        return ApiResource(params["name"], params["role"], workspace)
+        return ApiResource(
+            params["name"],
+            params["role"],
+            workspace,
+            params.get("fingerprint", "exact"),
+            params.get("batch_order", "ordered"),
+            params.get("cache_fingerprints", True),
+        )
 
     def has_local_state(self) -> bool:
         """Return true if this resource has local state and needs
@@ -164,7 +321,14 @@ class ApiResourceFactory(ResourceFactory):
         (e.g. a local path). In batch mode, should either come up with a reasonable
         default or error out if not enough information is available."""
         workspace._get_local_scratch_space_for_resource(params["name"], create_if_not_present=True)
-        return ApiResource(params["name"], params["role"], workspace)
+        return ApiResource(
+            params["name"],
+            params["role"],
+            workspace,
+            params.get("fingerprint", "exact"),
+            params.get("batch_order", "ordered"),
+            params.get("cache_fingerprints", True),
+        )
 
     def suggest_name(self, workspace: Workspace, role: str, *args) -> str:
         """Given the arguments passed in to create a resource,
@@ -184,7 +184,7 @@ class LocalFileResource(
             raise ConfigurationError("Source file %s does not exist." % local_path)
         if not os.path.isdir(parent_dir):
             os.makedirs(parent_dir)
-        shutil.copyfile(local_path, rel_dest_path)
+        shutil.copyfile(local_path, abs_dest_path)
 
     def does_subpath_exist(
         self, subpath: str, must_be_file: bool = False, must_be_directory: bool = False
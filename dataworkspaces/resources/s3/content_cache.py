@@ -0,0 +1,189 @@
+"""
+Local, read-through cache for the contents of S3 objects.
+
+Objects are stored under the resource's scratch directory, keyed by the
+object's key plus a tag identifying the exact content: the version id when a
+snapshot is active, or the ETag otherwise. Since a (key, tag) pair always
+refers to the same bytes, cache entries never need to be invalidated, just
+evicted when the cache exceeds its size cap.
+
+Fills are atomic: we download to a temporary file in the same directory and
+then rename it into place, so readers (including readers in other processes)
+never see a partial file. Eviction removes the least recently used entries,
+where a hit updates the modification time of the entry. On POSIX systems,
+removing an entry does not affect readers which already have it open.
+"""
+import os
+from os.path import join, exists
+import hashlib
+from typing import Callable, List, NamedTuple, Optional, Tuple
+
+from dataworkspaces.errors import InternalError
+from dataworkspaces.utils.file_utils import write_file_atomically
+
+# Default cap on the total size of the cache, in megabytes
+DEFAULT_CONTENT_CACHE_SIZE_MB = 1024
+
+TMP_PREFIX = ".tmp-"
+
+
+class ContentCacheStats(NamedTuple):
+    """Named tuple representing the results from a call
+    to :func:`~ContentCache.get_stats`
+    """
+
+    hits: int
+    misses: int
+    evictions: int
+    bytes_downloaded: int
+    current_size: int
+    max_size: int
+
+
+class ContentCache:
+    """Bounded, LRU-evicted cache of object contents in a local directory.
+    A max_size of zero disables the cache.
+    """
+
+    def __init__(self, cache_dir: str, max_size: int):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.bytes_downloaded = 0
+        # Our estimate of the cache size. We compute it on first use and rescan
+        # the directory before evicting, as other processes may share the cache.
+        self.current_size = None  # type: Optional[int]
+
+    def is_enabled(self) -> bool:
+        return self.max_size > 0
+
+    def _entry_path(self, key: str, tag: str) -> str:
+        digest = hashlib.sha1((key + "\0" + tag).encode("utf-8")).hexdigest()
+        return join(join(self.cache_dir, digest[0:2]), digest)
+
+    def _scan(self) -> List[Tuple[float, int, str]]:
+        """Return a list of (mtime, size, path) for each entry in the cache"""
+        entries = []  # type: List[Tuple[float, int, str]]
+        if not exists(self.cache_dir):
+            return entries
+        for subdir in os.listdir(self.cache_dir):
+            subdir_path = join(self.cache_dir, subdir)
+            if subdir.startswith(TMP_PREFIX) or not os.path.isdir(subdir_path):
+                continue  # staging area for a prefetch
+            for fname in os.listdir(subdir_path):
+                if fname.startswith(TMP_PREFIX):
+                    continue  # a fill in progress
+                path = join(subdir_path, fname)
+                try:
+                    st = os.stat(path)
+                except FileNotFoundError:
+                    continue  # evicted by another process
+                entries.append((st.st_mtime, st.st_size, path))
+        return entries
+
+    def _get_current_size(self) -> int:
+        if self.current_size is None:
+            self.current_size = sum(size for (_, size, _) in self._scan())
+        return self.current_size
+
+    def lookup(self, key: str, tag: str) -> Optional[str]:
+        """If the content for (key, tag) is in the cache, mark it as
+        recently used and return the local path. Otherwise, return None.
+        """
+        path = self._entry_path(key, tag)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return path
+
+    def contains(self, key: str, tag: str) -> bool:
+        """Return True if the content for (key, tag) is in the cache. Unlike
+        lookup(), this does not count as a use of the entry.
+        """
+        return exists(self._entry_path(key, tag))
+
+    def fill(self, key: str, tag: str, download_fn: Callable[[str], None]) -> str:
+        """Call download_fn with a temporary local path to obtain the content
+        for (key, tag), move the downloaded file into the cache, and return its
+        path. Evicts older entries if the cache is now over its size cap.
+        """
+        path = self._entry_path(key, tag)
+        current_size = self._get_current_size()  # scan before adding the new entry
+        sizes = []  # type: List[int]
+
+        def download(tmp_path: str) -> None:
+            download_fn(tmp_path)
+            sizes.append(os.stat(tmp_path).st_size)
+
+        write_file_atomically(path, download, TMP_PREFIX)
+        size = sizes[0]
+        self.bytes_downloaded += size
+        self.current_size = current_size + size
+        if self.current_size > self.max_size:
+            self._evict(keep=path)
+        return path
+
+    def get(self, key: str, tag: str, download_fn: Callable[[str], None]) -> str:
+        """Return a local path containing the content for (key, tag), calling
+        download_fn to fill the cache on a miss.
+        """
+        path = self.lookup(key, tag)
+        if path is not None:
+            return path
+        return self.fill(key, tag, download_fn)
+
+    def open(self, key: str, tag: str, mode: str, download_fn: Callable[[str], None]):
+        """Return a file object opened for read in the specified mode.
+        If the entry is evicted between the lookup and the open, we
+        just fill it again.
+        """
+        if mode not in ("r", "rb"):
+            raise InternalError("Content cache only supports read modes, got '%s'" % mode)
+        path = self.get(key, tag, download_fn)
+        try:
+            return open(path, mode)
+        except FileNotFoundError:
+            return open(self.fill(key, tag, download_fn), mode)
+
+    def _evict(self, keep: Optional[str] = None) -> None:
+        """Remove the least recently used entries until we are under the size cap.
+        The entry at keep (the one just filled) is never evicted.
+        """
+        entries = sorted(self._scan())
+        total = sum(size for (_, size, _) in entries)
+        for (_, size, path) in entries:
+            if total <= self.max_size:
+                break
+            if path == keep:
+                continue
+            try:
+                os.remove(path)
+                self.evictions += 1
+            except FileNotFoundError:
+                pass  # already evicted by another process
+            total -= size
+        self.current_size = total
+
+    def clear(self) -> None:
+        """Remove all entries from the cache"""
+        for (_, _, path) in self._scan():
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        self.current_size = 0
+
+    def get_stats(self) -> ContentCacheStats:
+        return ContentCacheStats(
+            self.hits,
+            self.misses,
+            self.evictions,
+            self.bytes_downloaded,
+            self._get_current_size(),
+            self.max_size,
+        )
@@ -0,0 +1,128 @@
+"""
+Cache of directory listings for a live (non-snapshot) S3 bucket.
+
+S3 has no real directories: an existence check is either a HEAD request on
+the key or a LIST on the key as a prefix. Rather than issuing one or two
+requests per path, we LIST the parent "directory" (with a delimiter, so
+only its immediate children are returned) and answer all the questions
+about its children from that listing. A walk over a tree therefore makes
+one LIST per prefix.
+
+Listings expire after a TTL, since other clients may change the bucket.
+Changes made through the resource itself (uploads and deletes) explicitly
+invalidate the affected listings.
+"""
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Tuple
+
+# Default time in seconds before a cached listing is refetched
+DEFAULT_LISTING_CACHE_TTL = 60
+
+# A listing maps the relative path of each child to True if it is a file
+# and False if it is a directory.
+Listing = Dict[str, bool]
+
+
+def parent_of(rel_path: str) -> str:
+    """Return the parent prefix of rel_path, where the root is the empty string"""
+    idx = rel_path.rstrip("/").rfind("/")
+    return rel_path[:idx] if idx != -1 else ""
+
+
+class ListingCache:
+    """Caches the immediate children of each prefix, as returned by
+    list_fn. list_fn takes a prefix ('' for the bucket root) and returns
+    a list of (rel_path, is_file) pairs, or an empty list if there is
+    nothing under the prefix. A ttl of zero disables caching.
+    """
+
+    def __init__(
+        self,
+        list_fn: Callable[[str], List[Tuple[str, bool]]],
+        ttl: float = DEFAULT_LISTING_CACHE_TTL,
+        max_workers: int = 16,
+    ):
+        self.list_fn = list_fn
+        self.ttl = ttl
+        self.max_workers = max_workers
+        self.listings = {}  # type: Dict[str, Tuple[float, Listing]]
+        self.num_lists = 0
+
+    def _fetch(self, prefix: str) -> Listing:
+        self.num_lists += 1
+        return {rel_path: is_file for (rel_path, is_file) in self.list_fn(prefix)}
+
+    def _get_cached(self, prefix: str) -> Optional[Listing]:
+        entry = self.listings.get(prefix)
+        if entry is None:
+            return None
+        (fetch_time, listing) = entry
+        if time.time() - fetch_time >= self.ttl:
+            del self.listings[prefix]
+            return None
+        return listing
+
+    def _store(self, prefix: str, listing: Listing) -> None:
+        if self.ttl > 0:
+            self.listings[prefix] = (time.time(), listing)
+
+    def get_listing(self, prefix: str) -> Listing:
+        """Return the immediate children of prefix, listing it if needed"""
+        listing = self._get_cached(prefix)
+        if listing is None:
+            listing = self._fetch(prefix)
+            self._store(prefix, listing)
+        return listing
+
+    def get_listings(self, prefixes: List[str]) -> Dict[str, Listing]:
+        """Return the listings for several prefixes, fetching any
+        which are not cached in parallel.
+        """
+        result = {}  # type: Dict[str, Listing]
+        missing = []  # type: List[str]
+        for prefix in set(prefixes):
+            listing = self._get_cached(prefix)
+            if listing is None:
+                missing.append(prefix)
+            else:
+                result[prefix] = listing
+        if len(missing) == 1:
+            result[missing[0]] = self.get_listing(missing[0])
+        elif len(missing) > 1:
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                fetched = list(executor.map(self._fetch, missing))
+            for (prefix, listing) in zip(missing, fetched):
+                self._store(prefix, listing)
+                result[prefix] = listing
+        return result
+
+    def lookup(self, rel_path: str) -> Optional[bool]:
+        """Return None if rel_path does not exist, True if it is a file and
+        False if it is a directory. The root always exists as a directory.
+        """
+        if rel_path == "":
+            return False
+        return self.get_listing(parent_of(rel_path)).get(rel_path)
+
+    def lookup_many(self, rel_paths: List[str]) -> List[Optional[bool]]:
+        """Batched version of lookup(): one LIST is made per distinct
+        parent prefix not already in the cache.
+        """
+        listings = self.get_listings([parent_of(p) for p in rel_paths if p != ""])
+        return [False if p == "" else listings[parent_of(p)].get(p) for p in rel_paths]
+
+    def invalidate(self, rel_path: str) -> None:
+        """Called when rel_path has been added or removed. Drops the listing
+        of rel_path itself and of each of its ancestors, since adding or removing
+        the last file under a prefix also creates or removes the directories
+        above it.
+        """
+        self.listings.pop(rel_path, None)
+        prefix = rel_path
+        while prefix != "":
+            prefix = parent_of(prefix)
+            self.listings.pop(prefix, None)
+
+    def clear(self) -> None:
+        self.listings = {}
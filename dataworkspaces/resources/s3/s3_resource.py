@@ -4,7 +4,9 @@ Resource for files living in a local directory
 """
 import os
 from os.path import join, exists
-from typing import Pattern, Tuple, Optional, Set, Union, List
+import shutil
+import tempfile
+from typing import Callable, Pattern, Tuple, Optional, Set, Union, List
 
 from s3fs import S3FileSystem # type: ignore
 
@@ -12,6 +14,7 @@ from s3fs import S3FileSystem # type: ignore
 from dataworkspaces.errors import ConfigurationError, NotSupportedError, InternalError, PathError
 from dataworkspaces.workspace import (
     Workspace,
+    SnapshotWorkspaceMixin,
     Resource,
     ResourceRoles,
     LocalStateResourceMixin,
@@ -22,13 +25,39 @@ from dataworkspaces.workspace import (
     ResourceFactory,
 )
 
-from dataworkspaces.utils.param_utils import StringType
+from dataworkspaces.utils.param_utils import StringType, IntType
 
 from dataworkspaces.resources.s3.snapfs import S3Snapshot
 from dataworkspaces.resources.s3.snapshot import snapshot_multiprocess
+from dataworkspaces.resources.s3.content_cache import (
+    ContentCache,
+    ContentCacheStats,
+    DEFAULT_CONTENT_CACHE_SIZE_MB,
+    TMP_PREFIX,
+)
+from dataworkspaces.resources.s3.transfer import (
+    DownloadItem,
+    UploadItem,
+    TransferStats,
+    download_objects,
+    upload_objects,
+    get_object_info,
+    MIN_UPLOAD_PART_SIZE,
+    DEFAULT_PART_SIZE_MB,
+    DEFAULT_TRANSFER_CONCURRENCY,
+)
+from dataworkspaces.resources.s3.listing_cache import ListingCache, DEFAULT_LISTING_CACHE_TTL
+from dataworkspaces.resources.s3.snapshot_cache import SnapshotCache, DEFAULT_SNAPSHOT_CACHE_SIZE_MB
 
 S3_RESOURCE_TYPE = "s3"
 
+# buffer size used when copying objects from the bucket into the content cache
+COPY_BUFFER_SIZE = 1024*1024
+
+# When no snapshot is active, larger objects are read directly from the bucket
+# rather than downloaded in full to the content cache, unless already cached.
+MAX_CACHED_OPEN_SIZE = 64*1024*1024
+
 
 # For anything specific to results resources, we throw this error
 RESULTS_ROLE_NOT_SUPPORTED=NotSupportedError(f"{ResourceRoles.RESULTS} not currently supported for S3 resources")
@@ -47,6 +76,11 @@ class S3Resource(
         workspace: Workspace,
         bucket_name: str,
         #region: str,
+        content_cache_size_mb: int = DEFAULT_CONTENT_CACHE_SIZE_MB,
+        transfer_concurrency: int = DEFAULT_TRANSFER_CONCURRENCY,
+        transfer_part_size_mb: int = DEFAULT_PART_SIZE_MB,
+        listing_cache_ttl: int = DEFAULT_LISTING_CACHE_TTL,
+        snapshot_cache_size_mb: int = DEFAULT_SNAPSHOT_CACHE_SIZE_MB,
     ):
         if role==ResourceRoles.RESULTS:
             raise RESULTS_ROLE_NOT_SUPPORTED
@@ -62,6 +96,63 @@ class S3Resource(
         self.bucket_name = self.param_defs.get(
             "bucket_name", bucket_name
         )  # type: str
+        self.param_defs.define(
+            "content_cache_size_mb",
+            default_value=DEFAULT_CONTENT_CACHE_SIZE_MB,
+            optional=False,
+            is_global=False,
+            help="Maximum size in megabytes of the local cache of file contents read from "
+            + "the bucket. Set to 0 to disable the cache.",
+            ptype=IntType(),
+        )
+        self.content_cache_size_mb = self.param_defs.get(
+            "content_cache_size_mb", content_cache_size_mb
+        )  # type: int
+        self.param_defs.define(
+            "transfer_concurrency",
+            default_value=DEFAULT_TRANSFER_CONCURRENCY,
+            optional=False,
+            is_global=False,
+            help="Maximum number of concurrent requests used for bulk transfers to or from the bucket.",
+            ptype=IntType(),
+        )
+        self.transfer_concurrency = self.param_defs.get(
+            "transfer_concurrency", transfer_concurrency
+        )  # type: int
+        self.param_defs.define(
+            "transfer_part_size_mb",
+            default_value=DEFAULT_PART_SIZE_MB,
+            optional=False,
+            is_global=False,
+            help="Size in megabytes of the parts used for multipart bulk transfers.",
+            ptype=IntType(),
+        )
+        self.transfer_part_size_mb = self.param_defs.get(
+            "transfer_part_size_mb", transfer_part_size_mb
+        )  # type: int
+        self.param_defs.define(
+            "listing_cache_ttl",
+            default_value=DEFAULT_LISTING_CACHE_TTL,
+            optional=False,
+            is_global=False,
+            help="Number of seconds that directory listings of the bucket are cached when no "
+            + "snapshot is active. Set to 0 to disable the cache.",
+            ptype=IntType(),
+        )
+        self.listing_cache_ttl = self.param_defs.get(
+            "listing_cache_ttl", listing_cache_ttl
+        )  # type: int
+        self.param_defs.define(
+            "snapshot_cache_size_mb",
+            default_value=DEFAULT_SNAPSHOT_CACHE_SIZE_MB,
+            optional=False,
+            is_global=False,
+            help="Maximum size in megabytes of the local cache of snapshot indexes.",
+            ptype=IntType(),
+        )
+        self.snapshot_cache_size_mb = self.param_defs.get(
+            "snapshot_cache_size_mb", snapshot_cache_size_mb
+        )  # type: int
 
         # local scratch space for resource is where we store the current snapshot and
         # the cache.
@@ -71,11 +162,17 @@ class S3Resource(
         self.current_snapshot_file = join(self.local_scratch_dir, 'current_snapshot.txt')
         self.current_snapshot = None # type: Optional[str]
         self.snapshot_fs = None # type: Optional[S3Snapshot]
-        # we cache snapshot files in a subdirectory of the scratch dir
+        # we cache snapshot indexes in a subdirectory of the scratch dir
         self.snapshot_cache_dir = join(self.local_scratch_dir, "snapshot_cache")
-        # Make sure it exists.
-        if not exists(self.snapshot_cache_dir):
-            os.makedirs(self.snapshot_cache_dir)
+        self.snapshot_cache = SnapshotCache(self.snapshot_cache_dir,
+                                            self.snapshot_cache_size_mb*1024*1024,
+                                            self._download_snapshot)
+        # file contents read through open() are cached in another subdirectory
+        self.content_cache = ContentCache(join(self.local_scratch_dir, "content_cache"),
+                                          self.content_cache_size_mb*1024*1024)
+        # listings of the live bucket, used for ls() and existence checks
+        self.listing_cache = ListingCache(self._list_prefix, self.listing_cache_ttl,
+                                          self.transfer_concurrency)
 
         if exists(self.current_snapshot_file):
             with open(self.current_snapshot_file, 'r') as f:
@@ -86,16 +183,30 @@ class S3Resource(
             self.fs = S3FileSystem()
 
 
+    def _download_snapshot(self, snapshot_hash:str, snapshot_local_path:str) -> None:
+        snapshot_s3_path = join(join(self.bucket_name, '.snapshots'),
+                                snapshot_hash+'.json.gz')
+        if not self.fs.exists(snapshot_s3_path):
+            raise InternalError(f"File s3://{snapshot_s3_path} not found for snapshot {snapshot_hash}")
+        self.fs.get(snapshot_s3_path, snapshot_local_path)
+
     def _load_snapshot(self, snapshot_hash:str) -> S3Snapshot:
-        snapshot_file = snapshot_hash+'.json.gz'
-        snapshot_local_path = join(self.snapshot_cache_dir, snapshot_file)
-        if not exists(snapshot_local_path):
-            snapshot_s3_path = join(join(self.bucket_name, '.snapshots'),
-                                    snapshot_file)
-            if not self.fs.exists(snapshot_s3_path):
-                raise InternalError(f"File s3://{snapshot_s3_path} not found for snapshot {snapshot_hash}")
-            self.fs.get(snapshot_s3_path, snapshot_local_path)
-        return S3Snapshot.read_snapshot_from_file(snapshot_local_path)
+        return self.snapshot_cache.get(snapshot_hash)
+
+    def prefetch_snapshots(self, max_count:int=10) -> int:
+        """Download and index the snapshots of this resource referenced by the
+        max_count most recent workspace snapshots, so that restoring them
+        does not need to go to the bucket. Returns the number of snapshots
+        downloaded.
+        """
+        if not isinstance(self.workspace, SnapshotWorkspaceMixin):
+            return 0
+        hashes = [] # type: List[str]
+        for md in self.workspace.list_snapshots(reverse=True, max_count=max_count):
+            restore_hash = md.restore_hashes.get(self.name)
+            if restore_hash is not None:
+                hashes.append(restore_hash)
+        return self.snapshot_cache.prefetch(hashes)
 
     def __repr__(self):
         return f"S3Resource(name={self.name}, role={self.role}, bucket_name={self.bucket_name},\n"+\
@@ -133,7 +244,59 @@ class S3Resource(
         self._verify_no_snapshot()
         if not exists(local_path):
             raise PathError("Source file %s does not exist." % local_path)
-        self.fs.put(local_path, join(self.bucket_name, rel_dest_path))
+        upload_objects(self.fs, [UploadItem(local_path, join(self.bucket_name, rel_dest_path))],
+                       self._get_upload_part_size(), self.transfer_concurrency,
+                       skip_unchanged=False)
+        self.listing_cache.invalidate(rel_dest_path)
+
+    def _get_upload_part_size(self) -> int:
+        return max(self.transfer_part_size_mb*1024*1024, MIN_UPLOAD_PART_SIZE)
+
+    def upload_tree(self, local_dir: str, rel_dest: str,
+                    progress: Optional[Callable[[int, int], None]] = None) -> None:
+        """Upload the files under local_dir to rel_dest in the bucket, using
+        concurrent multipart uploads. Files whose content matches the ETag
+        of the existing object are skipped. If provided, progress is called with
+        the number of bytes uploaded so far and the total number of bytes to upload.
+        """
+        self._verify_no_snapshot()
+        if not os.path.isdir(local_dir):
+            raise PathError("Source directory %s does not exist." % local_dir)
+        rel_paths = [] # type: List[str]
+        for (dirpath, dirnames, filenames) in os.walk(local_dir):
+            for fname in filenames:
+                rel_paths.append(os.path.relpath(join(dirpath, fname), local_dir))
+        items = [
+            UploadItem(join(local_dir, rel_path),
+                       join(self.bucket_name, join(rel_dest, rel_path) if rel_dest!='' else rel_path))
+            for rel_path in rel_paths
+        ]
+        stats = upload_objects(self.fs, items, self._get_upload_part_size(),
+                               self.transfer_concurrency, skip_unchanged=True,
+                               progress=progress)
+        for item in items:
+            self.listing_cache.invalidate(item.path[len(self.bucket_name)+1:])
+        self._report_transfer(f"uploaded {local_dir} to {rel_dest if rel_dest!='' else 'bucket'}:",
+                              stats)
+
+    def _list_prefix(self, prefix:str) -> List[Tuple[str, bool]]:
+        """List the immediate children of prefix in the live bucket, returning
+        (rel_path, is_file) pairs. This is a single LIST request. We bypass the
+        S3FileSystem's own listings cache, as our cache handles expiry.
+        """
+        baselen = len(self.bucket_name)+1
+        try:
+            entries = self.fs.ls(join(self.bucket_name, prefix), detail=True, refresh=True)
+        except FileNotFoundError:
+            return []
+        result = [] # type: List[Tuple[str, bool]]
+        for entry in entries:
+            rel_path = entry['name'][baselen:].rstrip('/')
+            # exclude the snapshots and, if prefix is a file, the file itself
+            if rel_path.startswith('.snapshots') or rel_path==prefix:
+                continue
+            result.append((rel_path, entry['type']!='directory'))
+        return result
 
     def does_subpath_exist(
         self, subpath: str, must_be_file: bool = False, must_be_directory: bool = False
@@ -151,27 +314,89 @@ class S3Resource(
             else:
                 return True
         else:
-            path = join(self.bucket_name, subpath)
-            if not self.fs.exists(path):
-                return False
-            elif must_be_file:
-                return self.fs.isfile(path)
-            elif must_be_directory:
-                return not self.fs.isfile(path)
-            else:
-                return True
+            return self._check_kind(self.listing_cache.lookup(subpath.rstrip('/')),
+                                    must_be_file, must_be_directory)
+
+    def does_subpaths_exist(
+        self, subpaths: List[str], must_be_file: bool = False, must_be_directory: bool = False
+    ) -> List[bool]:
+        """When no snapshot is active, we make one LIST request per distinct
+        parent directory that is not already cached, in parallel.
+        """
+        if self.current_snapshot:
+            return [self.does_subpath_exist(subpath, must_be_file, must_be_directory)
+                    for subpath in subpaths]
+        kinds = self.listing_cache.lookup_many([subpath.rstrip('/') for subpath in subpaths])
+        return [
+            (not subpath.startswith('.snapshots')) and
+            self._check_kind(kind, must_be_file, must_be_directory)
+            for (subpath, kind) in zip(subpaths, kinds)
+        ]
+
+    @staticmethod
+    def _check_kind(kind:Optional[bool], must_be_file:bool, must_be_directory:bool) -> bool:
+        """kind is the result of a listing cache lookup: None if the path does not exist,
+        True for a file and False for a directory."""
+        if kind is None:
+            return False
+        elif must_be_file:
+            return kind
+        elif must_be_directory:
+            return not kind
+        else:
+            return True
 
     def open(self, rel_path:str, mode:str):
+        """Open a file in the bucket. Reads go through the local content cache
+        (if enabled). When a snapshot is active, cache entries are keyed by the
+        version id from the snapshot. Otherwise, they are keyed by the ETag, and
+        objects larger than MAX_CACHED_OPEN_SIZE are only read from the cache if
+        they are already there.
+        """
         path = join(self.bucket_name, rel_path)
         if self.current_snapshot:
             if mode not in ('r', 'rb'):
                 raise NotSupportedError("Cannot open a snapshot file in write mode")
             assert self.snapshot_fs is not None
             version_id = self.snapshot_fs.version_id(rel_path)
-            return self.fs.open(path, mode, version_id=version_id)
+            if not self.content_cache.is_enabled():
+                return self.fs.open(path, mode, version_id=version_id)
+            # The "null" version id is used for objects written before versioning
+            # was enabled. It can be overwritten if versioning is later suspended,
+            # so we don't trust it as a cache key.
+            tag = 'v:'+version_id if version_id!='null' else self._get_etag_tag(path)
+            return self.content_cache.open(
+                rel_path, tag, mode,
+                lambda local_path: self._download(path, local_path, version_id))
+        elif mode in ('r', 'rb') and self.content_cache.is_enabled():
+            # We refresh, as the s3fs listing cache may have an out of date ETag
+            info = self.fs.info(path, refresh=True)
+            tag = 'etag:'+info['ETag'].strip('"')
+            if info['size']>min(MAX_CACHED_OPEN_SIZE, self.content_cache.max_size) and \
+               not self.content_cache.contains(rel_path, tag):
+                return self.fs.open(path, mode)
+            return self.content_cache.open(
+                rel_path, tag, mode,
+                lambda local_path: self._download(path, local_path, None))
         else:
             return self.fs.open(path, mode)
 
+    def _get_etag_tag(self, path:str) -> str:
+        # We refresh, as the s3fs listing cache may have an out of date ETag
+        return 'etag:'+self.fs.info(path, refresh=True)['ETag'].strip('"')
+
+    def _download(self, path:str, local_path:str, version_id:Optional[str]) -> None:
+        if version_id is not None:
+            src = self.fs.open(path, 'rb', version_id=version_id)
+        else:
+            src = self.fs.open(path, 'rb')
+        with src, open(local_path, 'wb') as dest:
+            shutil.copyfileobj(src, dest, COPY_BUFFER_SIZE)
+
+    def get_content_cache_stats(self) -> ContentCacheStats:
+        """Return the hit/miss statistics for the local content cache"""
+        return self.content_cache.get_stats()
+
     def ls(self, rel_path:str) -> List[str]:
         """For ls, we return a relative path, not including the bucket. This is different
         from S3FileSystem, which includes the bucket name."""
@@ -179,21 +404,107 @@ class S3Resource(
             assert self.snapshot_fs is not None
             return self.snapshot_fs.ls(rel_path)
         else:
-            # We call the S3FileSystem ls in this case. However,
-            # we need to exclude the snapshots. Also, there seems to be a bug where it
-            # includes the directory itself in some cases. We excluded that to prevent
-            # infinite loops when traversing the tree.
-            base = self.bucket_name + '/'
-            baselen = len(base)
+            # We use the cached listing of rel_path, which excludes the snapshots
+            # and the directory itself (S3FileSystem.ls includes it in some cases,
+            # which would cause infinite loops when traversing the tree).
+            rel_path = rel_path.rstrip('/')
+            listing = self.listing_cache.get_listing(rel_path)
+            if len(listing)>0:
+                return list(listing.keys())
+            kind = self.listing_cache.lookup(rel_path)
+            if kind is True:
+                return [rel_path]
+            elif kind is False:
+                return [] # the bucket root
+            else:
+                raise PathError(f"Path {rel_path} does not exist in bucket {self.bucket_name}")
+
+    def _list_files_under(self, rel_prefix:str) -> List[Tuple[str, Optional[str], Optional[int]]]:
+        """Return (key, version_id, size) for each file at or under rel_prefix.
+        If a snapshot is active, the files and versions are as of the snapshot
+        and the size is not known. Otherwise, we get the keys and sizes with
+        a single recursive listing.
+        """
+        if self.current_snapshot:
+            assert self.snapshot_fs is not None
+            return [
+                (key, version_id, None) for (key, version_id) in self.snapshot_fs.items_under(rel_prefix)
+            ]
+        else:
+            baselen = len(self.bucket_name)+1
             return [
-                entry[baselen:] for entry in
-                self.fs.ls(join(self.bucket_name, rel_path))
-                if not entry[baselen:].startswith('.snapshots')
-                and not entry[baselen:]==rel_path]
+                (path[baselen:], None, info['size']) for (path, info) in
+                self.fs.find(join(self.bucket_name, rel_prefix), detail=True).items()
+                if not path[baselen:].startswith('.snapshots/')
+            ]
+
+    def _report_transfer(self, what:str, stats:TransferStats) -> None:
+        if self.workspace.verbose:
+            print(f"[{self.name}] {what} {stats}")
+
+    def prefetch(self, rel_paths: List[str]) -> None:
+        """Download the specified files into the local content cache, using
+        parallel ranged GETs. Files which are already cached are skipped. If the
+        files exceed the size of the cache, the ones fetched first will be evicted.
+        """
+        if not self.content_cache.is_enabled():
+            return
+        if self.current_snapshot:
+            assert self.snapshot_fs is not None
+            versions = [self.snapshot_fs.version_id(rel_path) for rel_path in rel_paths] # type: List[Optional[str]]
+        else:
+            versions = [None for rel_path in rel_paths]
+        paths = [join(self.bucket_name, rel_path) for rel_path in rel_paths]
+        # We need a HEAD request for the ETag, unless we have a real version id
+        need_info = [(path, version_id) for (path, version_id) in zip(paths, versions)
+                     if version_id is None or version_id=='null']
+        infos = iter(get_object_info(self.fs, need_info, self.transfer_concurrency))
+        to_fetch = [] # type: List[Tuple[str, str, DownloadItem]]
+        stage_dir = tempfile.mkdtemp(prefix=TMP_PREFIX, dir=self.content_cache.cache_dir)
+        try:
+            for (i, (rel_path, path, version_id)) in enumerate(zip(rel_paths, paths, versions)):
+                if version_id is None or version_id=='null':
+                    info = next(infos)
+                    (tag, size) = ('etag:'+info['ETag'].strip('"'), info['size']) # type: Tuple[str, Optional[int]]
+                else:
+                    (tag, size) = ('v:'+version_id, None)
+                if self.content_cache.lookup(rel_path, tag) is None:
+                    to_fetch.append((rel_path, tag,
+                                     DownloadItem(path, version_id, join(stage_dir, str(i)), size)))
+            stats = download_objects(self.fs, [item for (_, _, item) in to_fetch],
+                                     self.transfer_part_size_mb*1024*1024,
+                                     self.transfer_concurrency)
+            for (rel_path, tag, item) in to_fetch:
+                self.content_cache.fill(rel_path, tag,
+                                        lambda local_path: os.replace(item.local_path, local_path))
+        finally:
+            shutil.rmtree(stage_dir, ignore_errors=True)
+        self._report_transfer("prefetched", stats)
+
+    def download_tree(self, rel_prefix: str, local_dir: str) -> None:
+        """Download the file or directory tree at rel_prefix to local_dir, using
+        parallel ranged GETs. If a snapshot is active, the versions
+        from the snapshot are downloaded.
+        """
+        files = self._list_files_under(rel_prefix)
+        if len(files)==1 and files[0][0]==rel_prefix:
+            base = os.path.dirname(rel_prefix) # a single file
+        else:
+            base = rel_prefix
+        items = [
+            DownloadItem(join(self.bucket_name, key), version_id,
+                         join(local_dir, key[len(base):].lstrip('/')), size)
+            for (key, version_id, size) in files
+        ]
+        stats = download_objects(self.fs, items, self.transfer_part_size_mb*1024*1024,
+                                 self.transfer_concurrency)
+        self._report_transfer(f"downloaded {rel_prefix if rel_prefix!='' else 'bucket'} to {local_dir}:",
+                              stats)
 
     def delete_file(self, rel_path: str) -> None:
         self._verify_no_snapshot()
         self.fs.rm(join(self.bucket_name, rel_path))
+        self.listing_cache.invalidate(rel_path)
 
     def read_results_file(self, subpath: str) -> JSONDict:
         """Read and parse json results data from the specified path
@@ -203,7 +514,7 @@ class S3Resource(
         raise RESULTS_ROLE_NOT_SUPPORTED
 
     def get_local_params(self) -> JSONDict:
-        return {}
+        return self.param_defs.get_local_params(self)
 
     def pull_precheck(self) -> None:
         """Nothing to do, since we donot support sync.
@@ -241,15 +552,14 @@ class S3Resource(
             with open(self.current_snapshot_file, 'w') as f:
                 f.write(self.current_snapshot)
             self.snapshot_fs = S3Snapshot(versions)
+            self.snapshot_cache.add(self.current_snapshot, self.snapshot_fs)
             self._ensure_fs_version_enabled()
             return (self.current_snapshot, self.current_snapshot)
 
     def restore_precheck(self, hashval):
-        snapshot_file = hashval+'.json.gz'
-        snapshot_local_path = join(self.snapshot_cache_dir, snapshot_file)
-        if not exists(snapshot_local_path):
+        if not self.snapshot_cache.contains(hashval):
             snapshot_s3_path = join(join(self.bucket_name, '.snapshots'),
-                                    snapshot_file)
+                                    hashval+'.json.gz')
             if not self.fs.exists(snapshot_s3_path):
                 raise ConfigurationError(f"File s3://{snapshot_s3_path} not found for snapshot {hashval}")
 
@@ -263,12 +573,9 @@ class S3Resource(
     def delete_snapshot(
         self, workspace_snapshot_hash: str, resource_restore_hash: str, relative_path: str
     ) -> None:
-        snapshot_file = resource_restore_hash+'.json.gz'
-        snapshot_local_path = join(self.snapshot_cache_dir, snapshot_file)
-        if exists(snapshot_local_path):
-            os.remove(snapshot_local_path)
+        self.snapshot_cache.remove(resource_restore_hash)
         snapshot_s3_path = join(join(self.bucket_name, '.snapshots'),
-                                snapshot_file)
+                                resource_restore_hash+'.json.gz')
         if  self.fs.exists(snapshot_s3_path):
             self.fs.rm(snapshot_s3_path)
         if self.current_snapshot==resource_restore_hash:
@@ -280,7 +587,7 @@ class S3Resource(
             assert self.snapshot_fs is not None
             if not self.snapshot_fs.exists(subpath):
                 raise ConfigurationError(f"Subpath {subpath} does not existing in bucket {self.bucket_name} as of snapshot {self.current_snapshot}")
-        elif not self.fs.exists(subpath):
+        elif not self.does_subpath_exist(subpath):
             raise ConfigurationError(f"Subpath {subpath} does not currently exist in bucket {self.bucket_name}")
 
 
@@ -305,7 +612,12 @@ class S3ResourceFactory(ResourceFactory):
             params["name"],
             params["role"],
             workspace,
-            params['bucket_name'])
+            params['bucket_name'],
+            local_params.get('content_cache_size_mb', DEFAULT_CONTENT_CACHE_SIZE_MB),
+            local_params.get('transfer_concurrency', DEFAULT_TRANSFER_CONCURRENCY),
+            local_params.get('transfer_part_size_mb', DEFAULT_PART_SIZE_MB),
+            local_params.get('listing_cache_ttl', DEFAULT_LISTING_CACHE_TTL),
+            local_params.get('snapshot_cache_size_mb', DEFAULT_SNAPSHOT_CACHE_SIZE_MB))
 
     def has_local_state(self) -> bool:
         return False
@@ -6,100 +6,10 @@ import sys
 import argparse
 import json
 import gzip
+from bisect import bisect_left
 
-from dataworkspaces.errors import PathError
-
-
-class Directory:
-    __slots__ = ('path', 'entries', 'subdirs')
-    def __init__(self, path):
-        self.path = path
-        self.entries = []
-        self.subdirs = {}
-
-    def ensure_subdir(self, name):
-        if name in self.subdirs:
-            subdir = self.subdirs[name]
-            assert isinstance(subdir, Directory)
-            return subdir
-        else:
-            subdir_path = name if self.path=="" else self.path + "/" + name
-            subdir = Directory(subdir_path)
-            self.subdirs[name] = subdir
-            self.entries.append(name)
-            return subdir
-
-    def add_file(self, name):
-        self.entries.append(name)
-
-    def ls(self, path):
-        if path=="" and self.path=="":
-            return self.entries
-        parts = path.split("/")
-        parent = self
-        for part in parts[0:-1]:
-            if part not in parent.subdirs:
-                raise PathError(f"Path {path} not present in snapshot")
-            parent = parent.subdirs[part]
-        leaf = parts[-1]
-        def join(p, name):
-            return name if p=="" else p + "/" + name
-        if leaf not in parent.entries:
-            raise PathError(f"Path {path} not present in snapshot")
-        if leaf in parent.subdirs:
-            return [join(join(parent.path, leaf), entry) for entry in parent.subdirs[leaf].entries]
-        else:
-            return [path]
-
-    def exists(self, path): 
-        parts = path.split("/")
-        parent = self
-        for part in parts[0:-1]:
-            if part not in parent.subdirs:
-                return False
-            parent = parent.subdirs[part]
-        leaf = parts[-1]
-        return leaf in parent.entries
-
-    def isfile(self, path):
-        parts = path.split("/")
-        parent = self
-        for part in parts[0:-1]:
-            if part not in parent.subdirs:
-                return False
-            parent = parent.subdirs[part]
-        leaf = parts[-1]
-        return (leaf in parent.entries) and (leaf not in parent.subdirs)
-
-    def __repr__(self):
-        if len(self.entries)>5:
-            separator = ',\n '
-        else:
-            separator = ', '
-        s = separator.join([(entry+'/' if entry in self.subdirs else entry) for entry in self.entries])
-        return '[' + s + ']'
-                
-    def validate(self):
-        assert len(self.entries)>0, "Empty directory!"
-        unique_entries = set(self.entries)
-        assert len(self.entries)==len(unique_entries), f"Not all entries are unique: {self}"
-        count = len(self.entries) - len(self.subdirs)
-        for key in self.subdirs.keys():
-            assert key in self.entries, f"entry {key} in subdirs but not keys: {self}"
-            subdir = self.subdirs[key]
-            count += subdir.validate()
-        return count
-
-        
-def build_file_tree(snapshot):
-    tree = Directory("")
-    for key in snapshot.keys():
-        parts = key.split('/')
-        parent = tree
-        for part in parts[0:-1]:
-            parent = parent.ensure_subdir(part)
-        parent.add_file(parts[-1])
-    return tree
+from dataworkspaces.errors import PathError, InternalError
+from dataworkspaces.utils.file_utils import write_file_atomically
 
 
 def read_snapshot(filename):
@@ -107,29 +17,133 @@ def read_snapshot(filename):
         raw_data = gzip.decompress(f.read()).decode('utf-8')
     return json.loads(raw_data)
 
+
+# Magic line at the start of a snapshot index file, followed by the number
+# of entries, the keys, and then the version ids, each separated by a null
+# character (which cannot appear in an S3 key).
+INDEX_MAGIC = 'dws-s3-snapshot-index-v1'
+
+
 class S3Snapshot:
+    """File-tree like view over the key to version id mapping of a snapshot.
+    We keep the keys as a sorted list, with the version ids in a parallel list.
+    Lookups are binary searches, so there is no tree to build when the snapshot
+    is loaded, and the index can be written to and read from a compact file
+    much faster than parsing the json.
+    """
     def __init__(self, snapshot):
-        self.snapshot = snapshot
-        self.root = build_file_tree(snapshot)
+        self.keys = sorted(snapshot.keys())
+        self.versions = [snapshot[key] for key in self.keys]
+        self._snapshot = snapshot
+
+    @staticmethod
+    def from_sorted_lists(keys, versions):
+        """Create a snapshot from keys (which must be sorted) and their versions"""
+        snapshot = S3Snapshot({})
+        snapshot.keys = keys
+        snapshot.versions = versions
+        snapshot._snapshot = None
+        return snapshot
+
+    @property
+    def snapshot(self):
+        """Mapping from keys to version ids. Built on first use when loaded from an index."""
+        if self._snapshot is None:
+            self._snapshot = dict(zip(self.keys, self.versions))
+        return self._snapshot
+
+    def __len__(self):
+        return len(self.keys)
+
+    def _find(self, path):
+        idx = bisect_left(self.keys, path)
+        return idx if idx<len(self.keys) and self.keys[idx]==path else None
+
+    def _is_dir(self, path):
+        dir_prefix = path + '/'
+        idx = bisect_left(self.keys, dir_prefix)
+        return idx<len(self.keys) and self.keys[idx].startswith(dir_prefix)
 
     def version_id(self, path):
-        if path not in self.snapshot:
+        idx = self._find(path)
+        if idx is None:
             raise PathError(f"Path {path} not present in snapshot")
-        return self.snapshot[path]
+        return self.versions[idx]
         # versioning including modification time
         # return self.snapshot[path][1]
 
+    def items_under(self, prefix):
+        """Return the (key, version_id) pairs for the file at prefix or the files
+        under it. Use the empty string for all files."""
+        if prefix=='':
+            return list(zip(self.keys, self.versions))
+        idx = self._find(prefix)
+        if idx is not None:
+            return [(prefix, self.versions[idx])]
+        start = bisect_left(self.keys, prefix+'/')
+        end = bisect_left(self.keys, prefix+'0') # '0' is the character after '/'
+        return list(zip(self.keys[start:end], self.versions[start:end]))
+
     def ls(self, path):
-        return self.root.ls(path)
+        if path!='':
+            if self._find(path) is not None:
+                return [path]
+            elif not self._is_dir(path):
+                raise PathError(f"Path {path} not present in snapshot")
+            dir_prefix = path + '/'
+        else:
+            dir_prefix = ''
+        # Walk the children in order. When we find a subdirectory, we skip
+        # past all the keys under it with a binary search.
+        entries = []
+        idx = bisect_left(self.keys, dir_prefix)
+        plen = len(dir_prefix)
+        while idx<len(self.keys) and self.keys[idx].startswith(dir_prefix):
+            key = self.keys[idx]
+            slash = key.find('/', plen)
+            if slash==-1:
+                entries.append(key)
+                idx += 1
+            else:
+                entries.append(key[0:slash])
+                idx = bisect_left(self.keys, key[0:slash]+'0', idx)
+        return entries
 
     def isfile(self, path):
-        return self.root.isfile(path)
+        return self._find(path) is not None
 
     def exists(self, path):
-        return self.root.exists(path)
+        if path=='':
+            return False
+        return self._find(path) is not None or self._is_dir(path)
 
     def __repr__(self):
-        return f'S3Snapshot({len(self.snapshot)} entries)'
+        return f'S3Snapshot({len(self.keys)} entries)'
+
+    def write_index(self, filename):
+        """Write the snapshot in the compact index format, atomically"""
+        def fill(tmp_filename):
+            with open(tmp_filename, 'w', encoding='utf-8') as f:
+                f.write(INDEX_MAGIC+'\n'+str(len(self.keys))+'\n')
+                f.write('\0'.join(self.keys))
+                f.write('\0')
+                f.write('\0'.join(self.versions))
+        write_file_atomically(filename, fill)
+
+    @staticmethod
+    def read_index(filename):
+        with open(filename, 'r', encoding='utf-8') as f:
+            data = f.read()
+        (magic, count, body) = data.split('\n', 2)
+        if magic!=INDEX_MAGIC:
+            raise InternalError(f"Snapshot index {filename} has an unexpected format")
+        n = int(count)
+        if n==0:
+            return S3Snapshot({})
+        parts = body.split('\0')
+        if len(parts)!=2*n:
+            raise InternalError(f"Snapshot index {filename} is corrupt")
+        return S3Snapshot.from_sorted_lists(parts[0:n], parts[n:])
 
     @staticmethod
     def read_snapshot_from_file(filename):
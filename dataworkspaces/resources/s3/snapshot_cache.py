@@ -0,0 +1,150 @@
+"""
+Local cache of the snapshots of an S3 bucket.
+
+A snapshot is stored in the bucket as .snapshots/HASH.json.gz, a gzipped
+mapping from keys to version ids. Parsing the json and building a view
+over it is slow for large buckets, so we keep each snapshot we have used
+in a compact index format (see :func:`~S3Snapshot.write_index`), which loads
+with a single read and split. Snapshots loaded in this process are also
+kept in memory, so switching back to one is free.
+
+The cache is bounded: when the index files exceed the size cap, the least
+recently used ones are removed. A removed snapshot is just downloaded
+again when needed.
+"""
+import os
+from os.path import join, exists
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Optional, Tuple
+
+from dataworkspaces.resources.s3.snapfs import S3Snapshot
+
+# Default cap on the total size of the snapshot indexes, in megabytes
+DEFAULT_SNAPSHOT_CACHE_SIZE_MB = 256
+
+# Number of parsed snapshots kept in memory
+MAX_SNAPSHOTS_IN_MEMORY = 4
+
+INDEX_SUFFIX = ".idx"
+DOWNLOAD_SUFFIX = ".json.gz"
+
+
+class SnapshotCache:
+    """Manages the snapshot indexes in cache_dir. download_fn is called
+    with a snapshot hash and a local path, and should download the
+    gzipped json for that snapshot to the path.
+    """
+
+    def __init__(
+        self, cache_dir: str, max_size: int, download_fn: Callable[[str, str], None]
+    ):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.download_fn = download_fn
+        self.in_memory = OrderedDict()  # type: OrderedDict[str, S3Snapshot]
+        if not exists(cache_dir):
+            os.makedirs(cache_dir)
+
+    def _index_path(self, snapshot_hash: str) -> str:
+        return join(self.cache_dir, snapshot_hash + INDEX_SUFFIX)
+
+    def _remember(self, snapshot_hash: str, snapshot: S3Snapshot) -> None:
+        self.in_memory[snapshot_hash] = snapshot
+        self.in_memory.move_to_end(snapshot_hash)
+        while len(self.in_memory) > MAX_SNAPSHOTS_IN_MEMORY:
+            self.in_memory.popitem(last=False)
+
+    def contains(self, snapshot_hash: str) -> bool:
+        return snapshot_hash in self.in_memory or exists(self._index_path(snapshot_hash))
+
+    def add(self, snapshot_hash: str, snapshot: S3Snapshot) -> None:
+        """Add a snapshot which we already have in memory (e.g. one just taken).
+        If the json for the snapshot was written to the cache directory,
+        it is removed, as we only keep the index.
+        """
+        snapshot.write_index(self._index_path(snapshot_hash))
+        json_path = join(self.cache_dir, snapshot_hash + DOWNLOAD_SUFFIX)
+        if exists(json_path):
+            os.remove(json_path)
+        self._remember(snapshot_hash, snapshot)
+        self._evict(keep=snapshot_hash)
+
+    def _fetch(self, snapshot_hash: str) -> S3Snapshot:
+        """Download the snapshot json and convert it to an index"""
+        # An older version of the resource kept the json files in the cache
+        # directory, so we use one if it is present.
+        json_path = join(self.cache_dir, snapshot_hash + DOWNLOAD_SUFFIX)
+        if not exists(json_path):
+            self.download_fn(snapshot_hash, json_path)
+        snapshot = S3Snapshot.read_snapshot_from_file(json_path)
+        snapshot.write_index(self._index_path(snapshot_hash))
+        os.remove(json_path)
+        return snapshot
+
+    def get(self, snapshot_hash: str) -> S3Snapshot:
+        """Return the snapshot, reading it from the index or downloading it as needed"""
+        if snapshot_hash in self.in_memory:
+            self.in_memory.move_to_end(snapshot_hash)
+            return self.in_memory[snapshot_hash]
+        index_path = self._index_path(snapshot_hash)
+        try:
+            snapshot = S3Snapshot.read_index(index_path)
+            os.utime(index_path)
+        except FileNotFoundError:
+            snapshot = self._fetch(snapshot_hash)
+            self._evict(keep=snapshot_hash)
+        self._remember(snapshot_hash, snapshot)
+        return snapshot
+
+    def prefetch(self, snapshot_hashes: List[str], max_workers: int = 4) -> int:
+        """Download and index the specified snapshots, if not already cached.
+        The snapshots are not loaded into memory. Returns the number of
+        snapshots fetched.
+        """
+        missing = [h for h in set(snapshot_hashes) if not self.contains(h)]
+        if len(missing) == 0:
+            return 0
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            list(executor.map(self._fetch, missing))
+        self._evict()
+        return len(missing)
+
+    def remove(self, snapshot_hash: str) -> None:
+        self.in_memory.pop(snapshot_hash, None)
+        for path in (
+            self._index_path(snapshot_hash),
+            join(self.cache_dir, snapshot_hash + DOWNLOAD_SUFFIX),
+        ):
+            if exists(path):
+                os.remove(path)
+
+    def _scan(self) -> List[Tuple[float, int, str]]:
+        """Return (mtime, size, hash) for each index in the cache"""
+        entries = []  # type: List[Tuple[float, int, str]]
+        for fname in os.listdir(self.cache_dir):
+            if not fname.endswith(INDEX_SUFFIX):
+                continue
+            try:
+                st = os.stat(join(self.cache_dir, fname))
+            except FileNotFoundError:
+                continue  # removed by another process
+            entries.append((st.st_mtime, st.st_size, fname[: -len(INDEX_SUFFIX)]))
+        return entries
+
+    def _evict(self, keep: Optional[str] = None) -> None:
+        """Remove the least recently used indexes until we are under the size cap.
+        The snapshot keep is never removed.
+        """
+        entries = sorted(self._scan())
+        total = sum(size for (_, size, _) in entries)
+        for (_, size, snapshot_hash) in entries:
+            if total <= self.max_size:
+                break
+            if snapshot_hash == keep:
+                continue
+            try:
+                os.remove(self._index_path(snapshot_hash))
+            except FileNotFoundError:
+                pass
+            total -= size
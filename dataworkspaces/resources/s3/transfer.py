@@ -0,0 +1,337 @@
+"""
+Parallel, multipart transfers between S3 and the local filesystem.
+
+Downloads are split into ranged GETs of at most part_size bytes, which are
+run concurrently across all the objects being transferred. This lets us
+stage many objects (or a few large ones) locally at close to line rate,
+rather than paying the per-request latency serially for each file.
+
+Uploads are the mirror image: files larger than the part size use the
+S3 multipart upload API, with the parts of all the files uploaded
+concurrently. Before uploading, we compare each file's MD5-based ETag with
+that of the existing object (if any) and skip files that are unchanged.
+
+The functions here take an s3fs.S3FileSystem (or anything with the same
+info(), cat_file() and call_s3() methods) so that they can be used without
+a workspace.
+"""
+import os
+from os.path import dirname, exists
+import time
+import tempfile
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Tuple
+
+DEFAULT_PART_SIZE_MB = 8
+DEFAULT_TRANSFER_CONCURRENCY = 16
+
+# S3 requires all the parts of a multipart upload, except the last, to be at least 5 MB
+MIN_UPLOAD_PART_SIZE = 5 * 1024 * 1024
+
+TMP_PREFIX = ".tmp-"
+
+
+class DownloadItem(NamedTuple):
+    """An object to be downloaded. path includes the bucket name.
+    If the size is not known, it will be obtained via a HEAD request.
+    """
+
+    path: str
+    version_id: Optional[str]
+    local_path: str
+    size: Optional[int] = None
+
+
+class TransferStats(NamedTuple):
+    """Summary of a bulk transfer, as returned by
+    :func:`~download_objects`.
+    """
+
+    num_files: int
+    num_bytes: int
+    elapsed_seconds: float
+    num_skipped: int = 0
+
+    def throughput_mb_per_sec(self) -> float:
+        if self.elapsed_seconds <= 0:
+            return 0.0
+        return self.num_bytes / (1024 * 1024) / self.elapsed_seconds
+
+    def __str__(self):
+        s = "%d files, %.1f MB in %.1f seconds (%.1f MB/s)" % (
+            self.num_files,
+            self.num_bytes / (1024 * 1024),
+            self.elapsed_seconds,
+            self.throughput_mb_per_sec(),
+        )
+        if self.num_skipped > 0:
+            s += ", %d unchanged files skipped" % self.num_skipped
+        return s
+
+
+def get_object_info(
+    fs, paths: List[Tuple[str, Optional[str]]], max_workers: int = DEFAULT_TRANSFER_CONCURRENCY
+) -> List[Dict[str, Any]]:
+    """Given a list of (path, version_id) pairs, return the info dicts
+    for each object (including size and ETag), obtained in parallel.
+    The info for the current version of an object always comes from a
+    new HEAD request, as s3fs answers from its directory listing cache
+    otherwise, which does not see objects overwritten by other writers.
+    """
+
+    def info(path_and_version):
+        (path, version_id) = path_and_version
+        if version_id is not None:
+            return fs.info(path, version_id=version_id)
+        else:
+            return fs.info(path, refresh=True)
+
+    if len(paths) == 0:
+        return []
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(info, paths))
+
+
+def _split_into_parts(size: int, part_size: int) -> List[Tuple[int, int]]:
+    if size == 0:
+        return []
+    return [(start, min(start + part_size, size)) for start in range(0, size, part_size)]
+
+
+def download_objects(
+    fs,
+    items: List[DownloadItem],
+    part_size: int = DEFAULT_PART_SIZE_MB * 1024 * 1024,
+    max_workers: int = DEFAULT_TRANSFER_CONCURRENCY,
+) -> TransferStats:
+    """Download the objects in parallel, using ranged GETs of at most part_size bytes.
+    Each object is written to a temporary file next to its local_path and renamed
+    into place once all its parts have been downloaded, so a partially downloaded
+    file is never visible at local_path.
+    """
+    start_time = time.time()
+    if len(items) == 0:
+        return TransferStats(0, 0, 0.0)
+    # First, get any missing sizes
+    missing = [(item.path, item.version_id) for item in items if item.size is None]
+    infos = iter(get_object_info(fs, missing, max_workers))
+    sizes = [item.size if item.size is not None else next(infos)["size"] for item in items]
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        # Next, allocate the temporary files and download all the parts
+        tmp_paths = []  # type: List[str]
+        parts = []  # type: List[Tuple[DownloadItem, str, int, int]]
+        try:
+            for (item, size) in zip(items, sizes):
+                local_dir = dirname(item.local_path)
+                if local_dir != "" and not exists(local_dir):
+                    os.makedirs(local_dir, exist_ok=True)
+                (fd, tmp_path) = tempfile.mkstemp(prefix=TMP_PREFIX, dir=local_dir or ".")
+                os.ftruncate(fd, size)
+                os.close(fd)
+                tmp_paths.append(tmp_path)
+                for (start, end) in _split_into_parts(size, part_size):
+                    parts.append((item, tmp_path, start, end))
+
+            def download_part(part):
+                (item, tmp_path, start, end) = part
+                if item.version_id is not None:
+                    data = fs.cat_file(item.path, start=start, end=end, version_id=item.version_id)
+                else:
+                    data = fs.cat_file(item.path, start=start, end=end)
+                with open(tmp_path, "r+b") as f:
+                    f.seek(start)
+                    f.write(data)
+
+            # list() forces any exceptions to be raised here
+            list(executor.map(download_part, parts))
+            for (item, tmp_path) in zip(items, tmp_paths):
+                os.replace(tmp_path, item.local_path)
+        except BaseException:
+            for tmp_path in tmp_paths:
+                if exists(tmp_path):
+                    os.remove(tmp_path)
+            raise
+    return TransferStats(len(items), sum(sizes), time.time() - start_time)
+
+
+class UploadItem(NamedTuple):
+    """A local file to be uploaded to path, which includes the bucket name."""
+
+    local_path: str
+    path: str
+
+
+def compute_etag(local_path: str, part_size: int) -> str:
+    """Compute the ETag S3 would assign to the file if uploaded with the given
+    part size: the MD5 of the content for a single part upload, or the MD5 of
+    the concatenated part MD5s, followed by the number of parts, for a
+    multipart upload.
+    """
+    part_digests = []  # type: List[bytes]
+    with open(local_path, "rb") as f:
+        while True:
+            data = f.read(part_size)
+            if len(data) == 0 and len(part_digests) > 0:
+                break
+            part_digests.append(hashlib.md5(data).digest())
+            if len(data) < part_size:
+                break
+    if len(part_digests) == 1:
+        return part_digests[0].hex()
+    else:
+        return "%s-%d" % (hashlib.md5(b"".join(part_digests)).hexdigest(), len(part_digests))
+
+
+def _is_unchanged(local_path: str, size: int, info: Optional[Dict[str, Any]], part_size: int) -> bool:
+    if info is None or info["size"] != size:
+        return False
+    etag = info.get("ETag", "").strip('"')
+    if "-" in etag:
+        # Multipart ETags only match if the object was uploaded with the same
+        # part size. If it wasn't, we upload again.
+        num_parts = int(etag.split("-")[1])
+        if num_parts != len(_split_into_parts(size, part_size)):
+            return False
+        return compute_etag(local_path, part_size) == etag
+    else:
+        return compute_etag(local_path, max(size, 1)) == etag
+
+
+def upload_objects(
+    fs,
+    items: List[UploadItem],
+    part_size: int = DEFAULT_PART_SIZE_MB * 1024 * 1024,
+    max_workers: int = DEFAULT_TRANSFER_CONCURRENCY,
+    skip_unchanged: bool = True,
+    progress: Optional[Callable[[int, int], None]] = None,
+) -> TransferStats:
+    """Upload the local files in parallel. Files larger than part_size use a
+    multipart upload, with the parts of all files uploaded concurrently.
+    If skip_unchanged is True, files whose ETag matches that of the existing
+    object are not uploaded. If provided, progress is called (from the calling
+    thread) with the number of bytes uploaded so far and the total number of bytes
+    to upload, after each part completes. If any upload fails, the incomplete
+    multipart uploads are aborted.
+    """
+    start_time = time.time()
+    sizes = [os.stat(item.local_path).st_size for item in items]
+    num_skipped = 0
+    if skip_unchanged and len(items) > 0:
+
+        def get_info(path):
+            try:
+                return fs.info(path, refresh=True)
+            except FileNotFoundError:
+                return None
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            infos = list(executor.map(get_info, [item.path for item in items]))
+            unchanged = list(
+                executor.map(
+                    lambda args: _is_unchanged(args[0].local_path, args[1], args[2], part_size),
+                    zip(items, sizes, infos),
+                )
+            )
+        to_upload = [(item, size) for (item, size, u) in zip(items, sizes, unchanged) if not u]
+        num_skipped = len(items) - len(to_upload)
+    else:
+        to_upload = list(zip(items, sizes))
+    total_bytes = sum(size for (_, size) in to_upload)
+
+    def split_path(path):
+        (bucket, key) = path.split("/", 1)
+        return (bucket, key)
+
+    def read_part(local_path, start, end):
+        with open(local_path, "rb") as f:
+            f.seek(start)
+            return f.read(end - start)
+
+    def put_object(item, size):
+        (bucket, key) = split_path(item.path)
+        fs.call_s3("put_object", Bucket=bucket, Key=key, Body=read_part(item.local_path, 0, size))
+        return size
+
+    def upload_part(item, upload_id, part_number, start, end):
+        (bucket, key) = split_path(item.path)
+        resp = fs.call_s3(
+            "upload_part",
+            Bucket=bucket,
+            Key=key,
+            UploadId=upload_id,
+            PartNumber=part_number,
+            Body=read_part(item.local_path, start, end),
+        )
+        return (part_number, resp["ETag"], end - start)
+
+    lock = threading.Lock()
+    upload_ids = {}  # type: Dict[str, str]
+    part_etags = {}  # type: Dict[str, List[Tuple[int, str]]]
+    multipart = [(item, size) for (item, size) in to_upload if size > part_size]
+    futures = {}  # type: Dict[Any, UploadItem]
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        try:
+
+            def create_upload(item):
+                (bucket, key) = split_path(item.path)
+                resp = fs.call_s3("create_multipart_upload", Bucket=bucket, Key=key)
+                with lock:
+                    upload_ids[item.path] = resp["UploadId"]
+                    part_etags[item.path] = []
+
+            list(executor.map(create_upload, [item for (item, _) in multipart]))
+            for (item, size) in to_upload:
+                if size > part_size:
+                    for (i, (start, end)) in enumerate(_split_into_parts(size, part_size)):
+                        f = executor.submit(
+                            upload_part, item, upload_ids[item.path], i + 1, start, end
+                        )
+                        futures[f] = item
+                else:
+                    futures[executor.submit(put_object, item, size)] = item
+            bytes_done = 0
+            for f in as_completed(futures):
+                result = f.result()
+                if isinstance(result, tuple):
+                    (part_number, etag, num_bytes) = result
+                    part_etags[futures[f].path].append((part_number, etag))
+                else:
+                    num_bytes = result
+                bytes_done += num_bytes
+                if progress is not None:
+                    progress(bytes_done, total_bytes)
+
+            def complete_upload(item):
+                (bucket, key) = split_path(item.path)
+                parts = sorted(part_etags[item.path])
+                fs.call_s3(
+                    "complete_multipart_upload",
+                    Bucket=bucket,
+                    Key=key,
+                    UploadId=upload_ids[item.path],
+                    MultipartUpload={
+                        "Parts": [{"PartNumber": n, "ETag": etag} for (n, etag) in parts]
+                    },
+                )
+                with lock:
+                    del upload_ids[item.path]
+
+            list(executor.map(complete_upload, [item for (item, _) in multipart]))
+        except BaseException:
+            for f in futures:
+                f.cancel()
+            for (path, upload_id) in list(upload_ids.items()):
+                (bucket, key) = split_path(path)
+                try:
+                    fs.call_s3(
+                        "abort_multipart_upload", Bucket=bucket, Key=key, UploadId=upload_id
+                    )
+                except Exception:
+                    pass  # the upload will be cleaned up by the bucket's lifecycle rules, if any
+            raise
+    if len(to_upload) > 0 and hasattr(fs, "invalidate_cache"):
+        fs.invalidate_cache()
+    return TransferStats(len(to_upload), total_bytes, time.time() - start_time, num_skipped)
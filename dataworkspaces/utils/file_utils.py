@@ -6,8 +6,9 @@ File-related utilities
 import os
 from os.path import dirname, isdir, abspath, expanduser, exists, isabs, commonpath, isfile, join
 import shutil
+import tempfile
 import click
-from typing import Optional
+from typing import Callable, Optional
 
 from dataworkspaces.errors import ConfigurationError
 
@@ -44,6 +45,28 @@ def safe_rename(src: str, dest: str) -> None:
             raise ConfigurationError("Unable to copy %s to %s: %s" % (src, dest, e)) from e
 
 
+def write_file_atomically(
+    path: str, fill_fn: Callable[[str], None], tmp_prefix: str = ".tmp-"
+) -> None:
+    """Call fill_fn with the path of a temporary file in the same directory
+    as path and then rename the temporary file to path, so that readers (including
+    readers in other processes) never see a partial file. The parent directory
+    is created if needed. If fill_fn or the rename fails, the temporary file is
+    removed and the exception is re-raised.
+    """
+    parent = dirname(path)
+    os.makedirs(parent, exist_ok=True)
+    (fd, tmp_path) = tempfile.mkstemp(dir=parent, prefix=tmp_prefix)
+    os.close(fd)
+    try:
+        fill_fn(tmp_path)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
 def get_subpath_from_absolute(absolute_parent_path: str, absolute_child_path: str) -> Optional[str]:
     """Given two absolute paths where one is the parent of the other, return the
     child path as a relative path from the parent. Returns None if the paths are
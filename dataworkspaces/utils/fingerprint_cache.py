@@ -0,0 +1,181 @@
+"""
+Cache of the fingerprints of in-memory data sets, so that data which is passed
+to several models (e.g. in a hyperparameter sweep) is only hashed once.
+
+Arrays are looked up by their identity. Since an array may be modified in
+place, each entry also records an invariant: the array's dtype, shape, strides,
+and buffer address, plus a small sampled fingerprint of its contents. An entry
+is only used if the invariant still matches. A modification which falls
+entirely outside of the sampled blocks is not detected, so the cache can be
+disabled for data which is changed in place.
+
+Arrays loaded from a file (e.g. by
+:func:`~dataworkspaces.kits.scikit_learn.load_dataset_from_resource`) can be
+registered via :func:`register_file_origin`. Their fingerprints are also
+stored in a directory (usually the resource's scratch directory), keyed by the
+file's path, size and modification time, so that other processes which load
+the same file do not need to hash it again. Each entry is a small file which is
+written atomically, so several processes can share the directory.
+
+Only NumPy arrays (without object dtypes) are cached. Other data is hashed
+each time.
+"""
+import os
+from os.path import join, exists, realpath
+import hashlib
+import weakref
+from typing import Any, Dict, NamedTuple, Optional
+
+from dataworkspaces.utils.file_utils import write_file_atomically
+from dataworkspaces.utils.fingerprint_utils import (
+    add_to_fingerprint,
+    add_sampled_fingerprint,
+    numpy,
+)
+
+# Size of the sampled fingerprint used to check that an array has not changed
+INVARIANT_BLOCKS = 8
+INVARIANT_BLOCK_BYTES = 4096
+
+TMP_PREFIX = ".tmp-"
+
+
+class _FileOrigin(NamedTuple):
+    invariant: str
+    file_key: str
+
+
+class _CacheEntry(NamedTuple):
+    ref: Any  # a weak reference to the array
+    invariant: str
+    digests: Dict[str, str]  # fingerprint mode => digest
+
+
+# The files that arrays were loaded from, keyed by the id of the array.
+# Entries are removed when their array is freed.
+_file_origins = {}  # type: Dict[int, _FileOrigin]
+
+
+def _is_cacheable(data) -> bool:
+    return (
+        numpy is not None and isinstance(data, numpy.ndarray) and not data.dtype.hasobject
+    )
+
+
+def _get_invariant(array) -> str:
+    hash_state = hashlib.sha1()
+    add_sampled_fingerprint(array, hash_state, INVARIANT_BLOCKS, INVARIANT_BLOCK_BYTES)
+    return "%s;%s;%s;%s" % (
+        array.__array_interface__["data"][0],
+        array.strides,
+        array.flags.c_contiguous,
+        hash_state.hexdigest(),
+    )
+
+
+def compute_digest(data, mode: str = "exact") -> str:
+    """Return the SHA-256 hex digest of the data's fingerprint, where mode is
+    "exact" or "sampled".
+    """
+    hash_state = hashlib.sha256()
+    if mode == "sampled":
+        add_sampled_fingerprint(data, hash_state)
+    else:
+        add_to_fingerprint(data, hash_state)
+    return hash_state.hexdigest()
+
+
+def register_file_origin(data, path: str, loader: str) -> None:
+    """Record that the array was loaded from the file at path. The loader
+    identifies how the file was parsed (e.g. "numpy.loadtxt"), as the same
+    file might be loaded into different arrays.
+    """
+    if not _is_cacheable(data):
+        return
+    stat = os.stat(path)
+    file_key = "%s|%s|%d|%d" % (loader, realpath(path), stat.st_size, stat.st_mtime_ns)
+    key = id(data)
+    if key not in _file_origins:
+        weakref.finalize(data, _file_origins.pop, key, None)
+    _file_origins[key] = _FileOrigin(_get_invariant(data), file_key)
+
+
+class FingerprintCache:
+    """Cache of the fingerprint digests of arrays. If cache_dir is not None,
+    the digests of arrays registered via :func:`register_file_origin`
+    are also stored there.
+    """
+
+    def __init__(self, cache_dir: Optional[str] = None):
+        self.cache_dir = cache_dir
+        self.entries = {}  # type: Dict[int, _CacheEntry]
+        self.hits = 0
+        self.misses = 0
+
+    def _get_entry_path(self, file_key: str, mode: str) -> str:
+        assert self.cache_dir is not None
+        return join(
+            self.cache_dir, hashlib.sha1((mode + "|" + file_key).encode("utf-8")).hexdigest()
+        )
+
+    def _read_persistent(self, file_key: str, mode: str) -> Optional[str]:
+        path = self._get_entry_path(file_key, mode)
+        if not exists(path):
+            return None
+        with open(path, "r") as f:
+            digest = f.read().strip()
+        return digest if len(digest) == 64 else None  # ignore truncated entries
+
+    def _write_persistent(self, file_key: str, mode: str, digest: str) -> None:
+        assert self.cache_dir is not None
+
+        def write_digest(tmp_path: str) -> None:
+            with open(tmp_path, "w") as f:
+                f.write(digest)
+
+        write_file_atomically(self._get_entry_path(file_key, mode), write_digest, TMP_PREFIX)
+
+    def _add_entry(self, data, invariant: str, mode: str, digest: str) -> None:
+        key = id(data)
+        entry = self.entries.get(key)
+        if entry is not None and entry.ref() is data and entry.invariant == invariant:
+            entry.digests[mode] = digest
+            return
+        if entry is None:
+            # the finalizer holds a reference to the cache, which is fine, as
+            # the cache lives as long as its resource
+            weakref.finalize(data, self.entries.pop, key, None)
+        self.entries[key] = _CacheEntry(weakref.ref(data), invariant, {mode: digest})
+
+    def get_digest(self, data, mode: str = "exact") -> str:
+        """Return the digest of the data's fingerprint (see :func:`compute_digest`),
+        from the cache if possible.
+        """
+        if not _is_cacheable(data):
+            return compute_digest(data, mode)
+        invariant = _get_invariant(data)
+        entry = self.entries.get(id(data))
+        if (
+            entry is not None
+            and entry.ref() is data
+            and entry.invariant == invariant
+            and mode in entry.digests
+        ):
+            self.hits += 1
+            return entry.digests[mode]
+        origin = _file_origins.get(id(data))
+        file_key = (
+            origin.file_key
+            if origin is not None and origin.invariant == invariant and self.cache_dir is not None
+            else None
+        )
+        digest = self._read_persistent(file_key, mode) if file_key is not None else None
+        if digest is not None:
+            self.hits += 1
+        else:
+            self.misses += 1
+            digest = compute_digest(data, mode)
+            if file_key is not None:
+                self._write_persistent(file_key, mode, digest)
+        self._add_entry(data, invariant, mode, digest)
+        return digest
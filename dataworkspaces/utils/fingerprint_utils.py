@@ -0,0 +1,496 @@
+"""
+Utilities for computing a fingerprint (a hash) of in-memory data sets, such
+as NumPy arrays, Pandas data frames, Arrow tables, and TensorFlow tensors.
+The kits use these fingerprints to record the version of the data that was
+passed to a model, when the data comes from an API resource.
+
+Each array is hashed along with its type, dtype, and shape, so arrays whose
+raw bytes happen to be equal (e.g. an int32 and a float32 array of zeros) have
+different fingerprints. The contents of contiguous arrays are passed to the
+hash function through a memoryview, without copying. Non-contiguous arrays
+(e.g. strided views) are copied a chunk at a time, so the memory used stays
+bounded.
+
+For large data sets, :func:`add_sampled_fingerprint` computes an approximate
+fingerprint from a fixed number of blocks of rows, spread evenly through the
+data, along with the exact shape and types of the data. This bounds the
+amount of data read, at the cost of missing changes to rows outside the
+sampled blocks.
+
+Data which arrives a batch at a time (e.g. from a generator during training)
+can be fingerprinted on background threads via :class:`BackgroundFingerprinter`,
+so that the hashing overlaps with the training.
+
+A :class:`MultisetDigest` combines the hashes of batches (or records) so that the
+result does not depend on their order, and partial digests (e.g. from each worker
+of a data-parallel training job) can be merged into one.
+
+NumPy is required to fingerprint arrays. Pandas, PyArrow, and TensorFlow
+are used if they are installed.
+"""
+import hashlib
+import queue
+import threading
+from typing import Any, Optional, Tuple, List
+
+from dataworkspaces.errors import ConfigurationError
+
+try:
+    import numpy  # type: ignore
+except ImportError:
+    numpy = None  # type: ignore
+
+try:
+    import pandas  # type: ignore
+except ImportError:
+    pandas = None  # type: ignore
+
+try:
+    import pyarrow  # type: ignore
+except ImportError:
+    pyarrow = None  # type: ignore
+
+try:
+    import tensorflow  # type: ignore
+except ImportError:
+    tensorflow = None  # type: ignore
+
+
+# Maximum size of the copies made when hashing non-contiguous arrays
+CHUNK_BYTES = 16 * 1024 * 1024
+
+# Sampled fingerprints hash this many blocks of rows, each of (roughly) this
+# size. Data sets which are no larger than the total are hashed exactly.
+SAMPLE_BLOCKS = 32
+SAMPLE_BLOCK_BYTES = 1024 * 1024
+
+# Defaults for BackgroundFingerprinter. The hash functions release the GIL
+# when hashing large buffers, so several threads can hash at once.
+BACKGROUND_THREADS = 2
+BACKGROUND_QUEUE_SIZE = 8
+
+# A MultisetDigest is the sum of the hashes of its elements, modulo this prime
+# (the largest prime less than 2**256).
+MULTISET_MODULUS = 2 ** 256 - 189
+
+
+def _add_header(hash_state, kind: str, *fields: Any) -> None:
+    """Each value is preceded by a header giving its kind and any metadata
+    (dtype, shape, length) needed to distinguish it from other values with
+    the same bytes.
+    """
+    hash_state.update(
+        ("%s(%s);" % (kind, ",".join(str(field) for field in fields))).encode("utf-8")
+    )
+
+
+def _dtype_to_str(dtype) -> str:
+    # dtype.str does not include the field names and types of structured dtypes
+    return str(dtype.descr) if dtype.fields is not None else dtype.str
+
+
+def _add_contiguous_buffer(array, hash_state) -> None:
+    """Add the bytes of a C-contiguous array. Viewing the array as bytes avoids
+    copying, and works for dtypes which the buffer protocol does not support
+    (e.g. datetime64).
+    """
+    if array.size > 0:
+        hash_state.update(memoryview(array.reshape(-1).view(numpy.uint8)))
+
+
+def _add_object_array(array, hash_state) -> None:
+    """Object arrays contain pointers, so we hash the values instead. If Pandas
+    is available, we use its vectorized hash of each value, which is much faster
+    than hashing the values one at a time.
+    """
+    values = array.reshape(-1)
+    if pandas is not None:
+        _add_contiguous_buffer(pandas.util.hash_array(values, categorize=False), hash_state)
+    else:
+        for value in values:
+            add_to_fingerprint(value, hash_state)
+
+
+def _add_ndarray(array, hash_state) -> None:
+    _add_header(hash_state, "ndarray", _dtype_to_str(array.dtype), array.shape)
+    if array.dtype.hasobject:
+        _add_object_array(array, hash_state)
+    elif array.flags.c_contiguous:
+        _add_contiguous_buffer(array, hash_state)
+    else:
+        # Copy the array a block of rows at a time. The concatenation of the
+        # blocks is the same as the bytes of the array in C order, so the
+        # fingerprint does not depend on the memory layout.
+        row_bytes = array[0:1].nbytes
+        rows_per_chunk = max(1, CHUNK_BYTES // row_bytes) if row_bytes > 0 else 1
+        for start in range(0, array.shape[0], rows_per_chunk):
+            _add_contiguous_buffer(
+                numpy.ascontiguousarray(array[start : start + rows_per_chunk]), hash_state
+            )
+
+
+def _add_pandas_series(series, hash_state) -> None:
+    _add_header(hash_state, "series", series.name, series.dtype, len(series))
+    if isinstance(series.dtype, numpy.dtype) and not series.dtype.hasobject:
+        # the series is backed by a numpy array (e.g. a row of a numeric block),
+        # which we can hash without a copy
+        _add_ndarray(series.to_numpy(copy=False), hash_state)
+    else:
+        # extension types (categoricals, nullable integers, strings, etc.) and
+        # object columns are hashed by value
+        _add_contiguous_buffer(
+            pandas.util.hash_pandas_object(series, index=False).to_numpy(), hash_state
+        )
+
+
+def _add_pandas_dataframe(df, hash_state) -> None:
+    _add_header(hash_state, "dataframe", list(df.columns), df.shape)
+    for i in range(df.shape[1]):
+        # iloc avoids problems with duplicate column names
+        _add_pandas_series(df.iloc[:, i], hash_state)
+
+
+def _add_arrow_array(array, hash_state) -> None:
+    _add_header(hash_state, "arrow", array.type, len(array))
+    if (
+        array.null_count == 0
+        and pyarrow.types.is_primitive(array.type)
+        and not pyarrow.types.is_boolean(array.type)
+    ):
+        # fixed width values without nulls can be viewed as a numpy array without copying
+        _add_ndarray(array.to_numpy(zero_copy_only=True), hash_state)
+    else:
+        _add_ndarray(array.to_numpy(zero_copy_only=False), hash_state)
+
+
+def add_to_fingerprint(data, hash_state) -> None:
+    """Add the data to the hash state (e.g. a ``hashlib.sha1()`` object).
+    The data may be a NumPy array or scalar, a Pandas DataFrame or Series,
+    a PyArrow Array, ChunkedArray, Table or RecordBatch, an eager TensorFlow
+    tensor or dataset, a Python scalar, or a list, tuple, or dict of these.
+    """
+    if numpy is not None and isinstance(data, numpy.ndarray):
+        _add_ndarray(data, hash_state)
+    elif numpy is not None and isinstance(data, numpy.generic):
+        _add_ndarray(numpy.asarray(data), hash_state)
+    elif pandas is not None and isinstance(data, pandas.DataFrame):
+        _add_pandas_dataframe(data, hash_state)
+    elif pandas is not None and isinstance(data, pandas.Series):
+        _add_pandas_series(data, hash_state)
+    elif pyarrow is not None and isinstance(data, pyarrow.Array):
+        _add_arrow_array(data, hash_state)
+    elif pyarrow is not None and isinstance(data, pyarrow.ChunkedArray):
+        _add_header(hash_state, "arrow_chunked", data.type, len(data))
+        for chunk in data.chunks:
+            _add_arrow_array(chunk, hash_state)
+    elif pyarrow is not None and isinstance(data, (pyarrow.Table, pyarrow.RecordBatch)):
+        _add_header(hash_state, "arrow_table", data.schema.names, data.num_rows)
+        for column in data.columns:
+            add_to_fingerprint(column, hash_state)
+    elif isinstance(data, (tuple, list)):
+        # Tensorflow frequently puts the parts of a dataset in a tuple.
+        # For example: (features, labels)
+        _add_header(hash_state, "sequence", len(data))
+        for element in data:
+            add_to_fingerprint(element, hash_state)
+    elif isinstance(data, dict):
+        # Tensorflow uses a dict (specifically OrderedDict) to store
+        # the columns of a CSV.
+        _add_header(hash_state, "dict", list(data.keys()))
+        for column in data.values():
+            add_to_fingerprint(column, hash_state)
+    elif (tensorflow is not None) and isinstance(data, tensorflow.data.Dataset):  # type: ignore
+        # We need to iterate through the dataset, to force an eager evaluation
+        for t in data:
+            add_to_fingerprint(t, hash_state)
+    elif (tensorflow is not None) and isinstance(data, tensorflow.Tensor):  # type: ignore
+        if hasattr(data, "numpy"):
+            # for tensors on the cpu, numpy() returns a view of the tensor's buffer
+            add_to_fingerprint(data.numpy(), hash_state)
+        else:
+            raise ConfigurationError(
+                "Tensor type %s is not in eager mode, cannot convert to numpy, value was: %s"
+                % (type(data), repr(data))
+            )
+    elif isinstance(data, (bytes, bytearray, memoryview)):
+        _add_header(hash_state, "bytes", len(data))
+        hash_state.update(data)
+    elif isinstance(data, str):
+        encoded = data.encode("utf-8")
+        _add_header(hash_state, "str", len(encoded))
+        hash_state.update(encoded)
+    elif data is None or isinstance(data, (bool, int, float)):
+        _add_header(hash_state, type(data).__name__, repr(data))
+    else:
+        raise ConfigurationError(
+            "Unable to fingerprint data type %s, data was: %s" % (type(data), data)
+        )
+
+
+def fingerprint(data) -> str:
+    """Return the hex digest of the SHA-1 fingerprint of the data. See
+    :func:`add_to_fingerprint` for the supported types.
+    """
+    hash_state = hashlib.sha1()
+    add_to_fingerprint(data, hash_state)
+    return hash_state.hexdigest()
+
+
+def _get_sampling_info(data) -> Optional[Tuple[str, int, int, List[Any]]]:
+    """If the data can be sampled by rows, return its kind, number of rows,
+    size in bytes, and the metadata to include in the sampled fingerprint.
+    Otherwise, return None.
+    """
+    if numpy is not None and isinstance(data, numpy.ndarray) and data.ndim > 0:
+        return ("ndarray", data.shape[0], data.nbytes, [_dtype_to_str(data.dtype), data.shape])
+    elif pandas is not None and isinstance(data, pandas.DataFrame):
+        metadata = [list(data.columns), [str(dtype) for dtype in data.dtypes], data.shape]
+        return ("pandas", len(data), int(data.memory_usage(index=False).sum()), metadata)
+    elif pandas is not None and isinstance(data, pandas.Series):
+        metadata = [data.name, str(data.dtype), data.shape]
+        return ("pandas", len(data), data.memory_usage(index=False), metadata)
+    elif pyarrow is not None and isinstance(data, (pyarrow.Array, pyarrow.ChunkedArray)):
+        return ("arrow", len(data), data.nbytes, [data.type, len(data)])
+    elif pyarrow is not None and isinstance(data, (pyarrow.Table, pyarrow.RecordBatch)):
+        return ("arrow", data.num_rows, data.nbytes, [data.schema, data.num_rows])
+    else:
+        return None
+
+
+def _get_rows(data, kind: str, start: int, stop: int):
+    if kind == "ndarray":
+        return data[start:stop]
+    elif kind == "pandas":
+        return data.iloc[start:stop]
+    else:
+        return data.slice(start, stop - start)
+
+
+def add_sampled_fingerprint(
+    data, hash_state, max_blocks: Optional[int] = None, block_bytes: Optional[int] = None
+) -> None:
+    """Add an approximate fingerprint of the data to the hash state. Arrays,
+    data frames, and tables larger than SAMPLE_BLOCKS*SAMPLE_BLOCK_BYTES are
+    sampled: the fingerprint includes their exact shape and types, and the
+    contents of SAMPLE_BLOCKS blocks of rows, starting with the first rows and
+    ending with the last rows, at evenly spaced positions. The blocks are the
+    same each time for data of the same shape, so the fingerprint is
+    deterministic. Smaller data, and types which cannot be sliced by rows
+    (e.g. TensorFlow datasets), are fingerprinted exactly via
+    :func:`add_to_fingerprint`. The max_blocks and block_bytes parameters
+    override SAMPLE_BLOCKS and SAMPLE_BLOCK_BYTES.
+    """
+    if max_blocks is None:
+        max_blocks = SAMPLE_BLOCKS
+    if block_bytes is None:
+        block_bytes = SAMPLE_BLOCK_BYTES
+    if (tensorflow is not None) and isinstance(data, tensorflow.Tensor):  # type: ignore
+        if hasattr(data, "numpy"):
+            data = data.numpy()
+    if isinstance(data, (tuple, list)):
+        _add_header(hash_state, "sequence", len(data))
+        for element in data:
+            add_sampled_fingerprint(element, hash_state, max_blocks, block_bytes)
+        return
+    elif isinstance(data, dict):
+        _add_header(hash_state, "dict", list(data.keys()))
+        for column in data.values():
+            add_sampled_fingerprint(column, hash_state, max_blocks, block_bytes)
+        return
+    info = _get_sampling_info(data)
+    if info is None or info[2] <= max_blocks * block_bytes:
+        add_to_fingerprint(data, hash_state)
+        return
+    (kind, num_rows, num_bytes, metadata) = info
+    row_bytes = max(1, num_bytes // max(1, num_rows))
+    rows_per_block = max(1, block_bytes // row_bytes)
+    num_blocks = min(max_blocks, max(1, num_rows // rows_per_block))
+    _add_header(hash_state, "sampled_" + kind, num_blocks, rows_per_block, *metadata)
+    last_start = num_rows - rows_per_block
+    for i in range(num_blocks):
+        start = (i * last_start) // (num_blocks - 1) if num_blocks > 1 else 0
+        add_to_fingerprint(_get_rows(data, kind, start, start + rows_per_block), hash_state)
+
+
+def add_digest_to_fingerprint(hexdigest: str, hash_state) -> None:
+    """Add the digest of a value, rather than the value itself, to the hash
+    state. This lets a digest be computed once (e.g. by a cache) and then be
+    included in several fingerprints.
+    """
+    _add_header(hash_state, "digest")
+    hash_state.update(hexdigest.encode("ascii"))
+
+
+def sampled_fingerprint(data) -> str:
+    """Return the hex digest of the SHA-1 approximate fingerprint of the data.
+    See :func:`add_sampled_fingerprint`.
+    """
+    hash_state = hashlib.sha1()
+    add_sampled_fingerprint(data, hash_state)
+    return hash_state.hexdigest()
+
+
+class BackgroundFingerprinter:
+    """Fingerprint batches of data on background threads. Each batch is added
+    with a key, which must be comparable with the other keys (e.g. the index
+    of the batch). Each batch gets its own digest,
+    and :meth:`finish` adds the digests to a hash state in the order of their keys.
+    The resulting fingerprint does not depend on the order in which the batches
+    were added or hashed, so the batches can come from several threads.
+    If a key is added more than once, only the batch added first is used.
+
+    If num_batches is provided, the keys must be integers and only the keys
+    below num_batches are used. This bounds the fingerprint to one epoch of the
+    data, even if a pipeline which prefetches or repeats the data has already
+    read past the end of the epoch.
+
+    The queue of batches waiting to be hashed is bounded, so :meth:`add` blocks
+    if the hashing falls behind. A batch should not be modified after it is
+    added, as it might not have been hashed yet.
+    """
+
+    def __init__(
+        self,
+        num_threads: int = BACKGROUND_THREADS,
+        max_queue_size: int = BACKGROUND_QUEUE_SIZE,
+        num_batches: Optional[int] = None,
+    ):
+        self.queue = queue.Queue(maxsize=max_queue_size)  # type: queue.Queue
+        self.num_batches = num_batches
+        self.added_keys = set()  # type: set
+        self.digests = {}  # type: dict
+        self.lock = threading.Lock()
+        self.error = None  # type: Optional[BaseException]
+        self.accepting = True
+        self.threads = [
+            threading.Thread(target=self._run, name="dws-fingerprint-%d" % i, daemon=True)
+            for i in range(num_threads)
+        ]
+        for thread in self.threads:
+            thread.start()
+
+    def _run(self) -> None:
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            (key, data) = item
+            try:
+                # SHA-256, so that the digests can be used by MultisetDigest
+                hash_state = hashlib.sha256()
+                add_to_fingerprint(data, hash_state)
+                with self.lock:
+                    self.digests[key] = hash_state.hexdigest()
+            except BaseException as e:
+                self.error = e  # reraised by add() or finish()
+
+    def add(self, key: Any, data: Any) -> None:
+        """Queue the batch to be hashed. Does nothing if the key was already
+        added or is not below num_batches, or after :meth:`stop_accepting`
+        or :meth:`close` have been called.
+        """
+        if self.error is not None:
+            raise self.error
+        if not self.accepting or (self.num_batches is not None and key >= self.num_batches):
+            return
+        with self.lock:
+            if key in self.added_keys:
+                return
+            self.added_keys.add(key)
+        self.queue.put((key, data))
+
+    def stop_accepting(self) -> None:
+        """Ignore any further batches (e.g. at the end of the first epoch)."""
+        self.accepting = False
+
+    def close(self) -> None:
+        """Wait for the queued batches to be hashed and stop the threads. Can be
+        called more than once.
+        """
+        self.accepting = False
+        if len(self.threads) > 0:
+            for _ in self.threads:
+                self.queue.put(None)
+            for thread in self.threads:
+                thread.join()
+            self.threads = []
+
+    def finish(self, hash_state) -> None:
+        """Wait for all the batches to be hashed and then add their digests, in
+        key order, to hash_state. If hash_state is a :class:`MultisetDigest`,
+        the keys are only used to drop duplicates.
+        """
+        self.close()
+        if self.error is not None:
+            raise self.error
+        if isinstance(hash_state, MultisetDigest):
+            # the order does not matter
+            for digest in self.digests.values():
+                hash_state.add_digest(digest)
+            return
+        _add_header(hash_state, "batches", len(self.digests))
+        for key in sorted(self.digests.keys()):
+            _add_header(hash_state, "batch", key)
+            hash_state.update(self.digests[key].encode("ascii"))
+
+
+class MultisetDigest:
+    """A digest of a multiset of values, which does not depend on the order in
+    which the values are added. Each value is hashed with SHA-256 and the
+    hashes are summed, modulo :data:`MULTISET_MODULUS`. Adding the same value
+    twice changes the digest. Since addition is commutative and associative,
+    digests computed separately (e.g. by each worker of a data-parallel job)
+    can be combined via :meth:`merge`, giving the same result as if all the
+    values had been added to one digest.
+
+    This class has the ``copy()`` and ``hexdigest()`` methods of the hashlib
+    objects, so it can be used in their place by callers which only need these.
+    Use :meth:`add` rather than ``update()`` to add a value.
+    """
+
+    def __init__(self, total: int = 0, count: int = 0):
+        self.total = total
+        self.count = count
+
+    def add(self, data: Any) -> None:
+        """Fingerprint the data and add it as one element of the multiset."""
+        hash_state = hashlib.sha256()
+        add_to_fingerprint(data, hash_state)
+        self.add_digest(hash_state.hexdigest())
+
+    def add_digest(self, hexdigest: str) -> None:
+        """Add an element which has already been hashed (as a hex string)."""
+        self.total = (self.total + int(hexdigest, 16)) % MULTISET_MODULUS
+        self.count += 1
+
+    def merge(self, other: "MultisetDigest") -> None:
+        """Add all of the elements of the other digest to this one."""
+        self.total = (self.total + other.total) % MULTISET_MODULUS
+        self.count += other.count
+
+    def copy(self) -> "MultisetDigest":
+        return MultisetDigest(self.total, self.count)
+
+    def hexdigest(self) -> str:
+        """Returns a SHA-1 hex digest of the count and sum, so the result has the
+        same form as the other hashes of the API resources.
+        """
+        hash_state = hashlib.sha1()
+        _add_header(hash_state, "multiset", self.count, "%064x" % self.total)
+        return hash_state.hexdigest()
+
+    def to_string(self) -> str:
+        """Serialize the digest (e.g. to send a worker's partial digest to the
+        coordinator), so that it can be merged later.
+        """
+        return "%d:%064x" % (self.count, self.total)
+
+    @staticmethod
+    def from_string(s: str) -> "MultisetDigest":
+        parts = s.split(":")
+        try:
+            if len(parts) != 2:
+                raise ValueError(s)
+            return MultisetDigest(int(parts[1], 16) % MULTISET_MODULUS, int(parts[0]))
+        except ValueError:
+            raise ConfigurationError("'%s' is not a valid partial digest" % s)
@@ -0,0 +1,166 @@
+"""
+Export of the lineage in a store as json lines, csv, or a graphviz dot file.
+
+The entries are read via :func:`~LineageStore.stream_entries` and each one is
+written as soon as it is read, so the memory used does not grow with the size
+of the lineage. This lets the lineage of large workspaces be loaded into other
+tools (e.g. a metadata database).
+"""
+import csv
+import json
+from typing import Any, List, Optional, TextIO
+
+from dataworkspaces.errors import InternalError
+from dataworkspaces.utils.lineage_utils import (
+    LineageStore,
+    ResourceLineage,
+    ResourceRef,
+    Certificate,
+    HashCertificate,
+    PlaceholderCertificate,
+    StepLineage,
+    SourceDataLineage,
+    CodeLineage,
+)
+
+EXPORT_FORMATS = ["jsonl", "csv", "dot"]
+
+CSV_COLUMNS = [
+    "resource_name",
+    "subpath",
+    "type",
+    "hash",
+    "placeholder_version",
+    "step_name",
+    "start_time",
+    "execution_time_seconds",
+    "inputs",
+    "code",
+    "parameters",
+    "command_line",
+]
+
+
+def _ref_to_str(ref: ResourceRef) -> str:
+    return ref.name if ref.subpath is None else ref.name + ":/" + ref.subpath
+
+
+def _cert_to_str(cert: Certificate) -> str:
+    """Returns a string of the form REF@HASH, or REF@placeholder-VERSION
+    for a placeholder certificate.
+    """
+    if isinstance(cert, HashCertificate):
+        return "%s@%s" % (_ref_to_str(cert.ref), cert.hashval)
+    else:
+        assert isinstance(cert, PlaceholderCertificate)
+        return "%s@placeholder-%d" % (_ref_to_str(cert.ref), cert.version)
+
+
+def _lineage_type(lineage: ResourceLineage) -> str:
+    if isinstance(lineage, StepLineage):
+        return "step"
+    elif isinstance(lineage, SourceDataLineage):
+        return "source_data"
+    elif isinstance(lineage, CodeLineage):
+        return "code"
+    else:
+        raise InternalError("Unexpected lineage type %s" % type(lineage))
+
+
+def _write_jsonl_entry(output: TextIO, ref: ResourceRef, lineage: ResourceLineage) -> None:
+    output.write(
+        json.dumps(
+            {"resource_name": ref.name, "subpath": ref.subpath, "lineage": lineage.to_json()}
+        )
+    )
+    output.write("\n")
+
+
+def _csv_row(ref: ResourceRef, lineage: ResourceLineage) -> List[Any]:
+    cert = lineage.get_cert_for_ref(ref)
+    assert cert is not None
+    row = {
+        "resource_name": ref.name,
+        "subpath": ref.subpath,
+        "type": _lineage_type(lineage),
+        "hash": cert.hashval if isinstance(cert, HashCertificate) else None,
+        "placeholder_version": (
+            cert.version if isinstance(cert, PlaceholderCertificate) else None
+        ),
+    }  # type: dict
+    if isinstance(lineage, StepLineage):
+        row["step_name"] = lineage.step_name
+        row["start_time"] = lineage.start_time.isoformat()
+        row["execution_time_seconds"] = lineage.execution_time_seconds
+        row["inputs"] = " ".join(_cert_to_str(c) for c in lineage.get_input_certs())
+        row["code"] = " ".join(_cert_to_str(c) for c in lineage.get_code_certs())
+        row["parameters"] = json.dumps(lineage.parameters, sort_keys=True)
+        if lineage.command_line is not None:
+            row["command_line"] = " ".join(lineage.command_line)
+    return [row.get(column) for column in CSV_COLUMNS]
+
+
+def _dot_quote(s: str) -> str:
+    return '"' + s.replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+
+def _write_dot_entry(output: TextIO, ref: ResourceRef, lineage: ResourceLineage) -> None:
+    """Each certificate is a node, and each step adds edges from its inputs and code
+    to the certificate of its output. A node may be written more than once, which
+    graphviz handles by merging the statements. This way, we do not need to track
+    which nodes have already been written.
+    """
+    cert = lineage.get_cert_for_ref(ref)
+    assert cert is not None
+    cert_node = _dot_quote(_cert_to_str(cert))
+    if isinstance(lineage, StepLineage):
+        output.write("  %s [shape=box];\n" % cert_node)
+        label = _dot_quote("%s at %s" % (lineage.step_name, lineage.start_time.isoformat()))
+        for input_cert in lineage.get_input_certs():
+            output.write(
+                "  %s -> %s [label=%s];\n"
+                % (_dot_quote(_cert_to_str(input_cert)), cert_node, label)
+            )
+        for code_cert in lineage.get_code_certs():
+            output.write(
+                "  %s -> %s [label=%s, style=dashed];\n"
+                % (_dot_quote(_cert_to_str(code_cert)), cert_node, label)
+            )
+    elif isinstance(lineage, CodeLineage):
+        output.write("  %s [shape=note];\n" % cert_node)
+    else:
+        output.write("  %s [shape=cylinder];\n" % cert_node)
+
+
+def export_lineage(
+    instance: str,
+    store: LineageStore,
+    output: TextIO,
+    format: str = "jsonl",
+    snapshot_hash: Optional[str] = None,
+) -> int:
+    """Write each lineage entry of the store (as of the snapshot, if specified) to
+    output in the specified format (one of EXPORT_FORMATS). Returns the number of
+    entries written.
+    """
+    if format not in EXPORT_FORMATS:
+        raise InternalError("Unknown lineage export format %s" % format)
+    entries = store.stream_entries(instance, snapshot_hash)
+    count = 0
+    if format == "jsonl":
+        for (ref, lineage) in entries:
+            _write_jsonl_entry(output, ref, lineage)
+            count += 1
+    elif format == "csv":
+        writer = csv.writer(output)
+        writer.writerow(CSV_COLUMNS)
+        for (ref, lineage) in entries:
+            writer.writerow(_csv_row(ref, lineage))
+            count += 1
+    else:
+        output.write("digraph lineage {\n")
+        for (ref, lineage) in entries:
+            _write_dot_entry(output, ref, lineage)
+            count += 1
+        output.write("}\n")
+    return count
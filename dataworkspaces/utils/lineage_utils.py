@@ -14,7 +14,10 @@ For pretty printing of resources and certs, the convention is:
 The __repr__ call should just be pp(0)
 """
 
+import atexit
+import copy
 import datetime
+import gc
 import os
 from os.path import (
     join,
@@ -27,10 +30,25 @@ from os.path import (
     dirname,
     isdir,
 )
-from typing import List, Any, Optional, Tuple, NamedTuple, Dict, Iterable, cast
+from typing import (
+    List,
+    Any,
+    Optional,
+    Tuple,
+    NamedTuple,
+    Dict,
+    Iterable,
+    Set,
+    FrozenSet,
+    Union,
+    cast,
+)
+from collections import OrderedDict
+import hashlib
 import json
 import shutil
 import sys
+import weakref
 from abc import ABCMeta, abstractmethod
 from string import Template
 
@@ -38,6 +56,16 @@ from string import Template
 from dataworkspaces.errors import InternalError, LineageError
 from .regexp_utils import isots_to_dt
 from .hash_utils import is_a_git_hash
+from .file_utils import write_file_atomically
+
+try:
+    import orjson  # type: ignore
+except ImportError:
+    orjson = None  # type: ignore
+try:
+    import fcntl
+except ImportError:
+    fcntl = None  # type: ignore
 
 
 class LineageConsistencyError(LineageError):
@@ -150,6 +178,134 @@ class ResourceRef(NamedTuple):
             return False
 
 
+def _subpath_components(subpath: Optional[str]) -> List[str]:
+    """Split a subpath into its components, dropping empty and '.' components
+    (as done by commonpath()).
+    """
+    if subpath is None:
+        return []
+    return [c for c in subpath.split("/") if c != "" and c != "."]
+
+
+class _TrieNode:
+    __slots__ = ("children", "ref", "count")
+
+    def __init__(self):
+        self.children = {}  # type: Dict[str, _TrieNode]
+        self.ref = None  # type: Optional[ResourceRef]
+        self.count = 0  # number of refs at or below this node
+
+
+class SubpathIndex:
+    """Index over the refs of a single resource, organized as a trie of
+    subpath components. The root of the trie is the ref for the whole
+    resource (subpath None). This lets us find the refs covering or covered
+    by a ref in time proportional to the depth of its subpath, rather than
+    calling ResourceRef.covers() on every ref of the resource.
+    """
+
+    def __init__(self, resource_name: str, refs: Iterable[ResourceRef] = ()):
+        self.resource_name = resource_name
+        self.root = _TrieNode()
+        for ref in refs:
+            self.add(ref)
+
+    def __len__(self):
+        return self.root.count
+
+    def _path(self, ref: ResourceRef) -> Optional[List[_TrieNode]]:
+        """Return the nodes from the root to the node for ref, or None if
+        the trie does not contain the node.
+        """
+        node = self.root
+        path = [node]
+        for c in _subpath_components(ref.subpath):
+            child = node.children.get(c)
+            if child is None:
+                return None
+            path.append(child)
+            node = child
+        return path
+
+    def add(self, ref: ResourceRef) -> None:
+        assert ref.name == self.resource_name
+        node = self.root
+        path = [node]
+        for c in _subpath_components(ref.subpath):
+            child = node.children.get(c)
+            if child is None:
+                child = node.children[c] = _TrieNode()
+            path.append(child)
+            node = child
+        if node.ref is not None:
+            return
+        node.ref = ref
+        for n in path:
+            n.count += 1
+
+    def remove(self, ref: ResourceRef) -> None:
+        path = self._path(ref)
+        if path is None or path[-1].ref != ref:
+            return
+        path[-1].ref = None
+        for n in path:
+            n.count -= 1
+        # prune the nodes which no longer have refs
+        components = _subpath_components(ref.subpath)
+        for i in range(len(components), 0, -1):
+            if path[i].count == 0:
+                del path[i - 1].children[components[i - 1]]
+            else:
+                break
+
+    def find_covering(self, ref: ResourceRef) -> Optional[ResourceRef]:
+        """Return a ref in the index which strictly covers ref, or None if there
+        are none.
+        """
+        node = self.root
+        for c in _subpath_components(ref.subpath):
+            if node.ref is not None:
+                return node.ref
+            child = node.children.get(c)
+            if child is None:
+                return None
+            node = child
+        return None
+
+    def find_covered(self, ref: ResourceRef) -> Optional[ResourceRef]:
+        """Return a ref in the index which is strictly covered by ref, or None
+        if there are none.
+        """
+        path = self._path(ref)
+        if path is None:
+            return None
+        node = path[-1]
+        if node.count - (1 if node.ref is not None else 0) == 0:
+            return None
+        # walk down to any ref below this node
+        while True:
+            for child in node.children.values():
+                if child.count > 0:
+                    node = child
+                    break
+            if node.ref is not None:
+                return node.ref
+
+    def get_covered(self, ref: ResourceRef) -> List[ResourceRef]:
+        """Return all the refs in the index strictly covered by ref"""
+        path = self._path(ref)
+        if path is None:
+            return []
+        result = []  # type: List[ResourceRef]
+        stack = list(path[-1].children.values())
+        while len(stack) > 0:
+            node = stack.pop()
+            if node.ref is not None:
+                result.append(node.ref)
+            stack.extend(node.children.values())
+        return result
+
+
 class Certificate(metaclass=ABCMeta):
     __slots__ = ("ref", "comment")
 
@@ -164,9 +320,18 @@ class Certificate(metaclass=ABCMeta):
         pass
 
     @staticmethod
-    def from_json(obj: Any, filename: Optional[str] = None):
-        validate_json_keys(obj, Certificate, ["resource_name", "certificate"], filename=filename)
-        ref = ResourceRef(obj["resource_name"], subpath=obj.get("subpath", None))
+    def from_json(obj: Any, filename: Optional[str] = None, refs: Optional[List[ResourceRef]] = None):
+        """Parse a certificate. If refs is provided, the object is in the compact format,
+        where the ref is an index into refs.
+        """
+        if refs is not None:
+            validate_json_keys(obj, Certificate, ["ref", "certificate"], filename=filename)
+            ref = refs[obj["ref"]]
+        else:
+            validate_json_keys(
+                obj, Certificate, ["resource_name", "certificate"], filename=filename
+            )
+            ref = ResourceRef(obj["resource_name"], subpath=obj.get("subpath", None))
         cert_obj = obj["certificate"]
         validate_json_keys(cert_obj, Certificate, ["cert_type",], filename=filename)
         cert_type = cert_obj["cert_type"]
@@ -177,7 +342,8 @@ class Certificate(metaclass=ABCMeta):
             validate_json_keys(
                 cert_obj, PlaceholderCertificate, ["version", "comment"], filename=filename
             )
-            if cert_obj.get("is_output", False) == True:
+            # older versions wrote this key as "is_ouput"
+            if cert_obj.get("is_output", cert_obj.get("is_ouput", False)) == True:
                 return OutputPlaceholderCert(ref, cert_obj["version"], cert_obj["comment"])
             else:
                 return InputPlaceholderCert(ref, cert_obj["version"], cert_obj["comment"])
@@ -315,7 +481,7 @@ class InputPlaceholderCert(PlaceholderCertificate):
                 "cert_type": "placeholder",
                 "version": self.version,
                 "comment": self.comment,
-                "is_ouput": False,
+                "is_output": False,
             },
         }
 
@@ -372,7 +538,7 @@ class OutputPlaceholderCert(PlaceholderCertificate):
                 "cert_type": "placeholder",
                 "version": self.version,
                 "comment": self.comment,
-                "is_ouput": True,
+                "is_output": True,
             },
         }
 
@@ -385,17 +551,20 @@ class ResourceLineage(metaclass=ABCMeta):
     __slots__ = ()
 
     @staticmethod
-    def from_json(obj, filename=None):
+    def from_json(obj, filename=None, refs=None):
+        """Parse a lineage object. refs is the table of refs for the compact format
+        (see :func:`~encode_lineage_file`).
+        """
         validate_json_keys(obj, ResourceLineage, ["type"], filename=filename)
         restype = obj["type"]
         if restype == "step":
-            return StepLineage.from_json(obj, filename=filename)
+            return StepLineage.from_json(obj, filename=filename, refs=refs)
         elif restype == "source_data":
-            return SourceDataLineage.from_json(obj, filename=filename)
+            return SourceDataLineage.from_json(obj, filename=filename, refs=refs)
         elif restype == "code":
-            return CodeLineage.from_json(obj, filename=filename)
+            return CodeLineage.from_json(obj, filename=filename, refs=refs)
         elif restype == "imported":
-            return ImportedLineage.from_json(obj, filename=filename)
+            return ImportedLineage.from_json(obj, filename=filename, refs=refs)
         else:
             raise JsonValueError(ResourceLineage, "type", ["step", "source_data"], restype)
 
@@ -626,6 +795,17 @@ class StepLineage(ResourceLineage):
             )
         )
 
+    def annotate_input(self, ref: ResourceRef, note: str) -> None:
+        """Append a note to the comment of the step's certificate for the input ref
+        (e.g. to record how its hash was computed). The certificate is copied, as
+        it may be shared with the input's own lineage.
+        """
+        for (i, c) in enumerate(self.input_resources):
+            if c.ref == ref and not c.comment.endswith("(%s)" % note):
+                annotated = copy.copy(c)
+                annotated.comment = "%s (%s)" % (c.comment, note)
+                self.input_resources[i] = annotated
+
     @staticmethod
     def make_step_lineage(
         instance: str,
@@ -803,25 +983,81 @@ class StepLineage(ResourceLineage):
         }
 
     @staticmethod
-    def from_json(obj, filename=None):
+    def _args_from_json(obj, filename=None, refs=None) -> Tuple[Any, ...]:
         validate_json_keys(
             obj,
             StepLineage,
             ["step_name", "start_time", "parameters", "input_resources", "code_resources"],
             filename=filename,
         )
-        return StepLineage(
+        return (
             obj["step_name"],
             isots_to_dt(obj["start_time"]),
             obj["parameters"],
-            [Certificate.from_json(rcobj, filename) for rcobj in obj["input_resources"]],
-            [Certificate.from_json(rcobj, filename) for rcobj in obj["code_resources"]],
-            [Certificate.from_json(rcobj, filename) for rcobj in obj["output_resources"]],
+            [Certificate.from_json(rcobj, filename, refs) for rcobj in obj["input_resources"]],
+            [Certificate.from_json(rcobj, filename, refs) for rcobj in obj["code_resources"]],
+            [Certificate.from_json(rcobj, filename, refs) for rcobj in obj["output_resources"]],
             obj.get("execution_time_seconds", None),
             obj.get("command_line", None),
             obj.get("run_from_directory", None),
         )
 
+    @staticmethod
+    def from_json(obj, filename=None, refs=None):
+        return StepLineage(*StepLineage._args_from_json(obj, filename, refs))
+
+
+class _LazyStepLineage(StepLineage):
+    """A step lineage read from a lineage file, which is only built from its
+    json representation when one of its attributes is first accessed. Most
+    operations on a lineage file only look at a few of its entries, so this
+    saves parsing the rest. The refs of the outputs are available without
+    building the lineage, as they are needed to index the file.
+    """
+
+    __slots__ = ["_json", "_filename", "_refs"]
+
+    def __init__(
+        self, obj: Dict[str, Any], filename: Optional[str], refs: Optional[List[ResourceRef]]
+    ):
+        # We do not call the superclass constructor, which happens on first access
+        self._json = obj  # type: Optional[Dict[str, Any]]
+        self._filename = filename
+        self._refs = refs
+
+    def __getattr__(self, name):
+        # Only called for attributes which have not been set, which means that
+        # we have not been built yet.
+        if name in _LazyStepLineage.__slots__ or name.startswith("__"):
+            raise AttributeError(name)
+        obj = self._json
+        if obj is None:
+            raise AttributeError(name)
+        StepLineage.__init__(self, *StepLineage._args_from_json(obj, self._filename, self._refs))
+        self._json = None
+        return getattr(self, name)
+
+    def get_output_refs(self) -> List[ResourceRef]:
+        """Return the refs of the step's outputs, without building the lineage"""
+        if self._json is None:
+            return [cert.ref for cert in self.output_resources]
+        refs = self._refs
+        if refs is not None:
+            return [refs[c["ref"]] for c in self._json["output_resources"]]
+        else:
+            return [
+                ResourceRef(c["resource_name"], c.get("subpath", None))
+                for c in self._json["output_resources"]
+            ]
+
+    def to_json(self):
+        if self._json is None:
+            return super().to_json()
+        elif self._refs is None:
+            return self._json
+        else:
+            return _expand_lineage_json(self._json, self._refs)
+
 
 class SourceDataLineage(ResourceLineage):
     """Used for a source data resource that is not created
@@ -839,9 +1075,9 @@ class SourceDataLineage(ResourceLineage):
         return obj
 
     @staticmethod
-    def from_json(obj, filename=None):
+    def from_json(obj, filename=None, refs=None):
         assert obj["type"] == "source_data"
-        return SourceDataLineage(Certificate.from_json(obj, filename=filename))
+        return SourceDataLineage(Certificate.from_json(obj, filename=filename, refs=refs))
 
     def __str__(self):
         return "SourceDataLineage(%s)" % self.cert
@@ -892,9 +1128,9 @@ class CodeLineage(ResourceLineage):
         return obj
 
     @staticmethod
-    def from_json(obj, filename=None) -> "CodeLineage":
+    def from_json(obj, filename=None, refs=None) -> "CodeLineage":
         assert obj["type"] == "code"
-        return CodeLineage(Certificate.from_json(obj, filename=filename))
+        return CodeLineage(Certificate.from_json(obj, filename=filename, refs=refs))
 
     def __str__(self):
         return "CodeLineage(%s)" % self.cert
@@ -1004,10 +1240,11 @@ class ImportedLineage:
         }
 
     @staticmethod
-    def from_json(obj, filename=None) -> "ImportedLineage":
+    def from_json(obj, filename=None, refs=None) -> "ImportedLineage":
         assert obj["type"] == "imported"
         nested_lineage = [
-            ResourceLineage.from_json(d, filename=filename) for d in obj["nested_lineage"]
+            ResourceLineage.from_json(d, filename=filename, refs=refs)
+            for d in obj["nested_lineage"]
         ]
         return ImportedLineage(obj["resource_name"], nested_lineage)
 
@@ -1027,6 +1264,368 @@ class ImportedLineage:
         return self.pp()
 
 
+# Value of the "format" key in lineage files written in the compact format
+COMPACT_FORMAT = "compact"
+
+
+def _load_json(data: bytes) -> Any:
+    """Parse json data, using orjson if it is installed"""
+    if orjson is not None:
+        return orjson.loads(data)
+    else:
+        return json.loads(data.decode("utf-8"))
+
+
+class _RefTable:
+    """Interns the refs used by a lineage file in the compact format"""
+
+    def __init__(self):
+        self.refs = []  # type: List[List[Optional[str]]]
+        self.index = {}  # type: Dict[Tuple[str, Optional[str]], int]
+
+    def add(self, name: str, subpath: Optional[str]) -> int:
+        key = (name, subpath)
+        idx = self.index.get(key)
+        if idx is None:
+            idx = len(self.refs)
+            self.refs.append([name, subpath])
+            self.index[key] = idx
+        return idx
+
+
+def _compact_cert_json(obj: Dict[str, Any], table: _RefTable) -> Dict[str, Any]:
+    result = {k: v for (k, v) in obj.items() if k != "resource_name" and k != "subpath"}
+    result["ref"] = table.add(obj["resource_name"], obj.get("subpath", None))
+    return result
+
+
+def _compact_lineage_json(obj: Dict[str, Any], table: _RefTable) -> Dict[str, Any]:
+    """Convert the json representation of a lineage to the compact format, where each
+    ref is replaced by an index into the ref table.
+    """
+    ltype = obj["type"]
+    if ltype == "step":
+        result = dict(obj)
+        for key in ("input_resources", "code_resources", "output_resources"):
+            result[key] = [_compact_cert_json(c, table) for c in obj[key]]
+        return result
+    elif ltype == "imported":
+        result = dict(obj)
+        result["nested_lineage"] = [_compact_lineage_json(l, table) for l in obj["nested_lineage"]]
+        return result
+    else:  # source data or code, where the certificate is inline
+        return _compact_cert_json(obj, table)
+
+
+def _expand_cert_json(obj: Dict[str, Any], refs: List[ResourceRef]) -> Dict[str, Any]:
+    result = {k: v for (k, v) in obj.items() if k != "ref"}
+    ref = refs[obj["ref"]]
+    result["resource_name"] = ref.name
+    result["subpath"] = ref.subpath
+    return result
+
+
+def _expand_lineage_json(obj: Dict[str, Any], refs: List[ResourceRef]) -> Dict[str, Any]:
+    """Inverse of _compact_lineage_json()"""
+    ltype = obj["type"]
+    if ltype == "step":
+        result = dict(obj)
+        for key in ("input_resources", "code_resources", "output_resources"):
+            result[key] = [_expand_cert_json(c, refs) for c in obj[key]]
+        return result
+    elif ltype == "imported":
+        result = dict(obj)
+        result["nested_lineage"] = [_expand_lineage_json(l, refs) for l in obj["nested_lineage"]]
+        return result
+    else:
+        return _expand_cert_json(obj, refs)
+
+
+def encode_lineage_file(
+    resource_name: str, lineages: Iterable[Union[ResourceLineage, ImportedLineage]], compact: bool
+) -> bytes:
+    """Encode the lineages for a resource file. The default format is indented json,
+    with each certificate including its resource name and subpath. The compact format
+    has no whitespace and stores each distinct ref once, in a "refs" table, with the
+    certificates referring to refs by their index in the table. Older versions of
+    DWS cannot read the compact format.
+    """
+    lineages_json = [l.to_json() for l in lineages]
+    if not compact:
+        return json.dumps(
+            {"resource_name": resource_name, "lineages": lineages_json}, indent=2
+        ).encode("utf-8")
+    table = _RefTable()
+    compacted = [_compact_lineage_json(l, table) for l in lineages_json]
+    obj = {
+        "resource_name": resource_name,
+        "format": COMPACT_FORMAT,
+        "refs": table.refs,
+        "lineages": compacted,
+    }
+    if orjson is not None:
+        return orjson.dumps(obj)
+    else:
+        return json.dumps(obj, separators=(",", ":")).encode("utf-8")
+
+
+def decode_lineage_file(
+    resource_name: str, data: bytes, filename: Optional[str] = None
+) -> Dict[ResourceRef, ResourceLineage]:
+    """Parse a resource lineage file written by :func:`~encode_lineage_file`,
+    in either format, and return a mapping from the refs of resource_name to
+    their lineage. Step lineages are built lazily.
+    """
+    # Parsing a large file allocates many objects, which triggers repeated garbage
+    # collection passes over the whole heap. None of these objects are cyclic, so we
+    # pause the collector while parsing.
+    gc_was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        return _decode_lineage_file(resource_name, data, filename)
+    finally:
+        if gc_was_enabled:
+            gc.enable()
+
+
+def _decode_lineage_file(
+    resource_name: str, data: bytes, filename: Optional[str]
+) -> Dict[ResourceRef, ResourceLineage]:
+    obj = _load_json(data)
+    if not isinstance(obj, dict):
+        raise JsonTypeError(ResourceLineage, dict, type(obj), filename=filename)
+    if obj.get("format", None) == COMPACT_FORMAT:
+        refs = [
+            ResourceRef(name, subpath) for (name, subpath) in obj["refs"]
+        ]  # type: Optional[List[ResourceRef]]
+    else:
+        refs = None
+    # The resource file is a list of lineages rather than a map from
+    # refs to lineages. We need to recreate the map.
+    mapping = {}  # type: Dict[ResourceRef, ResourceLineage]
+    for lobj in obj["lineages"]:
+        if isinstance(lobj, dict) and lobj.get("type", None) == "step":
+            step = _LazyStepLineage(lobj, filename, refs)
+            output_refs = step.get_output_refs()
+            l = step  # type: ResourceLineage
+        else:
+            l = ResourceLineage.from_json(lobj, filename, refs=refs)
+            output_refs = [cert.ref for cert in l.get_certs()]
+        for ref in output_refs:
+            if ref.name == resource_name:
+                mapping[ref] = l
+    return mapping
+
+
+def _step_key(step: StepLineage) -> Tuple[Any, ...]:
+    """Identifies a step run, as there may be multiple copies of its lineage"""
+    return (step.step_name, step.start_time, tuple(step.get_certs()))
+
+
+class LineageGraph:
+    """In-memory view of the lineage in a store (either the current lineage or
+    as of a snapshot), indexed for graph queries. This is built once per state of
+    the store by :func:`~LineageStore.get_lineage_graph` and dropped whenever the
+    store is changed.
+
+    The nodes of the graph are certificates. Each certificate that was produced by
+    a lineage in the store has edges to the input and code certificates of that
+    lineage (its parents). The reverse edges (children) go from a certificate to the
+    outputs of each step that consumed it. Lookups of refs and the transitive
+    closures (ancestors and descendants) are memoized.
+    """
+
+    def __init__(self, store: "LineageStore", instance: str, snapshot_hash: Optional[str] = None):
+        self.store = store
+        self.instance = instance
+        self.snapshot_hash = snapshot_hash
+        if snapshot_hash is not None:
+            iterator = store.iterate_all_as_of_snapshot(instance, snapshot_hash)
+        else:
+            iterator = store.iterate_all(instance)
+        self.entries = list(iterator)  # type: List[Tuple[ResourceRef, ResourceLineage]]
+        self.lineage_for_cert = {}  # type: Dict[Certificate, ResourceLineage]
+        self.parents = {}  # type: Dict[Certificate, List[Certificate]]
+        self.children = {}  # type: Dict[Certificate, List[Certificate]]
+        self.consumers = {}  # type: Dict[Certificate, List[StepLineage]]
+        for (ref, lineage) in self.entries:
+            cert = lineage.get_cert_for_ref(ref)
+            assert cert is not None
+            if cert in self.lineage_for_cert:
+                continue
+            self.lineage_for_cert[cert] = lineage
+            if isinstance(lineage, StepLineage):
+                inputs = list(lineage.get_input_certs()) + list(lineage.get_code_certs())
+                self.parents[cert] = inputs
+                for input_cert in inputs:
+                    self.children.setdefault(input_cert, []).append(cert)
+                    consumers = self.consumers.setdefault(input_cert, [])
+                    if lineage not in consumers:
+                        consumers.append(lineage)
+            else:
+                self.parents[cert] = []
+        self.entry_cache = {}  # type: Dict[ResourceRef, Optional[ResourceLineage]]
+        self.refs_cache = {}  # type: Dict[str, List[ResourceRef]]
+        self.ancestor_cache = {}  # type: Dict[Certificate, FrozenSet[Certificate]]
+        self.descendant_cache = {}  # type: Dict[Certificate, FrozenSet[Certificate]]
+
+    def get_refs_for_resource(self, resource_name: str) -> List[ResourceRef]:
+        if resource_name not in self.refs_cache:
+            if self.snapshot_hash is not None:
+                refs = self.store.get_refs_for_resource_as_of_snapshot(
+                    self.instance, resource_name, self.snapshot_hash
+                )
+            else:
+                refs = self.store.get_refs_for_resource(self.instance, resource_name)
+            self.refs_cache[resource_name] = list(refs)
+        return self.refs_cache[resource_name]
+
+    def retrieve_entry(self, ref: ResourceRef) -> ResourceLineage:
+        """Retrieve the entry for ref (or one covering it) from the store, raising
+        a LineageNotFoundError if there is none.
+        """
+        if ref not in self.entry_cache:
+            try:
+                if self.snapshot_hash is not None:
+                    lineage = self.store.retrieve_entry_as_of_snapshot(
+                        self.instance, ref, self.snapshot_hash
+                    )  # type: Optional[ResourceLineage]
+                else:
+                    lineage = self.store.retrieve_entry(self.instance, ref)
+            except LineageNotFoundError:
+                lineage = None
+            self.entry_cache[ref] = lineage
+        result = self.entry_cache[ref]
+        if result is None:
+            raise LineageNotFoundError("No lineage found for %s" % repr(ref))
+        return result
+
+    def get_cert_for_ref(self, ref: ResourceRef) -> Optional[Certificate]:
+        """Return the certificate for the current state of ref, or None if the
+        ref has no lineage.
+        """
+        try:
+            return self.retrieve_entry(ref).get_cert_for_ref(ref)
+        except LineageNotFoundError:
+            return None
+
+    def is_current(self, cert: Certificate) -> bool:
+        """Return True if cert is still the state of its ref, rather than having
+        been overwritten by a later step.
+        """
+        return self.get_cert_for_ref(cert.ref) == cert
+
+    def get_lineage_for_cert(self, cert: Certificate) -> Optional[ResourceLineage]:
+        """Return the lineage which produced the certificate, if it is in the store"""
+        return self.lineage_for_cert.get(cert)
+
+    def _closure(
+        self,
+        cert: Certificate,
+        edges: Dict[Certificate, List[Certificate]],
+        cache: Dict[Certificate, FrozenSet[Certificate]],
+    ) -> FrozenSet[Certificate]:
+        if cert in cache:
+            return cache[cert]
+        result = set()  # type: Set[Certificate]
+        worklist = list(edges.get(cert, []))
+        while len(worklist) > 0:
+            c = worklist.pop()
+            if c in result:
+                continue
+            result.add(c)
+            if c in cache:
+                result.update(cache[c])  # reuse the closure already computed for c
+            else:
+                worklist.extend(edges.get(c, []))
+        cache[cert] = frozenset(result)
+        return cache[cert]
+
+    def ancestors(self, cert: Certificate) -> FrozenSet[Certificate]:
+        """Return all the certificates that cert transitively depends on"""
+        return self._closure(cert, self.parents, self.ancestor_cache)
+
+    def descendants(self, cert: Certificate) -> FrozenSet[Certificate]:
+        """Return all the certificates transitively derived from cert"""
+        return self._closure(cert, self.children, self.descendant_cache)
+
+    def impacted_outputs(self, cert: Certificate) -> List[Certificate]:
+        """Return the descendants of cert which are still the current state of their
+        refs. These are the outputs which would change if cert changed.
+        """
+        return sorted(
+            (c for c in self.descendants(cert) if self.is_current(c)), key=lambda c: str(c)
+        )
+
+    def get_current_steps(self) -> List[StepLineage]:
+        """Return the steps which produced the current state of at least one ref,
+        in topological order: a step comes after the steps producing its inputs.
+        Steps which are not otherwise ordered are sorted by start time.
+        """
+        steps = OrderedDict()  # type: OrderedDict[Tuple[Any, ...], StepLineage]
+        for (_, lineage) in self.entries:
+            if isinstance(lineage, StepLineage):
+                # the same step may be stored once per output resource
+                steps.setdefault(_step_key(lineage), lineage)
+        predecessors = {
+            key: set() for key in steps.keys()
+        }  # type: Dict[Tuple[Any, ...], Set[Tuple[Any, ...]]]
+        for (key, step) in steps.items():
+            for output_cert in step.get_certs():
+                for consumer in self.consumers.get(output_cert, []):
+                    consumer_key = _step_key(consumer)
+                    if consumer_key in predecessors and consumer_key != key:
+                        predecessors[consumer_key].add(key)
+        result = []  # type: List[StepLineage]
+        remaining = sorted(steps.keys(), key=lambda k: steps[k].start_time)
+        done = set()  # type: Set[Tuple[Any, ...]]
+        while len(remaining) > 0:
+            ready = [k for k in remaining if predecessors[k] <= done]
+            if len(ready) == 0:
+                ready = remaining[0:1]  # a cycle, which should not happen, so we break it
+            for k in ready:
+                result.append(steps[k])
+                done.add(k)
+            remaining = [k for k in remaining if k not in done]
+        return result
+
+    def impacted_steps(
+        self, changed_ref: ResourceRef, current_hash: Optional[str] = None
+    ) -> List[Tuple[StepLineage, List[Certificate]]]:
+        """Return the steps which need to be re-run because changed_ref has changed,
+        in the order they should be run, each paired with its inputs which are stale.
+
+        A step input (or code) is changed if it overlaps changed_ref and it was not a
+        hash certificate for current_hash, which is the current hash of the resource.
+        If current_hash is None, all the overlapping inputs are assumed to be changed.
+        A step is impacted if any of its inputs are changed or are outputs of
+        an impacted step. Only the steps which produced the current state of
+        some ref are considered, as earlier runs have already been superseded.
+        """
+
+        def is_changed(cert: Certificate) -> bool:
+            if not (
+                cert.ref == changed_ref
+                or cert.ref.covers(changed_ref)
+                or changed_ref.covers(cert.ref)
+            ):
+                return False
+            return not (isinstance(cert, HashCertificate) and cert.hashval == current_hash)
+
+        stale_certs = set()  # type: Set[Certificate]
+        result = []  # type: List[Tuple[StepLineage, List[Certificate]]]
+        for step in self.get_current_steps():
+            stale_inputs = [
+                cert
+                for cert in list(step.get_input_certs()) + list(step.get_code_certs())
+                if cert in stale_certs or is_changed(cert)
+            ]
+            if len(stale_inputs) > 0:
+                result.append((step, stale_inputs))
+                stale_certs.update(step.get_certs())
+        return result
+
+
 class LineageStore(metaclass=ABCMeta):
     """Abstract interface for storing lineage data. This can have mutiple
     implementations. Workspaces that support lineage should include a lineage store
@@ -1057,6 +1656,39 @@ class LineageStore(metaclass=ABCMeta):
        certificates. If any are left when taking a snapshot, a LineagePlaceholderError should be thrown.
     """
 
+    # Cache of LineageGraph objects, keyed by snapshot hash (None for the current lineage).
+    # Implementations must call _invalidate_lineage_graph() whenever they change the
+    # lineage.
+    lineage_graphs = None  # type: Optional[Dict[Optional[str], LineageGraph]]
+
+    def get_lineage_graph(
+        self, instance: str, snapshot_hash: Optional[str] = None
+    ) -> LineageGraph:
+        """Return a LineageGraph for the current lineage or as of the specified
+        snapshot. The graph is reused until the store changes.
+        """
+        if self.lineage_graphs is None:
+            self.lineage_graphs = {}
+        graph = self.lineage_graphs.get(snapshot_hash)
+        if graph is None or graph.instance != instance:
+            graph = LineageGraph(self, instance, snapshot_hash)
+            self.lineage_graphs[snapshot_hash] = graph
+        return graph
+
+    def _invalidate_lineage_graph(self, snapshot_hash: Optional[str] = None) -> None:
+        """Drop the cached graph for the current lineage (if snapshot_hash is None)
+        or for the specified snapshot.
+        """
+        if self.lineage_graphs is not None:
+            self.lineage_graphs.pop(snapshot_hash, None)
+
+    def flush(self) -> None:
+        """Write out any changes to the lineage that have been buffered by the store.
+        This is called when a step completes and before a snapshot is taken. The
+        default does nothing, for stores which do not buffer their changes.
+        """
+        pass
+
     @abstractmethod
     def store_entry(self, instance: str, lineage: ResourceLineage) -> None:
         """Store the specified lineage object at the specific reference for the
@@ -1163,6 +1795,21 @@ class LineageStore(metaclass=ABCMeta):
         """
         pass
 
+    def stream_entries(
+        self, instance: str, snapshot_hash: Optional[str] = None
+    ) -> Iterable[Tuple[ResourceRef, ResourceLineage]]:
+        """Iterate through the contents of the store (as of the snapshot, if specified),
+        like :func:`~iterate_all`, for exporting the lineage. Implementations
+        should read the entries incrementally and not add them to any caches,
+        so that the memory used does not grow with the size of the store.
+        The default just calls :func:`~iterate_all` or
+        :func:`~iterate_all_as_of_snapshot`.
+        """
+        if snapshot_hash is not None:
+            return self.iterate_all_as_of_snapshot(instance, snapshot_hash)
+        else:
+            return self.iterate_all(instance)
+
     @abstractmethod
     def dump(self, instance: str) -> None:
         """Print the current contents of the store (for debugging).
@@ -1245,11 +1892,14 @@ class LineageStore(metaclass=ABCMeta):
     ) -> Tuple[List[ResourceLineage], int]:
         """Return a list of all transitive lineage for the specified
         resource and a integer indicating the number of warnings.
+        The lookups are answered from the store's lineage graph, so
+        ancestors shared between queries are only retrieved once.
         """
+        graph = self.get_lineage_graph(instance)
         ref_to_cert = {}  # type: Dict[ResourceRef, Certificate]
         result = []  # type: List[ResourceLineage]
         warnings = 0
-        to_process = [ref for ref in self.get_refs_for_resource(instance, resource_name)]
+        to_process = [ref for ref in graph.get_refs_for_resource(resource_name)]
         if len(to_process) == 0:
             print(
                 "WARNING: no lineage data found for resource '%s'" % resource_name, file=sys.stderr
@@ -1260,7 +1910,7 @@ class LineageStore(metaclass=ABCMeta):
             next_to_process = []  # type: List[ResourceRef]
             for ref in to_process:
                 try:
-                    lineage = self.retrieve_entry(instance, ref)
+                    lineage = graph.retrieve_entry(ref)
                 except LineageNotFoundError:
                     assert 0, "No entry found for ref %s" % repr(
                         ref
@@ -1301,7 +1951,7 @@ class LineageStore(metaclass=ABCMeta):
                             next_to_process.append(input_cert.ref)
                             ref_to_cert[input_cert.ref] = input_cert
                             try:
-                                result.append(self.retrieve_entry(instance, input_cert.ref))
+                                result.append(graph.retrieve_entry(input_cert.ref))
                             except LineageNotFoundError:
                                 print(
                                     "WARNING: step %s references input %s, which has no lingeage"
@@ -1327,7 +1977,7 @@ class LineageStore(metaclass=ABCMeta):
                             next_to_process.append(code_cert.ref)
                             ref_to_cert[code_cert.ref] = code_cert
                             try:
-                                result.append(self.retrieve_entry(instance, code_cert.ref))
+                                result.append(graph.retrieve_entry(code_cert.ref))
                             except LineageNotFoundError:
                                 print(
                                     "WARNING: step %s references code resource %s, which has no lingeage"
@@ -1338,11 +1988,138 @@ class LineageStore(metaclass=ABCMeta):
         return (result, warnings)
 
 
+# Name of the subdirectory of the snapshot lineage directory which contains
+# the lineage blobs shared across snapshots.
+BLOB_DIR_NAME = "blobs"
+MANIFEST_FILENAME = "manifest.json"
+# Number of parsed snapshot lineage files kept in memory
+SNAPSHOT_RFILE_CACHE_SIZE = 256
+# File in the current lineage directory containing the placeholder index.
+# This must not end in .json, as those files are the resource lineage files.
+PLACEHOLDER_INDEX_FILENAME = "placeholders.index"
+# Journal of a write-behind flush in progress, in the current lineage directory.
+JOURNAL_FILENAME = "lineage.journal"
+# Suffix of the files written by a journaled flush before they are renamed into place.
+# Other writes use write_file_atomically(), which picks a unique temporary name.
+TMP_SUFFIX = ".tmp"
+# Lock file in the current lineage directory, held while changing the files there.
+LOCK_FILENAME = "lineage.lock"
+
+# (inode, size, modification time) of a file, used to detect changes
+FileSignature = Tuple[int, int, int]
+
+
+def _get_file_signature(path: str) -> Optional[FileSignature]:
+    """Return the signature of the file or None if it does not exist. As we always
+    replace the lineage files via a rename, a changed file has a new inode.
+    """
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (st.st_ino, st.st_size, st.st_mtime_ns)
+
+
+class _LineageLock:
+    """Exclusive lock on a current lineage directory, shared across processes. This is
+    a no-op on platforms without fcntl (e.g. Windows).
+    """
+
+    def __init__(self, current_lineage_path: str):
+        self.lock_path = join(current_lineage_path, LOCK_FILENAME)
+        self.fd = None  # type: Optional[int]
+
+    def __enter__(self):
+        if fcntl is not None:
+            self.fd = os.open(self.lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+            fcntl.flock(self.fd, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if self.fd is not None:
+            fcntl.flock(self.fd, fcntl.LOCK_UN)
+            os.close(self.fd)
+            self.fd = None
+        return False
+
+# Maps placeholder resource names to versions to the names of the resource files
+# containing lineages with that placeholder.
+PlaceholderIndex = Dict[str, Dict[int, Set[str]]]
+
+
+def _iterate_mapping(
+    mapping: Dict[ResourceRef, ResourceLineage]
+) -> Iterable[Tuple[ResourceRef, ResourceLineage]]:
+    """Iterate through the entries of a resource file's mapping, expanding imported lineage"""
+    for (ref, lineage) in mapping.items():
+        if isinstance(lineage, ImportedLineage):
+            for (ref, lineage) in lineage.iterate():
+                yield (ref, lineage)
+            # There could be other entries in tne mapping,
+            # but they will also point to this same
+            # ImportedLineage
+            break
+        else:  # normal case
+            yield (ref, lineage)
+
+
+def _write_file_atomic(path: str, data: bytes, sync: bool = False) -> None:
+    """Write the file via write_file_atomically(), so that readers never see a
+    partially written file. If sync is True, the data is also flushed to disk
+    before the rename.
+    """
+
+    def fill(tmp_path: str) -> None:
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+            if sync:
+                f.flush()
+                os.fsync(f.fileno())
+
+    write_file_atomically(path, fill)
+
+
+# File lineage stores in write-behind mode, which we flush when the process exits
+_write_behind_stores = weakref.WeakSet()  # type: weakref.WeakSet
+
+
+def _flush_write_behind_stores() -> None:
+    for store in list(_write_behind_stores):
+        if not isdir(store.current_lineage_path):
+            continue  # the workspace was removed
+        try:
+            store.flush()
+        except Exception as e:
+            print(
+                "ERROR: unable to save lineage to %s: %s" % (store.current_lineage_path, e),
+                file=sys.stderr,
+            )
+
+
+atexit.register(_flush_write_behind_stores)
+
+
+def _get_placeholder_certs(lineage: ResourceLineage) -> List[PlaceholderCertificate]:
+    """Return all the placeholder certificates used by the lineage (outputs, inputs, and code)"""
+    certs = list(lineage.get_certs())
+    if isinstance(lineage, StepLineage):
+        certs.extend(lineage.get_input_certs())
+        certs.extend(lineage.get_code_certs())
+    return [c for c in certs if isinstance(c, PlaceholderCertificate)]
+
+
 class FileLineageStore(LineageStore):
     """Store lineage data on the local filesystem.
     """
 
-    def __init__(self, instance: str, current_lineage_path: str, snapshot_lineage_path: str):
+    def __init__(
+        self,
+        instance: str,
+        current_lineage_path: str,
+        snapshot_lineage_path: str,
+        compact: bool = False,
+        write_behind: bool = False,
+    ):
         """:current_lineage_path: is private to the instance.
 
         :snapshot_lineage_path: should be replicated/visible to all instances
@@ -1351,42 +2128,263 @@ class FileLineageStore(LineageStore):
         We pass in :instance: to the constructor as this implementation works against
         local state only and the instance parameters of the methods must all match
         this instance.
+
+        If :compact: is True, resource files are written in the compact format (see
+        :func:`~encode_lineage_file`). Files in either format can always be read.
+
+        If :write_behind: is True, changes to the current lineage are kept in memory
+        until :func:`~flush` is called (or the process exits). Otherwise, each change
+        is written out when it is made.
         """
         self.instance = instance
         self.current_lineage_path = current_lineage_path
         self.snapshot_lineage_path = snapshot_lineage_path
-        # Write-through cache of the resources. We use this
+        self.compact = compact
+        self.write_behind = write_behind
+        # Cache of the resources. We use this
         # to make following backlinks faster.
         # This is a dict from resource names to resource ref to lineage mappings.
         # Note that a a given lineage object may be independently repeated in multiple
         # places. This is OK, as long as any changes are made identically to all copies.
         self.resource_cache = {}  # type: Dict[str, Dict[ResourceRef, ResourceLineage]]
+        # Index over the refs of each resource in resource_cache, built on demand.
+        # Kept in sync with the cache: any change to a resource's mapping
+        # must either update the index or drop it.
+        self.ref_index = {}  # type: Dict[str, SubpathIndex]
+        # Caches for the snapshot lineage, which does not change once written
+        self.manifest_cache = {}  # type: Dict[str, Dict[str, str]]
+        self.snapshot_rfile_cache = (
+            OrderedDict()
+        )  # type: OrderedDict[str, Dict[ResourceRef, ResourceLineage]]
+        # Reverse index from placeholder certificates to the resource files that
+        # use them, loaded on demand. This lets replace_placeholders() visit
+        # just the lineage that has placeholders.
+        self.placeholder_index = None  # type: Optional[PlaceholderIndex]
+        # The resource files which have been changed or deleted in the cache, but
+        # not yet on disk. In write-through mode, these are written at the end of
+        # each operation. In write-behind mode, they are written by flush().
+        self.dirty_resources = set()  # type: Set[str]
+        self.deleted_resources = set()  # type: Set[str]
+        self.placeholder_index_dirty = False
+        # For each dirty resource, the refs we have changed, which are
+        # reapplied if another process has changed the file. None means that
+        # the resource was cleared, so our mapping replaces the file.
+        self.changed_refs = {}  # type: Dict[str, Optional[Set[ResourceRef]]]
+        # Signature of each file in the current lineage directory as we last read
+        # or wrote it, used to detect changes by other processes.
+        self.file_signatures = {}  # type: Dict[str, Optional[FileSignature]]
+        if write_behind:
+            _write_behind_stores.add(self)
+        if isdir(current_lineage_path):
+            with _LineageLock(current_lineage_path):
+                self._recover_from_journal()
 
     def _rfile_exists(self, resource_name: str) -> bool:
+        if resource_name in self.dirty_resources:
+            return True
+        elif resource_name in self.deleted_resources:
+            return False
         return exists(join(self.current_lineage_path, resource_name + ".json"))
 
+    def _rfile_changed(self, resource_name: str, refs: Iterable[ResourceRef]) -> None:
+        """Called when the resource's mapping in the cache has changed at refs
+        (set or removed).
+        """
+        self.deleted_resources.discard(resource_name)
+        self.dirty_resources.add(resource_name)
+        changed = self.changed_refs.get(resource_name, set())
+        if changed is not None:
+            changed.update(refs)
+            self.changed_refs[resource_name] = changed
+
+    def _rfile_deleted(self, resource_name: str) -> None:
+        """Called when the resource's lineage has been cleared from the cache"""
+        self.dirty_resources.discard(resource_name)
+        self.deleted_resources.add(resource_name)
+        self.changed_refs[resource_name] = None
+
+    def _placeholder_index_changed(self) -> None:
+        self.placeholder_index_dirty = True
+
+    def _write_through(self) -> None:
+        """Called at the end of each operation which changes the current lineage"""
+        if not self.write_behind:
+            self.flush()
+
+    def _merge_concurrent_changes(self) -> None:
+        """Another process may have written the current lineage since we read it.
+        For each dirty resource whose file has changed, we reload the file and
+        reapply our changes to it. If one of our refs conflicts with a ref from
+        the file (one covers the other), ours is newer, so we drop the other.
+        The placeholder entries for the files we are writing are then recomputed,
+        on top of the latest index. Must be called with the lock held.
+        """
+        for rname in sorted(self.dirty_resources):
+            fname = rname + ".json"
+            path = join(self.current_lineage_path, fname)
+            signature = _get_file_signature(path)
+            if signature == self.file_signatures.get(fname):
+                continue
+            changed = self.changed_refs.get(rname)
+            if changed is None:
+                continue  # we replace the whole file
+            if signature is None:
+                merged = {}  # type: Dict[ResourceRef, ResourceLineage]
+            else:
+                with open(path, "rb") as f:
+                    merged = decode_lineage_file(rname, f.read(), path)
+            ours = self.resource_cache[rname]
+            for ref in changed:
+                for other_ref in [
+                    r for r in merged.keys() if r == ref or r.covers(ref) or ref.covers(r)
+                ]:
+                    del merged[other_ref]
+            for ref in changed:
+                if ref in ours:
+                    merged[ref] = ours[ref]
+            self.resource_cache[rname] = merged
+            self.ref_index.pop(rname, None)
+            self._invalidate_lineage_graph()
+        if not (self.placeholder_index_dirty or self.dirty_resources or self.deleted_resources):
+            return
+        index_path = join(self.current_lineage_path, PLACEHOLDER_INDEX_FILENAME)
+        if self.placeholder_index is None or _get_file_signature(
+            index_path
+        ) == self.file_signatures.get(PLACEHOLDER_INDEX_FILENAME):
+            return
+        index = self._read_placeholder_index()
+        if index is None:
+            # Removed by another process (e.g. a restore). It will be rebuilt
+            # from the files when next needed.
+            self.placeholder_index = None
+            self.placeholder_index_dirty = False
+            return
+        rfiles = self.dirty_resources.union(self.deleted_resources)
+        for versions in index.values():
+            for files in versions.values():
+                files.difference_update(rfiles)
+        for rname in self.dirty_resources:
+            for lineage in self.resource_cache[rname].values():
+                self._add_to_placeholder_index(index, rname, lineage)
+        self.placeholder_index = index
+        self.placeholder_index_dirty = True
+
+    def flush(self) -> None:
+        """Write out the buffered changes, holding the lock on the current lineage
+        so that concurrent writers from other processes are serialized. Any changes
+        made by other processes since we read the files are merged with ours.
+
+        In write-behind mode, the new files are first written under temporary names.
+        We then write a journal listing the files to be renamed into place and
+        deleted, and then make those changes. If we crash before the journal is
+        written, the current lineage is unchanged. If we crash after, the changes
+        are completed from the journal when the store is next opened.
+        """
+        if (
+            len(self.dirty_resources) == 0
+            and len(self.deleted_resources) == 0
+            and not self.placeholder_index_dirty
+        ):
+            return
+        with _LineageLock(self.current_lineage_path):
+            self._merge_concurrent_changes()
+            if self.write_behind:
+                self._write_with_journal()
+            else:
+                for rname in sorted(self.dirty_resources):
+                    self._save_rfile_to_curr(rname, self.resource_cache[rname])
+                for rname in sorted(self.deleted_resources):
+                    if exists(join(self.current_lineage_path, rname + ".json")):
+                        self._delete_from_current(rname)
+                if self.placeholder_index_dirty:
+                    self._save_placeholder_index()
+            for rname in self.dirty_resources.union(self.deleted_resources):
+                self._update_file_signature(rname + ".json")
+            if self.placeholder_index_dirty:
+                self._update_file_signature(PLACEHOLDER_INDEX_FILENAME)
+        self.dirty_resources = set()
+        self.deleted_resources = set()
+        self.changed_refs = {}
+        self.placeholder_index_dirty = False
+
+    def _write_with_journal(self) -> None:
+        writes = []  # type: List[str]
+        for rname in sorted(self.dirty_resources):
+            fname = rname + ".json"
+            data = encode_lineage_file(rname, self.resource_cache[rname].values(), self.compact)
+            with open(join(self.current_lineage_path, fname + TMP_SUFFIX), "wb") as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            writes.append(fname)
+        if self.placeholder_index_dirty:
+            with open(
+                join(self.current_lineage_path, PLACEHOLDER_INDEX_FILENAME + TMP_SUFFIX), "wb"
+            ) as f:
+                f.write(self._encode_placeholder_index())
+                f.flush()
+                os.fsync(f.fileno())
+            writes.append(PLACEHOLDER_INDEX_FILENAME)
+        journal = {
+            "write": writes,
+            "delete": [rname + ".json" for rname in sorted(self.deleted_resources)],
+        }
+        journal_path = join(self.current_lineage_path, JOURNAL_FILENAME)
+        _write_file_atomic(journal_path, json.dumps(journal).encode("utf-8"), sync=True)
+        self._apply_journal(journal)
+        os.remove(journal_path)
+
+    def _update_file_signature(self, fname: str) -> None:
+        self.file_signatures[fname] = _get_file_signature(join(self.current_lineage_path, fname))
+
+    def _apply_journal(self, journal: Dict[str, List[str]]) -> None:
+        """Make the changes listed in the journal. This may be run more than once,
+        if we crash while applying it.
+        """
+        for fname in journal["write"]:
+            tmp_path = join(self.current_lineage_path, fname + TMP_SUFFIX)
+            if exists(tmp_path):
+                os.replace(tmp_path, join(self.current_lineage_path, fname))
+        for fname in journal["delete"]:
+            path = join(self.current_lineage_path, fname)
+            if exists(path):
+                os.remove(path)
+
+    def _recover_from_journal(self) -> None:
+        """Complete any flush that was interrupted after writing its journal, and
+        remove the temporary files of any that was interrupted before.
+        """
+        journal_path = join(self.current_lineage_path, JOURNAL_FILENAME)
+        if exists(journal_path):
+            with open(journal_path, "r") as f:
+                journal = json.load(f)
+            self._apply_journal(journal)
+            os.remove(journal_path)
+        for fname in os.listdir(self.current_lineage_path):
+            if fname.endswith(TMP_SUFFIX):
+                os.remove(join(self.current_lineage_path, fname))
+
     def _parse_rfile(self, resource_name: str) -> Dict[ResourceRef, ResourceLineage]:
         if resource_name in self.resource_cache:
             return self.resource_cache[resource_name]
 
         rfile_path = join(self.current_lineage_path, resource_name + ".json")
-        with open(rfile_path, "r") as f:
-            data = json.load(f)
-        assert isinstance(data, dict), (
-            "Resource lineage file %s is not in correct format" % rfile_path
-        )
-        # For backward compatibility, the resource file is a list of lineages rather than a map from
-        # refs to lineages. We need to recreate the map.
-        # TODO: support reading/writing a new format that uses the map directly
-        lineages = [ResourceLineage.from_json(r, rfile_path) for r in data["lineages"]]
-        mapping = {}  # type: Dict[ResourceRef, ResourceLineage]
-        for l in lineages:
-            for rc in l.get_certs():
-                if rc.ref.name == resource_name:
-                    mapping[rc.ref] = l
+        with open(rfile_path, "rb") as f:
+            # We get the signature from the open file, so that it matches what we read
+            st = os.fstat(f.fileno())
+            mapping = decode_lineage_file(resource_name, f.read(), rfile_path)
+        self.file_signatures[resource_name + ".json"] = (st.st_ino, st.st_size, st.st_mtime_ns)
         self.resource_cache[resource_name] = mapping
         return mapping
 
+    def _get_ref_index(self, resource_name: str) -> SubpathIndex:
+        """Return the subpath index for the resource, which must be in the cache"""
+        index = self.ref_index.get(resource_name)
+        if index is None:
+            index = SubpathIndex(resource_name, self.resource_cache[resource_name].keys())
+            self.ref_index[resource_name] = index
+        return index
+
     def _load_resource_cache(self):
         """When tracking backlinks, we need to go through the entire current
         resource database. We load it all in memory to speed things up.
@@ -1395,7 +2393,7 @@ class FileLineageStore(LineageStore):
         for f in files:
             if f.endswith(".json"):
                 rname = f[0 : -len(".json")]
-                if rname not in self.resource_cache:
+                if rname not in self.resource_cache and rname not in self.deleted_resources:
                     self._parse_rfile(rname)
 
     def _save_rfile_to_curr(
@@ -1405,33 +2403,74 @@ class FileLineageStore(LineageStore):
         is needed by a subpclass
         """
         rfile_path = join(self.current_lineage_path, resource_name + ".json")
-        # for backward compability, we just save the lineage values
-        with open(rfile_path, "w") as f:
-            json.dump(
-                {
-                    "resource_name": resource_name,
-                    "lineages": [r.to_json() for r in lineage_map.values()],
-                },
-                f,
-                indent=2,
-            )
+        _write_file_atomic(
+            rfile_path, encode_lineage_file(resource_name, lineage_map.values(), self.compact)
+        )
         return rfile_path
 
     def _get_snapshot_path(self, resource_name: str, snapshot_hash: str) -> str:
+        """Path of a resource file in the legacy snapshot layout, which has a full
+        copy of each resource file in the snapshot directory.
+        """
         return join(join(self.snapshot_lineage_path, snapshot_hash), resource_name + ".json")
 
+    def _get_blob_path(self, blob_hash: str) -> str:
+        return join(self.snapshot_lineage_path, BLOB_DIR_NAME, blob_hash + ".json")
+
+    def _get_manifest_path(self, snapshot_hash: str) -> str:
+        return join(self.snapshot_lineage_path, snapshot_hash, MANIFEST_FILENAME)
+
+    def _get_snapshot_manifest(self, snapshot_hash: str) -> Optional[Dict[str, str]]:
+        """Return the mapping from resource names to blob hashes for the snapshot,
+        or None if the snapshot uses the legacy layout (or does not exist).
+        """
+        if snapshot_hash in self.manifest_cache:
+            return self.manifest_cache[snapshot_hash]
+        manifest_path = self._get_manifest_path(snapshot_hash)
+        if not exists(manifest_path):
+            return None
+        with open(manifest_path, "r") as f:
+            manifest = json.load(f)["resources"]
+        self.manifest_cache[snapshot_hash] = manifest
+        return manifest
+
     def _snapshot_rfile_exists(self, resource_name: str, snapshot_hash: str) -> bool:
+        manifest = self._get_snapshot_manifest(snapshot_hash)
+        if manifest is not None:
+            return resource_name in manifest
         return exists(self._get_snapshot_path(resource_name, snapshot_hash))
 
+    def _get_snapshot_rfile_path(self, resource_name: str, snapshot_hash: str) -> str:
+        """Return the path of the file containing the resource's lineage as of the snapshot"""
+        manifest = self._get_snapshot_manifest(snapshot_hash)
+        if manifest is not None:
+            return self._get_blob_path(manifest[resource_name])
+        return self._get_snapshot_path(resource_name, snapshot_hash)
+
     def _ensure_snapshot_dir_exists(self, snapshot_hash: str) -> None:
         snapshot_dir = join(self.snapshot_lineage_path, snapshot_hash)
         if not exists(snapshot_dir):
             os.makedirs(snapshot_dir)
 
+    def get_snapshot_hashes(self) -> List[str]:
+        """Return the hashes of the snapshots which have lineage in this store"""
+        if not isdir(self.snapshot_lineage_path):
+            return []
+        return [
+            name
+            for name in sorted(os.listdir(self.snapshot_lineage_path))
+            if name != BLOB_DIR_NAME and isdir(join(self.snapshot_lineage_path, name))
+        ]
+
     def _get_resources_in_snapshot(self, snapshot_hash: str) -> Iterable[str]:
         snapshot_dir = join(self.snapshot_lineage_path, snapshot_hash)
         if not isdir(snapshot_dir):
             raise LineageNotFoundError("No lineage data found for snapshot hash %s" % snapshot_hash)
+        manifest = self._get_snapshot_manifest(snapshot_hash)
+        if manifest is not None:
+            for rname in sorted(manifest.keys()):
+                yield rname
+            return
         for fname in sorted(os.listdir(snapshot_dir)):
             if fname.endswith(".json"):
                 yield fname[0:-5]
@@ -1439,107 +2478,239 @@ class FileLineageStore(LineageStore):
     def _parse_snapshot_rfile(
         self, resource_name: str, snapshot_hash: str
     ) -> Dict[ResourceRef, ResourceLineage]:
-        """Since this is for a snapshot, it does not use the cache.
-        """
-        rfile_path = self._get_snapshot_path(resource_name, snapshot_hash)
-        with open(rfile_path, "r") as f:
-            data = json.load(f)
-        assert isinstance(data, dict), "Lineage file %s is not in expected format" % rfile_path
-        # For backward compatibility, the resource file is a list of lineages rather than a map from
-        # refs to lineages. We need to recreate the map.
-        # TODO: support reading/writing a new format that uses the map directly
-        lineages = [ResourceLineage.from_json(r, rfile_path) for r in data["lineages"]]
-        mapping = {}  # type: Dict[ResourceRef, ResourceLineage]
-        for l in lineages:
-            for rc in l.get_certs():
-                if rc.ref.name == resource_name:
-                    mapping[rc.ref] = l
+        """Snapshot lineage is immutable, so we keep the most recently used
+        files in a cache, keyed by path. As the blobs are shared across
+        snapshots, this also avoids re-parsing unchanged lineage when moving
+        between snapshots.
+        """
+        rfile_path = self._get_snapshot_rfile_path(resource_name, snapshot_hash)
+        if rfile_path in self.snapshot_rfile_cache:
+            self.snapshot_rfile_cache.move_to_end(rfile_path)
+            return self.snapshot_rfile_cache[rfile_path]
+        with open(rfile_path, "rb") as f:
+            mapping = decode_lineage_file(resource_name, f.read(), rfile_path)
+        self.snapshot_rfile_cache[rfile_path] = mapping
+        while len(self.snapshot_rfile_cache) > SNAPSHOT_RFILE_CACHE_SIZE:
+            self.snapshot_rfile_cache.popitem(last=False)
         return mapping
 
-    def _save_rfile_to_snapshot(
-        self,
-        resource_name: str,
-        lineage_map: Dict[ResourceRef, ResourceLineage],
-        snapshot_hash: str,
-    ) -> str:
-        """Save the resource mapping to the snapshot. Returns the path in case it
-        is needed by a subclass.
-        """
-        snapshot_path = self._get_snapshot_path(resource_name, snapshot_hash)
-        # for backward compability, we just save the lineage values
-        with open(snapshot_path, "w") as f:
-            json.dump(
-                {
-                    "resource_name": resource_name,
-                    "lineages": [r.to_json() for r in lineage_map.values()],
-                },
-                f,
-                indent=2,
-            )
-        return snapshot_path
+    def _write_blob(self, blob_hash: str, data: bytes) -> str:
+        """Write a lineage blob, returning its path in case it is needed by a subclass."""
+        blob_path = self._get_blob_path(blob_hash)
+        blob_dir = dirname(blob_path)
+        if not exists(blob_dir):
+            os.makedirs(blob_dir)
+        with open(blob_path, "wb") as f:
+            f.write(data)
+        return blob_path
+
+    def _save_blob(self, data: bytes) -> Tuple[str, Optional[str]]:
+        """Save the resource file contents as a blob, if not already present, and
+        return its hash and the path of the blob, if it was written.
+        """
+        blob_hash = hashlib.sha1(data).hexdigest()
+        if not exists(self._get_blob_path(blob_hash)):
+            return (blob_hash, self._write_blob(blob_hash, data))
+        return (blob_hash, None)
+
+    def _write_snapshot_manifest(self, snapshot_hash: str, manifest: Dict[str, str]) -> str:
+        """Write the manifest for a snapshot. Returns the path in case it is
+        needed by a subclass.
+        """
+        manifest_path = self._get_manifest_path(snapshot_hash)
+        with open(manifest_path, "w") as f:
+            json.dump({"resources": manifest}, f, indent=2, sort_keys=True)
+        self.manifest_cache[snapshot_hash] = manifest
+        return manifest_path
+
+    def _stage_snapshot_files(self, paths: List[str]) -> None:
+        """Called once a snapshot's lineage has been written, with the paths of the new
+        files (blobs and the manifest), so that a subclass can add them to version control.
+        """
+        pass
 
-    def _copy_rfile_to_snapshot(self, resource_name: str, snapshot_hash: str) -> Tuple[str, str]:
-        src_rpath = join(self.current_lineage_path, resource_name + ".json")
-        dest_rpath = self._get_snapshot_path(resource_name, snapshot_hash)
-        shutil.copyfile(src_rpath, dest_rpath)
-        return (src_rpath, dest_rpath)
+    def _remove_blobs(self, blob_paths: List[str]) -> None:
+        for blob_path in blob_paths:
+            os.remove(blob_path)
+
+    def _remove_unreferenced_blobs(self) -> None:
+        """Remove any blobs which are not referenced by a snapshot's manifest"""
+        blob_dir = join(self.snapshot_lineage_path, BLOB_DIR_NAME)
+        if not isdir(blob_dir):
+            return
+        referenced = set(
+            blob_hash
+            for snapshot_hash in self.get_snapshot_hashes()
+            for blob_hash in (self._get_snapshot_manifest(snapshot_hash) or {}).values()
+        )
+        unreferenced = [
+            join(blob_dir, fname)
+            for fname in sorted(os.listdir(blob_dir))
+            if fname.endswith(".json") and fname[0:-5] not in referenced
+        ]
+        for blob_path in unreferenced:
+            self.snapshot_rfile_cache.pop(blob_path, None)
+        if len(unreferenced) > 0:
+            self._remove_blobs(unreferenced)
 
     def _copy_snapshot_rfile_to_current(
         self, resource_name: str, snapshot_hash: str
     ) -> Tuple[str, str]:
-        src_rpath = self._get_snapshot_path(resource_name, snapshot_hash)
+        src_rpath = self._get_snapshot_rfile_path(resource_name, snapshot_hash)
         dest_rpath = join(self.current_lineage_path, resource_name + ".json")
-        shutil.copyfile(src_rpath, dest_rpath)
-        return (src_rpath, dest_rpath)
 
-    def _write_placeholder_to_snapshot(
-        self, snapshot_hash: str, filename: str, content: str
-    ) -> str:
-        path = join(join(self.snapshot_lineage_path, snapshot_hash), filename)
-        with open(path, "w") as f:
-            f.write(content)
-        return path
+        def fill(tmp_path: str) -> None:
+            shutil.copyfile(src_rpath, tmp_path)
+
+        write_file_atomically(dest_rpath, fill)
+        return (src_rpath, dest_rpath)
 
     def _delete_from_current(self, resource_name: str) -> str:
         rfile_path = join(self.current_lineage_path, resource_name + ".json")
         os.remove(rfile_path)
         return rfile_path
 
+    def _get_placeholder_index(self) -> PlaceholderIndex:
+        """Return the placeholder index, loading it if needed. If there is no index
+        file (e.g. the lineage was written by an older version), we build the index
+        by scanning all the resource files.
+        """
+        if self.placeholder_index is not None:
+            return self.placeholder_index
+        self.placeholder_index = self._read_placeholder_index()
+        if self.placeholder_index is None:
+            self._load_resource_cache()
+            index = {}  # type: PlaceholderIndex
+            for (rname, mapping) in self.resource_cache.items():
+                for lineage in mapping.values():
+                    self._add_to_placeholder_index(index, rname, lineage)
+            self.placeholder_index = index
+            self._placeholder_index_changed()
+        return self.placeholder_index
+
+    def _read_placeholder_index(self) -> Optional[PlaceholderIndex]:
+        """Read the placeholder index file, returning None if it does not exist"""
+        index_path = join(self.current_lineage_path, PLACEHOLDER_INDEX_FILENAME)
+        try:
+            with open(index_path, "r") as f:
+                st = os.fstat(f.fileno())
+                data = json.load(f)
+        except FileNotFoundError:
+            return None
+        self.file_signatures[PLACEHOLDER_INDEX_FILENAME] = (
+            st.st_ino,
+            st.st_size,
+            st.st_mtime_ns,
+        )
+        return {
+            rname: {int(version): set(rfiles) for (version, rfiles) in versions.items()}
+            for (rname, versions) in data["placeholders"].items()
+        }
+
+    def _add_to_placeholder_index(
+        self, index: PlaceholderIndex, rfile_name: str, lineage: ResourceLineage
+    ) -> bool:
+        """Add the placeholders of a lineage stored in the specified resource file to the index.
+        Returns True if the index was changed.
+        """
+        changed = False
+        for cert in _get_placeholder_certs(lineage):
+            rfiles = index.setdefault(cert.ref.name, {}).setdefault(cert.version, set())
+            if rfile_name not in rfiles:
+                rfiles.add(rfile_name)
+                changed = True
+        return changed
+
+    def _invalidate_placeholder_index(self) -> None:
+        """Called when resource files are replaced wholesale. The index will be
+        rebuilt from the files the next time it is needed.
+        """
+        self.placeholder_index = None
+        index_path = join(self.current_lineage_path, PLACEHOLDER_INDEX_FILENAME)
+        if exists(index_path):
+            os.remove(index_path)
+
+    def _save_placeholder_index(self) -> None:
+        _write_file_atomic(
+            join(self.current_lineage_path, PLACEHOLDER_INDEX_FILENAME),
+            self._encode_placeholder_index(),
+        )
+
+    def _encode_placeholder_index(self) -> bytes:
+        assert self.placeholder_index is not None
+        return json.dumps(
+            {
+                "placeholders": {
+                    rname: {str(version): sorted(rfiles) for (version, rfiles) in versions.items()}
+                    for (rname, versions) in self.placeholder_index.items()
+                }
+            },
+            indent=2,
+        ).encode("utf-8")
+
     def store_entry(self, instance: str, lineage: ResourceLineage) -> None:
         assert instance == self.instance
+        self._invalidate_lineage_graph()
+        placeholder_index = self._get_placeholder_index()
+        index_changed = False
+        # The lineage may have many outputs in the same resource, so we save
+        # each resource file once, after all the outputs have been added.
+        changed_refs = OrderedDict()  # type: OrderedDict[str, List[ResourceRef]]
+        try:
+            self._store_certs(lineage, changed_refs)
+        finally:
+            for (rname, refs) in changed_refs.items():
+                self._rfile_changed(rname, refs)
+                if self._add_to_placeholder_index(placeholder_index, rname, lineage):
+                    index_changed = True
+            if index_changed:
+                self._placeholder_index_changed()
+            self._write_through()
+
+    def _store_certs(
+        self, lineage: ResourceLineage, changed_refs: Dict[str, List[ResourceRef]]
+    ) -> None:
+        """Add the lineage to the mapping of each of its certificates, adding each
+        ref to changed_refs.
+        """
         for cert in lineage.get_certs():
             if self._rfile_exists(cert.ref.name):
                 # case where we need to merge into data
                 mapping = self._parse_rfile(cert.ref.name)
-                # check for conflicts
-                for other_ref in mapping.keys():
-                    if other_ref == cert.ref:
-                        break  # got an exact match, there won't be conflicts
-                    elif other_ref.covers(cert.ref):
+                index = self._get_ref_index(cert.ref.name)
+                # check for conflicts. If we have an exact match, there won't be conflicts.
+                if cert.ref not in mapping:
+                    other_ref = index.find_covering(cert.ref)
+                    if other_ref is not None:
                         raise LineageConflictError(
                             "Cannot store new lineage data at %s: existing lineage data %s is a parent path"
                             % (cert.ref, other_ref)
                         )
-                    elif cert.ref.covers(other_ref):
+                    other_ref = index.find_covered(cert.ref)
+                    if other_ref is not None:
                         # TODO: Consider whether we can allow conflicts in this case.
                         raise LineageConflictError(
                             "Cannot store new lineage data at %s: existing lineage data %s is a child path"
                             % (cert.ref, other_ref)
                         )
                 mapping[cert.ref] = lineage
+                index.add(cert.ref)
             else:
                 mapping = {cert.ref: lineage}
+                self.ref_index.pop(cert.ref.name, None)
             self.resource_cache[cert.ref.name] = mapping
-            self._save_rfile_to_curr(cert.ref.name, mapping)
+            changed_refs.setdefault(cert.ref.name, []).append(cert.ref)
 
     def retrieve_entry(self, instance: str, ref: ResourceRef) -> ResourceLineage:
         assert instance == self.instance
         if not self._rfile_exists(ref.name):
             raise LineageNotFoundError("No lineage exists for %s" % str(ref))
         mapping = self._parse_rfile(ref.name)
-        for (other_ref, lineage) in mapping.items():
-            if ref == other_ref or other_ref.covers(ref):
-                return lineage
+        if ref in mapping:
+            return mapping[ref]
+        other_ref = self._get_ref_index(ref.name).find_covering(ref)
+        if other_ref is not None:
+            return mapping[other_ref]
         raise LineageNotFoundError("No lineage exists for %s" % str(ref))
 
     def has_entry(self, instance: str, ref: ResourceRef, include_covers: bool = True) -> bool:
@@ -1547,29 +2718,33 @@ class FileLineageStore(LineageStore):
         if not self._rfile_exists(ref.name):
             return False
         mapping = self._parse_rfile(ref.name)
-        for (other_ref, lineage) in mapping.items():
-            if ref == other_ref or (include_covers and other_ref.covers(ref)):
-                return True
-        return False
+        if ref in mapping:
+            return True
+        return include_covers and (self._get_ref_index(ref.name).find_covering(ref) is not None)
 
     def clear_entry(self, instance: str, ref: ResourceRef) -> None:
         assert instance == self.instance
+        self._invalidate_lineage_graph()
         if ref.subpath is None:
             # special case when its the entire file
             if self._rfile_exists(ref.name):
-                self._delete_from_current(ref.name)
+                self._rfile_deleted(ref.name)
             if ref.name in self.resource_cache:
                 del self.resource_cache[ref.name]
+            self.ref_index.pop(ref.name, None)
+            self._write_through()
         else:
             mapping = self._parse_rfile(ref.name)
-            keys = [k for k in mapping.keys()]
-            changed = False
+            index = self._get_ref_index(ref.name)
+            keys = index.get_covered(ref)
+            if ref in mapping:
+                keys.append(ref)
             for key in keys:
-                if ref == key or ref.covers(key):
-                    del mapping[key]  # also updates the cache
-                    changed = True
-            if changed:
-                self._save_rfile_to_curr(ref.name, mapping)
+                del mapping[key]  # also updates the cache
+                index.remove(key)
+            if len(keys) > 0:
+                self._rfile_changed(ref.name, keys)
+                self._write_through()
 
     def get_refs_for_resource(self, instance: str, resource_name: str) -> Iterable[ResourceRef]:
         """Iterate through all the refs in this store belonging to this resource.
@@ -1586,93 +2761,165 @@ class FileLineageStore(LineageStore):
     def replace_placeholders(
         self, instance: str, hash_mapping: Dict[str, str], verbose=False
     ) -> None:
+        """We use the placeholder index to find the resource files with placeholders,
+        and only rewrite those files where placeholders were replaced.
+        """
         assert instance == self.instance
-        # we load the entire current store, as following the backlinks can go to any resource
-        self._load_resource_cache()
-        dirty_resources = set()  # need to save these at the end
-        for (rname, mapping) in self.resource_cache.items():
-            for (ref, lineage) in mapping.items():
-                dirty = lineage.replace_placeholders(hash_mapping)
-                if dirty:
-                    dirty_resources.add(rname)
-                    if verbose:
-                        print(
-                            "replaced placeholders for ref %s lineage\n   %s" % (repr(ref), lineage)
-                        )
-                else:
-                    if verbose:
-                        print("No placeholders for ref %s lineage:  \n%s" % (repr(ref), lineage))
-        for rname in dirty_resources:
-            self._save_rfile_to_curr(rname, self.resource_cache[rname])
+        self._invalidate_lineage_graph()
+        index = self._get_placeholder_index()
+        rfile_names = sorted(
+            set(
+                rname
+                for versions in index.values()
+                for rfiles in versions.values()
+                for rname in rfiles
+            )
+        )
+        # The same lineage object may be shared by several resource files, so we
+        # find the dirty files before replacing anything.
+        # need to save these at the end
+        dirty_refs = {}  # type: Dict[str, Set[ResourceRef]]
+        to_replace = []  # type: List[Tuple[ResourceRef, ResourceLineage]]
+        for rname in rfile_names:
+            if not self._rfile_exists(rname):
+                continue  # cleared since the placeholder was added
+            for (ref, lineage) in self._parse_rfile(rname).items():
+                placeholders = _get_placeholder_certs(lineage)
+                if len(placeholders) == 0:
+                    continue
+                to_replace.append((ref, lineage))
+                if any(cert.ref.name in hash_mapping for cert in placeholders):
+                    dirty_refs.setdefault(rname, set()).add(ref)
+        new_index = {}  # type: PlaceholderIndex
+        for (ref, lineage) in to_replace:
+            # This may raise a LineagePlaceHolderError
+            lineage.replace_placeholders(hash_mapping)
+            if verbose:
+                print("replaced placeholders for ref %s lineage\n   %s" % (repr(ref), lineage))
+        for rname in rfile_names:
+            if self._rfile_exists(rname):
+                for lineage in self.resource_cache[rname].values():
+                    self._add_to_placeholder_index(new_index, rname, lineage)
+        for rname in sorted(dirty_refs.keys()):
+            self._rfile_changed(rname, dirty_refs[rname])
+        self.placeholder_index = new_index
+        self._placeholder_index_changed()
+        self._write_through()
 
     def snapshot_lineage(
         self, instance: str, snapshot_hash: str, resource_names: List[str]
     ) -> None:
+        """The lineage files of the resources are saved as blobs named by the
+        hash of their contents, and the snapshot directory just contains a
+        manifest mapping each resource to its blob. Lineage which has not changed
+        since a previous snapshot is not copied again.
+        """
         assert instance == self.instance
+        self.flush()
         self._ensure_snapshot_dir_exists(snapshot_hash)
-        if len(resource_names) == 0:
-            self._write_placeholder_to_snapshot(
-                snapshot_hash,
-                "placeholder.txt",
-                "No resources for lineage snapshot %s\n" % snapshot_hash,
-            )
-            return
+        manifest = {}  # type: Dict[str, str]
+        new_paths = []  # type: List[str]
         for resource_name in resource_names:
             if self._rfile_exists(resource_name):
-                self._copy_rfile_to_snapshot(resource_name, snapshot_hash)
+                with open(join(self.current_lineage_path, resource_name + ".json"), "rb") as f:
+                    data = f.read()
             else:
-                self._save_rfile_to_snapshot(resource_name, {}, snapshot_hash)
+                # save an empty entry, so that restoring clears out any existing lineage
+                data = json.dumps(
+                    {"resource_name": resource_name, "lineages": []}, indent=2
+                ).encode("utf-8")
+            (manifest[resource_name], blob_path) = self._save_blob(data)
+            if blob_path is not None:
+                new_paths.append(blob_path)
+        new_paths.append(self._write_snapshot_manifest(snapshot_hash, manifest))
+        self._stage_snapshot_files(new_paths)
 
     def restore_lineage(
         self, instance: str, snapshot_hash: str, resources_to_restore: List[str], verbose=False
     ) -> None:
         assert instance == self.instance
+        self._invalidate_lineage_graph()
         snapshot_dir = join(self.snapshot_lineage_path, snapshot_hash)
         if not exists(snapshot_dir):
             raise LineageNotFoundError("Did not find lineage data for snapshot %s" % snapshot_hash)
-        for resource_name in resources_to_restore:
-            if self._snapshot_rfile_exists(resource_name, snapshot_hash):
-                (src_rpath, dest_rpath) = self._copy_snapshot_rfile_to_current(
-                    resource_name, snapshot_hash
-                )
-                if verbose:
-                    print("Restore: copied %s to %s" % (src_rpath, dest_rpath))
-            elif self._rfile_exists(resource_name):
-                # if included in the restore, but no lineage data remove current
-                deleted_rfile = self._delete_from_current(resource_name)
-                if verbose:
-                    print(
-                        "Removed %s, as %s has no lineage data with this snapshot"
-                        % (deleted_rfile, resource_name)
+        self.flush()
+        with _LineageLock(self.current_lineage_path):
+            for resource_name in resources_to_restore:
+                if self._snapshot_rfile_exists(resource_name, snapshot_hash):
+                    (src_rpath, dest_rpath) = self._copy_snapshot_rfile_to_current(
+                        resource_name, snapshot_hash
                     )
-            else:
-                if verbose:
-                    print("No lineage data for resource %s" % resource_name)
-        # invalidate the cache
-        self.resource_cache = {}  # type: ignore
+                    if verbose:
+                        print("Restore: copied %s to %s" % (src_rpath, dest_rpath))
+                elif self._rfile_exists(resource_name):
+                    # if included in the restore, but no lineage data remove current
+                    deleted_rfile = self._delete_from_current(resource_name)
+                    if verbose:
+                        print(
+                            "Removed %s, as %s has no lineage data with this snapshot"
+                            % (deleted_rfile, resource_name)
+                        )
+                else:
+                    if verbose:
+                        print("No lineage data for resource %s" % resource_name)
+            # invalidate the cache
+            self.resource_cache = {}  # type: ignore
+            self.ref_index = {}
+            self.file_signatures = {}
+            self._invalidate_placeholder_index()
 
     def delete_snapshot_lineage(self, instance: str, snapshot_hash: str) -> None:
         """Delete any lineage data associated with the specified snapshot.
         """
+        self._invalidate_lineage_graph(snapshot_hash)
         snapshot_dir = join(self.snapshot_lineage_path, snapshot_hash)
         if exists(snapshot_dir):
             shutil.rmtree(snapshot_dir)
+        self.manifest_cache.pop(snapshot_hash, None)
+        self._remove_unreferenced_blobs()
 
     def iterate_all(self, instance: str) -> Iterable[Tuple[ResourceRef, ResourceLineage]]:
         """Iterate through the contents of the store
         """
         self._load_resource_cache()
-        for (rname, mapping) in self.resource_cache.items():
-            for (ref, lineage) in mapping.items():
-                if isinstance(lineage, ImportedLineage):
-                    for (ref, lineage) in lineage.iterate():
-                        yield (ref, lineage)
-                    # There could be other entries in tne mapping,
-                    # but they will also point to this same
-                    # ImportedLineage
-                    break
-                else:  # normal case
+        for mapping in self.resource_cache.values():
+            for (ref, lineage) in _iterate_mapping(mapping):
+                yield (ref, lineage)
+
+    def stream_entries(
+        self, instance: str, snapshot_hash: Optional[str] = None
+    ) -> Iterable[Tuple[ResourceRef, ResourceLineage]]:
+        """The resource files are read one at a time. Files which are
+        already in the cache are taken from there, but we do not add
+        any files to the cache.
+        """
+        assert instance == self.instance
+        if snapshot_hash is not None:
+            for rname in self._get_resources_in_snapshot(snapshot_hash):
+                rfile_path = self._get_snapshot_rfile_path(rname, snapshot_hash)
+                mapping = self.snapshot_rfile_cache.get(rfile_path)
+                if mapping is None:
+                    with open(rfile_path, "rb") as f:
+                        mapping = decode_lineage_file(rname, f.read(), rfile_path)
+                for (ref, lineage) in _iterate_mapping(mapping):
                     yield (ref, lineage)
+            return
+        rnames = set(self.dirty_resources)
+        if isdir(self.current_lineage_path):
+            for fname in os.listdir(self.current_lineage_path):
+                if fname.endswith(".json"):
+                    rnames.add(fname[0 : -len(".json")])
+        for rname in sorted(rnames.difference(self.deleted_resources)):
+            mapping = self.resource_cache.get(rname)
+            if mapping is None:
+                rfile_path = join(self.current_lineage_path, rname + ".json")
+                try:
+                    with open(rfile_path, "rb") as f:
+                        mapping = decode_lineage_file(rname, f.read(), rfile_path)
+                except FileNotFoundError:
+                    continue  # removed by another process
+            for (ref, lineage) in _iterate_mapping(mapping):
+                yield (ref, lineage)
 
     def iterate_all_as_of_snapshot(
         self, instance: str, snapshot_hash: str
@@ -1751,14 +2998,15 @@ class FileLineageStore(LineageStore):
         return mapping.keys()
 
     def import_lineage_file(self, resource_name: str, lineages_as_json: List[Dict[str, Any]]):
+        self.flush()
+        self._invalidate_lineage_graph()
         nested_lineage = [ResourceLineage.from_json(d) for d in lineages_as_json]
         r = ImportedLineage(resource_name, nested_lineage)
+        self.resource_cache.pop(resource_name, None)
+        self.ref_index.pop(resource_name, None)
         rfile_path = join(self.current_lineage_path, resource_name + ".json")
-        # for backward compability, we just save the lineage values
-        with open(rfile_path, "w") as f:
-            json.dump(
-                {"resource_name": resource_name, "lineages": [r.to_json()],}, f, indent=2,
-            )
+        with _LineageLock(self.current_lineage_path):
+            _write_file_atomic(rfile_path, encode_lineage_file(resource_name, [r], self.compact))
 
 
 def make_lineage_table(
@@ -1781,19 +3029,13 @@ def make_lineage_table(
             assert isinstance(cert, PlaceholderCertificate)
             return "Placeholder:version=%d" % cert.version
 
+    graph = store.get_lineage_graph(instance, snapshot_hash)
+
     def input_to_str(cert):
-        try:
-            if snapshot_hash is not None:
-                lg = store.retrieve_entry_as_of_snapshot(instance, cert.ref, snapshot_hash)
-            else:
-                lg = store.retrieve_entry(instance, cert.ref)
-        except LineageNotFoundError:
-            return "%s (%s)" % (ref_name(cert.ref), cert_name(cert))
-        cur_cert = lg.get_cert_for_ref(cert.ref)
-        if cur_cert is None or cur_cert != cert:
-            return "%s (%s)" % (ref_name(cert.ref), cert_name(cert))
-        else:
+        if graph.is_current(cert):
             return "%s (current)" % ref_name(cert.ref)
+        else:
+            return "%s (%s)" % (ref_name(cert.ref), cert_name(cert))
 
     def lineage_to_cols(lineage) -> Tuple[str, str, Optional[List[str]]]:
         if isinstance(lineage, StepLineage):
@@ -1806,12 +3048,7 @@ def make_lineage_table(
         else:
             assert 0
 
-    iterator = (
-        store.iterate_all_as_of_snapshot(instance, snapshot_hash)
-        if snapshot_hash is not None
-        else store.iterate_all(instance)
-    )
-    for (ref, lineage) in iterator:
+    for (ref, lineage) in graph.entries:
         (ltype, details, inputs) = lineage_to_cols(lineage)
         yield (ref_name(ref), ltype, details, inputs)
 
@@ -1857,7 +3094,7 @@ def make_lineage_graph_for_visualization(
         elif isinstance(lineage, CodeLineage):
             return ("Code", cert_name(lineage.cert))
 
-    for (ref, lineage) in store.iterate_all(instance):
+    for (ref, lineage) in store.get_lineage_graph(instance).entries:
         if ref not in ref_nodes:
             ref_node = {"name": ref_name(ref), "label": "Ref", "id": next_node_id}
             nodes.append(ref_node)
@@ -1961,20 +3198,16 @@ def make_simplified_lineage_graph_for_resource(
                 self.next_node_id += 1
                 return (node_id, True)
 
+    graph = store.get_lineage_graph(instance, snapshot_hash)
+
     def get_cert_and_lineage(ref: ResourceRef) -> Tuple[Certificate, ResourceLineage]:
-        if snapshot_hash is not None:
-            lineage = store.retrieve_entry_as_of_snapshot(instance, ref, snapshot_hash)
-        else:
-            lineage = store.retrieve_entry(instance, ref)
+        lineage = graph.retrieve_entry(ref)
         cert = lineage.get_cert_for_ref(ref)
         assert cert is not None
         return (cert, lineage)
 
     def cert_in_lineage(cert: Certificate) -> bool:
-        if snapshot_hash is not None:
-            lineage = store.retrieve_entry_as_of_snapshot(instance, cert.ref, snapshot_hash)
-        else:
-            lineage = store.retrieve_entry(instance, cert.ref)
+        lineage = graph.retrieve_entry(cert.ref)
         other_cert = lineage.get_cert_for_ref(cert.ref)
         if other_cert == cert:
             return True
@@ -2015,15 +3248,7 @@ def make_simplified_lineage_graph_for_resource(
                             next_nested_worklist.append(input_cert.ref)
             nested_worklist = next_nested_worklist
 
-    if snapshot_hash is not None:
-        worklist = [
-            ref
-            for ref in store.get_refs_for_resource_as_of_snapshot(
-                instance, resource_name, snapshot_hash
-            )
-        ]
-    else:
-        worklist = [ref for ref in store.get_refs_for_resource(instance, resource_name)]
+    worklist = list(graph.get_refs_for_resource(resource_name))
     if len(worklist) == 0:
         raise LineageError("No lineage found for resource %s" % resource_name)
     while len(worklist) > 0:
@@ -97,6 +97,22 @@ class StringType(ParamType):
         return "string"
 
 
+class IntType(ParamType):
+    """Non-negative integer parameter"""
+
+    def parse(self, str_value: str) -> int:
+        return int(str_value)
+
+    def validate(self, value: Any) -> None:
+        if (not isinstance(value, int)) or isinstance(value, bool):
+            raise ParamValidationError("Value '%s' is not an integer" % repr(value))
+        if value < 0:
+            raise ParamValidationError("Value '%s' must not be negative" % repr(value))
+
+    def __str__(self):
+        return "int"
+
+
 class AbspathType(ParamType):
     def validate(self, value: Any) -> None:
         if not isinstance(value, str):
@@ -334,6 +350,36 @@ DWS_GIT_BRANCH = define_param(
     ptype=StringType()
 )
 
+LINEAGE_STORE = define_param(
+    "lineage.store",
+    default_value="file",
+    optional=False,
+    help="How lineage data is stored: 'file' (one json file per resource) or 'sqlite' "
+    + "(SQLite databases, which scale better to large numbers of steps). Use the "
+    + "'dws lineage migrate' command to switch an existing workspace to sqlite.",
+    ptype=EnumType("file", "sqlite"),
+)
+
+LINEAGE_COMPACT_FORMAT = define_param(
+    "lineage.compact_format",
+    default_value=False,
+    optional=False,
+    help="If True, the file lineage store writes lineage files in a compact json format, "
+    + "which is smaller and faster to parse. Older versions of DWS cannot read this "
+    + "format, so only enable it if everyone using the workspace has upgraded.",
+    ptype=BoolType(),
+)
+
+LINEAGE_WRITE_BEHIND = define_param(
+    "lineage.write_behind",
+    default_value=True,
+    optional=False,
+    help="If True, the file lineage store keeps changes to the current lineage in memory "
+    + "and writes them out together when a step completes, a snapshot is taken, or the "
+    + "process exits. If False, each change is written out immediately.",
+    ptype=BoolType(),
+)
+
 def get_global_param_defaults():
     """Return a mapping of all default values of global params for use
     in generating the initial config file
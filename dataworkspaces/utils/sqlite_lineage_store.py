@@ -0,0 +1,890 @@
+"""
+Lineage store backed by SQLite.
+
+The :class:`~dataworkspaces.utils.lineage_utils.FileLineageStore` keeps one json
+file per resource and rewrites the whole file on each change, which gets slow
+once a workspace has accumulated many steps. This store keeps the same data in
+two SQLite databases:
+
+* The *current* database holds the lineage for the current state of the
+  workspace. It is private to the instance.
+* The *snapshot* database holds the lineage for all snapshots. It is attached
+  to the connection as the ``snap`` schema.
+
+A binary database cannot be merged, so the snapshot database is not what gets
+replicated to the other instances of the workspace. Instead, if an export
+directory is provided, the lineage of each snapshot is also written to its
+own json file (``<SNAPSHOT_HASH>.lineage.json``) in that directory. Snapshots
+taken in different instances add different files, which merge cleanly. When
+the store is opened, the snapshot database is brought in sync with the
+export directory: snapshots with a new export file (e.g. from a pull) are
+loaded, and snapshots whose file has been removed are deleted.
+
+Both databases have the same tables:
+
+``lineages``
+  One row per distinct lineage object, stored as json and keyed by a hash of
+  its content. Since snapshots usually share most of their lineage with the
+  previous snapshot, this means that a snapshot only adds the lineage that
+  changed.
+``steps``
+  The name, start time and execution time of each step lineage.
+``certificates``
+  The certificates of each lineage (outputs, inputs and code), used to find the
+  lineages with placeholders and to query lineage by resource.
+``refs``
+  Maps each (resource, subpath) to its lineage. The scope column is the empty
+  string for the current lineage and the snapshot hash in the snapshot database.
+``snapshots`` and ``snapshot_resources``
+  The snapshots and the resources included in each snapshot.
+
+Subpaths are stored with the empty string representing the whole resource,
+so that refs can be looked up by (resource, subpath) via the indexes, including
+the covering and covered refs.
+"""
+import os
+from os.path import isdir, join, exists
+import sys
+import json
+import hashlib
+import sqlite3
+from typing import Any, Dict, Iterable, List, Optional, Tuple, Union, cast
+
+from dataworkspaces.utils.lineage_utils import (
+    LineageStore,
+    FileLineageStore,
+    ResourceRef,
+    ResourceLineage,
+    StepLineage,
+    ImportedLineage,
+    Certificate,
+    HashCertificate,
+    PlaceholderCertificate,
+    LineageConflictError,
+    LineageNotFoundError,
+)
+
+CURRENT_SCOPE = ""
+SNAPSHOT_EXPORT_SUFFIX = ".lineage.json"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS {s}.lineages (
+    lineage_id INTEGER PRIMARY KEY,
+    content_hash TEXT NOT NULL UNIQUE,
+    lineage_type TEXT NOT NULL,
+    lineage_json TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS {s}.steps (
+    lineage_id INTEGER PRIMARY KEY,
+    step_name TEXT NOT NULL,
+    start_time TEXT NOT NULL,
+    execution_time_seconds REAL
+);
+CREATE INDEX IF NOT EXISTS {s}.steps_by_name ON steps (step_name);
+CREATE TABLE IF NOT EXISTS {s}.certificates (
+    lineage_id INTEGER NOT NULL,
+    usage TEXT NOT NULL,
+    resource_name TEXT NOT NULL,
+    subpath TEXT NOT NULL,
+    cert_type TEXT NOT NULL,
+    hashval TEXT,
+    version INTEGER
+);
+CREATE INDEX IF NOT EXISTS {s}.certificates_by_ref ON certificates (resource_name, subpath);
+CREATE INDEX IF NOT EXISTS {s}.certificates_by_lineage ON certificates (lineage_id);
+CREATE TABLE IF NOT EXISTS {s}.refs (
+    scope TEXT NOT NULL,
+    resource_name TEXT NOT NULL,
+    subpath TEXT NOT NULL,
+    lineage_id INTEGER NOT NULL,
+    PRIMARY KEY (scope, resource_name, subpath)
+);
+CREATE INDEX IF NOT EXISTS {s}.refs_by_lineage ON refs (lineage_id);
+CREATE TABLE IF NOT EXISTS {s}.snapshots (
+    snapshot_hash TEXT PRIMARY KEY
+);
+CREATE TABLE IF NOT EXISTS {s}.snapshot_resources (
+    snapshot_hash TEXT NOT NULL,
+    resource_name TEXT NOT NULL,
+    PRIMARY KEY (snapshot_hash, resource_name)
+);
+"""
+
+LineageOrImported = Union[ResourceLineage, ImportedLineage]
+
+
+def _subpath_key(subpath: Optional[str]) -> str:
+    return subpath if subpath is not None else ""
+
+
+def _ref_from_row(resource_name: str, subpath: str) -> ResourceRef:
+    return ResourceRef(resource_name, subpath if subpath != "" else None)
+
+
+def _ancestor_keys(subpath: Optional[str]) -> List[str]:
+    """Return the subpath keys of the refs which would cover a ref with this
+    subpath: the whole resource plus each parent directory of the subpath.
+    """
+    if subpath is None:
+        return []
+    components = [c for c in subpath.split("/") if c != ""]
+    return [""] + ["/".join(components[0:i]) for i in range(1, len(components))]
+
+
+def _lineage_to_json_str(lineage: LineageOrImported) -> str:
+    return json.dumps(lineage.to_json(), sort_keys=True, separators=(",", ":"))
+
+
+def _content_hash(lineage_json: str) -> str:
+    return hashlib.sha1(lineage_json.encode("utf-8")).hexdigest()
+
+
+def _cert_row(usage: str, cert: Certificate) -> Tuple[str, str, str, str, Optional[str], Optional[int]]:
+    if isinstance(cert, HashCertificate):
+        return (usage, cert.ref.name, _subpath_key(cert.ref.subpath), "hash", cert.hashval, None)
+    else:
+        assert isinstance(cert, PlaceholderCertificate)
+        return (
+            usage,
+            cert.ref.name,
+            _subpath_key(cert.ref.subpath),
+            "placeholder",
+            None,
+            cert.version,
+        )
+
+
+class SqliteLineageStore(LineageStore):
+    """Store lineage data in SQLite databases on the local filesystem.
+    """
+
+    def __init__(
+        self,
+        instance: str,
+        current_db_path: str,
+        snapshot_db_path: str,
+        snapshot_export_dir: Optional[str] = None,
+    ):
+        """:current_db_path: and :snapshot_db_path: are private to the instance.
+
+        :snapshot_export_dir:, if provided, holds the json export of each snapshot's
+        lineage and should be replicated/visible to all instances of the workspace.
+
+        As with the FileLineageStore, we pass in :instance: to the constructor
+        and the instance parameters of the methods must all match this instance.
+        """
+        self.instance = instance
+        self.current_db_path = current_db_path
+        self.snapshot_db_path = snapshot_db_path
+        self.snapshot_export_dir = snapshot_export_dir
+        self._conn = None  # type: Optional[sqlite3.Connection]
+        # Parsed lineages, keyed by content hash. As the key is determined by the
+        # content, entries never go stale.
+        self.lineage_cache = {}  # type: Dict[str, LineageOrImported]
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        if self._conn is None:
+            conn = sqlite3.connect(self.current_db_path)
+            conn.execute("ATTACH DATABASE ? AS snap", (self.snapshot_db_path,))
+            with conn:
+                for schema in ("main", "snap"):
+                    conn.executescript(SCHEMA.format(s=schema))
+            self._conn = conn
+            if self.snapshot_export_dir is not None:
+                self._sync_snapshot_exports()
+        return self._conn
+
+    def _get_export_path(self, snapshot_hash: str) -> str:
+        assert self.snapshot_export_dir is not None
+        return join(self.snapshot_export_dir, snapshot_hash + SNAPSHOT_EXPORT_SUFFIX)
+
+    def _write_snapshot_export(self, snapshot_hash: str) -> str:
+        """Write the lineage of the snapshot to its export file and return the path"""
+        resources = [
+            row[0]
+            for row in self.conn.execute(
+                "SELECT resource_name FROM snap.snapshot_resources WHERE snapshot_hash=? "
+                + "ORDER BY 1",
+                (snapshot_hash,),
+            )
+        ]
+        refs = []  # type: List[List[str]]
+        lineages = {}  # type: Dict[str, Any]
+        for (resource_name, subpath, content_hash, lineage_json) in self.conn.execute(
+            "SELECT r.resource_name, r.subpath, l.content_hash, l.lineage_json "
+            + "FROM snap.refs r JOIN snap.lineages l ON r.lineage_id=l.lineage_id "
+            + "WHERE r.scope=? ORDER BY 1, 2",
+            (snapshot_hash,),
+        ):
+            refs.append([resource_name, subpath, content_hash])
+            lineages[content_hash] = json.loads(lineage_json)
+        export_path = self._get_export_path(snapshot_hash)
+        with open(export_path, "w") as f:
+            json.dump(
+                {
+                    "snapshot_hash": snapshot_hash,
+                    "resources": resources,
+                    "refs": refs,
+                    "lineages": lineages,
+                },
+                f,
+                sort_keys=True,
+                indent=1,
+            )
+        return export_path
+
+    def _load_snapshot_export(self, snapshot_hash: str) -> None:
+        """Load the snapshot's export file. Must be called within a transaction."""
+        with open(self._get_export_path(snapshot_hash), "r") as f:
+            data = json.load(f)
+        self.conn.execute("INSERT OR IGNORE INTO snap.snapshots VALUES (?)", (snapshot_hash,))
+        self.conn.executemany(
+            "INSERT OR IGNORE INTO snap.snapshot_resources VALUES (?, ?)",
+            [(snapshot_hash, resource_name) for resource_name in data["resources"]],
+        )
+        lineage_ids = {
+            content_hash: self._intern_lineage("snap", ResourceLineage.from_json(lineage_json))
+            for (content_hash, lineage_json) in data["lineages"].items()
+        }
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO snap.refs VALUES (?, ?, ?, ?)",
+            [
+                (snapshot_hash, resource_name, subpath, lineage_ids[content_hash])
+                for (resource_name, subpath, content_hash) in data["refs"]
+            ],
+        )
+
+    def _sync_snapshot_exports(self) -> None:
+        """Load the snapshots which have an export file but are not in the snapshot
+        database and delete those whose export file no longer exists.
+        """
+        assert self.snapshot_export_dir is not None
+        exported = set(
+            fname[0 : -len(SNAPSHOT_EXPORT_SUFFIX)]
+            for fname in (
+                os.listdir(self.snapshot_export_dir) if isdir(self.snapshot_export_dir) else []
+            )
+            if fname.endswith(SNAPSHOT_EXPORT_SUFFIX)
+        )
+        in_db = set(self.get_snapshot_hashes())
+        if exported == in_db:
+            return
+        with self.conn:
+            for snapshot_hash in sorted(exported - in_db):
+                self._load_snapshot_export(snapshot_hash)
+            for snapshot_hash in sorted(in_db - exported):
+                self._delete_snapshot_rows(snapshot_hash)
+            self._gc("snap")
+
+    def close(self) -> None:
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def _parse(self, content_hash: str, lineage_json: str) -> LineageOrImported:
+        lineage = self.lineage_cache.get(content_hash)
+        if lineage is None:
+            lineage = ResourceLineage.from_json(json.loads(lineage_json))
+            self.lineage_cache[content_hash] = lineage
+        return lineage
+
+    def _intern_lineage(self, schema: str, lineage: LineageOrImported) -> int:
+        """Add the lineage to the lineages table of the schema, if an identical one is
+        not already present, and return its id. Must be called within a transaction.
+        """
+        lineage_json = _lineage_to_json_str(lineage)
+        content_hash = _content_hash(lineage_json)
+        row = self.conn.execute(
+            "SELECT lineage_id FROM %s.lineages WHERE content_hash=?" % schema, (content_hash,)
+        ).fetchone()
+        if row is not None:
+            return row[0]
+        lineage_type = lineage.to_json()["type"]
+        cur = self.conn.execute(
+            "INSERT INTO %s.lineages (content_hash, lineage_type, lineage_json) VALUES (?, ?, ?)"
+            % schema,
+            (content_hash, lineage_type, lineage_json),
+        )
+        lineage_id = cast(int, cur.lastrowid)
+        self._index_lineage(schema, lineage_id, lineage)
+        return lineage_id
+
+    def _index_lineage(self, schema: str, lineage_id: int, lineage: LineageOrImported) -> None:
+        """Populate the steps and certificates tables for a lineage"""
+        if isinstance(lineage, StepLineage):
+            self.conn.execute(
+                "INSERT INTO %s.steps VALUES (?, ?, ?, ?)" % schema,
+                (
+                    lineage_id,
+                    lineage.step_name,
+                    lineage.start_time.isoformat(),
+                    lineage.execution_time_seconds,
+                ),
+            )
+            cert_rows = (
+                [_cert_row("output", c) for c in lineage.get_certs()]
+                + [_cert_row("input", c) for c in lineage.get_input_certs()]
+                + [_cert_row("code", c) for c in lineage.get_code_certs()]
+            )
+        else:
+            cert_rows = [_cert_row("output", c) for c in lineage.get_certs()]
+        self.conn.executemany(
+            "INSERT INTO %s.certificates VALUES (?, ?, ?, ?, ?, ?, ?)" % schema,
+            [(lineage_id,) + row for row in cert_rows],
+        )
+
+    def _delete_lineages(self, schema: str, lineage_ids: Iterable[int]) -> None:
+        for table in ("lineages", "steps", "certificates"):
+            self.conn.executemany(
+                "DELETE FROM %s.%s WHERE lineage_id=?" % (schema, table),
+                [(lineage_id,) for lineage_id in lineage_ids],
+            )
+
+    def _gc(self, schema: str, candidate_ids: Optional[Iterable[int]] = None) -> None:
+        """Remove lineages that are no longer referenced. If candidate_ids is
+        provided, only those lineages are checked.
+        """
+        if candidate_ids is None:
+            rows = self.conn.execute(
+                "SELECT lineage_id FROM {s}.lineages WHERE lineage_id NOT IN "
+                "(SELECT lineage_id FROM {s}.refs)".format(s=schema)
+            ).fetchall()
+        else:
+            rows = [
+                (lineage_id,)
+                for lineage_id in set(candidate_ids)
+                if self.conn.execute(
+                    "SELECT 1 FROM %s.refs WHERE lineage_id=? LIMIT 1" % schema, (lineage_id,)
+                ).fetchone()
+                is None
+            ]
+        self._delete_lineages(schema, [row[0] for row in rows])
+
+    def _lookup(
+        self, schema: str, scope: str, ref: ResourceRef, include_covers: bool = True
+    ) -> Optional[Tuple[str, str]]:
+        """Return the (content_hash, lineage_json) of the lineage at ref or,
+        if include_covers is True, at a ref covering ref.
+        """
+        keys = [_subpath_key(ref.subpath)]
+        if include_covers:
+            keys += _ancestor_keys(ref.subpath)
+        # Longest key first, so that an exact match wins
+        row = self.conn.execute(
+            (
+                "SELECT l.content_hash, l.lineage_json FROM {s}.refs r "
+                + "JOIN {s}.lineages l ON r.lineage_id=l.lineage_id "
+                + "WHERE r.scope=? AND r.resource_name=? AND r.subpath IN (%s) "
+                + "ORDER BY length(r.subpath) DESC LIMIT 1"
+            ).format(s=schema)
+            % ",".join(["?"] * len(keys)),
+            [scope, ref.name] + keys,
+        ).fetchone()
+        return (row[0], row[1]) if row is not None else None
+
+    def _covered_keys(self, schema: str, scope: str, ref: ResourceRef) -> List[str]:
+        """Return the subpath keys of the refs strictly covered by ref"""
+        if ref.subpath is None:
+            query = "SELECT subpath FROM %s.refs WHERE scope=? AND resource_name=? AND subpath!=''"
+            params = [scope, ref.name]
+        else:
+            prefix = ref.subpath.rstrip("/")
+            # '0' is the character after '/', so this selects everything under prefix/
+            query = (
+                "SELECT subpath FROM %s.refs WHERE scope=? AND resource_name=? "
+                + "AND subpath>=? AND subpath<?"
+            )
+            params = [scope, ref.name, prefix + "/", prefix + "0"]
+        return [row[0] for row in self.conn.execute(query % schema, params)]
+
+    def _refs_for_resource(self, schema: str, scope: str, resource_name: str) -> List[ResourceRef]:
+        return [
+            _ref_from_row(resource_name, row[0])
+            for row in self.conn.execute(
+                "SELECT subpath FROM %s.refs WHERE scope=? AND resource_name=? ORDER BY subpath"
+                % schema,
+                (scope, resource_name),
+            )
+        ]
+
+    def _iterate(
+        self, schema: str, scope: str, stream: bool = False
+    ) -> Iterable[Tuple[ResourceRef, ResourceLineage]]:
+        """If stream is True, the rows are read from the cursor as we go and
+        the parsed lineage is not cached.
+        """
+        cursor = self.conn.execute(
+            (
+                "SELECT r.resource_name, r.subpath, l.content_hash, l.lineage_json "
+                + "FROM {s}.refs r JOIN {s}.lineages l ON r.lineage_id=l.lineage_id "
+                + "WHERE r.scope=? ORDER BY r.resource_name, r.subpath"
+            ).format(s=schema),
+            (scope,),
+        )
+        rows = cursor if stream else cursor.fetchall()
+        imported_resources = set()
+        for (resource_name, subpath, content_hash, lineage_json) in rows:
+            if resource_name in imported_resources:
+                continue  # handled by the iterate() of the imported lineage
+            if stream:
+                lineage = self.lineage_cache.get(content_hash)
+                if lineage is None:
+                    lineage = ResourceLineage.from_json(json.loads(lineage_json))
+            else:
+                lineage = self._parse(content_hash, lineage_json)
+            if isinstance(lineage, ImportedLineage):
+                imported_resources.add(resource_name)
+                for (ref, nested) in lineage.iterate():
+                    yield (ref, nested)
+            else:
+                yield (_ref_from_row(resource_name, subpath), lineage)
+
+    def _snapshot_has_resource(self, snapshot_hash: str, resource_name: str) -> bool:
+        return (
+            self.conn.execute(
+                "SELECT 1 FROM snap.snapshot_resources WHERE snapshot_hash=? AND resource_name=?",
+                (snapshot_hash, resource_name),
+            ).fetchone()
+            is not None
+        )
+
+    def _has_snapshot(self, snapshot_hash: str) -> bool:
+        return (
+            self.conn.execute(
+                "SELECT 1 FROM snap.snapshots WHERE snapshot_hash=?", (snapshot_hash,)
+            ).fetchone()
+            is not None
+        )
+
+    def _copy_refs(
+        self,
+        from_schema: str,
+        from_scope: str,
+        to_schema: str,
+        to_scope: str,
+        resource_name: str,
+    ) -> int:
+        """Copy the refs (and lineages) of a resource between schemas. The lineages
+        are matched by content hash, so lineages already in the destination are
+        shared rather than copied. Returns the number of refs copied.
+        """
+        missing = self.conn.execute(
+            (
+                "SELECT DISTINCT l.content_hash, l.lineage_type, l.lineage_json "
+                + "FROM {f}.refs r JOIN {f}.lineages l ON r.lineage_id=l.lineage_id "
+                + "WHERE r.scope=? AND r.resource_name=? "
+                + "AND l.content_hash NOT IN (SELECT content_hash FROM {t}.lineages)"
+            ).format(f=from_schema, t=to_schema),
+            (from_scope, resource_name),
+        ).fetchall()
+        for (content_hash, lineage_type, lineage_json) in missing:
+            cur = self.conn.execute(
+                "INSERT INTO %s.lineages (content_hash, lineage_type, lineage_json) VALUES (?, ?, ?)"
+                % to_schema,
+                (content_hash, lineage_type, lineage_json),
+            )
+            self._index_lineage(to_schema, cast(int, cur.lastrowid), self._parse(content_hash, lineage_json))
+        cur = self.conn.execute(
+            (
+                "INSERT INTO {t}.refs (scope, resource_name, subpath, lineage_id) "
+                + "SELECT ?, r.resource_name, r.subpath, t.lineage_id "
+                + "FROM {f}.refs r JOIN {f}.lineages l ON r.lineage_id=l.lineage_id "
+                + "JOIN {t}.lineages t ON t.content_hash=l.content_hash "
+                + "WHERE r.scope=? AND r.resource_name=?"
+            ).format(f=from_schema, t=to_schema),
+            (to_scope, from_scope, resource_name),
+        )
+        return cur.rowcount
+
+    def _clear_resource(self, resource_name: str) -> None:
+        old_ids = [
+            row[0]
+            for row in self.conn.execute(
+                "SELECT lineage_id FROM main.refs WHERE scope=? AND resource_name=?",
+                (CURRENT_SCOPE, resource_name),
+            )
+        ]
+        self.conn.execute(
+            "DELETE FROM main.refs WHERE scope=? AND resource_name=?",
+            (CURRENT_SCOPE, resource_name),
+        )
+        self._gc("main", old_ids)
+
+    def store_entry(self, instance: str, lineage: ResourceLineage) -> None:
+        assert instance == self.instance
+        self._invalidate_lineage_graph()
+        refs = [cert.ref for cert in lineage.get_certs()]
+        if len(refs) == 0:
+            return
+        with self.conn:
+            for ref in refs:
+                if self._lookup("main", CURRENT_SCOPE, ref, include_covers=False) is not None:
+                    continue  # got an exact match, there won't be conflicts
+                for key in _ancestor_keys(ref.subpath):
+                    if self._lookup(
+                        "main", CURRENT_SCOPE, _ref_from_row(ref.name, key), include_covers=False
+                    ):
+                        raise LineageConflictError(
+                            "Cannot store new lineage data at %s: existing lineage data %s is a parent path"
+                            % (ref, _ref_from_row(ref.name, key))
+                        )
+                covered = self._covered_keys("main", CURRENT_SCOPE, ref)
+                if len(covered) > 0:
+                    # As in the file store, we refuse rather than overwrite: the new
+                    # entry would silently replace the lineage of the child paths.
+                    raise LineageConflictError(
+                        "Cannot store new lineage data at %s: existing lineage data %s is a child path"
+                        % (ref, _ref_from_row(ref.name, covered[0]))
+                    )
+            lineage_id = self._intern_lineage("main", lineage)
+            old_ids = [
+                row[0]
+                for ref in refs
+                for row in self.conn.execute(
+                    "SELECT lineage_id FROM main.refs WHERE scope=? AND resource_name=? AND subpath=?",
+                    (CURRENT_SCOPE, ref.name, _subpath_key(ref.subpath)),
+                )
+            ]
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO main.refs VALUES (?, ?, ?, ?)",
+                [
+                    (CURRENT_SCOPE, ref.name, _subpath_key(ref.subpath), lineage_id)
+                    for ref in refs
+                ],
+            )
+            self._gc("main", old_ids)
+
+    def retrieve_entry(self, instance: str, ref: ResourceRef) -> ResourceLineage:
+        assert instance == self.instance
+        row = self._lookup("main", CURRENT_SCOPE, ref)
+        if row is None:
+            raise LineageNotFoundError("No lineage exists for %s" % str(ref))
+        return self._parse(*row)  # type: ignore
+
+    def has_entry(self, instance: str, ref: ResourceRef, include_covers: bool = True) -> bool:
+        assert instance == self.instance
+        return self._lookup("main", CURRENT_SCOPE, ref, include_covers) is not None
+
+    def clear_entry(self, instance: str, ref: ResourceRef) -> None:
+        assert instance == self.instance
+        self._invalidate_lineage_graph()
+        with self.conn:
+            if ref.subpath is None:
+                self._clear_resource(ref.name)
+                return
+            keys = [_subpath_key(ref.subpath)] + self._covered_keys("main", CURRENT_SCOPE, ref)
+            old_ids = []  # type: List[int]
+            for key in keys:
+                old_ids.extend(
+                    row[0]
+                    for row in self.conn.execute(
+                        "SELECT lineage_id FROM main.refs WHERE scope=? AND resource_name=? AND subpath=?",
+                        (CURRENT_SCOPE, ref.name, key),
+                    )
+                )
+                self.conn.execute(
+                    "DELETE FROM main.refs WHERE scope=? AND resource_name=? AND subpath=?",
+                    (CURRENT_SCOPE, ref.name, key),
+                )
+            self._gc("main", old_ids)
+
+    def get_refs_for_resource(self, instance: str, resource_name: str) -> Iterable[ResourceRef]:
+        assert instance == self.instance
+        return self._refs_for_resource("main", CURRENT_SCOPE, resource_name)
+
+    def replace_placeholders(
+        self, instance: str, hash_mapping: Dict[str, str], verbose=False
+    ) -> None:
+        """Only the lineages which have placeholder certificates are visited,
+        since others will not change and cannot raise a LineagePlaceHolderError.
+        """
+        assert instance == self.instance
+        self._invalidate_lineage_graph()
+        with self.conn:
+            rows = self.conn.execute(
+                "SELECT lineage_id, lineage_json FROM main.lineages WHERE lineage_id IN "
+                + "(SELECT lineage_id FROM main.certificates WHERE cert_type='placeholder')"
+            ).fetchall()
+            for (lineage_id, lineage_json) in rows:
+                # we parse a fresh copy, as replace_placeholders() modifies the lineage
+                lineage = ResourceLineage.from_json(json.loads(lineage_json))
+                lineage.replace_placeholders(hash_mapping)
+                new_json = _lineage_to_json_str(lineage)
+                if new_json == lineage_json:
+                    if verbose:
+                        print("No placeholders replaced for lineage:  \n%s" % lineage)
+                    continue
+                new_id = self._intern_lineage("main", lineage)
+                self.conn.execute(
+                    "UPDATE main.refs SET lineage_id=? WHERE lineage_id=?", (new_id, lineage_id)
+                )
+                self._delete_lineages("main", [lineage_id])
+                if verbose:
+                    print("replaced placeholders for lineage\n   %s" % lineage)
+
+    def snapshot_lineage(
+        self, instance: str, snapshot_hash: str, resource_names: List[str]
+    ) -> None:
+        """Copy the current lineage of the resources to the snapshot. If there is an
+        export directory, the snapshot's export file is written as well.
+        """
+        assert instance == self.instance
+        with self.conn:
+            self.conn.execute(
+                "INSERT OR IGNORE INTO snap.snapshots VALUES (?)", (snapshot_hash,)
+            )
+            for resource_name in resource_names:
+                self.conn.execute(
+                    "INSERT OR IGNORE INTO snap.snapshot_resources VALUES (?, ?)",
+                    (snapshot_hash, resource_name),
+                )
+                self.conn.execute(
+                    "DELETE FROM snap.refs WHERE scope=? AND resource_name=?",
+                    (snapshot_hash, resource_name),
+                )
+                self._copy_refs("main", CURRENT_SCOPE, "snap", snapshot_hash, resource_name)
+        if self.snapshot_export_dir is not None:
+            self._write_snapshot_export(snapshot_hash)
+
+    def restore_lineage(
+        self, instance: str, snapshot_hash: str, resources_to_restore: List[str], verbose=False
+    ) -> None:
+        assert instance == self.instance
+        self._invalidate_lineage_graph()
+        if not self._has_snapshot(snapshot_hash):
+            raise LineageNotFoundError("Did not find lineage data for snapshot %s" % snapshot_hash)
+        with self.conn:
+            for resource_name in resources_to_restore:
+                self._clear_resource(resource_name)
+                if self._snapshot_has_resource(snapshot_hash, resource_name):
+                    num_refs = self._copy_refs(
+                        "snap", snapshot_hash, "main", CURRENT_SCOPE, resource_name
+                    )
+                    if verbose:
+                        print(
+                            "Restore: copied %d lineage entries for %s" % (num_refs, resource_name)
+                        )
+                elif verbose:
+                    print("No lineage data for resource %s in this snapshot" % resource_name)
+
+    def _delete_snapshot_rows(self, snapshot_hash: str) -> None:
+        """Must be called within a transaction"""
+        self._invalidate_lineage_graph(snapshot_hash)
+        self.conn.execute("DELETE FROM snap.refs WHERE scope=?", (snapshot_hash,))
+        self.conn.execute(
+            "DELETE FROM snap.snapshot_resources WHERE snapshot_hash=?", (snapshot_hash,)
+        )
+        self.conn.execute("DELETE FROM snap.snapshots WHERE snapshot_hash=?", (snapshot_hash,))
+
+    def delete_snapshot_lineage(self, instance: str, snapshot_hash: str) -> None:
+        """Delete any lineage data associated with the specified snapshot, including
+        its export file.
+        """
+        with self.conn:
+            self._delete_snapshot_rows(snapshot_hash)
+            self._gc("snap")
+        if self.snapshot_export_dir is not None and exists(self._get_export_path(snapshot_hash)):
+            os.remove(self._get_export_path(snapshot_hash))
+
+    def iterate_all(self, instance: str) -> Iterable[Tuple[ResourceRef, ResourceLineage]]:
+        """Iterate through the contents of the store
+        """
+        return self._iterate("main", CURRENT_SCOPE)
+
+    def iterate_all_as_of_snapshot(
+        self, instance: str, snapshot_hash: str
+    ) -> Iterable[Tuple[ResourceRef, ResourceLineage]]:
+        """Iterate through the contents of the store, as of the specific snapshot.
+        """
+        if not self._has_snapshot(snapshot_hash):
+            raise LineageNotFoundError("No lineage data found for snapshot hash %s" % snapshot_hash)
+        return self._iterate("snap", snapshot_hash)
+
+    def stream_entries(
+        self, instance: str, snapshot_hash: Optional[str] = None
+    ) -> Iterable[Tuple[ResourceRef, ResourceLineage]]:
+        if snapshot_hash is None:
+            return self._iterate("main", CURRENT_SCOPE, stream=True)
+        if not self._has_snapshot(snapshot_hash):
+            raise LineageNotFoundError("No lineage data found for snapshot hash %s" % snapshot_hash)
+        return self._iterate("snap", snapshot_hash, stream=True)
+
+    def dump(self, instance: str) -> None:
+        def _indent(s, level, underline=None):
+            for line in s.split("\n"):
+                indented = " " * level + line
+                print(indented)
+                if underline is not None:
+                    print(" " * level + underline * len(line))
+
+        _indent("Lineage store", 2, "=")
+        last_rname = None
+        for (rname, subpath, lineage_json) in self.conn.execute(
+            "SELECT r.resource_name, r.subpath, l.lineage_json FROM main.refs r "
+            + "JOIN main.lineages l ON r.lineage_id=l.lineage_id "
+            + "WHERE r.scope=? ORDER BY r.resource_name, r.subpath",
+            (CURRENT_SCOPE,),
+        ):
+            if rname != last_rname:
+                _indent("Resource %s" % rname, 4, "-")
+                last_rname = rname
+            _indent(str(_ref_from_row(rname, subpath)) + ":", 6)
+            _indent(json.dumps(json.loads(lineage_json), indent=2), 8)
+        print()
+
+    def retrieve_entry_as_of_snapshot(
+        self, instance: str, ref: ResourceRef, snapshot_hash: str
+    ) -> ResourceLineage:
+        if not self._snapshot_has_resource(snapshot_hash, ref.name):
+            raise LineageNotFoundError("%s as of snapshot %s" % (ref.name, snapshot_hash))
+        row = self._lookup("snap", snapshot_hash, ref)
+        if row is None:
+            raise LineageNotFoundError(
+                "No lineage exists for %s as of %s" % (str(ref), snapshot_hash)
+            )
+        return self._parse(*row)  # type: ignore
+
+    def has_entry_as_of_snapshot(
+        self, instance: str, ref: ResourceRef, snapshot_hash: str, include_covers: bool = True
+    ) -> bool:
+        if not self._snapshot_has_resource(snapshot_hash, ref.name):
+            raise LineageNotFoundError("%s as of snapshot %s" % (ref.name, snapshot_hash))
+        return self._lookup("snap", snapshot_hash, ref, include_covers) is not None
+
+    def get_refs_for_resource_as_of_snapshot(
+        self, instance: str, resource_name: str, snapshot_hash: str
+    ) -> Iterable[ResourceRef]:
+        return self._refs_for_resource("snap", snapshot_hash, resource_name)
+
+    def import_lineage_file(self, resource_name: str, lineages_as_json: List[Dict[str, Any]]):
+        self._invalidate_lineage_graph()
+        nested_lineage = [ResourceLineage.from_json(d) for d in lineages_as_json]
+        r = ImportedLineage(resource_name, nested_lineage)
+        with self.conn:
+            self._clear_resource(resource_name)
+            lineage_id = self._intern_lineage("main", r)
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO main.refs VALUES (?, ?, ?, ?)",
+                [
+                    (CURRENT_SCOPE, resource_name, _subpath_key(cert.ref.subpath), lineage_id)
+                    for cert in r.get_certs()
+                ],
+            )
+
+    def get_snapshot_hashes(self) -> List[str]:
+        """Return the hashes of the snapshots which have lineage in this store"""
+        return [
+            row[0]
+            for row in self.conn.execute("SELECT snapshot_hash FROM snap.snapshots ORDER BY 1")
+        ]
+
+    def _store_snapshot_resource(
+        self, snapshot_hash: str, resource_name: str, lineage_map: Dict[ResourceRef, Any]
+    ) -> None:
+        """Used by the migration. Must be called within a transaction."""
+        self.conn.execute("INSERT OR IGNORE INTO snap.snapshots VALUES (?)", (snapshot_hash,))
+        self.conn.execute(
+            "INSERT OR IGNORE INTO snap.snapshot_resources VALUES (?, ?)",
+            (snapshot_hash, resource_name),
+        )
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO snap.refs VALUES (?, ?, ?, ?)",
+            [
+                (snapshot_hash, ref.name, _subpath_key(ref.subpath), self._intern_lineage("snap", l))
+                for (ref, l) in lineage_map.items()
+            ],
+        )
+
+    def _store_current_resource(
+        self, resource_name: str, lineage_map: Dict[ResourceRef, Any]
+    ) -> None:
+        """Used by the migration. Must be called within a transaction."""
+        self._clear_resource(resource_name)
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO main.refs VALUES (?, ?, ?, ?)",
+            [
+                (CURRENT_SCOPE, ref.name, _subpath_key(ref.subpath), self._intern_lineage("main", l))
+                for (ref, l) in lineage_map.items()
+            ],
+        )
+
+
+def _migrate_current_lineage(file_store: FileLineageStore, sqlite_store: SqliteLineageStore) -> int:
+    num_resources = 0
+    if isdir(file_store.current_lineage_path):
+        for fname in sorted(os.listdir(file_store.current_lineage_path)):
+            if not fname.endswith(".json"):
+                continue
+            rname = fname[0 : -len(".json")]
+            sqlite_store._store_current_resource(rname, file_store._parse_rfile(rname))
+            num_resources += 1
+    return num_resources
+
+
+def _migrate_snapshot_lineage(
+    file_store: FileLineageStore,
+    sqlite_store: SqliteLineageStore,
+    snapshot_hashes: List[str],
+    verbose: bool,
+) -> None:
+    for snapshot_hash in snapshot_hashes:
+        sqlite_store.conn.execute(
+            "INSERT OR IGNORE INTO snap.snapshots VALUES (?)", (snapshot_hash,)
+        )
+        for rname in file_store._get_resources_in_snapshot(snapshot_hash):
+            sqlite_store.conn.execute(
+                "DELETE FROM snap.refs WHERE scope=? AND resource_name=?", (snapshot_hash, rname),
+            )
+            sqlite_store._store_snapshot_resource(
+                snapshot_hash, rname, file_store._parse_snapshot_rfile(rname, snapshot_hash),
+            )
+        if verbose:
+            print("Migrated lineage for snapshot %s" % snapshot_hash, file=sys.stderr)
+    sqlite_store._gc("snap")
+
+
+def migrate_file_lineage_to_sqlite(
+    file_store: FileLineageStore, sqlite_store: SqliteLineageStore, verbose: bool = False
+) -> Tuple[int, int]:
+    """Copy the current and snapshot lineage from a file lineage store to a SQLite
+    lineage store. Existing entries in the SQLite store for the same resources and
+    snapshots are replaced, so it is safe to run the migration more than once.
+    Returns a tuple of the number of resources and the number of snapshots migrated.
+    """
+    file_store.flush()
+    snapshot_hashes = file_store.get_snapshot_hashes()
+    with sqlite_store.conn:
+        num_resources = _migrate_current_lineage(file_store, sqlite_store)
+        _migrate_snapshot_lineage(file_store, sqlite_store, snapshot_hashes, verbose)
+    if sqlite_store.snapshot_export_dir is not None:
+        for snapshot_hash in snapshot_hashes:
+            sqlite_store._write_snapshot_export(snapshot_hash)
+    return (num_resources, len(snapshot_hashes))
+
+
+def import_unmigrated_file_lineage(
+    file_store: FileLineageStore, sqlite_store: SqliteLineageStore, verbose: bool = False
+) -> Tuple[int, List[str]]:
+    """When one clone of a workspace is migrated to the SQLite store, the other
+    clones switch to it when they pull, but their lineage is still in json
+    files: the current lineage, which is local to each clone, and any snapshots
+    taken before the pull. This is called when a clone's SQLite store is first
+    created, to import that lineage. Snapshots which already have an export file
+    are not imported, as their lineage is loaded from the export. Returns the
+    number of resources and the hashes of the snapshots imported (which now
+    have export files).
+    """
+    file_store.flush()
+    assert sqlite_store.snapshot_export_dir is not None
+    snapshot_hashes = [
+        snapshot_hash
+        for snapshot_hash in file_store.get_snapshot_hashes()
+        if not exists(sqlite_store._get_export_path(snapshot_hash))
+    ]
+    with sqlite_store.conn:
+        num_resources = _migrate_current_lineage(file_store, sqlite_store)
+        _migrate_snapshot_lineage(file_store, sqlite_store, snapshot_hashes, verbose)
+    for snapshot_hash in snapshot_hashes:
+        sqlite_store._write_snapshot_export(snapshot_hash)
+    return (num_resources, snapshot_hashes)
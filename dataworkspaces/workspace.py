@@ -44,12 +44,13 @@ The module ``dataworkspaces.commands.COMMAND`` should look like this::
 
 """
 
-from typing import Dict, Any, Iterable, Optional, List, Tuple, Set, cast, Pattern, Union
+from typing import Dict, Any, Callable, Iterable, Optional, List, Tuple, Set, cast, Pattern, Union
 
 from abc import ABCMeta, abstractmethod
 import importlib
 import os.path
 import os
+import shutil
 import datetime
 import getpass
 import json
@@ -806,6 +807,18 @@ class FileResourceMixin(metaclass=ABCMeta):
         """
         pass
 
+    def does_subpaths_exist(
+        self, subpaths: List[str], must_be_file: bool = False, must_be_directory: bool = False
+    ) -> List[bool]:
+        """Batched version of does_subpath_exist(), returning a list of results
+        in the same order as subpaths. Remote resources can override this to
+        avoid a round trip per path.
+        """
+        return [
+            self.does_subpath_exist(subpath, must_be_file, must_be_directory)
+            for subpath in subpaths
+        ]
+
     @abstractmethod
     def delete_file(self, rel_path: str) -> None:
         """Delete a file from the resource. If the resource is read-only or
@@ -824,6 +837,70 @@ class FileResourceMixin(metaclass=ABCMeta):
         """List the files under the relative path (use empty string for root)"""
         pass
 
+    def upload_tree(
+        self,
+        local_dir: str,
+        rel_dest: str,
+        progress: Optional[Callable[[int, int], None]] = None,
+    ) -> None:
+        """Copy the files under local_dir to rel_dest in the resource (use empty
+        string for root), preserving the directory structure. If provided, progress
+        is called with the number of bytes copied so far and the total number
+        of bytes. The default implementation calls upload_file() for each file.
+        Remote resources should override this to upload the files in parallel.
+        """
+        files = []  # type: List[Tuple[str, int]]
+        for (dirpath, dirnames, filenames) in os.walk(local_dir):
+            for fname in filenames:
+                rel_path = os.path.relpath(os.path.join(dirpath, fname), local_dir)
+                files.append((rel_path, os.stat(os.path.join(dirpath, fname)).st_size))
+        total_bytes = sum(size for (_, size) in files)
+        bytes_done = 0
+        for (rel_path, size) in files:
+            self.upload_file(
+                os.path.join(local_dir, rel_path),
+                os.path.join(rel_dest, rel_path) if rel_dest != "" else rel_path,
+            )
+            bytes_done += size
+            if progress is not None:
+                progress(bytes_done, total_bytes)
+
+    def prefetch(self, rel_paths: List[str]) -> None:
+        """Hint that the specified files will be read soon. Resources that
+        keep their files remotely can override this to fetch the files in bulk
+        into a local cache. The default implementation does nothing.
+        """
+        pass
+
+    def download_tree(self, rel_prefix: str, local_dir: str) -> None:
+        """Copy the file or directory tree at rel_prefix (use empty string for root)
+        to local_dir, preserving the directory structure under rel_prefix.
+        Any .git directories are skipped. The default implementation walks the
+        tree via ls() and copies each file via open(). Remote resources should
+        override this to download the files in parallel.
+        """
+        if rel_prefix != "" and self.does_subpath_exist(rel_prefix, must_be_file=True):
+            to_visit = []  # type: List[str]
+            files = [rel_prefix]
+            base = os.path.dirname(rel_prefix)
+        else:
+            to_visit = [rel_prefix]
+            files = []
+            base = rel_prefix
+        while len(to_visit) > 0:
+            for entry in self.ls(to_visit.pop()):
+                if os.path.basename(entry) == ".git":
+                    continue  # git metadata of a git-backed resource
+                if self.does_subpath_exist(entry, must_be_file=True):
+                    files.append(entry)
+                else:
+                    to_visit.append(entry)
+        for rel_path in files:
+            local_path = os.path.join(local_dir, rel_path[len(base) :].lstrip("/"))
+            os.makedirs(os.path.dirname(local_path), exist_ok=True)
+            with self.open(rel_path, "rb") as src, open(local_path, "wb") as dest:
+                shutil.copyfileobj(src, dest)
+
 
 class LocalStateResourceMixin(metaclass=ABCMeta):
     """Mixin for the resource api for resources with local state
@@ -1002,6 +1079,7 @@ class SyncedWorkspaceMixin(metaclass=ABCMeta):
                     cast(SnapshotResourceMixin, r).copy_imported_lineage(lstore)
                     if self.verbose:
                         print("Imported lineage for %s" % r.name)
+            lstore.flush()
 
     def _push_precheck(self, resource_list: List[LocalStateResourceMixin]) -> None:
         """Default calls pull_precheck() on each of the supplied resources.
@@ -1308,6 +1386,7 @@ class SnapshotWorkspaceMixin(metaclass=ABCMeta):
                 lstore.clear_entry(instance, ResourceRef(rname, None))
                 if cast(Workspace, self).verbose:
                     print("Cleared lineage for results resource %s" % rname)
+            lstore.flush()
         return metadata, manifest_bytes
 
     def _restore_precheck(
@@ -0,0 +1,61 @@
+"""Benchmark for fingerprinting large numpy arrays. Compares the fingerprint
+from fingerprint_utils with copying the array to a bytes object and hashing
+that (which is what is needed for non-contiguous arrays if the array's buffer
+is not used directly), and with the sampled fingerprint used for large
+API resources. Each size is tested with a contiguous array and with
+a strided view of an array twice as large. Needs about three times the
+largest size in memory.
+
+Run as: python fingerprint_benchmark.py [SIZE_IN_GB ...]
+For example, to benchmark 10 GB arrays: python fingerprint_benchmark.py 10
+"""
+import sys
+import os
+import time
+import hashlib
+
+try:
+    import dataworkspaces
+except ImportError:
+    sys.path.append(os.path.abspath(".."))
+
+import numpy
+
+from dataworkspaces.utils.fingerprint_utils import fingerprint, sampled_fingerprint
+
+SIZES_IN_GB = [0.1, 1.0]
+
+
+def hash_copy(array):
+    hash_state = hashlib.sha1()
+    hash_state.update(array.tobytes())
+    return hash_state.hexdigest()
+
+
+def time_fn(fn, array):
+    start = time.time()
+    fn(array)
+    return time.time() - start
+
+
+def run(size_in_gb):
+    num_elements = int(size_in_gb * 1e9) // 8
+    print("%.1f GB" % size_in_gb)
+    array = numpy.ones(num_elements, dtype=numpy.float64)
+    print("  contiguous, fingerprint: %.2f s" % time_fn(fingerprint, array))
+    print("  contiguous, copy:        %.2f s" % time_fn(hash_copy, array))
+    print("  contiguous, sampled:     %.2f s" % time_fn(sampled_fingerprint, array))
+    del array
+    array = numpy.ones(2 * num_elements, dtype=numpy.float64)[::2]
+    print("  strided, fingerprint:    %.2f s" % time_fn(fingerprint, array))
+    print("  strided, copy:           %.2f s" % time_fn(hash_copy, array))
+    print("  strided, sampled:        %.2f s" % time_fn(sampled_fingerprint, array))
+
+
+def main(sizes):
+    for size_in_gb in sizes:
+        run(size_in_gb)
+
+
+if __name__ == "__main__":
+    main([float(arg) for arg in sys.argv[1:]] if len(sys.argv) > 1 else SIZES_IN_GB)
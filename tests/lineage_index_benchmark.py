@@ -0,0 +1,82 @@
+"""Benchmark for the lookups of the file lineage store against a resource
+with a large number of subpath refs. Compares the store's indexed lookups
+with a linear scan using ResourceRef.covers() (which is what the store
+did before the index was added).
+
+Run as: python lineage_index_benchmark.py [NUM_REFS]
+"""
+import sys
+import os
+import time
+import json
+import shutil
+import tempfile
+import datetime
+
+try:
+    import dataworkspaces
+except ImportError:
+    sys.path.append(os.path.abspath(".."))
+
+from dataworkspaces.utils.lineage_utils import (
+    FileLineageStore,
+    ResourceRef,
+    HashCertificate,
+    SourceDataLineage,
+)
+
+NUM_REFS = 50000
+NUM_LOOKUPS = 2000
+# The linear scan is slow, so we only time it on a sample of the lookups
+NUM_LINEAR_LOOKUPS = 50
+
+
+def make_subpath(i):
+    return "run%03d/fold%02d/out%d.csv" % (i // 500, (i // 10) % 50, i % 10)
+
+
+def main(num_refs):
+    tempdir = tempfile.mkdtemp()
+    try:
+        current_dir = os.path.join(tempdir, "current")
+        os.mkdir(current_dir)
+        os.mkdir(os.path.join(tempdir, "snapshots"))
+        comment = "benchmark at %s" % datetime.datetime.now()
+        lineages = [
+            SourceDataLineage(
+                HashCertificate(ResourceRef("results", make_subpath(i)), "h%d" % i, comment)
+            ).to_json()
+            for i in range(num_refs)
+        ]
+        with open(os.path.join(current_dir, "results.json"), "w") as f:
+            json.dump({"resource_name": "results", "lineages": lineages}, f)
+        store = FileLineageStore("bench", current_dir, os.path.join(tempdir, "snapshots"))
+        queries = [
+            ResourceRef("results", make_subpath((i * 7919) % num_refs) + "/part-0")
+            for i in range(NUM_LOOKUPS)
+        ]
+        store.has_entry("bench", queries[0])  # load the file and build the index
+
+        start = time.time()
+        for ref in queries:
+            assert store.retrieve_entry("bench", ref) is not None
+            assert not store.has_entry("bench", ResourceRef("results", "missing/" + ref.subpath))
+        indexed = time.time() - start
+
+        mapping = store.resource_cache["results"]
+        start = time.time()
+        for ref in queries[0:NUM_LINEAR_LOOKUPS]:
+            assert any(other.covers(ref) for other in mapping.keys())
+            missing = ResourceRef("results", "missing/" + ref.subpath)
+            assert not any(other.covers(missing) for other in mapping.keys())
+        linear = time.time() - start
+
+        print("%d refs" % num_refs)
+        print("  indexed:     %.1f us/lookup" % (indexed * 1e6 / (2 * NUM_LOOKUPS)))
+        print("  linear scan: %.1f us/lookup" % (linear * 1e6 / (2 * NUM_LINEAR_LOOKUPS)))
+    finally:
+        shutil.rmtree(tempdir)
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else NUM_REFS)
@@ -0,0 +1,28 @@
+#!/usr/bin/env python3
+"""Step which streams per-epoch metrics while it runs
+"""
+
+import sys
+import os
+
+from dataworkspaces.lineage import LineageBuilder
+
+def main():
+    builder = (
+        LineageBuilder()
+        .as_script_step()
+        .with_parameters({'epochs': 5})
+        .with_input_path('./source-data/data.csv')
+        .as_results_step(os.path.join('./results', 'training/'))
+    )
+    with builder.eval() as lineage:
+        stream = lineage.get_metrics_stream(flush_seconds=1000.0, flush_bytes=1)
+        for epoch in range(5):
+            stream.write('epoch', {'loss': 1.0/(epoch+1), 'optimizer': 'sgd'}, epoch=epoch)
+        # each record was flushed, so the log can be read during the run
+        with open(os.path.join('./results', 'training/metrics.jsonl'), 'r') as f:
+            assert len(f.readlines()) == 5
+        lineage.write_results({'loss': 0.2})
+    return 0
+
+sys.exit(main())
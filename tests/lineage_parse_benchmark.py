@@ -0,0 +1,106 @@
+"""Benchmark for parsing a resource lineage file with a large number of
+step lineages. Compares the original indented format with the compact
+format, and parsing every lineage up front (which is what the store did
+before lineages were built lazily) with the lazy parsing done by
+decode_lineage_file(). Uses orjson if it is installed.
+
+Run as: python lineage_parse_benchmark.py [NUM_ENTRIES ...]
+"""
+import sys
+import os
+import time
+import json
+import datetime
+
+try:
+    import dataworkspaces
+except ImportError:
+    sys.path.append(os.path.abspath(".."))
+
+from dataworkspaces.utils.lineage_utils import (
+    ResourceRef,
+    HashCertificate,
+    ResourceLineage,
+    StepLineage,
+    encode_lineage_file,
+    decode_lineage_file,
+    orjson,
+)
+
+NUM_ENTRIES = [10000, 100000]
+# Number of lineages looked up after the file is parsed
+NUM_LOOKUPS = 100
+
+
+def make_step(i, comment):
+    outputs = [
+        HashCertificate(
+            ResourceRef("results", "run%06d/out%d" % (i, j)), "h%d_%d" % (i, j), comment
+        )
+        for j in range(2)
+    ]
+    return StepLineage(
+        "step%d" % (i % 10),
+        datetime.datetime(2020, 1, 1, 12, 0, 0, 1000),
+        {"epochs": 10, "run": i},
+        [HashCertificate(ResourceRef("source", "part%d" % (i % 50)), "s%d" % (i % 50), comment)],
+        [HashCertificate(ResourceRef("code"), "codehash", comment)],
+        outputs,
+        12.5,
+        ["python", "train.py", str(i)],
+    )
+
+
+def parse_eager(data, filename):
+    obj = json.loads(data)
+    mapping = {}
+    for lobj in obj["lineages"]:
+        l = ResourceLineage.from_json(lobj, filename)
+        for cert in l.get_certs():
+            if cert.ref.name == "results":
+                mapping[cert.ref] = l
+    return mapping
+
+
+def time_parse(fn, data, lookups):
+    start = time.time()
+    mapping = fn(data)
+    for ref in lookups:
+        assert mapping[ref].step_name.startswith("step")
+    return time.time() - start
+
+
+def run(num_entries):
+    comment = "benchmark at %s" % datetime.datetime.now()
+    lineages = [make_step(i, comment) for i in range(num_entries)]
+    lookups = [
+        ResourceRef("results", "run%06d/out0" % ((i * 7919) % num_entries))
+        for i in range(NUM_LOOKUPS)
+    ]
+    indented = encode_lineage_file("results", lineages, compact=False)
+    compact = encode_lineage_file("results", lineages, compact=True)
+    print("%d entries" % num_entries)
+    print("  indented: %.1f MB" % (len(indented) / 1e6))
+    print("  compact:  %.1f MB" % (len(compact) / 1e6))
+    print(
+        "  indented, eager: %.2f s"
+        % time_parse(lambda d: parse_eager(d, "results.json"), indented, lookups)
+    )
+    print(
+        "  indented, lazy:  %.2f s"
+        % time_parse(lambda d: decode_lineage_file("results", d), indented, lookups)
+    )
+    print(
+        "  compact, lazy:   %.2f s"
+        % time_parse(lambda d: decode_lineage_file("results", d), compact, lookups)
+    )
+
+
+def main(sizes):
+    print("using %s" % ("orjson" if orjson is not None else "json"))
+    for num_entries in sizes:
+        run(num_entries)
+
+
+if __name__ == "__main__":
+    main([int(arg) for arg in sys.argv[1:]] if len(sys.argv) > 1 else NUM_ENTRIES)
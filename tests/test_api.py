@@ -22,7 +22,8 @@ except ImportError:
 from dataworkspaces.utils.git_utils import GIT_EXE_PATH
 
 from dataworkspaces.api import get_resource_info, take_snapshot,\
-                               get_snapshot_history, restore
+                               get_snapshot_history, restore,\
+                               get_filesystem_for_resource
 
 
 def makefile(relpath, contents):
@@ -121,6 +122,33 @@ class TestApi(unittest.TestCase):
         self._assert_contents('code/test.py',
                               'print("This is a test")\nprint("Version 2")\n')
 
+    def test_download_tree(self):
+        os.mkdir(join(TEMPDIR, 'data/subdir'))
+        makefile('data/subdir/more.csv', 'a,b\n')
+        fs = get_filesystem_for_resource('data', TEMPDIR)
+        fs.prefetch(['data.csv']) # no-op for local resources
+        dest = join(TEMPDIR, 'copy')
+        fs.download_tree('', dest)
+        self._assert_contents('copy/data.csv', 'x,y,z\n1,2,3\n')
+        self._assert_contents('copy/subdir/more.csv', 'a,b\n')
+        fs.download_tree('subdir/more.csv', join(TEMPDIR, 'copy2'))
+        self._assert_contents('copy2/more.csv', 'a,b\n')
+        progress = []
+        fs.upload_tree(dest, 'uploaded', lambda done, total: progress.append((done, total)))
+        self._assert_contents('data/uploaded/subdir/more.csv', 'a,b\n')
+        self._assert_contents('data/uploaded/data.csv', 'x,y,z\n1,2,3\n')
+        self.assertEqual((16, 16), progress[-1])
+
+    def test_download_tree_skips_git(self):
+        # a resource which is its own git repository has a .git directory at its root
+        os.mkdir(join(TEMPDIR, 'data/.git'))
+        makefile('data/.git/config', '[core]\n')
+        fs = get_filesystem_for_resource('data', TEMPDIR)
+        dest = join(TEMPDIR, 'copy')
+        fs.download_tree('', dest)
+        self._assert_contents('copy/data.csv', 'x,y,z\n1,2,3\n')
+        self.assertEqual(['data.csv'], os.listdir(dest))
+
 
 
 
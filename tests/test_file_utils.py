@@ -17,7 +17,7 @@ try:
 except ImportError:
     sys.path.append(os.path.abspath(".."))
 
-from dataworkspaces.utils.file_utils import safe_rename
+from dataworkspaces.utils.file_utils import safe_rename, write_file_atomically
 
 class TestFileUtils(unittest.TestCase):
     def setUp(self):
@@ -48,6 +48,33 @@ class TestFileUtils(unittest.TestCase):
             if os.path.exists(testfile.name):
                 os.remove(testfile.name)
 
+    def test_write_file_atomically(self):
+        dest = os.path.join(TEMPDIR, 'subdir/data.txt')
+        def fill(tmp_path):
+            self.assertFalse(os.path.exists(dest))
+            with open(tmp_path, 'w') as f:
+                f.write("data")
+        write_file_atomically(dest, fill)
+        with open(dest, 'r') as f:
+            self.assertEqual("data", f.read())
+        self.assertEqual(['data.txt'], os.listdir(os.path.join(TEMPDIR, 'subdir')))
+
+    def test_write_file_atomically_error(self):
+        """The temporary file is removed if the fill function fails and the
+        existing file is left unchanged.
+        """
+        dest = os.path.join(TEMPDIR, 'data.txt')
+        with open(dest, 'w') as f:
+            f.write("old")
+        def fill(tmp_path):
+            with open(tmp_path, 'w') as f:
+                f.write("partial")
+            raise OSError("disk full")
+        with self.assertRaises(OSError):
+            write_file_atomically(dest, fill)
+        self.assertEqual(['data.txt'], os.listdir(TEMPDIR))
+        with open(dest, 'r') as f:
+            self.assertEqual("old", f.read())
 
 
 if __name__ == '__main__':
@@ -0,0 +1,96 @@
+
+import unittest
+import sys
+import os
+import os.path
+import shutil
+
+try:
+    import dataworkspaces
+except ImportError:
+    sys.path.append(os.path.abspath(".."))
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from utils_for_tests import TEMPDIR
+
+if numpy is not None:
+    from dataworkspaces.utils.fingerprint_cache import FingerprintCache, compute_digest,\
+        register_file_origin
+
+CACHE_DIR = os.path.join(TEMPDIR, 'fingerprint_cache')
+
+
+@unittest.skipUnless(numpy is not None, "SKIP: Numpy not available")
+class TestFingerprintCache(unittest.TestCase):
+    def setUp(self):
+        if os.path.exists(TEMPDIR):
+            shutil.rmtree(TEMPDIR)
+        os.mkdir(TEMPDIR)
+
+    def tearDown(self):
+        if os.path.exists(TEMPDIR):
+            shutil.rmtree(TEMPDIR)
+
+    def test_in_memory(self):
+        cache = FingerprintCache()
+        a = numpy.arange(1000, dtype=numpy.float64)
+        expected = compute_digest(a)
+        self.assertEqual(expected, cache.get_digest(a))
+        self.assertEqual(expected, cache.get_digest(a))
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+        self.assertEqual(compute_digest(a, 'sampled'), cache.get_digest(a, 'sampled'))
+        self.assertEqual(cache.misses, 2)
+        # an in-place change to a sampled block is detected
+        a[0] = -1.0
+        self.assertEqual(compute_digest(a), cache.get_digest(a))
+        self.assertNotEqual(expected, cache.get_digest(a))
+        # a copy is a different object
+        cache.get_digest(a.copy())
+        self.assertEqual(cache.misses, 4)
+        # entries are removed when their arrays are freed
+        del a
+        self.assertEqual(len(cache.entries), 0)
+
+    def test_uncacheable(self):
+        cache = FingerprintCache()
+        data = [numpy.arange(10), numpy.arange(5)]
+        self.assertEqual(compute_digest(data), cache.get_digest(data))
+        self.assertEqual(len(cache.entries), 0)
+
+    def test_file_origin(self):
+        path = os.path.join(TEMPDIR, 'data.npy')
+        numpy.save(path, numpy.arange(1000))
+        a = numpy.load(path)
+        register_file_origin(a, path, 'numpy.load')
+        cache = FingerprintCache(CACHE_DIR)
+        expected = cache.get_digest(a)
+        self.assertEqual(cache.misses, 1)
+        # a new cache (e.g. in another process) finds the digest for the file
+        b = numpy.load(path)
+        register_file_origin(b, path, 'numpy.load')
+        cache2 = FingerprintCache(CACHE_DIR)
+        self.assertEqual(expected, cache2.get_digest(b))
+        self.assertEqual((cache2.hits, cache2.misses), (1, 0))
+        # an array which was changed after it was loaded is rehashed
+        c = numpy.load(path)
+        register_file_origin(c, path, 'numpy.load')
+        c[0] = -1
+        cache3 = FingerprintCache(CACHE_DIR)
+        self.assertEqual(compute_digest(c), cache3.get_digest(c))
+        self.assertEqual(cache3.misses, 1)
+        # if the file changes, the key changes
+        numpy.save(path, numpy.arange(1001))
+        os.utime(path, ns=(0, 0))
+        d = numpy.load(path)
+        register_file_origin(d, path, 'numpy.load')
+        cache4 = FingerprintCache(CACHE_DIR)
+        self.assertEqual(compute_digest(d), cache4.get_digest(d))
+        self.assertEqual(cache4.misses, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,271 @@
+
+import unittest
+import sys
+import os.path
+import hashlib
+import random
+import threading
+
+try:
+    import dataworkspaces
+except ImportError:
+    sys.path.append(os.path.abspath(".."))
+
+from dataworkspaces.errors import ConfigurationError
+from dataworkspaces.utils.fingerprint_utils import fingerprint, add_to_fingerprint,\
+    sampled_fingerprint, BackgroundFingerprinter, MultisetDigest
+import dataworkspaces.utils.fingerprint_utils as fingerprint_utils
+
+try:
+    import pandas
+except ImportError:
+    pandas = None
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+
+
+@unittest.skipUnless(numpy is not None, "SKIP: Numpy not available")
+class TestNumpyFingerprint(unittest.TestCase):
+    def test_dtype_and_shape(self):
+        a = numpy.zeros(12, dtype=numpy.int32)
+        self.assertNotEqual(fingerprint(a), fingerprint(numpy.zeros(12, dtype=numpy.float32)))
+        self.assertNotEqual(fingerprint(a), fingerprint(a.reshape((3, 4))))
+        self.assertNotEqual(fingerprint(a.reshape((3, 4))), fingerprint(a.reshape((4, 3))))
+        self.assertEqual(fingerprint(a), fingerprint(numpy.zeros(12, dtype=numpy.int32)))
+
+    def test_memory_layout(self):
+        a = numpy.arange(200, dtype=numpy.float64).reshape((20, 10))
+        self.assertEqual(fingerprint(a), fingerprint(numpy.asfortranarray(a)))
+        view = a[::3, 1::2]
+        self.assertFalse(view.flags.c_contiguous)
+        self.assertEqual(fingerprint(numpy.ascontiguousarray(view)), fingerprint(view))
+        self.assertNotEqual(fingerprint(a[::2]), fingerprint(a[1::2]))
+
+    def test_chunked_copies(self):
+        # force the non-contiguous path to use many chunks
+        a = numpy.arange(10000, dtype=numpy.int64).reshape((1000, 10))[:, ::2]
+        expected = fingerprint(numpy.ascontiguousarray(a))
+        old_chunk_bytes = fingerprint_utils.CHUNK_BYTES
+        fingerprint_utils.CHUNK_BYTES = 100
+        try:
+            self.assertEqual(expected, fingerprint(a))
+        finally:
+            fingerprint_utils.CHUNK_BYTES = old_chunk_bytes
+
+    def test_scalars(self):
+        self.assertNotEqual(fingerprint(numpy.int64(5)), fingerprint(numpy.int64(6)))
+        self.assertNotEqual(fingerprint(numpy.int64(5)), fingerprint(numpy.int32(5)))
+        self.assertEqual(fingerprint(numpy.float32(1.5)), fingerprint(numpy.array(1.5, numpy.float32)))
+        fingerprint(numpy.datetime64('2020-01-01'))
+
+    def test_object_arrays(self):
+        a = numpy.array(['a', 'bb', None, 3], dtype=object)
+        b = numpy.array(['a', 'bb', None, 3], dtype=object)
+        self.assertEqual(fingerprint(a), fingerprint(b))
+        b[1] = 'bc'
+        self.assertNotEqual(fingerprint(a), fingerprint(b))
+
+    def test_sequences(self):
+        x = numpy.arange(10)
+        y = numpy.arange(5)
+        self.assertNotEqual(fingerprint((x, y)), fingerprint((y, x)))
+        self.assertNotEqual(fingerprint([x, y]), fingerprint([numpy.concatenate([x, y])]))
+        self.assertEqual(fingerprint({'x':x, 'y':y}), fingerprint({'x':x.copy(), 'y':y.copy()}))
+
+    def test_add_to_existing_hash(self):
+        hash_state = hashlib.sha1()
+        add_to_fingerprint(numpy.arange(10), hash_state)
+        self.assertEqual(fingerprint(numpy.arange(10)), hash_state.hexdigest())
+
+    def test_unsupported(self):
+        self.assertRaises(ConfigurationError, fingerprint, object())
+
+
+@unittest.skipUnless(numpy is not None, "SKIP: Numpy not available")
+class TestSampledFingerprint(unittest.TestCase):
+    """Use a small sample size, so that we can test sampling on small arrays"""
+    def setUp(self):
+        self.old_sizes = (fingerprint_utils.SAMPLE_BLOCKS, fingerprint_utils.SAMPLE_BLOCK_BYTES)
+        fingerprint_utils.SAMPLE_BLOCKS = 4
+        fingerprint_utils.SAMPLE_BLOCK_BYTES = 160 # two rows of 10 int64s
+
+    def tearDown(self):
+        (fingerprint_utils.SAMPLE_BLOCKS, fingerprint_utils.SAMPLE_BLOCK_BYTES) = self.old_sizes
+
+    def test_small_data_is_exact(self):
+        a = numpy.arange(80, dtype=numpy.int64).reshape((8, 10))
+        self.assertEqual(fingerprint(a), sampled_fingerprint(a))
+
+    def test_sampling(self):
+        a = numpy.arange(1000, dtype=numpy.int64).reshape((100, 10))
+        expected = sampled_fingerprint(a)
+        self.assertNotEqual(fingerprint(a), expected)
+        self.assertEqual(expected, sampled_fingerprint(a.copy()))
+        # the first and last rows are always sampled
+        for row in (0, 99):
+            b = a.copy()
+            b[row, 5] = -1
+            self.assertNotEqual(expected, sampled_fingerprint(b))
+        # the shape and dtype are always included
+        self.assertNotEqual(expected, sampled_fingerprint(a.reshape((200, 5))))
+        self.assertNotEqual(expected, sampled_fingerprint(a.astype(numpy.float64)))
+        # a row outside the sampled blocks is missed
+        b = a.copy()
+        b[20, 5] = -1
+        self.assertEqual(expected, sampled_fingerprint(b))
+
+    @unittest.skipUnless(pandas is not None, "SKIP: Pandas not available")
+    def test_sampled_dataframe(self):
+        df = pandas.DataFrame({'x':numpy.arange(100), 'y':numpy.arange(100)*1.5})
+        expected = sampled_fingerprint(df)
+        self.assertEqual(expected, sampled_fingerprint(df.copy()))
+        df2 = df.copy()
+        df2.loc[99, 'y'] = 0.0
+        self.assertNotEqual(expected, sampled_fingerprint(df2))
+        self.assertNotEqual(expected, sampled_fingerprint(df.rename(columns={'y':'z'})))
+
+
+@unittest.skipUnless(numpy is not None, "SKIP: Numpy not available")
+class TestBackgroundFingerprinter(unittest.TestCase):
+    def _batches(self):
+        return [(numpy.arange(i, i+100), numpy.ones(10)*i) for i in range(20)]
+
+    def _fingerprint(self, keys, num_threads=2, num_producers=1):
+        batches = self._batches()
+        fingerprinter = BackgroundFingerprinter(num_threads=num_threads, max_queue_size=2)
+        def produce(my_keys):
+            for key in my_keys:
+                fingerprinter.add(key, batches[key])
+        producers = [threading.Thread(target=produce, args=(keys[i::num_producers],))
+                     for i in range(num_producers)]
+        for producer in producers:
+            producer.start()
+        for producer in producers:
+            producer.join()
+        hash_state = hashlib.sha1()
+        fingerprinter.finish(hash_state)
+        return hash_state.hexdigest()
+
+    def test_order_independent(self):
+        keys = list(range(20))
+        expected = self._fingerprint(keys, num_threads=1)
+        random.shuffle(keys)
+        self.assertEqual(expected, self._fingerprint(keys, num_threads=4, num_producers=3))
+        self.assertNotEqual(expected, self._fingerprint(keys[:-1]))
+        # if a batch is added more than once, only the first is used
+        self.assertEqual(expected, self._fingerprint(keys + keys[:5]))
+
+    def test_stop_accepting(self):
+        fingerprinter = BackgroundFingerprinter()
+        fingerprinter.add(0, numpy.arange(10))
+        fingerprinter.stop_accepting()
+        fingerprinter.add(1, numpy.arange(10))
+        hash_state = hashlib.sha1()
+        fingerprinter.finish(hash_state)
+        self.assertEqual(list(fingerprinter.digests.keys()), [0])
+
+    def test_num_batches(self):
+        """Batches read ahead past the end of the first epoch (e.g. by a prefetch
+        or a repeated dataset) are ignored.
+        """
+        batches = self._batches()
+        expected = self._fingerprint(list(range(10)))
+        for _ in range(5):
+            fingerprinter = BackgroundFingerprinter(num_threads=4, num_batches=10)
+            for key in range(len(batches)):
+                fingerprinter.add(key, batches[key])
+            # a later epoch, which may have been shuffled
+            for key in range(10):
+                fingerprinter.add(key, batches[19 - key])
+            hash_state = hashlib.sha1()
+            fingerprinter.finish(hash_state)
+            self.assertEqual(expected, hash_state.hexdigest())
+
+    def test_error(self):
+        fingerprinter = BackgroundFingerprinter()
+        fingerprinter.add(0, object())
+        self.assertRaises(ConfigurationError, fingerprinter.finish, hashlib.sha1())
+
+
+@unittest.skipUnless(numpy is not None, "SKIP: Numpy not available")
+class TestMultisetDigest(unittest.TestCase):
+    def _digest(self, values):
+        digest = MultisetDigest()
+        for value in values:
+            digest.add(value)
+        return digest
+
+    def test_order_independent(self):
+        values = [numpy.arange(i, i+10) for i in range(10)]
+        expected = self._digest(values).hexdigest()
+        self.assertEqual(expected, self._digest(list(reversed(values))).hexdigest())
+        self.assertNotEqual(expected, self._digest(values[:-1]).hexdigest())
+        self.assertNotEqual(expected, self._digest(values + values[:1]).hexdigest())
+        self.assertNotEqual(expected, MultisetDigest().hexdigest())
+
+    def test_merge(self):
+        values = [numpy.arange(i, i+10) for i in range(10)]
+        expected = self._digest(values).hexdigest()
+        digest = self._digest(values[:3])
+        copied = digest.copy()
+        digest.merge(MultisetDigest.from_string(self._digest(values[3:7]).to_string()))
+        digest.merge(self._digest(values[7:]))
+        self.assertEqual(expected, digest.hexdigest())
+        self.assertEqual(self._digest(values[:3]).hexdigest(), copied.hexdigest())
+        self.assertRaises(ConfigurationError, MultisetDigest.from_string, 'not a digest')
+
+    def test_background_fingerprinter(self):
+        values = [numpy.arange(i, i+10) for i in range(10)]
+        fingerprinter = BackgroundFingerprinter()
+        for (i, value) in reversed(list(enumerate(values))):
+            fingerprinter.add(i, value)
+        digest = MultisetDigest()
+        fingerprinter.finish(digest)
+        self.assertEqual(self._digest(values).hexdigest(), digest.hexdigest())
+
+
+@unittest.skipUnless(pandas is not None, "SKIP: Pandas not available")
+class TestPandasFingerprint(unittest.TestCase):
+    def _make_df(self):
+        return pandas.DataFrame({'x1':[1,2,3,4,5],
+                                 'x2':[1.5,2.5,3.5,4.5,5.5],
+                                 's':['a', 'b', 'c', 'd', None],
+                                 'c':pandas.Categorical(['u', 'v', 'u', 'v', 'u'])})
+
+    def test_dataframe(self):
+        df = self._make_df()
+        self.assertEqual(fingerprint(df), fingerprint(self._make_df()))
+        df2 = self._make_df()
+        df2.loc[4, 's'] = 'e'
+        self.assertNotEqual(fingerprint(df), fingerprint(df2))
+        df3 = self._make_df()
+        df3.loc[0, 'c'] = 'v'
+        self.assertNotEqual(fingerprint(df), fingerprint(df3))
+        self.assertNotEqual(fingerprint(df), fingerprint(df.rename(columns={'x1':'z'})))
+
+    def test_series(self):
+        s = pandas.Series([1,0,0,1,1], name='y')
+        self.assertEqual(fingerprint(s), fingerprint(pandas.Series([1,0,0,1,1], name='y')))
+        self.assertNotEqual(fingerprint(s), fingerprint(s.astype('float64')))
+
+
+@unittest.skipUnless(pyarrow is not None, "SKIP: PyArrow not available")
+class TestArrowFingerprint(unittest.TestCase):
+    def test_table(self):
+        t = pyarrow.table({'x':[1, 2, 3], 's':['a', None, 'c']})
+        self.assertEqual(fingerprint(t), fingerprint(pyarrow.table({'x':[1, 2, 3],
+                                                                    's':['a', None, 'c']})))
+        self.assertNotEqual(fingerprint(t), fingerprint(pyarrow.table({'x':[1, 2, 4],
+                                                                       's':['a', None, 'c']})))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -18,6 +18,7 @@ from dataworkspaces.utils.subprocess_utils import find_exe
 from dataworkspaces.utils.lineage_utils import LineageStore, ResourceRef,\
     ResourceLineage
 from dataworkspaces.utils.git_utils import GIT_EXE_PATH
+from dataworkspaces.lineage import MetricsStream
 
 TEMPDIR=os.path.abspath(os.path.expanduser(__file__)).replace('.py', '_data')
 WS_DIR=join(TEMPDIR, 'workspace')
@@ -47,6 +48,8 @@ class TestLineage(unittest.TestCase):
                         join(CODE_DIR, 'lineage_step2.py'))
         shutil.copyfile(join(TEST_DIR, 'lineage_params_step.py'),
                         join(CODE_DIR, 'lineage_params_step.py'))
+        shutil.copyfile(join(TEST_DIR, 'lineage_metrics_step.py'),
+                        join(CODE_DIR, 'lineage_metrics_step.py'))
 
     def _run_dws(self, dws_args, cwd=WS_DIR, env=None, verbose=True):
         if verbose:
@@ -159,6 +162,24 @@ class TestLineage(unittest.TestCase):
         self.assertEqual(45, results['metrics']['size_filtered'])
         self.assertEqual(334, results['metrics']['size_raw'])
 
+    def test_metrics_stream(self):
+        self._run_step('lineage_metrics_step.py', [])
+        with open(join(RESULTS_DIR, 'training/metrics.jsonl'), 'r') as f:
+            records = [json.loads(line) for line in f]
+        self.assertEqual([0, 1, 2, 3, 4], [r['epoch'] for r in records])
+        self.assertEqual(0.5, records[1]['metrics']['loss'])
+        with open(join(RESULTS_DIR, 'training/results.json'), 'r') as f:
+            results = json.load(f)
+        self.assertEqual(0.2, results['metrics']['loss'])
+        summary = results['metrics_log']
+        self.assertEqual('training/metrics.jsonl', summary['file'])
+        self.assertEqual(5, summary['records'])
+        epochs = summary['events']['epoch']
+        self.assertEqual(5, epochs['count'])
+        self.assertEqual({'loss':0.2, 'optimizer':'sgd'}, epochs['last'])
+        self.assertEqual({'loss':0.2}, epochs['min'])
+        self.assertEqual({'loss':1.0}, epochs['max'])
+
     def test_lineage_graph_command(self):
         self._run_step('lineage_step1.py', ['test_lineage1'])
         self._run_step('lineage_step2.py', ['test_lineage1'])
@@ -172,7 +193,108 @@ class TestLineage(unittest.TestCase):
         self._run_dws(['lineage', 'graph', '--snapshot=S1', graph_file2])
         self.assertTrue(exists(graph_file2))
 
+    def test_impacted(self):
+        from dataworkspaces.api import get_impacted_steps
+        self._run_step('lineage_step1.py', ['test_lineage1'])
+        self._run_step('lineage_step2.py', ['test_lineage1'])
+        # before a snapshot, we have no hash for source-data, so all uses are impacted
+        steps = get_impacted_steps('source-data', workspace_uri_or_path=WS_DIR)
+        self.assertEqual(['lineage_step1', 'lineage_step2'], [s.step_name for s in steps])
+        self.assertEqual(['source-data'], steps[0].stale_inputs)
+        self.assertEqual(['intermediate-data:/s1'], steps[1].stale_inputs)
+        self._run_dws(['snapshot', 'S1'])
+        self.assertEqual([], get_impacted_steps('source-data', workspace_uri_or_path=WS_DIR))
+        with open(join(WS_DIR, 'source-data/data.csv'), 'a') as f:
+            f.write('4,5,6\n')
+        self._run_dws(['snapshot', 'S2'])
+        # results lineage was cleared by the snapshot, leaving just step 1
+        steps = get_impacted_steps('source-data', workspace_uri_or_path=WS_DIR)
+        self.assertEqual(['lineage_step1'], [s.step_name for s in steps])
+        self._run_dws(['lineage', 'impacted', 'source-data'])
+        self.assertEqual([], get_impacted_steps('intermediate-data:s2',
+                                                workspace_uri_or_path=WS_DIR))
+
+    def test_export(self):
+        self._run_step('lineage_step1.py', ['test_lineage1'])
+        self._run_step('lineage_step2.py', ['test_lineage1'])
+        self._run_dws(['snapshot', 'S1'])
+        export_file = join(TEMPDIR, 'lineage.jsonl')
+        self._run_dws(['lineage', 'export', '--snapshot=S1', export_file])
+        with open(export_file, 'r') as f:
+            entries = [json.loads(line) for line in f]
+        step_names = {e['lineage']['step_name'] for e in entries
+                      if e['lineage']['type']=='step'}
+        self.assertEqual({'lineage_step1', 'lineage_step2'}, step_names)
+        # the results lineage was cleared by the snapshot
+        csv_file = join(TEMPDIR, 'lineage.csv')
+        self._run_dws(['lineage', 'export', '--format=csv', csv_file])
+        with open(csv_file, 'r') as f:
+            self.assertEqual(len(entries), len(f.readlines()))
+
+    def test_migrate_second_clone(self):
+        """A clone which pulls the switch to the sqlite store imports the lineage
+        that it recorded in json files.
+        """
+        self._run_git(['init', '--bare', 'workspace_origin.git'], cwd=TEMPDIR)
+        self._run_git(['remote', 'add', 'origin', WS_ORIGIN], cwd=WS_DIR)
+        self._run_git(['add', 'code', 'source-data'])
+        self._run_git(['commit', '-m', 'added code'])
+        self._run_dws(['push'])
+        self._run_dws(['clone', '--hostname', 'other-host', WS_ORIGIN, 'workspace2'],
+                      cwd=TEMPDIR)
+        other_ws = join(TEMPDIR, 'workspace2')
+        r = subprocess.run([sys.executable, join(other_ws, 'code/lineage_step1.py'),
+                            'test_lineage1'], cwd=other_ws)
+        r.check_returncode()
+        self._run_git(['add', 'intermediate-data'], cwd=other_ws)
+        self._run_git(['commit', '-m', 'ran step1'], cwd=other_ws)
+        self._run_git(['config', 'pull.rebase', 'false'], cwd=other_ws)
+        self._run_dws(['lineage', 'migrate'])
+        self._run_dws(['push'])
+        # a pull of the resources would invalidate their lineage
+        self._run_dws(['pull', '--only-workspace'], cwd=other_ws)
+        export_file = join(TEMPDIR, 'lineage.jsonl')
+        self._run_dws(['lineage', 'export', export_file], cwd=other_ws)
+        with open(export_file, 'r') as f:
+            entries = [json.loads(line) for line in f]
+        step_names = {e['lineage']['step_name'] for e in entries
+                      if e['lineage']['type']=='step'}
+        self.assertEqual({'lineage_step1'}, step_names)
+        self.assertTrue(exists(join(other_ws, '.dataworkspace/current_lineage/lineage.db')))
+
+
+
+class TestMetricsStream(unittest.TestCase):
+    def setUp(self):
+        if exists(TEMPDIR):
+            shutil.rmtree(TEMPDIR)
+        self.log_file = join(TEMPDIR, 'results/metrics.jsonl')
+
+    def tearDown(self):
+        if exists(TEMPDIR) and not KEEP_OUTPUTS:
+            shutil.rmtree(TEMPDIR)
+
+    def _read_log(self):
+        with open(self.log_file, 'r') as f:
+            return [json.loads(line) for line in f]
 
+    def test_flush_budget(self):
+        stream = MetricsStream(self.log_file, None, 'metrics.jsonl', flush_seconds=1000.0,
+                               flush_bytes=300)
+        stream.write('batch', {'loss':1.5}, epoch=0, batch=0)
+        self.assertEqual([], self._read_log())
+        stream.write('batch', {'loss':1.0}, epoch=0, batch=1)
+        stream.write('epoch', {'loss':1.25}, epoch=0)
+        self.assertEqual(['batch', 'batch', 'epoch'], [r['event'] for r in self._read_log()])
+        stream.write('batch', {'loss':0.5}, epoch=1, batch=0)
+        stream.close()
+        self.assertEqual(4, len(self._read_log()))
+        self.assertEqual({'loss':0.5}, stream.get_summary()['events']['batch']['min'])
+        # with no time budget, each record is written immediately
+        stream = MetricsStream(self.log_file, None, 'metrics.jsonl', flush_seconds=0.0)
+        self.assertEqual([], self._read_log())
+        stream.write('epoch', {'loss':1.0}, epoch=0)
+        self.assertEqual(1, len(self._read_log()))
 
 
 if __name__ == '__main__':
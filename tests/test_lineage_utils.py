@@ -5,6 +5,10 @@ import sys
 import shutil
 import datetime
 import json
+import time
+import multiprocessing
+import io
+import csv
 from copy import copy
 from abc import ABCMeta, abstractmethod
 
@@ -19,7 +23,10 @@ from dataworkspaces.utils.lineage_utils import \
     LineageConsistencyError, InputPlaceholderCert, OutputPlaceholderCert,\
     PlaceholderCertificate, HashCertificate,\
     FileLineageStore, CodeLineage, make_lineage_graph_for_visualization,\
-    LineagePlaceHolderError
+    LineagePlaceHolderError, SubpathIndex, decode_lineage_file, LineageConflictError
+from dataworkspaces.utils.sqlite_lineage_store import SqliteLineageStore,\
+    migrate_file_lineage_to_sqlite, import_unmigrated_file_lineage
+from dataworkspaces.utils.lineage_export import export_lineage
 
 KEEP_OUTPUTS = False
 
@@ -53,6 +60,39 @@ class TestResourceRef(unittest.TestCase):
         self.assertFalse(ResourceRef('foo', 'bar/b').covers(ResourceRef('foo', 'bar/baz')),
                          "covers should be based on paths, not substrings")
 
+class TestSubpathIndex(unittest.TestCase):
+    def test_lookups(self):
+        index = SubpathIndex('r', [ResourceRef('r', 'a/b'), ResourceRef('r', 'c')])
+        self.assertEqual(2, len(index))
+        self.assertEqual(ResourceRef('r', 'a/b'), index.find_covering(ResourceRef('r', 'a/b/c/d')))
+        self.assertIsNone(index.find_covering(ResourceRef('r', 'a/b')))
+        self.assertIsNone(index.find_covering(ResourceRef('r', 'a')))
+        self.assertEqual(ResourceRef('r', 'a/b'), index.find_covered(ResourceRef('r', 'a')))
+        self.assertIsNone(index.find_covered(ResourceRef('r', 'a/b')))
+        self.assertIsNone(index.find_covered(ResourceRef('r', 'ab')))
+        self.assertEqual([ResourceRef('r', 'a/b'), ResourceRef('r', 'c')],
+                         sorted(index.get_covered(ResourceRef('r'))))
+        index.add(ResourceRef('r'))
+        self.assertEqual(ResourceRef('r'), index.find_covering(ResourceRef('r', 'a')))
+        index.remove(ResourceRef('r', 'a/b'))
+        index.remove(ResourceRef('r'))
+        self.assertEqual(1, len(index))
+        self.assertEqual({'c'}, set(index.root.children.keys()))  # 'a' was pruned
+        self.assertIsNone(index.find_covered(ResourceRef('r', 'a')))
+
+    def test_matches_covers(self):
+        """Check the index against ResourceRef.covers() for all pairs"""
+        subpaths = [None, 'a', 'a/b', 'a/b/c', 'a/bc', 'ab', 'b/a', 'b/a/c', 'c/d/e']
+        refs = [ResourceRef('r', sp) for sp in subpaths]
+        for (i, stored) in enumerate(refs):
+            index = SubpathIndex('r', [stored])
+            for query in refs:
+                self.assertEqual(stored if stored.covers(query) else None,
+                                 index.find_covering(query))
+                self.assertEqual(stored if query.covers(stored) else None,
+                                 index.find_covered(query))
+
+
 class TestResourceCert(unittest.TestCase):
     def test_cert_equality(self):
         rc1 = HashCertificate(R2_FOO_BAR, 'hv1', 'comment1')
@@ -161,6 +201,14 @@ class TstStoreMixin(metaclass=ABCMeta):
     def test_basic_scenaio(self):
         self._run_initial_workflow()
 
+    def test_subpath_conflicts(self):
+        """Lineage is not stored over the lineage of a parent or child path."""
+        self._run_initial_workflow()
+        self.assertRaises(LineageConflictError, self._run_step, 'step4', [R1],
+                          [INTERMEDIATE_ROOT])
+        self.assertRaises(LineageConflictError, self._run_step, 'step5', [R1],
+                          [INTERMEDIATE_S1_SUBDIR])
+
     def test_inconsistency(self):
         self._run_initial_workflow()
         s = self._get_store()
@@ -373,6 +421,94 @@ class TstStoreMixin(metaclass=ABCMeta):
         self.assertEqual(warnings, 1)
         self.assertEqual(len(lineages), 0)
 
+    def test_lineage_graph(self):
+        s = self._get_store()
+        instance = self._get_instance()
+        self._run_initial_workflow()
+        graph = s.get_lineage_graph(instance)
+        self.assertIs(graph, s.get_lineage_graph(instance))
+        def cert(ref):
+            return graph.get_cert_for_ref(ref)
+        results = cert(RESULTS)
+        self.assertEqual('results_hash', results.hashval)
+        self.assertEqual({cert(R1), cert(R2_FOO_BAR), cert(INTERMEDIATE_S1),
+                          cert(INTERMEDIATE_S2), cert(CODE)},
+                         graph.ancestors(results))
+        self.assertEqual({cert(INTERMEDIATE_S1), cert(INTERMEDIATE_S2), results},
+                         graph.descendants(cert(R1)))
+        self.assertEqual(frozenset(), graph.descendants(results))
+        self.assertEqual([cert(INTERMEDIATE_S2), results],
+                         graph.impacted_outputs(cert(INTERMEDIATE_S1)))
+        self.assertEqual('step1', graph.get_lineage_for_cert(cert(INTERMEDIATE_S1)).step_name)
+
+        # Rerunning step1 overwrites intermediate:/s1, so the graph is rebuilt
+        # and s2 and results no longer derive from the current s1.
+        old_s1 = cert(INTERMEDIATE_S1)
+        self._run_step('step1', [R1, R2_FOO_BAR], [INTERMEDIATE_S1])
+        graph2 = s.get_lineage_graph(instance)
+        self.assertIsNot(graph, graph2)
+        self.assertFalse(graph2.is_current(old_s1))
+        self.assertEqual([], graph2.impacted_outputs(graph2.get_cert_for_ref(INTERMEDIATE_S1)))
+        self.assertEqual([graph2.get_cert_for_ref(INTERMEDIATE_S2), graph2.get_cert_for_ref(RESULTS)],
+                         graph2.impacted_outputs(old_s1))
+
+        # the snapshot graph is unaffected
+        snapshot_graph = s.get_lineage_graph(instance, 'snapshot1')
+        self.assertEqual(old_s1, snapshot_graph.get_cert_for_ref(INTERMEDIATE_S1))
+
+    def test_impacted_steps(self):
+        s = self._get_store()
+        instance = self._get_instance()
+        self._run_initial_workflow()
+        graph = s.get_lineage_graph(instance)
+        self.assertEqual(['step1', 'step2', 'step3'],
+                         [step.step_name for step in graph.get_current_steps()])
+        def impacted(ref, current_hash=None):
+            return [(step.step_name, [c.ref for c in stale])
+                    for (step, stale) in graph.impacted_steps(ref, current_hash)]
+        self.assertEqual([], impacted(R1, 'r1hash'))
+        self.assertEqual([('step1', [R1]), ('step2', [INTERMEDIATE_S1]),
+                          ('step3', [INTERMEDIATE_S2])],
+                         impacted(R1, 'r1hash_v2'))
+        # r2:/foo/bar is read by both step1 and step3, and is covered by r2
+        self.assertEqual([('step1', [R2_FOO_BAR]), ('step2', [INTERMEDIATE_S1]),
+                          ('step3', [R2_FOO_BAR, INTERMEDIATE_S2])],
+                         impacted(ResourceRef('r2')))
+        self.assertEqual([('step3', [INTERMEDIATE_S2])], impacted(INTERMEDIATE_S2))
+        self.assertEqual([], impacted(RESULTS))
+
+    def test_export(self):
+        s = self._get_store()
+        instance = self._get_instance()
+        self._run_initial_workflow()
+        self._run_step('step4', [RESULTS], [OUT4])
+        expected_refs = {R1, R2_FOO_BAR, INTERMEDIATE_S1, INTERMEDIATE_S2, RESULTS, CODE}
+        # current lineage, as json lines
+        output = io.StringIO()
+        self.assertEqual(7, export_lineage(instance, s, output, 'jsonl'))
+        entries = [json.loads(line) for line in output.getvalue().splitlines()]
+        self.assertEqual(expected_refs|{OUT4},
+                         {ResourceRef(e['resource_name'], e['subpath']) for e in entries})
+        out4 = [e for e in entries if e['resource_name']=='out4'][0]
+        self.assertEqual('step4', out4['lineage']['step_name'])
+        # snapshot lineage, as csv
+        output = io.StringIO()
+        self.assertEqual(6, export_lineage(instance, s, output, 'csv', 'snapshot1'))
+        rows = list(csv.DictReader(io.StringIO(output.getvalue())))
+        self.assertEqual(expected_refs,
+                         {ResourceRef(r['resource_name'], r['subpath'] or None) for r in rows})
+        s1 = [r for r in rows if r['subpath']=='s1'][0]
+        self.assertEqual('step', s1['type'])
+        self.assertEqual('intermediate_hash', s1['hash'])
+        self.assertEqual('r1@r1hash r2:/foo/bar@r2hash', s1['inputs'])
+        # snapshot lineage, as a dot graph
+        output = io.StringIO()
+        self.assertEqual(6, export_lineage(instance, s, output, 'dot', 'snapshot1'))
+        dot = output.getvalue()
+        self.assertTrue(dot.startswith('digraph lineage {'))
+        self.assertIn('"intermediate:/s1@intermediate_hash" -> "intermediate:/s2@intermediate_hash"',
+                      dot)
+
 
 LOCAL_STORE_DIR=os.path.join(TEMPDIR, 'local_store')
 SNAPSHOT_DIR=os.path.join(TEMPDIR, 'lineage_snapshots')
@@ -398,7 +534,386 @@ class TestFileLineageStore(unittest.TestCase, TstStoreMixin):
     def _get_instance(self):
         return 'test_inst'
 
+    def test_stream_entries_not_cached(self):
+        self._run_initial_workflow()
+        self._make_another_store_instance()
+        refs = [ref for (ref, _) in self.store.stream_entries('test_inst')]
+        self.assertEqual(6, len(refs))
+        self.assertEqual(6, len(list(self.store.stream_entries('test_inst', 'snapshot1'))))
+        self.assertEqual({}, self.store.resource_cache)
+        self.assertEqual(0, len(self.store.snapshot_rfile_cache))
+
+    def test_snapshots_share_blobs(self):
+        RESOURCE_NAMES=['r1', 'r2', 'results', 'intermediate', 'code']
+        self._run_initial_workflow()
+        s = self.store
+        blob_dir = join(SNAPSHOT_DIR, 'blobs')
+        blobs = sorted(os.listdir(blob_dir))
+        self.assertEqual(len(RESOURCE_NAMES), len(blobs))
+        self.assertEqual(['manifest.json'], os.listdir(SNAPSHOT1_DIR))
+        s.snapshot_lineage('test_inst', 'snapshot2', RESOURCE_NAMES)
+        self.assertEqual(blobs, sorted(os.listdir(blob_dir)))
+        self.assertEqual(['snapshot1', 'snapshot2'], s.get_snapshot_hashes())
+        s.delete_snapshot_lineage('test_inst', 'snapshot1')
+        self.assertEqual(blobs, sorted(os.listdir(blob_dir)))
+        s.delete_snapshot_lineage('test_inst', 'snapshot2')
+        self.assertEqual([], os.listdir(blob_dir))
+
+    def test_placeholder_index(self):
+        s = self.store
+        self._run_step('step1', [R1, R2_FOO_BAR], [INTERMEDIATE_S1])
+        index = s._get_placeholder_index()
+        self.assertEqual({'r1', 'intermediate'}, index['r1'][1])
+        self.assertEqual({'intermediate'}, index['intermediate'][1])
+        self.assertEqual({'code', 'intermediate'}, index['code'][1])
+        # the index is reloaded from its file
+        self._make_another_store_instance()
+        self.assertEqual(index, self.store._get_placeholder_index())
+        # if the index file is missing, it is rebuilt from the lineage files
+        os.remove(join(LOCAL_STORE_DIR, 'placeholders.index'))
+        self._make_another_store_instance()
+        self.assertEqual(index, self.store._get_placeholder_index())
+
+        # replacing only rewrites the files with placeholders
+        s = self.store
+        s.replace_placeholders('test_inst', BASE_SNAPSHOT_HASHES)
+        self.assertEqual({}, s._get_placeholder_index())
+        self._run_step('step2', [INTERMEDIATE_S1], [INTERMEDIATE_S2])
+        saved = []
+        orig_save = s._save_rfile_to_curr
+        def save_rfile(rname, mapping):
+            saved.append(rname)
+            return orig_save(rname, mapping)
+        s._save_rfile_to_curr = save_rfile
+        s.replace_placeholders('test_inst', BASE_SNAPSHOT_HASHES)
+        self.assertEqual(['intermediate'], saved)
+        self._make_another_store_instance()
+        self._assert_step_hash(INTERMEDIATE_S2, 'step2', 'intermediate_hash')
+
+    def test_compact_format(self):
+        self._run_initial_workflow()
+        with open(join(LOCAL_STORE_DIR, 'intermediate.json'), 'rb') as f:
+            data = f.read()
+        expected = {ref:l.to_json()
+                    for (ref, l) in decode_lineage_file('intermediate', data).items()}
+        # files written in the original format are read by a compact store, and
+        # rewritten in the compact format
+        self.store = FileLineageStore('test_inst', LOCAL_STORE_DIR, SNAPSHOT_DIR, compact=True)
+        self._run_step('step4', [INTERMEDIATE_S2], [INTERMEDIATE_S3])
+        with open(join(LOCAL_STORE_DIR, 'intermediate.json'), 'rb') as f:
+            compact_data = f.read()
+        obj = json.loads(compact_data)
+        self.assertEqual('compact', obj['format'])
+        self.assertIn(['intermediate', 's1'], obj['refs'])
+        mapping = decode_lineage_file('intermediate', compact_data)
+        self.assertEqual(3, len(mapping))
+        for (ref, lineage_json) in expected.items():
+            self.assertEqual(lineage_json, mapping[ref].to_json())
+        self._make_another_store_instance()
+        self._assert_step_hash(INTERMEDIATE_S1, 'step1', 'intermediate_hash')
+        self.assertEqual('step4', self.store.retrieve_entry('test_inst', INTERMEDIATE_S3).step_name)
+
+    def test_lazy_step_lineage(self):
+        self._run_initial_workflow()
+        with open(join(LOCAL_STORE_DIR, 'intermediate.json'), 'rb') as f:
+            mapping = decode_lineage_file('intermediate', f.read())
+        lineage = mapping[INTERMEDIATE_S1]
+        self.assertIsInstance(lineage, StepLineage)
+        self.assertIsNotNone(lineage._json)
+        self.assertEqual([INTERMEDIATE_S1], lineage.get_output_refs())
+        self.assertIsNotNone(lineage._json)
+        self.assertEqual('step1', lineage.step_name)
+        self.assertIsNone(lineage._json)
+        self.assertEqual({'p1':'v1', 'p2':5}, lineage.parameters)
+        self.assertEqual([INTERMEDIATE_S1], lineage.get_output_refs())
+
+    def test_legacy_snapshot_layout(self):
+        """Snapshots taken before the blobs were introduced have a copy of
+        each resource file in the snapshot directory.
+        """
+        self._run_initial_workflow()
+        os.mkdir(SNAPSHOT2_DIR)
+        for fname in os.listdir(LOCAL_STORE_DIR):
+            shutil.copyfile(join(LOCAL_STORE_DIR, fname), join(SNAPSHOT2_DIR, fname))
+        self._make_another_store_instance()
+        s = self.store
+        def refs_and_certs(it):
+            return sorted([(ref, lineage.get_cert_for_ref(ref)) for (ref, lineage) in it])
+        self.assertEqual(refs_and_certs(s.iterate_all('test_inst')),
+                         refs_and_certs(s.iterate_all_as_of_snapshot('test_inst', 'snapshot2')))
+        self.assertEqual(
+            s.retrieve_entry_as_of_snapshot('test_inst', INTERMEDIATE_S1, 'snapshot1').to_json(),
+            s.retrieve_entry_as_of_snapshot('test_inst', INTERMEDIATE_S1, 'snapshot2').to_json())
+
+    def tearDown(self):
+        if exists(TEMPDIR) and not KEEP_OUTPUTS:
+            shutil.rmtree(TEMPDIR)
+
+
+class TestWriteBehindFileLineageStore(unittest.TestCase, TstStoreMixin):
+    """Tests for the file lineage store with writes buffered until a flush"""
+    def setUp(self):
+        if os.path.exists(TEMPDIR):
+            shutil.rmtree(TEMPDIR)
+        os.mkdir(TEMPDIR)
+        os.mkdir(LOCAL_STORE_DIR)
+        os.mkdir(SNAPSHOT_DIR)
+        self.store = FileLineageStore('test_inst', LOCAL_STORE_DIR, SNAPSHOT_DIR,
+                                      write_behind=True)
+
+    def _get_store(self):
+        return self.store
+
+    def _make_another_store_instance(self):
+        self.store.flush()
+        self.store = FileLineageStore('test_inst', LOCAL_STORE_DIR, SNAPSHOT_DIR,
+                                      write_behind=True)
+
+    def _get_instance(self):
+        return 'test_inst'
+
+    def _list_store_dir(self):
+        return sorted(f for f in os.listdir(LOCAL_STORE_DIR) if f != 'lineage.lock')
+
+    def test_writes_are_buffered(self):
+        s = self.store
+        self._run_step('step1', [R1, R2_FOO_BAR], [INTERMEDIATE_S1, INTERMEDIATE_S2])
+        self.assertEqual([], self._list_store_dir())
+        self.assertTrue(s.has_entry('test_inst', INTERMEDIATE_S2))
+        s.flush()
+        self.assertEqual(['code.json', 'intermediate.json', 'placeholders.index',
+                          'r1.json', 'r2.json'],
+                         self._list_store_dir())
+        # clearing a resource is also buffered
+        s.clear_entry('test_inst', INTERMEDIATE_ROOT)
+        self.assertFalse(s.has_entry('test_inst', INTERMEDIATE_S1))
+        self.assertTrue(exists(join(LOCAL_STORE_DIR, 'intermediate.json')))
+        self.assertEqual(3, len(list(s.iterate_all('test_inst'))))
+        s.flush()
+        self.assertFalse(exists(join(LOCAL_STORE_DIR, 'intermediate.json')))
+        self._make_another_store_instance()
+        self.assertFalse(self.store.has_entry('test_inst', INTERMEDIATE_S1))
+        self.assertTrue(self.store.has_entry('test_inst', R1))
+
+    def test_recovery_from_journal(self):
+        s = self.store
+        self._run_step('step1', [R1], [INTERMEDIATE_S1])
+        s.flush()
+        self._run_step('step2', [INTERMEDIATE_S1], [INTERMEDIATE_S2])
+        # crash after writing the journal, but before making the changes
+        def crash(journal):
+            raise KeyboardInterrupt()
+        s._apply_journal = crash
+        self.assertRaises(KeyboardInterrupt, s.flush)
+        self.assertTrue(exists(join(LOCAL_STORE_DIR, 'lineage.journal')))
+        self.store = FileLineageStore('test_inst', LOCAL_STORE_DIR, SNAPSHOT_DIR,
+                                      write_behind=True)
+        self.assertEqual(['code.json', 'intermediate.json', 'placeholders.index', 'r1.json'],
+                         self._list_store_dir())
+        self.assertEqual('step2',
+                         self.store.retrieve_entry('test_inst', INTERMEDIATE_S2).step_name)
+        # crash before writing the journal: the changes are lost, but the
+        # files are not corrupted
+        self._run_step('step3', [INTERMEDIATE_S2], [INTERMEDIATE_S3])
+        with open(join(LOCAL_STORE_DIR, 'intermediate.json.tmp'), 'w') as f:
+            f.write('{"resource_name": "intermedi')
+        self.store = FileLineageStore('test_inst', LOCAL_STORE_DIR, SNAPSHOT_DIR,
+                                      write_behind=True)
+        self.assertFalse(exists(join(LOCAL_STORE_DIR, 'intermediate.json.tmp')))
+        self.assertFalse(self.store.has_entry('test_inst', INTERMEDIATE_S3))
+        self.assertTrue(self.store.has_entry('test_inst', INTERMEDIATE_S2))
+
+    def tearDown(self):
+        if exists(TEMPDIR) and not KEEP_OUTPUTS:
+            shutil.rmtree(TEMPDIR)
+
+
+NUM_WORKERS=8
+STEPS_PER_WORKER=25
+
+def _run_concurrent_steps(worker, write_behind):
+    """Run steps which each write a distinct subpath of the results resource,
+    completing them as Lineage.complete() does.
+    """
+    store = FileLineageStore('test_inst', LOCAL_STORE_DIR, SNAPSHOT_DIR,
+                             write_behind=write_behind)
+    for i in range(STEPS_PER_WORKER):
+        lineage = StepLineage.make_step_lineage('test_inst', 'train', datetime.datetime.now(),
+                                                {'worker':worker, 'run':i}, [R1], [CODE], store)
+        lineage.add_output('test_inst', store, ResourceRef('results', 'w%d/run%d' % (worker, i)))
+        store.store_entry('test_inst', lineage)
+        store.flush()
+
+
+class TestConcurrentWrites(unittest.TestCase):
+    """Stress test of steps in several processes completing at the same time,
+    all writing to the same resource.
+    """
+    def setUp(self):
+        if os.path.exists(TEMPDIR):
+            shutil.rmtree(TEMPDIR)
+        os.mkdir(TEMPDIR)
+        os.mkdir(LOCAL_STORE_DIR)
+        os.mkdir(SNAPSHOT_DIR)
+
+    def _run_workers(self, write_behind):
+        workers = [multiprocessing.Process(target=_run_concurrent_steps, args=(w, write_behind))
+                   for w in range(NUM_WORKERS)]
+        start = time.time()
+        for p in workers:
+            p.start()
+        for p in workers:
+            p.join()
+            self.assertEqual(0, p.exitcode)
+        print("%d concurrent steps completed at %.0f steps/second" %
+              (NUM_WORKERS*STEPS_PER_WORKER,
+               NUM_WORKERS*STEPS_PER_WORKER/(time.time()-start)))
+        store = FileLineageStore('test_inst', LOCAL_STORE_DIR, SNAPSHOT_DIR)
+        refs = set(store.get_refs_for_resource('test_inst', 'results'))
+        self.assertEqual(set(ResourceRef('results', 'w%d/run%d' % (w, i))
+                             for w in range(NUM_WORKERS) for i in range(STEPS_PER_WORKER)),
+                         refs)
+        self.assertTrue(store.has_entry('test_inst', R1))
+        # the placeholders from every process are in the index
+        index = store._get_placeholder_index()
+        self.assertEqual({'results'}, set().union(*index['results'].values()))
+        store.replace_placeholders('test_inst', BASE_SNAPSHOT_HASHES)
+        self.assertEqual({}, store._get_placeholder_index())
+
+    def test_write_through(self):
+        self._run_workers(write_behind=False)
+
+    def test_write_behind(self):
+        self._run_workers(write_behind=True)
+
+    def tearDown(self):
+        if exists(TEMPDIR) and not KEEP_OUTPUTS:
+            shutil.rmtree(TEMPDIR)
+
+
+CURRENT_DB=os.path.join(LOCAL_STORE_DIR, 'lineage.db')
+SNAPSHOT_DB=os.path.join(SNAPSHOT_DIR, 'lineage.db')
+
+class TestSqliteLineageStore(unittest.TestCase, TstStoreMixin):
+    """Tests for the lineage store api SQLite-based implementation"""
+    def setUp(self):
+        if os.path.exists(TEMPDIR):
+            shutil.rmtree(TEMPDIR)
+        os.mkdir(TEMPDIR)
+        os.mkdir(LOCAL_STORE_DIR)
+        os.mkdir(SNAPSHOT_DIR)
+        self.store = SqliteLineageStore('test_inst', CURRENT_DB, SNAPSHOT_DB)
+
+    def _get_store(self):
+        return self.store
+
+    def _make_another_store_instance(self):
+        self.store.close()
+        self.store = SqliteLineageStore('test_inst', CURRENT_DB, SNAPSHOT_DB,
+                                        self.store.snapshot_export_dir)
+
+    def _get_instance(self):
+        return 'test_inst'
+
+    def test_snapshots_share_lineage(self):
+        """Taking a second snapshot without any changes should not add
+        any lineage rows, and deleting a snapshot should only remove the rows
+        which are not used by other snapshots.
+        """
+        RESOURCE_NAMES=['r1', 'r2', 'results', 'intermediate', 'code']
+        self._run_initial_workflow()
+        s = self.store
+        def num_snapshot_lineages():
+            return s.conn.execute("select count(*) from snap.lineages").fetchone()[0]
+        num_lineages = num_snapshot_lineages()
+        self.assertTrue(num_lineages>0)
+        s.snapshot_lineage('test_inst', 'snapshot2', RESOURCE_NAMES)
+        self.assertEqual(num_lineages, num_snapshot_lineages())
+        self.assertEqual(['snapshot1', 'snapshot2'], s.get_snapshot_hashes())
+        s.delete_snapshot_lineage('test_inst', 'snapshot1')
+        self.assertEqual(num_lineages, num_snapshot_lineages())
+        s.delete_snapshot_lineage('test_inst', 'snapshot2')
+        self.assertEqual(0, num_snapshot_lineages())
+
+    def test_snapshot_exports(self):
+        """The snapshot lineage is exported to one file per snapshot, which
+        another store (e.g. in a clone of the workspace) loads when opened.
+        """
+        export_dir = os.path.join(TEMPDIR, 'exports')
+        os.mkdir(export_dir)
+        self.store = SqliteLineageStore('test_inst', CURRENT_DB, SNAPSHOT_DB, export_dir)
+        self._run_initial_workflow()
+        self.store.snapshot_lineage('test_inst', 'snapshot2', ['r1', 'results'])
+        self.assertEqual(['snapshot1.lineage.json', 'snapshot2.lineage.json'],
+                         sorted(os.listdir(export_dir)))
+        def contents(store, snapshot_hash):
+            it = store.iterate_all_as_of_snapshot('test_inst', snapshot_hash)
+            return sorted([(ref, lineage.get_cert_for_ref(ref)) for (ref, lineage) in it])
+        other_dir = os.path.join(TEMPDIR, 'other')
+        os.mkdir(other_dir)
+        other = SqliteLineageStore('test_inst', os.path.join(other_dir, 'lineage.db'),
+                                   os.path.join(other_dir, 'snapshot_lineage.db'), export_dir)
+        try:
+            self.assertEqual(['snapshot1', 'snapshot2'], other.get_snapshot_hashes())
+            for snapshot_hash in ('snapshot1', 'snapshot2'):
+                self.assertEqual(contents(self.store, snapshot_hash),
+                                 contents(other, snapshot_hash))
+        finally:
+            other.close()
+        # a snapshot deleted elsewhere is dropped when the store is reopened
+        os.remove(os.path.join(export_dir, 'snapshot2.lineage.json'))
+        self._make_another_store_instance()
+        self.assertEqual(['snapshot1'], self.store.get_snapshot_hashes())
+        self.store.delete_snapshot_lineage('test_inst', 'snapshot1')
+        self.assertEqual([], os.listdir(export_dir))
+
+    def test_migration(self):
+        file_store = FileLineageStore('test_inst', LOCAL_STORE_DIR, SNAPSHOT_DIR)
+        self.store = file_store
+        self._run_initial_workflow(s3_outputs=[RESULTS, OUT4],
+                                   snapshot_hash_overrides={'out4':'out4hash'})
+        sqlite_store = SqliteLineageStore('test_inst', CURRENT_DB, SNAPSHOT_DB)
+        (num_resources, num_snapshots) = migrate_file_lineage_to_sqlite(file_store, sqlite_store)
+        self.assertEqual(1, num_snapshots)
+        self.assertEqual(6, num_resources)
+        def contents(store, snapshot_hash=None):
+            it = store.iterate_all('test_inst') if snapshot_hash is None \
+                 else store.iterate_all_as_of_snapshot('test_inst', snapshot_hash)
+            return sorted([(ref, lineage.get_cert_for_ref(ref)) for (ref, lineage) in it])
+        self.assertEqual(contents(file_store), contents(sqlite_store))
+        self.assertEqual(contents(file_store, 'snapshot1'),
+                         contents(sqlite_store, 'snapshot1'))
+
+    def test_import_unmigrated(self):
+        """Only the snapshots which have no export file are imported, along with
+        the current lineage.
+        """
+        file_store = FileLineageStore('test_inst', LOCAL_STORE_DIR, SNAPSHOT_DIR)
+        self.store = file_store
+        self._run_initial_workflow()
+        file_store.snapshot_lineage('test_inst', 'snapshot2', ['r1', 'results'])
+        export_dir = os.path.join(TEMPDIR, 'exports')
+        os.mkdir(export_dir)
+        # snapshot1 was exported by the clone which migrated
+        with open(os.path.join(export_dir, 'snapshot1.lineage.json'), 'w') as f:
+            json.dump({'snapshot_hash':'snapshot1', 'resources':[], 'refs':[],
+                       'lineages':{}}, f)
+        sqlite_store = SqliteLineageStore('test_inst', CURRENT_DB, SNAPSHOT_DB, export_dir)
+        try:
+            (num_resources, snapshot_hashes) = \
+                import_unmigrated_file_lineage(file_store, sqlite_store)
+            self.assertEqual(['snapshot2'], snapshot_hashes)
+            self.assertEqual(len(list(file_store.iterate_all('test_inst'))),
+                             len(list(sqlite_store.iterate_all('test_inst'))))
+            self.assertTrue(num_resources > 0)
+            self.assertEqual(['snapshot1', 'snapshot2'], sqlite_store.get_snapshot_hashes())
+            self.assertTrue(exists(os.path.join(export_dir, 'snapshot2.lineage.json')))
+        finally:
+            sqlite_store.close()
+
     def tearDown(self):
+        if isinstance(self.store, SqliteLineageStore):
+            self.store.close()
         if exists(TEMPDIR) and not KEEP_OUTPUTS:
             shutil.rmtree(TEMPDIR)
 
@@ -6,10 +6,24 @@ import shutil
 import gzip
 import unittest
 import re
+import hashlib
+import io
 
 from dataworkspaces.resources.s3.snapfs import S3Snapshot
+from dataworkspaces.resources.s3.content_cache import ContentCache
+from dataworkspaces.resources.s3.transfer import DownloadItem, download_objects,\
+                                                  UploadItem, upload_objects, compute_etag,\
+                                                  get_object_info
+from dataworkspaces.resources.s3.listing_cache import ListingCache
+from dataworkspaces.resources.s3.snapshot_cache import SnapshotCache
 from dataworkspaces.api import get_filesystem_for_resource
 
+try:
+    from dataworkspaces.resources.s3.s3_resource import S3Resource
+    S3FS_INSTALLED=True
+except ImportError:
+    S3FS_INSTALLED=False
+
 from utils_for_tests import TEMPDIR, WS_DIR, write_gzipped_json, get_configuration_for_test, SimpleCase
 
 SNAPSHOT_PATH=join(TEMPDIR, 'snapshot.json.gz')
@@ -303,6 +317,389 @@ class TestS3SnapFs(unittest.TestCase):
         self.assertEqual(snapshot.version_id("hourly_stats_by_day/2021-07-16_http_requests.json.gz"),
                          "QTJCEmmr7pWISkzD3sU8_kMCt_6C2vrn")
 
+    def test_items_under(self):
+        snapshot = S3Snapshot({'a/b':'1', 'a/c/d':'2', 'a.txt':'3', 'ab':'4'})
+        self.assertEqual(['a.txt', 'a', 'ab'], snapshot.ls('')) # in key order
+        self.assertEqual(['a/b', 'a/c'], snapshot.ls('a'))
+        self.assertEqual([('a/b', '1'), ('a/c/d', '2')], snapshot.items_under('a'))
+        self.assertEqual([('a/c/d', '2')], snapshot.items_under('a/c/d'))
+        self.assertEqual([], snapshot.items_under('a/x'))
+        self.assertEqual(4, len(snapshot.items_under('')))
+
+    def test_index_round_trip(self):
+        snapshot = S3Snapshot.read_snapshot_from_file(SNAPSHOT_PATH)
+        index_path = join(TEMPDIR, 'snapshot.idx')
+        snapshot.write_index(index_path)
+        snapshot2 = S3Snapshot.read_index(index_path)
+        self.assertEqual(SNAPSHOT_DATA, snapshot2.snapshot)
+        self.assertEqual(snapshot.ls('sampled_logs'), snapshot2.ls('sampled_logs'))
+        S3Snapshot({}).write_index(index_path)
+        self.assertEqual([], S3Snapshot.read_index(index_path).ls(''))
+
+
+class TestSnapshotCache(unittest.TestCase):
+    def setUp(self):
+        if exists(TEMPDIR):
+            shutil.rmtree(TEMPDIR)
+        os.mkdir(TEMPDIR)
+        self.cache_dir = join(TEMPDIR, 'snapshot_cache')
+        self.downloads = []
+
+    def tearDown(self):
+        if exists(TEMPDIR):
+            shutil.rmtree(TEMPDIR)
+
+    def _download(self, snapshot_hash, local_path):
+        self.downloads.append(snapshot_hash)
+        write_gzipped_json({'f%d' % i:snapshot_hash for i in range(10)}, local_path)
+
+    def test_get_and_evict(self):
+        cache = SnapshotCache(self.cache_dir, 1000, self._download)
+        self.assertEqual('h1', cache.get('h1').version_id('f5'))
+        self.assertEqual(['h1.idx'], os.listdir(self.cache_dir))
+        # a new instance (e.g. in a new process) reads the index
+        cache = SnapshotCache(self.cache_dir, 1000, self._download)
+        self.assertEqual('h1', cache.get('h1').version_id('f5'))
+        self.assertEqual(['h1'], self.downloads)
+        index_size = os.stat(join(self.cache_dir, 'h1.idx')).st_size
+        cache.max_size = 2*index_size
+        path = join(self.cache_dir, 'h1.idx')
+        os.utime(path, (os.stat(path).st_atime-10, os.stat(path).st_mtime-10))
+        self.assertEqual(2, cache.prefetch(['h1', 'h2', 'h3']))
+        self.assertEqual(['h2.idx', 'h3.idx'], sorted(os.listdir(self.cache_dir)))
+        self.assertTrue(cache.contains('h1')) # still in memory
+        cache.remove('h1')
+        self.assertFalse(cache.contains('h1'))
+
+class TestContentCache(unittest.TestCase):
+    """Test the local content cache used by S3Resource.open(), using a fake
+    download function in place of the bucket.
+    """
+    def setUp(self):
+        if exists(TEMPDIR):
+            shutil.rmtree(TEMPDIR)
+        os.mkdir(TEMPDIR)
+        self.cache_dir = join(TEMPDIR, 'content_cache')
+        self.downloads = []
+
+    def tearDown(self):
+        if exists(TEMPDIR):
+            shutil.rmtree(TEMPDIR)
+
+    def _downloader(self, data):
+        def download(local_path):
+            self.downloads.append(data)
+            with open(local_path, 'wb') as f:
+                f.write(data)
+        return download
+
+    def test_hits_and_misses(self):
+        cache = ContentCache(self.cache_dir, 1000)
+        with cache.open('a/b.txt', 'v:1', 'rb', self._downloader(b'version 1')) as f:
+            self.assertEqual(b'version 1', f.read())
+        with cache.open('a/b.txt', 'v:1', 'rb', self._downloader(b'unexpected')) as f:
+            self.assertEqual(b'version 1', f.read())
+        with cache.open('a/b.txt', 'v:2', 'r', self._downloader(b'version 2')) as f:
+            self.assertEqual('version 2', f.read())
+        self.assertEqual([b'version 1', b'version 2'], self.downloads)
+        # checking for an entry does not count as a hit or miss
+        self.assertTrue(cache.contains('a/b.txt', 'v:1'))
+        self.assertFalse(cache.contains('a/b.txt', 'v:3'))
+        stats = cache.get_stats()
+        self.assertEqual(1, stats.hits)
+        self.assertEqual(2, stats.misses)
+        self.assertEqual(18, stats.bytes_downloaded)
+        self.assertEqual(18, stats.current_size)
+
+    def test_lru_eviction(self):
+        cache = ContentCache(self.cache_dir, 250)
+        cache.get('f1', 't', self._downloader(b'1'*100))
+        cache.get('f2', 't', self._downloader(b'2'*100))
+        # make f1 the most recently used entry
+        path = cache.lookup('f1', 't')
+        os.utime(path, (os.stat(path).st_atime+10, os.stat(path).st_mtime+10))
+        cache.get('f3', 't', self._downloader(b'3'*100))
+        self.assertEqual(1, cache.get_stats().evictions)
+        self.assertIsNotNone(cache.lookup('f1', 't'))
+        self.assertIsNone(cache.lookup('f2', 't'))
+        self.assertIsNotNone(cache.lookup('f3', 't'))
+        self.assertEqual(200, cache.get_stats().current_size)
+        # a new cache instance over the same directory sees the same entries
+        cache2 = ContentCache(self.cache_dir, 250)
+        self.assertEqual(200, cache2.get_stats().current_size)
+
+    def test_failed_fill(self):
+        cache = ContentCache(self.cache_dir, 1000)
+        def failing_download(local_path):
+            with open(local_path, 'wb') as f:
+                f.write(b'partial')
+            raise IOError("connection reset")
+        with self.assertRaises(IOError):
+            cache.get('f1', 't', failing_download)
+        self.assertIsNone(cache.lookup('f1', 't'))
+        self.assertEqual(0, cache.get_stats().current_size)
+
+class FakeVersionedFs:
+    """Stands in for s3fs for the transfer tests. Objects are stored in
+    a dict of (path, version_id) -> bytes, where version None is the latest.
+    """
+    def __init__(self, objects):
+        self.objects = objects
+        self.requests = []
+        self.etags = {}
+        self.uploads = {}
+        self.cached_infos = {}
+
+    def call_s3(self, method, Bucket, Key, **kwargs):
+        self.requests.append((method, Bucket+'/'+Key))
+        path = Bucket+'/'+Key
+        if method=='put_object':
+            self.objects[(path, None)] = kwargs['Body']
+            self.etags[path] = hashlib.md5(kwargs['Body']).hexdigest()
+        elif method=='create_multipart_upload':
+            self.uploads[path] = {}
+            return {'UploadId':path}
+        elif method=='upload_part':
+            self.uploads[kwargs['UploadId']][kwargs['PartNumber']] = kwargs['Body']
+            return {'ETag':'"%s"' % hashlib.md5(kwargs['Body']).hexdigest()}
+        elif method=='complete_multipart_upload':
+            parts = self.uploads.pop(kwargs['UploadId'])
+            numbers = [p['PartNumber'] for p in kwargs['MultipartUpload']['Parts']]
+            assert numbers==sorted(parts.keys())
+            self.objects[(path, None)] = b''.join(parts[n] for n in numbers)
+            self.etags[path] = '%s-%d' % (
+                hashlib.md5(b''.join(hashlib.md5(parts[n]).digest() for n in numbers)).hexdigest(),
+                len(numbers))
+        elif method=='abort_multipart_upload':
+            del self.uploads[kwargs['UploadId']]
+
+    def info(self, path, version_id=None, refresh=False):
+        # like s3fs, answer from the listing cache unless refresh is specified
+        if version_id is None and not refresh and path in self.cached_infos:
+            return self.cached_infos[path]
+        self.requests.append(('info', path, version_id))
+        if (path, version_id) not in self.objects:
+            raise FileNotFoundError(path)
+        info = {'size':len(self.objects[(path, version_id)]),
+                'ETag':'"%s"' % self.etags.get(path, 'e')}
+        if version_id is None:
+            self.cached_infos[path] = info
+        return info
+
+    def cat_file(self, path, start=None, end=None, version_id=None):
+        self.requests.append(('get', path, version_id, start, end))
+        return self.objects[(path, version_id)][start:end]
+
+    def open(self, path, mode='rb', version_id=None):
+        self.requests.append(('open', path, version_id))
+        data = self.objects[(path, version_id)]
+        return io.BytesIO(data) if mode=='rb' else io.StringIO(data.decode('utf-8'))
+
+
+class TestTransfer(unittest.TestCase):
+    """Test the parallel multipart downloads used for prefetch and download_tree"""
+    def setUp(self):
+        if exists(TEMPDIR):
+            shutil.rmtree(TEMPDIR)
+        os.mkdir(TEMPDIR)
+
+    def tearDown(self):
+        if exists(TEMPDIR):
+            shutil.rmtree(TEMPDIR)
+
+    def test_multipart_download(self):
+        fs = FakeVersionedFs({
+            ('bucket/big.bin', None): bytes(range(256))*40,
+            ('bucket/dir/small.txt', 'v1'): b'old',
+            ('bucket/dir/small.txt', None): b'new',
+            ('bucket/empty', None): b''
+        })
+        items = [
+            DownloadItem('bucket/big.bin', None, join(TEMPDIR, 'big.bin'), 10240),
+            DownloadItem('bucket/dir/small.txt', 'v1', join(TEMPDIR, 'dir/small.txt')),
+            DownloadItem('bucket/empty', None, join(TEMPDIR, 'empty'))
+        ]
+        stats = download_objects(fs, items, part_size=1000, max_workers=4)
+        self.assertEqual(3, stats.num_files)
+        self.assertEqual(10243, stats.num_bytes)
+        with open(join(TEMPDIR, 'big.bin'), 'rb') as f:
+            self.assertEqual(bytes(range(256))*40, f.read())
+        with open(join(TEMPDIR, 'dir/small.txt'), 'rb') as f:
+            self.assertEqual(b'old', f.read())
+        self.assertEqual(0, os.stat(join(TEMPDIR, 'empty')).st_size)
+        gets = [r for r in fs.requests if r[0]=='get']
+        self.assertEqual(12, len(gets)) # 11 parts for big.bin, 1 for small.txt
+        # only the items with unknown sizes needed a HEAD request
+        self.assertEqual(2, len([r for r in fs.requests if r[0]=='info']))
+        self.assertEqual(['big.bin', 'dir', 'empty'], sorted(os.listdir(TEMPDIR)))
+
+    def test_info_is_refreshed(self):
+        fs = FakeVersionedFs({('bucket/f1', None): b'old'})
+        fs.info('bucket/f1') # fills the listing cache
+        # another writer overwrites the object
+        fs.objects[('bucket/f1', None)] = b'newer'
+        fs.etags['bucket/f1'] = 'e2'
+        [info] = get_object_info(fs, [('bucket/f1', None)])
+        self.assertEqual(('"e2"', 5), (info['ETag'], info['size']))
+        stats = download_objects(fs, [DownloadItem('bucket/f1', None, join(TEMPDIR, 'f1'))])
+        self.assertEqual(5, stats.num_bytes)
+
+    def test_failed_download(self):
+        fs = FakeVersionedFs({('bucket/f1', None): b'data'})
+        items = [DownloadItem('bucket/f1', None, join(TEMPDIR, 'f1')),
+                 DownloadItem('bucket/missing', None, join(TEMPDIR, 'f2'), 10)]
+        with self.assertRaises(KeyError):
+            download_objects(fs, items)
+        self.assertEqual([], os.listdir(TEMPDIR))
+
+    def _write(self, rel_path, data):
+        with open(join(TEMPDIR, rel_path), 'wb') as f:
+            f.write(data)
+        return join(TEMPDIR, rel_path)
+
+    def test_upload_and_skip_unchanged(self):
+        fs = FakeVersionedFs({})
+        items = [UploadItem(self._write('big.bin', bytes(range(256))*40), 'bucket/big.bin'),
+                 UploadItem(self._write('small.txt', b'small'), 'bucket/d/small.txt'),
+                 UploadItem(self._write('empty', b''), 'bucket/empty')]
+        progress = []
+        stats = upload_objects(fs, items, part_size=1000, max_workers=4,
+                               progress=lambda done, total: progress.append((done, total)))
+        self.assertEqual(3, stats.num_files)
+        self.assertEqual(0, stats.num_skipped)
+        self.assertEqual(bytes(range(256))*40, fs.objects[('bucket/big.bin', None)])
+        self.assertEqual(b'small', fs.objects[('bucket/d/small.txt', None)])
+        self.assertEqual(b'', fs.objects[('bucket/empty', None)])
+        self.assertEqual(11, len([r for r in fs.requests if r[0]=='upload_part']))
+        self.assertEqual((10245, 10245), progress[-1])
+        self.assertEqual(13, len(progress))
+        self.assertEqual(fs.etags['bucket/big.bin'], compute_etag(items[0].local_path, 1000))
+        # a second upload skips everything but the changed file
+        self._write('small.txt', b'changed')
+        fs.requests = []
+        stats = upload_objects(fs, items, part_size=1000, max_workers=4)
+        self.assertEqual(1, stats.num_files)
+        self.assertEqual(2, stats.num_skipped)
+        self.assertEqual(b'changed', fs.objects[('bucket/d/small.txt', None)])
+        self.assertEqual(['put_object'], [r[0] for r in fs.requests if r[0]!='info'])
+
+    def test_failed_upload_is_aborted(self):
+        fs = FakeVersionedFs({})
+        path = self._write('big.bin', b'x'*2500)
+        def failing_call_s3(method, Bucket, Key, **kwargs):
+            if method=='upload_part' and kwargs['PartNumber']==2:
+                raise IOError("connection reset")
+            return FakeVersionedFs.call_s3(fs, method, Bucket, Key, **kwargs)
+        fs.call_s3 = failing_call_s3
+        with self.assertRaises(IOError):
+            upload_objects(fs, [UploadItem(path, 'bucket/big.bin')], part_size=1000)
+        self.assertEqual({}, fs.uploads)
+        self.assertNotIn(('bucket/big.bin', None), fs.objects)
+
+@unittest.skipUnless(S3FS_INSTALLED, "SKIP: s3fs not available")
+class TestOpen(unittest.TestCase):
+    """Test the reads of S3Resource.open() when no snapshot is active, using a
+    fake filesystem in place of the bucket.
+    """
+    def setUp(self):
+        if exists(TEMPDIR):
+            shutil.rmtree(TEMPDIR)
+        os.mkdir(TEMPDIR)
+        self.fs = FakeVersionedFs({('bucket/small.txt', None): b'small',
+                                   ('bucket/big.bin', None): b'b'*100})
+        # We skip the constructor, which needs a workspace
+        self.resource = S3Resource.__new__(S3Resource)
+        self.resource.bucket_name = 'bucket'
+        self.resource.current_snapshot = None
+        self.resource.fs = self.fs
+        self.resource.content_cache = ContentCache(join(TEMPDIR, 'content_cache'), 50)
+
+    def tearDown(self):
+        if exists(TEMPDIR):
+            shutil.rmtree(TEMPDIR)
+
+    def _read(self, rel_path):
+        with self.resource.open(rel_path, 'rb') as f:
+            return f.read()
+
+    def test_small_objects_are_cached(self):
+        self.assertEqual(b'small', self._read('small.txt'))
+        self.assertEqual(b'small', self._read('small.txt'))
+        self.assertEqual(1, len([r for r in self.fs.requests if r[0]=='open']))
+        self.assertEqual(1, self.resource.content_cache.get_stats().hits)
+
+    def test_large_objects_are_streamed(self):
+        self.assertEqual(b'b'*100, self._read('big.bin'))
+        self.assertEqual(b'b'*100, self._read('big.bin'))
+        self.assertEqual(2, len([r for r in self.fs.requests if r[0]=='open']))
+        self.assertEqual(0, self.resource.content_cache.get_stats().current_size)
+        # an object which is already cached is still read from the cache
+        def download(local_path):
+            with open(local_path, 'wb') as f:
+                f.write(b'cached')
+        self.resource.content_cache.fill('big.bin', 'etag:e', download)
+        self.assertEqual(b'cached', self._read('big.bin'))
+        self.assertEqual(2, len([r for r in self.fs.requests if r[0]=='open']))
+
+
+class TestListingCache(unittest.TestCase):
+    """Test the listing cache used by S3Resource when no snapshot is active,
+    using a set of keys in place of the bucket.
+    """
+    def setUp(self):
+        self.keys = {'a.txt', 'd1/b.txt', 'd1/d2/c.txt', 'd1/d2/d.txt'}
+        self.prefixes_listed = []
+
+    def _list(self, prefix):
+        self.prefixes_listed.append(prefix)
+        base = prefix+'/' if prefix!='' else ''
+        children = {}
+        for key in self.keys:
+            if key.startswith(base):
+                rest = key[len(base):].split('/')
+                children[base+rest[0]] = (len(rest)==1)
+        return list(children.items())
+
+    def test_lookups(self):
+        cache = ListingCache(self._list, ttl=60)
+        self.assertTrue(cache.lookup('a.txt'))
+        self.assertFalse(cache.lookup('d1'))
+        self.assertIsNone(cache.lookup('missing'))
+        self.assertFalse(cache.lookup(''))
+        self.assertEqual([''], self.prefixes_listed)
+        self.assertEqual([True, False, None, True],
+                         cache.lookup_many(['d1/b.txt', 'd1/d2', 'd1/d2/e.txt', 'd1/d2/c.txt']))
+        self.assertEqual(['', 'd1', 'd1/d2'], sorted(self.prefixes_listed))
+
+    def test_walk_lists_each_prefix_once(self):
+        cache = ListingCache(self._list, ttl=60)
+        to_visit = ['']
+        files = []
+        while len(to_visit)>0:
+            for (rel_path, is_file) in cache.get_listing(to_visit.pop()).items():
+                if cache.lookup(rel_path):
+                    files.append(rel_path)
+                else:
+                    to_visit.append(rel_path)
+        self.assertEqual(sorted(self.keys), sorted(files))
+        self.assertEqual(['', 'd1', 'd1/d2'], sorted(self.prefixes_listed))
+        self.assertEqual(3, cache.num_lists)
+
+    def test_invalidation_and_ttl(self):
+        cache = ListingCache(self._list, ttl=60)
+        self.assertIsNone(cache.lookup('d3/e.txt'))
+        self.keys.add('d3/e.txt')
+        self.assertIsNone(cache.lookup('d3/e.txt')) # still cached
+        cache.invalidate('d3/e.txt')
+        self.assertTrue(cache.lookup('d3/e.txt'))
+        self.assertFalse(cache.lookup('d3'))
+        self.keys.remove('a.txt')
+        cache.ttl = 0 # everything has now expired
+        self.assertIsNone(cache.lookup('a.txt'))
+        self.assertEqual(['d3', 'd3', '', ''], self.prefixes_listed)
+
+
+
 @unittest.skipUnless(S3_BUCKET_CONFIGURATION is not None,
                      "SKIP: S3 bucket not specified in test_params.cfg")
 class TestS3Resource(SimpleCase):
@@ -1,5 +1,8 @@
 import unittest
 import sys
+import os
+import json
+import subprocess
 from os.path import exists, join
 
 from utils_for_tests import SimpleCase, WS_DIR
@@ -59,6 +62,206 @@ class TestSklearnKit(SimpleCase):
     def test_wrapper(self):
         self.wrapper_tc('digits.joblib')
 
+    @unittest.skipUnless(SKLEARN_INSTALLED, "SKIP: Sklearn not available")
+    def test_api_resource_sampled_fingerprint(self):
+        from sklearn.svm import SVC
+        from sklearn.datasets import load_digits
+        import dataworkspaces.kits.scikit_learn as skkit
+        from dataworkspaces.workspace import find_and_load_workspace, ResourceRef
+        self._setup_initial_repo(git_resources='code,results', api_resources='digits-api')
+        self._run_dws(['config', '--resource=digits-api', 'fingerprint', 'sampled'])
+        digits = load_digits()
+        classifier = skkit.LineagePredictor(SVC(gamma=0.001),
+                                            'multiclass_classification',
+                                            input_resource='digits-api',
+                                            workspace_dir=WS_DIR,
+                                            verbose=False)
+        classifier.fit(digits.data[:1000], digits.target[:1000])
+        classifier.score(digits.data[1000:], digits.target[1000:])
+        workspace = find_and_load_workspace(True, False, WS_DIR)
+        step = workspace.get_lineage_store().retrieve_entry(workspace.get_instance(),
+                                                            ResourceRef('results'))
+        [input_cert] = [c for c in step.get_input_certs() if c.ref.name=='digits-api']
+        self.assertTrue(input_cert.comment.endswith(
+                            '(approximate hash from a sampled fingerprint)'),
+                        "Unexpected comment: %s" % input_cert.comment)
+
+    @unittest.skipUnless(SKLEARN_INSTALLED, "SKIP: Sklearn not available")
+    def test_api_resource_exact_hash_not_annotated(self):
+        """In sampled mode, the hash is only marked as approximate if data was
+        actually added via a sampled fingerprint.
+        """
+        import numpy
+        from dataworkspaces.workspace import find_and_load_workspace
+        from dataworkspaces.utils.fingerprint_utils import BackgroundFingerprinter
+        self._setup_initial_repo(git_resources='code,results', api_resources='digits-api')
+        self._run_dws(['config', '--resource=digits-api', 'fingerprint', 'sampled'])
+        workspace = find_and_load_workspace(True, False, WS_DIR)
+        resource = workspace.get_resource('digits-api')
+        comment_file = join(workspace._get_local_scratch_space_for_resource('digits-api'),
+                            'comment.txt')
+        resource.init_hash_state()
+        fingerprinter = BackgroundFingerprinter()
+        fingerprinter.add(0, numpy.arange(100))
+        fingerprinter.finish(resource.get_hash_state())
+        resource.save_current_hash()
+        self.assertFalse(resource.hash_is_approximate())
+        self.assertFalse(exists(comment_file))
+        resource.add_to_hash(numpy.arange(100))
+        resource.save_current_hash()
+        self.assertTrue(resource.hash_is_approximate())
+        self.assertTrue(exists(comment_file))
+        resource.init_hash_state()
+        self.assertFalse(resource.hash_is_approximate())
+
+    @unittest.skipUnless(SKLEARN_INSTALLED, "SKIP: Sklearn not available")
+    def test_api_resource_unordered_batches(self):
+        import numpy
+        from dataworkspaces.workspace import find_and_load_workspace
+        self._setup_initial_repo(git_resources='code,results', api_resources='digits-api')
+        self._run_dws(['config', '--resource=digits-api', 'batch_order', 'unordered'])
+        batches = [numpy.arange(i, i+10) for i in range(4)]
+        workspace = find_and_load_workspace(True, False, WS_DIR)
+        resource = workspace.get_resource('digits-api')
+        def digest(batches):
+            resource.init_hash_state()
+            for batch in batches:
+                resource.add_to_hash(batch)
+            return resource.get_hash_state().hexdigest()
+        expected = digest(batches)
+        self.assertEqual(expected, digest(list(reversed(batches))))
+        self.assertNotEqual(expected, digest(batches[:3]))
+        # the partial digests of two workers combine to the digest of all of the batches
+        digest(batches[2:])
+        partial = resource.get_partial_digest()
+        digest(batches[:2])
+        resource.merge_partial_digest(partial)
+        self.assertEqual(expected, resource.get_hash_state().hexdigest())
+
+    @unittest.skipUnless(SKLEARN_INSTALLED, "SKIP: Sklearn not available")
+    def test_load_dataset_cache_and_mmap(self):
+        import numpy
+        import dataworkspaces.kits.scikit_learn as skkit
+        from dataworkspaces.errors import ConfigurationError
+        from dataworkspaces.workspace import find_and_load_workspace
+        self._setup_initial_repo(git_resources='code,source-data,results')
+        dataset_dir = join(WS_DIR, 'source-data/dataset')
+        os.mkdir(dataset_dir)
+        data = numpy.arange(60, dtype=numpy.float64).reshape((20, 3))
+        numpy.savetxt(join(dataset_dir, 'data.csv'), data, delimiter=',')
+        with open(join(dataset_dir, 'target.csv'), 'w') as f:
+            f.write('label\n' + '\n'.join('a' if i%2==0 else 'b' for i in range(20)) + '\n')
+        numpy.save(join(dataset_dir, 'weights.npy'), numpy.ones(20))
+        with open(join(dataset_dir, 'DESCR.txt'), 'w') as f:
+            f.write('A test dataset\n')
+        dataset = skkit.load_dataset_from_resource('source-data', 'dataset',
+                                                   workspace_dir=WS_DIR)
+        numpy.testing.assert_array_equal(data, dataset.data)
+        self.assertEqual(['a', 'b'], list(dataset.target[:2]))
+        self.assertEqual('A test dataset\n', dataset.DESCR)
+        workspace = find_and_load_workspace(True, False, WS_DIR)
+        cache_dir = join(workspace.get_scratch_directory(), skkit.DATASET_CACHE_DIR)
+        self.assertEqual(1, len([f for f in os.listdir(cache_dir) if f.endswith('.npy')]))
+        # the second time, data comes from the cache, memory-mapped
+        dataset = skkit.load_dataset_from_resource('source-data', 'dataset',
+                                                   workspace_dir=WS_DIR, mmap_mode='r')
+        self.assertTrue(isinstance(dataset.data, numpy.memmap))
+        self.assertTrue(dataset.data.filename.startswith(cache_dir))
+        numpy.testing.assert_array_equal(data, dataset.data)
+        self.assertTrue(isinstance(dataset.weights, numpy.memmap))
+        # a changed file gets a new cache entry
+        numpy.savetxt(join(dataset_dir, 'data.csv'), data*2, delimiter=',')
+        dataset = skkit.load_dataset_from_resource('source-data', 'dataset',
+                                                   workspace_dir=WS_DIR)
+        numpy.testing.assert_array_equal(data*2, dataset.data)
+        self.assertRaises(ConfigurationError, skkit.load_dataset_from_resource,
+                          'source-data', 'dataset', workspace_dir=WS_DIR, mmap_mode='w+')
+
+    @unittest.skipUnless(SKLEARN_INSTALLED, "SKIP: Sklearn not available")
+    def test_load_csv_cache_write_error(self):
+        """If the cache file cannot be written or memory-mapped, we fall back
+        to the array loaded from the csv file.
+        """
+        import numpy
+        from unittest import mock
+        import dataworkspaces.kits.scikit_learn as skkit
+        self._setup_initial_repo(git_resources='code,source-data,results')
+        data = numpy.arange(12, dtype=numpy.float64).reshape((4, 3))
+        csv_path = join(WS_DIR, 'source-data/data.csv')
+        numpy.savetxt(csv_path, data, delimiter=',')
+        # the cache directory cannot be created under a regular file
+        array = skkit._load_csv_file(csv_path, 'r', join(csv_path, 'cache'))
+        numpy.testing.assert_array_equal(data, array)
+        cache_dir = join(WS_DIR, 'cache')
+        with mock.patch.object(skkit.np, 'load', side_effect=OSError("no mmap")):
+            array = skkit._load_csv_file(csv_path, 'r', cache_dir)
+        self.assertFalse(isinstance(array, numpy.memmap))
+        numpy.testing.assert_array_equal(data, array)
+
+    @unittest.skipUnless(SKLEARN_INSTALLED, "SKIP: Sklearn not available")
+    def test_cv_run_key(self):
+        """Cross validation results are only reused for the same data."""
+        import numpy
+        from sklearn.svm import SVC
+        from sklearn.utils import Bunch
+        from dataworkspaces.kits.scikit_learn import _get_cv_run_key
+        data = numpy.arange(60, dtype=numpy.float64).reshape((20, 3))
+        target = numpy.arange(20) % 2
+        def key(data, target, random_state=42):
+            return _get_cv_run_key(SVC, {'gamma':[0.01]}, Bunch(data=data, target=target),
+                                   0.2, 3, 'accuracy', random_state)
+        self.assertEqual(key(data, target), key(data.copy(), target.copy()))
+        changed = data.copy()
+        changed[5, 1] = -1.0
+        self.assertNotEqual(key(data, target), key(changed, target))
+        self.assertNotEqual(key(data, target), key(data, 1 - target))
+        self.assertIsNone(key(data, target, random_state=None))
+
+    @unittest.skipUnless(SKLEARN_INSTALLED, "SKIP: Sklearn not available")
+    def test_train_and_predict_with_cv(self):
+        import numpy
+        from sklearn.datasets import load_digits
+        self._setup_initial_repo(git_resources='code,source-data,results')
+        dataset_dir = join(WS_DIR, 'source-data/digits')
+        os.mkdir(dataset_dir)
+        digits = load_digits()
+        numpy.savetxt(join(dataset_dir, 'data.csv'), digits.data[:300], delimiter=',')
+        numpy.savetxt(join(dataset_dir, 'target.csv'), digits.target[:300], delimiter=',')
+        with open(join(WS_DIR, 'code/cv.py'), 'w') as f:
+            f.write(CV_SCRIPT)
+        self._run_dws(['snapshot', 'S1'])
+        subprocess.run([sys.executable, 'cv.py'], cwd=join(WS_DIR, 'code'), check=True)
+        self.assertTrue(exists(join(WS_DIR, 'results/results.json')))
+        cv_results_file = join(WS_DIR, 'results/cv_results.jsonl')
+        with open(cv_results_file, 'r') as f:
+            records = [json.loads(line) for line in f]
+        self.assertEqual(6, len(records))
+        self.assertEqual(set((c, f) for c in range(2) for f in range(3)),
+                         set((r['candidate'], r['fold']) for r in records))
+        # simulate a killed run, with a partially written last line
+        with open(cv_results_file, 'w') as f:
+            for r in records[:4]:
+                f.write(json.dumps(r) + '\n')
+            f.write('{"run_key": ')
+        subprocess.run([sys.executable, 'cv.py'], cwd=join(WS_DIR, 'code'), check=True)
+        with open(cv_results_file, 'r') as f:
+            lines = f.readlines()
+        # only the two missing folds were run
+        self.assertEqual(7, len(lines))
+        self.assertEqual(set((r['candidate'], r['fold'], r['score']) for r in records[4:]),
+                         set((r['candidate'], r['fold'], r['score'])
+                             for r in map(json.loads, lines[5:])))
+
+
+CV_SCRIPT='''
+from sklearn.svm import SVC
+from dataworkspaces.kits.scikit_learn import load_dataset_from_resource,\\
+    train_and_predict_with_cv
+dataset = load_dataset_from_resource('source-data', 'digits')
+train_and_predict_with_cv(SVC, {'gamma':[0.01, 0.001]}, dataset, '../results',
+                          folds=3, random_state=42, n_jobs=2)
+'''
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -4,6 +4,7 @@ import os.path
 from os.path import exists, join
 import json
 import functools
+import hashlib
 import inspect
 
 from utils_for_tests import SimpleCase, WS_DIR
@@ -213,6 +214,85 @@ class TestTensorflowKit(SimpleCase):
         self.assertAlmostEqual(test_loss, data['metrics']['loss'])
         self._take_snapshot()
 
+    @unittest.skipUnless(TF_INSTALLED and TF_VERSION==2, "SKIP: Tensorflow 2 not available")
+    def test_fingerprint_repeated_dataset(self):
+        """Only the first epoch of a repeated, prefetched dataset is fingerprinted,
+        even though the pipeline reads ahead into the next epoch.
+        """
+        import tensorflow as tf
+        import numpy as np
+        from dataworkspaces.kits.tensorflow import _wrap_input_for_fingerprint
+        def fingerprint(dataset, steps, num_read):
+            (wrapped, fingerprinter) = _wrap_input_for_fingerprint('fit', dataset, None, steps)
+            for (_, _) in zip(range(num_read), wrapped):
+                pass
+            digest = hashlib.sha1()
+            fingerprinter.finish(digest)
+            return digest.hexdigest()
+        data = np.arange(40, dtype=np.float32).reshape((10, 4))
+        dataset = tf.data.Dataset.from_tensor_slices(data).batch(2)
+        expected = fingerprint(dataset, None, 5)
+        repeated = dataset.repeat().prefetch(3)
+        self.assertEqual(expected, fingerprint(repeated, 5, 5))
+        self.assertEqual(expected, fingerprint(repeated, 5, 12))
+
+    @unittest.skipUnless(TF_INSTALLED and TF_VERSION==2, "SKIP: Tensorflow 2 not available")
+    def test_get_num_batches(self):
+        import tensorflow as tf
+        import numpy as np
+        from dataworkspaces.kits.tensorflow import _get_num_batches
+        class Batches(tf.keras.utils.Sequence):
+            def __len__(self):
+                return 3
+            def __getitem__(self, idx):
+                return np.full((2, 4), idx, dtype=np.float32)
+        # a sequence is keyed by index, so its length is used even if steps is given
+        self.assertEqual(3, _get_num_batches(Batches(), None))
+        self.assertEqual(3, _get_num_batches(Batches(), 5))
+        data = np.arange(40, dtype=np.float32).reshape((10, 4))
+        dataset = tf.data.Dataset.from_tensor_slices(data).batch(2)
+        self.assertEqual(5, _get_num_batches(dataset, None))
+        self.assertEqual(4, _get_num_batches(dataset, 4))
+        self.assertIsNone(_get_num_batches(dataset.repeat(), None))
+        self.assertEqual(5, _get_num_batches(dataset.repeat(), 5))
+        self.assertIsNone(_get_num_batches(generator_from_arrays(data, data), None))
+        self.assertEqual(2, _get_num_batches(generator_from_arrays(data, data), 2))
+
+    @unittest.skipUnless(TF_INSTALLED and TF_VERSION==2, "SKIP: Tensorflow 2 not available")
+    def test_wrap_input_for_fingerprint(self):
+        import tensorflow as tf
+        import numpy as np
+        from dataworkspaces.kits.tensorflow import _wrap_input_for_fingerprint
+        data = np.arange(40, dtype=np.float32).reshape((10, 4))
+        # arrays are hashed directly and not wrapped
+        (wrapped, fingerprinter) = _wrap_input_for_fingerprint('fit', data, data, None)
+        self.assertIs(data, wrapped)
+        self.assertIsNone(fingerprinter)
+        self.assertRaises(NotSupportedError, _wrap_input_for_fingerprint, 'fit',
+                          generator_from_arrays(data, data), data, None)
+        # a wrapped generator returns the same values
+        (wrapped, fingerprinter) = _wrap_input_for_fingerprint(
+            'fit', generator_from_arrays(data, data), None, None)
+        for ((x, y), (x2, y2)) in zip(wrapped, generator_from_arrays(data, data)):
+            self.assertTrue(np.array_equal(x, x2))
+            self.assertTrue(np.array_equal(y, y2))
+        fingerprinter.finish(hashlib.sha1())
+        # the batches of a sequence may be read in any order
+        class Batches(tf.keras.utils.Sequence):
+            def __len__(self):
+                return 3
+            def __getitem__(self, idx):
+                return np.full((2, 4), idx, dtype=np.float32)
+        def fingerprint(order):
+            (wrapped, fingerprinter) = _wrap_input_for_fingerprint('fit', Batches(), None, None)
+            self.assertEqual(3, len(wrapped))
+            for idx in order:
+                self.assertTrue(np.array_equal(Batches()[idx], wrapped[idx]))
+            digest = hashlib.sha1()
+            fingerprinter.finish(digest)
+            return digest.hexdigest()
+        self.assertEqual(fingerprint([0, 1, 2]), fingerprint([2, 0, 1, 0]))
+
     @unittest.skipUnless(TF_INSTALLED, "SKIP: Tensorflow not available")
     def test_wrapper_for_generators(self):
         """This test follows the basic classification tutorial, modified for using
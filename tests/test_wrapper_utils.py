@@ -1,15 +1,21 @@
 
 import unittest
 import sys
+import os
 import os.path
 import hashlib
+import shutil
+import time
 
 try:
     import dataworkspaces
 except ImportError:
     sys.path.append(os.path.abspath(".."))
 
-from dataworkspaces.kits.wrapper_utils import _add_to_hash
+from dataworkspaces.kits.wrapper_utils import _add_to_hash, _CheckpointExporter,\
+    _CheckpointRetention
+from dataworkspaces.workspace import FileResourceMixin
+from utils_for_tests import TEMPDIR
 
 try:
     import pandas
@@ -65,5 +71,170 @@ class TestAddToHash(unittest.TestCase):
         print(self.hash_state.hexdigest())
 
 
+class DirResource(FileResourceMixin):
+    """Just enough of a file resource to test the checkpoint exporter:
+    the files are copied to a local directory.
+    """
+    def __init__(self, root):
+        self.root = root
+        self.uploads = []
+
+    def upload_file(self, src_local_path, rel_dest_path):
+        self.uploads.append(rel_dest_path)
+        os.makedirs(os.path.dirname(os.path.join(self.root, rel_dest_path)), exist_ok=True)
+        shutil.copyfile(src_local_path, os.path.join(self.root, rel_dest_path))
+
+    def delete_file(self, rel_path):
+        os.remove(os.path.join(self.root, rel_path))
+
+    def results_move_current_files(self, *args): pass
+    def results_copy_current_files(self, *args): pass
+    def add_results_file(self, *args): pass
+    def read_results_file(self, *args): pass
+    def does_subpath_exist(self, *args): pass
+    def open(self, *args): pass
+    def ls(self, *args): pass
+
+
+class CheckpointTestCase(unittest.TestCase):
+    def setUp(self):
+        if os.path.exists(TEMPDIR):
+            shutil.rmtree(TEMPDIR)
+        self.checkpoint_dir = os.path.join(TEMPDIR, 'checkpoints')
+        os.makedirs(self.checkpoint_dir)
+        self.results_dir = os.path.join(TEMPDIR, 'results')
+        os.makedirs(self.results_dir)
+
+    def tearDown(self):
+        if os.path.exists(TEMPDIR):
+            shutil.rmtree(TEMPDIR)
+
+    def _write_checkpoint(self, name, contents):
+        files = []
+        for (extn, data) in zip(['.index', '.data-00000-of-00001'], contents):
+            # like TensorFlow, write to a temporary file and rename it
+            path = os.path.join(self.checkpoint_dir, name + extn)
+            with open(path + '.tmp', 'w') as f:
+                f.write(data)
+            os.replace(path + '.tmp', path)
+            files.append(path)
+        return files
+
+
+class TestCheckpointExporter(CheckpointTestCase):
+    def test_export(self):
+        resource = DirResource(self.results_dir)
+        exporter = _CheckpointExporter(resource, 'model', os.path.join(self.checkpoint_dir, '.export'))
+        exporter.export(self._write_checkpoint('m_1', ['i1', 'd1']))
+        exporter.export(self._write_checkpoint('m_2', ['i2', 'd2']))
+        # rewritten and exported again, but the index file has not changed
+        files = self._write_checkpoint('m_2', ['i2', 'd2 final'])
+        exporter.export(files)
+        metadata_file = os.path.join(self.checkpoint_dir, 'checkpoint')
+        with open(metadata_file, 'w') as f:
+            f.write('model_checkpoint_path: "m_2"\n')
+        exporter.finish(files, [metadata_file])
+        self.assertEqual(['checkpoint', 'm_2.data-00000-of-00001', 'm_2.index'],
+                         sorted(os.listdir(os.path.join(self.results_dir, 'model'))))
+        with open(os.path.join(self.results_dir, 'model/m_2.data-00000-of-00001'), 'r') as f:
+            self.assertEqual('d2 final', f.read())
+        self.assertEqual(1, resource.uploads.count('model/m_2.index'))
+        self.assertEqual(2, resource.uploads.count('model/m_2.data-00000-of-00001'))
+        self.assertFalse(os.path.exists(os.path.join(self.checkpoint_dir, '.export')))
+
+    def test_identical_files(self):
+        """A data file with the same content as one which was already exported
+        is only uploaded once, unless it is part of the kept checkpoint.
+        """
+        resource = DirResource(self.results_dir)
+        exporter = _CheckpointExporter(resource, None, os.path.join(self.checkpoint_dir, '.export'))
+        files_1 = self._write_checkpoint('m_1', ['i1', 'frozen'])
+        exporter.export(files_1)
+        exporter.export(self._write_checkpoint('m_2', ['i2', 'frozen']))
+        exporter.finish(files_1, [])
+        self.assertEqual(['m_1.data-00000-of-00001', 'm_1.index', 'm_2.index'],
+                         sorted(resource.uploads))
+        self.assertEqual(['m_1.data-00000-of-00001', 'm_1.index'],
+                         sorted(os.listdir(self.results_dir)))
+
+    def test_identical_files_kept(self):
+        resource = DirResource(self.results_dir)
+        exporter = _CheckpointExporter(resource, None, os.path.join(self.checkpoint_dir, '.export'))
+        exporter.export(self._write_checkpoint('m_1', ['i1', 'frozen']))
+        files_2 = self._write_checkpoint('m_2', ['i2', 'frozen'])
+        exporter.export(files_2)
+        exporter.finish(files_2, [])
+        # the skipped file is uploaded under its own name at the end
+        self.assertEqual(['m_2.data-00000-of-00001', 'm_2.index'],
+                         sorted(os.listdir(self.results_dir)))
+        with open(os.path.join(self.results_dir, 'm_2.data-00000-of-00001'), 'r') as f:
+            self.assertEqual('frozen', f.read())
+
+    def test_error(self):
+        resource = DirResource(self.results_dir)
+        exporter = _CheckpointExporter(resource, None, os.path.join(self.checkpoint_dir, '.export'))
+        files = self._write_checkpoint('m_1', ['i1', 'd1'])
+        # a directory in place of the file makes the upload fail
+        os.makedirs(os.path.join(self.results_dir, 'm_1.index'))
+        exporter.export(files)
+        self.assertRaises(OSError, exporter.finish, files, [])
+
+
+class TestCheckpointRetention(CheckpointTestCase):
+    def _names(self):
+        return sorted(set(f.split('.')[0] for f in os.listdir(self.checkpoint_dir)))
+
+    def test_keep_best_and_last(self):
+        retention = _CheckpointRetention(keep_best=2, keep_last=1)
+        for (epoch, loss) in enumerate([0.5, 0.3, 0.4, 0.2, 0.6, 0.7]):
+            name = 'm_%d' % epoch
+            files = self._write_checkpoint(name, ['i%d' % epoch, 'd%d' % epoch])
+            retention.add(name, files, loss, name)
+        retention.finish()
+        self.assertEqual(['m_1', 'm_3', 'm_5'], self._names())
+        self.assertEqual(3, retention.num_removed)
+
+    def test_current_is_kept(self):
+        retention = _CheckpointRetention(keep_last=1, max_bytes=1)
+        retention.add('m_0', self._write_checkpoint('m_0', ['i0', 'd0']), None, 'm_0')
+        # with save_best_only, the metadata file may point to an older checkpoint
+        retention.add('m_1', self._write_checkpoint('m_1', ['i1', 'd1']), None, 'm_0')
+        retention.finish()
+        self.assertEqual(['m_0'], self._names())
+        self.assertEqual(4, retention.current_bytes)
+
+    def test_dedup_and_size_cap(self):
+        retention = _CheckpointRetention(max_bytes=30)
+        retention.add('m_0', self._write_checkpoint('m_0', ['i0', 'x'*10]), None, 'm_0')
+        retention.add('m_1', self._write_checkpoint('m_1', ['i1', 'x'*10]), None, 'm_1')
+        retention.add('m_2', self._write_checkpoint('m_2', ['i2', 'y'*10]), None, 'm_2')
+        retention.finish()
+        # the identical data files are linked and only counted once
+        self.assertEqual(1, retention.num_linked)
+        self.assertEqual(['m_0', 'm_1', 'm_2'], self._names())
+        self.assertEqual(26, retention.current_bytes)
+        retention = _CheckpointRetention(max_bytes=30)
+        for (name, data) in [('m_0', 'x'*10), ('m_1', 'y'*10), ('m_2', 'z'*10)]:
+            files = self._write_checkpoint(name, ['i', data])
+            retention.add(name, files, None, name)
+        retention.finish()
+        self.assertEqual(['m_1', 'm_2'], self._names())
+        self.assertEqual(2, retention.num_linked)
+        self.assertEqual(21, retention.current_bytes)
+        self.assertEqual(31, retention.peak_bytes)
+
+    def test_file_removed_between_adds(self):
+        retention = _CheckpointRetention()
+        files_0 = self._write_checkpoint('m_0', ['i0', 'x'*10])
+        retention.add('m_0', files_0, None, 'm_0')
+        while retention.current_bytes == 0:  # wait for m_0 to be processed
+            time.sleep(0.01)
+        os.remove(files_0[1])
+        retention.add('m_1', self._write_checkpoint('m_1', ['i1', 'x'*10]), None, 'm_1')
+        retention.finish()
+        self.assertEqual(0, retention.num_linked)
+        self.assertEqual(14, retention.current_bytes)
+
+
 if __name__ == '__main__':
     unittest.main()